@@ -1,11 +1,30 @@
-'''Tests the "helloworld" example.'''
+'''Tests the "helloworld" example.
+
+The ``HelloWorldBench`` measures the requests per second served by a
+worker process. The ``legacy`` test uses a server writing the response
+headers and body with separate writes and rendering the ``Date`` header
+for every request, as the :class:`.HttpServerResponse` did before
+coalescing writes. Sizes map to the number of requests: ``tiny`` 1000,
+``normal`` 10000 and ``huge`` 100000.
+'''
+import time
 import unittest
+from functools import partial
+from wsgiref.handlers import format_date_time
 
-from pulsar import send, SERVER_SOFTWARE, get_application, get_actor
+from pulsar import (send, SERVER_SOFTWARE, get_application, get_actor,
+                    async, multi_async, new_event_loop, coroutine_return)
+from pulsar.utils.pep import range
+from pulsar.apps.wsgi import WSGIServer, HttpServerResponse, MAX_CHUNK_SIZE
+from pulsar.apps.wsgi.server import chunk_encoding
+from pulsar.apps.socket import Connection
 from pulsar.apps.http import HttpClient
 from pulsar.apps.test import run_on_arbiter, dont_run_with_thread
 
-from .manage import server
+from .manage import server, hello
+
+# Number of concurrent requests of the benchmark
+CONCURRENCY = 20
 
 
 class TestHelloWorldThread(unittest.TestCase):
@@ -59,3 +78,97 @@ class TestHelloWorldThread(unittest.TestCase):
 @dont_run_with_thread
 class TestHelloWorldProcess(TestHelloWorldThread):
     concurrency = 'process'
+
+
+class LegacyResponse(HttpServerResponse):
+
+    def write(self, data, force=False):
+        if not self._headers_sent:
+            headers = self.get_headers()
+            headers.update([('Server', self.SERVER_SOFTWARE),
+                            ('Date', format_date_time(time.time()))])
+            self._headers_sent = headers.flat(self.version, self.status)
+            self.fire_event('on_headers')
+            self.transport.write(self._headers_sent)
+        if data:
+            if self.chunked:
+                chunks = []
+                while len(data) >= MAX_CHUNK_SIZE:
+                    chunk, data = data[:MAX_CHUNK_SIZE], data[MAX_CHUNK_SIZE:]
+                    chunks.append(chunk_encoding(chunk))
+                if data:
+                    chunks.append(chunk_encoding(data))
+                self.transport.write(b''.join(chunks))
+            else:
+                self.transport.write(data)
+        elif force and self.chunked:
+            self.transport.write(chunk_encoding(data))
+
+
+class LegacyServer(WSGIServer):
+
+    def protocol_factory(self):
+        cfg = self.cfg
+        return partial(Connection, partial(LegacyResponse, cfg.callable, cfg,
+                                           cfg.server_software))
+
+
+class HelloWorldBench(unittest.TestCase):
+    __benchmark__ = True
+    __number__ = 5
+    _sizes = {'tiny': 1000,
+              'small': 5000,
+              'normal': 10000,
+              'big': 50000,
+              'huge': 100000}
+    benchmark_template = ('{0[name]}: repeated {0[number]} times, '
+                          'average {0[mean]} secs, stdev {0[std]}, '
+                          '{0[rps]} requests per second')
+    servers = ()
+
+    @classmethod
+    def setUpClass(cls):
+        cls.size = cls._sizes[cls.cfg.size]
+        cls.servers = []
+        cls.uri = yield cls.start(WSGIServer)
+        cls.legacy_uri = yield cls.start(LegacyServer)
+        cls.client = HttpClient(pool_size=CONCURRENCY, loop=new_event_loop())
+
+    @classmethod
+    def tearDownClass(cls):
+        for name in cls.servers:
+            yield send('arbiter', 'kill_actor', name)
+        if cls.servers:
+            cls.client.close()
+
+    @classmethod
+    def start(cls, server_class):
+        name = 'helloworld_bench_%s' % server_class.__name__.lower()
+        s = server_class(hello, name=name, bind='127.0.0.1:0',
+                         concurrency='process', workers=1)
+        app_cfg = yield send('arbiter', 'run', s)
+        cls.servers.append(app_cfg.name)
+        coroutine_return('http://{0}:{1}'.format(*app_cfg.addresses[0]))
+
+    def getInfo(self, info, delta, dt):
+        info['rps'] = int(self.size/dt)
+
+    def get(self, uri):
+        client = self.client
+        loop = client._loop
+
+        def requests():
+            for start in range(0, self.size, CONCURRENCY):
+                number = min(CONCURRENCY, self.size - start)
+                responses = yield multi_async([client.get(uri) for _ in
+                                               range(number)], loop=loop)
+                for response in responses:
+                    self.assertEqual(response.status_code, 200)
+
+        loop.run_until_complete(async(requests(), loop))
+
+    def test_hello(self):
+        self.get(self.uri)
+
+    def test_legacy(self):
+        self.get(self.legacy_uri)
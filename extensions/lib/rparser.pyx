@@ -1,5 +1,9 @@
 from itertools import starmap
 
+cdef extern from "Python.h":
+    char* PyByteArray_AS_STRING(object bytearray)
+    object PyBytes_FromStringAndSize(const char* v, Py_ssize_t length)
+
 cdef class Task
 
 cdef bytes CRLF = b"\r\n"
@@ -12,17 +16,26 @@ cdef bytes nil = b'$-1\r\n'
 cdef bytes null_array = b'*-1\r\n'
 
 
+cdef inline bytes buffer_slice(bytearray b, Py_ssize_t start,
+                               Py_ssize_t end):
+    # Copy a slice of the buffer into a new bytes object
+    return PyBytes_FromStringAndSize(PyByteArray_AS_STRING(b) + start,
+                                     end - start)
+
+
 cdef class RedisParser:
     cdef object _protocolError
     cdef object _responseError
     cdef object _encoding
-    cdef object _inbuffer
+    cdef bytearray _inbuffer
+    cdef Py_ssize_t _pos
     cdef Task _current
 
     def __cinit__(self, object perr, object rerr):
         self._protocolError = perr
         self._responseError = rerr
         self._inbuffer = bytearray()
+        self._pos = 0
 
     def on_connect(self, connection):
         if connection.decode_responses:
@@ -34,15 +47,23 @@ cdef class RedisParser:
     # DECODER
     def get(self):
         if self._current:
-            return self._resume(self._current, False)
+            result = self._resume(self._current, False)
         else:
-            return self._get(None)
+            result = self._get(None)
+        if self._pos and self._pos == len(self._inbuffer):
+            self._inbuffer = bytearray()
+            self._pos = 0
+        return result
 
     def feed(self, stream):
+        if self._pos:
+            # only the unparsed data is moved
+            del self._inbuffer[:self._pos]
+            self._pos = 0
         self._inbuffer.extend(stream)
 
     def buffer(self):
-        return self._inbuffer
+        return buffer_slice(self._inbuffer, self._pos, len(self._inbuffer))
 
     # CLIENT ENCODERS
     def pack_command(self, args):
@@ -113,11 +134,14 @@ cdef class RedisParser:
             yield v
 
     cdef object _get(self, Task next):
-        b = self._inbuffer
-        cdef int length = b.find(b'\r\n')
-        if length >= 0:
-            self._inbuffer, response = b[length+2:], bytes(b[:length])
-            rtype, response = response[:1], response[1:]
+        cdef bytearray b = self._inbuffer
+        cdef Py_ssize_t pos = self._pos
+        cdef Py_ssize_t end = b.find(CRLF, pos)
+        cdef bytes rtype, response
+        if end >= 0:
+            self._pos = end + 2
+            rtype = buffer_slice(b, pos, pos + 1)
+            response = buffer_slice(b, pos + 1, end)
             if rtype == RESPONSE_ERROR:
                 return self._responseError(response.decode('utf-8'))
             elif rtype == RESPONSE_INTEGER:
@@ -133,6 +157,7 @@ cdef class RedisParser:
             else:
                 # Clear the buffer and raise
                 self._inbuffer = bytearray()
+                self._pos = 0
                 raise self._protocolError('Protocol Error')
         else:
             return False
@@ -155,12 +180,16 @@ cdef class Task:
 
     cdef object decode(self, RedisParser parser, object result):
         cdef long length = self._length
+        cdef bytearray b
+        cdef Py_ssize_t start
         cdef bytes chunk
         parser._current = None
         if length >= 0:
             b = parser._inbuffer
-            if len(b) >= length+2:
-                parser._inbuffer, chunk = b[length+2:], bytes(b[:length])
+            start = parser._pos
+            if len(b) >= start+length+2:
+                parser._pos = start + length + 2
+                chunk = buffer_slice(b, start, start + length)
                 if parser._encoding:
                     return chunk.decode(parser._encoding)
                 else:
@@ -25,15 +25,43 @@ Redis Pipeline
 .. autoclass:: pulsar.apps.data.stores.redis.client.Pipeline
    :members:
    :member-order: bysource
+
+Client Side Cache
+~~~~~~~~~~~~~~~~~~~
+
+.. automodule:: pulsar.apps.data.stores.redis.cache
+
+.. autoclass:: pulsar.apps.data.stores.redis.cache.NearCache
+   :members:
+   :member-order: bysource
+
+Auto Pipelining
+~~~~~~~~~~~~~~~~~~~
+
+.. automodule:: pulsar.apps.data.stores.redis.pipelining
+
+.. autoclass:: pulsar.apps.data.stores.redis.pipelining.PipelinedConnection
+   :members:
+   :member-order: bysource
+
+Sharding
+~~~~~~~~~~~~~~~~~~~
+
+.. automodule:: pulsar.apps.data.stores.redis.sharding
+
+.. autoclass:: pulsar.apps.data.stores.redis.sharding.ShardedRedisStore
+   :members:
+   :member-order: bysource
 '''
 from pulsar.utils.config import Global
 from pulsar.apps.data import register_store
 
 from .store import RedisStore
+from .sharding import ShardedRedisStore
 from .client import RedisScript
 
 
-__all__ = ['RedisStore', 'RedisScript']
+__all__ = ['RedisStore', 'ShardedRedisStore', 'RedisScript']
 
 
 class RedisServer(Global):
@@ -45,3 +73,5 @@ class RedisServer(Global):
 
 
 register_store('redis', 'pulsar.apps.data.stores.RedisStore')
+register_store('shards+redis', 'pulsar.apps.data.stores.ShardedRedisStore')
+register_store('shards+pulsar', 'pulsar.apps.data.stores.ShardedRedisStore')
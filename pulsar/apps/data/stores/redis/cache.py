@@ -0,0 +1,177 @@
+'''Client side caching for :class:`.RedisStore`.
+
+When the store is created with a positive ``cache_size``, replies of the
+read commands in :data:`CACHEABLE_COMMANDS` are kept in a
+:class:`NearCache` and served without a round trip to the server.
+The store opens a connection subscribed to the ``__redis__:invalidate``
+channel and enables ``CLIENT TRACKING`` with a redirect to it on the
+connections which execute cacheable commands, so that the server notifies
+the store when a cached key changes.
+
+A reply is cached only if its key is not invalidated while the command is
+in flight, and the whole cache is dropped when the invalidation connection
+is lost, since notifications may have been missed.
+'''
+from copy import copy
+from collections import OrderedDict
+
+from pulsar import Future
+from pulsar.utils.pep import to_bytes
+
+from .pubsub import PubsubProtocol
+
+
+INVALIDATE_CHANNEL = b'__redis__:invalidate'
+
+# Read commands on a single key whose reply is cached
+CACHEABLE_COMMANDS = frozenset((
+    'bitcount', 'bitpos', 'exists', 'get', 'getbit', 'getrange', 'hexists',
+    'hget', 'hgetall', 'hkeys', 'hlen', 'hmget', 'hvals', 'lindex', 'llen',
+    'lrange', 'scard', 'sismember', 'smembers', 'strlen', 'type', 'zcard',
+    'zcount', 'zlexcount', 'zrange', 'zrangebylex', 'zrangebyscore',
+    'zrank', 'zrevrange', 'zrevrangebyscore', 'zrevrank', 'zscore'))
+
+# Types of replies copied when served from the cache
+MUTABLE_TYPES = (list, dict, set)
+
+
+class NearCache(object):
+    '''A bounded cache of replies, evicting the least recently used.
+
+    Entries are identified by a tuple of the key, the command arguments
+    and the options of the reply callback, and are grouped by key so that
+    all the replies of a key are dropped when it is invalidated.
+    '''
+    def __init__(self, max_size, encoding='utf-8'):
+        self.max_size = max_size
+        self.encoding = encoding
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, entry):
+        return entry in self._entries
+
+    def entry(self, args, options):
+        '''The entry of a command with ``args`` and ``options``, ``None``
+        if the reply cannot be cached.
+        '''
+        if len(args) > 1 and args[0].lower() in CACHEABLE_COMMANDS:
+            try:
+                entry = (to_bytes(args[1], self.encoding),
+                         args[0].lower()) + args[2:]
+                if options:
+                    entry += (tuple(sorted(options.items())),)
+                hash(entry)
+            except TypeError:
+                return None
+            return entry
+
+    def get(self, entry):
+        '''The cached reply of ``entry``, raise ``KeyError`` if missing.
+        '''
+        try:
+            value = self._entries.pop(entry)
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        self._entries[entry] = value
+        return copy(value) if isinstance(value, MUTABLE_TYPES) else value
+
+    def pending(self, entry):
+        '''Register a command about to be sent to the server, return the
+        token to pass to :meth:`set` with its reply.
+        '''
+        token = object()
+        self._pending[entry] = token
+        self._add_key(entry)
+        return token
+
+    def set(self, entry, value, token):
+        '''Cache the ``value`` of ``entry`` unless its key was invalidated
+        since :meth:`pending` returned ``token``.
+        '''
+        if self._pending.get(entry) is token:
+            self._pending.pop(entry)
+            entries = self._entries
+            entries.pop(entry, None)
+            entries[entry] = value
+            while len(entries) > self.max_size:
+                self._release(entries.popitem(False)[0])
+
+    def discard(self, entry, token):
+        '''Forget a command sent with ``token`` which failed.'''
+        if self._pending.get(entry) is token:
+            self._pending.pop(entry)
+            self._release(entry)
+
+    def invalidate(self, key):
+        '''Drop the cached replies of ``key``.'''
+        for entry in self._keys.pop(key, ()):
+            self._entries.pop(entry, None)
+            self._pending.pop(entry, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._pending.clear()
+        self._keys.clear()
+
+    def broadcast(self, response):
+        '''Handle a message received on the invalidation channel.
+
+        The message is the list of invalidated keys, or ``None`` when the
+        keys of a database were flushed.
+        '''
+        channel, keys = response
+        if keys is None:
+            self.clear()
+        else:
+            for key in keys:
+                self.invalidate(key)
+
+    def _add_key(self, entry):
+        entries = self._keys.get(entry[0])
+        if entries is None:
+            self._keys[entry[0]] = entries = set()
+        entries.add(entry)
+
+    def _release(self, entry):
+        # forget the key of entry unless it is cached or in flight
+        entries = self._keys.get(entry[0])
+        if (entries is not None and entry not in self._entries and
+                entry not in self._pending):
+            entries.discard(entry)
+            if not entries:
+                self._keys.pop(entry[0])
+
+
+class InvalidationProtocol(PubsubProtocol):
+    '''The connection receiving invalidation messages for a
+    :class:`NearCache`.
+
+    Its client id, needed to redirect invalidation messages, is
+    available in the :attr:`client_id` future.
+    '''
+    def __init__(self, *args, **kw):
+        super(InvalidationProtocol, self).__init__(*args, **kw)
+        self.client_id = Future(loop=self._producer._loop)
+
+    def data_received(self, data):
+        parser = self.parser
+        parser.feed(data)
+        response = parser.get()
+        while response is not False:
+            if isinstance(response, Exception):
+                raise response
+            elif isinstance(response, list):
+                if response[0] == b'message':
+                    self.handler.broadcast(response[1:3])
+            elif isinstance(response, int):
+                self.client_id.set_result(response)
+            response = parser.get()
@@ -0,0 +1,149 @@
+'''Auto pipelining for :class:`.RedisStore`.
+
+When the store is created with a positive ``pipelining``, commands are not
+executed on connections checked out from the pool, one command per
+connection at a time. Instead, they are sent over at most ``pipelining``
+:class:`PipelinedConnection` shared by all callers. The commands executed
+on a connection during a loop iteration are written with a single
+``pack_pipeline`` call at the next iteration, and their replies, which the
+server sends in the order the commands were received, are matched to the
+waiting futures in FIFO order.
+
+Commands which block or change the state of a connection, listed in
+:data:`POOL_COMMANDS`, are still executed on pool connections, and so are
+the transactions of :class:`.Pipeline`.
+'''
+from collections import deque
+
+from pulsar import Protocol, Future, task, coroutine_return
+
+from .client import Consumer, ResponseError, CommandError
+
+
+# Commands executed on a connection of the pool
+POOL_COMMANDS = frozenset((
+    'auth', 'blpop', 'brpop', 'brpoplpush', 'client', 'discard', 'exec',
+    'monitor', 'multi', 'psubscribe', 'punsubscribe', 'quit', 'select',
+    'subscribe', 'unsubscribe', 'unwatch', 'wait', 'watch'))
+
+
+class PipelinedConnection(Protocol):
+    '''A connection shared by many callers, writing the commands of a
+    loop iteration in one go.
+    '''
+    def __init__(self, *args, **kw):
+        super(PipelinedConnection, self).__init__(*args, **kw)
+        self.parser = self._producer._parser_class()
+        # Client id of the connection receiving the invalidation messages
+        # of keys read by this connection
+        self.tracking = None
+        self._buffer = []
+        self._waiting = deque()
+        self.bind_event('connection_lost', self._lost)
+
+    @property
+    def waiting(self):
+        '''Number of commands waiting for a reply'''
+        return len(self._buffer) + len(self._waiting)
+
+    def execute(self, *args, **options):
+        '''Queue a command, return a :class:`.Future` called back with its
+        reply or a :class:`.ResponseError`.
+        '''
+        if self.closed:
+            raise CommandError('connection closed')
+        future = Future(loop=self._loop)
+        if not self._buffer:
+            self._loop.call_soon(self._write)
+        self._buffer.append(((args, options), future))
+        return future
+
+    def data_received(self, data):
+        parser = self.parser
+        parser.feed(data)
+        response = parser.get()
+        while response is not False:
+            (args, options), future = self._waiting.popleft()
+            if not future.done():
+                if isinstance(response, Exception):
+                    response = ResponseError(response)
+                else:
+                    response = self.parse_response(response, args[0],
+                                                   options)
+                future.set_result(response)
+            response = parser.get()
+
+    def parse_response(self, response, command, options):
+        callback = Consumer.RESPONSE_CALLBACKS.get(command.upper())
+        return callback(response, **options) if callback else response
+
+    def _write(self):
+        requests, self._buffer = self._buffer, []
+        if requests and not self.closed:
+            self._waiting.extend(requests)
+            chunk = self.parser.pack_pipeline([r[0] for r in requests])
+            self._transport.write(chunk)
+
+    def _lost(self, connection, exc=None):
+        exc = exc or CommandError('connection lost')
+        requests = self._buffer
+        requests.extend(self._waiting)
+        self._buffer = []
+        self._waiting.clear()
+        for _, future in requests:
+            if not future.done():
+                future.set_exception(exc)
+
+
+class Multiplexer(object):
+    '''Distribute commands over at most ``size`` shared
+    :class:`PipelinedConnection`.
+
+    Connections are opened on demand, one at a time, and a command is sent
+    to the connection with fewer commands waiting for a reply.
+    '''
+    def __init__(self, connect, size):
+        self._connect = connect
+        self.size = size
+        self._connections = []
+        self._connecting = None
+
+    @property
+    def connections(self):
+        return tuple(self._connections)
+
+    def connect(self):
+        '''The :class:`PipelinedConnection` for the next command or a
+        :class:`.Future` called back with it.
+        '''
+        connections = self._connections
+        if connections:
+            connection = min(connections, key=lambda c: c.waiting)
+            if connection.waiting and len(connections) < self.size:
+                self._open()
+            return connection
+        else:
+            return self._open()
+
+    def close(self):
+        for connection in self._connections:
+            connection.close()
+
+    def _open(self):
+        if self._connecting is None:
+            self._connecting = self._new_connection()
+        return self._connecting
+
+    @task
+    def _new_connection(self):
+        try:
+            connection = yield self._connect()
+        finally:
+            self._connecting = None
+        connection.bind_event('connection_lost', self._remove)
+        self._connections.append(connection)
+        coroutine_return(connection)
+
+    def _remove(self, connection, exc=None):
+        if connection in self._connections:
+            self._connections.remove(connection)
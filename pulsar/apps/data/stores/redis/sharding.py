@@ -0,0 +1,220 @@
+'''Client side sharding for :class:`.RedisStore`.
+
+A :class:`ShardedRedisStore` spreads the keyspace over several redis or
+pulsar-ds nodes, each accessed via its own :class:`.RedisStore`. It is
+created with the ``shards+redis`` or ``shards+pulsar`` scheme, the address
+of the first node and the addresses of the other nodes in the ``nodes``
+parameter::
+
+    shards+redis://127.0.0.1:6379/3?nodes=127.0.0.1:6380,127.0.0.1:6381
+
+Keys are mapped to nodes via the 16384 hash slots of redis cluster: the
+slot of a key is the CRC16 of the key, or of the hash tag between ``{``
+and ``}`` if present, and each node owns a contiguous range of slots.
+Therefore nodes must always be listed in the same order.
+
+* A command is executed by the node owning its keys.
+* ``DEL``, ``UNLINK``, ``MGET`` and ``MSET`` on keys owned by several nodes
+  are split into one command per node, executed in parallel, and their
+  replies are gathered. Other commands on keys owned by several nodes
+  fail with a ``CROSSSLOT`` :class:`.CommandError`; hash tags can be used
+  to keep related keys in the same node.
+* Commands without keys in :data:`BROADCAST_COMMANDS`, such as ``FLUSHDB``
+  and ``DBSIZE``, are executed by all nodes, the other commands without
+  keys, publish/subscribe included, by the first node.
+* The commands of a :class:`.Pipeline` are split into one transaction per
+  node, executed in parallel, and replies are returned in the order of
+  the commands. A transaction is therefore atomic only within a node.
+
+The store name is the name of the nodes store (``redis`` or ``pulsar``),
+so that the odm and the task backend use it as a single node store.
+'''
+from collections import OrderedDict
+
+from pulsar import task, coroutine_return, multi_async
+from pulsar.utils.pep import native_str, to_bytes
+from pulsar.apps.ds.cluster import command_keys, key_slot, shard_slots
+
+from .client import CommandError
+from .store import RedisStore
+
+
+# Commands without keys executed by all nodes and how replies are gathered
+BROADCAST_COMMANDS = {
+    'dbsize': sum,
+    'flushall': all,
+    'flushdb': all,
+    'keys': lambda replies: [key for keys in replies for key in keys],
+    'ping': all,
+    'script': lambda replies: replies[0]}
+
+# Multi-key commands split by node and how replies are gathered
+SCATTER_COMMANDS = {
+    'del': sum,
+    'mget': None,
+    'mset': all,
+    'unlink': sum}
+
+
+def parse_node(node):
+    '''The ``(host, port)`` address of a ``host:port`` ``node``'''
+    if isinstance(node, tuple):
+        return node
+    host, port = node.strip().split(':')
+    return host, int(port)
+
+
+class HashSlots(object):
+    '''Map keys to ``size`` nodes via the hash slots of redis cluster.'''
+    def __init__(self, size):
+        self.size = size
+        self._owners = []
+        for index, (start, end) in enumerate(shard_slots(size)):
+            self._owners.extend([index]*(end - start + 1))
+
+    def node(self, key):
+        '''The index of the node owning ``key``'''
+        return self._owners[key_slot(to_bytes(key))]
+
+    def nodes(self, args):
+        '''The lower case command name of ``args`` and the list of nodes
+        owning its keys, one for each key.
+        '''
+        name = native_str(args[0]).lower()
+        keys = command_keys([name] + list(args[1:]))
+        return name, [self.node(key) for key in keys]
+
+    def split(self, args, nodes):
+        '''Split the multi-key command ``args`` with keys owned by
+        ``nodes``.
+
+        Return a list of ``(node, positions, args)`` with the positions
+        of the keys of each node and the command to execute on it.
+        '''
+        step = len(args[1:]) // len(nodes)
+        groups = OrderedDict()
+        for position, node in enumerate(nodes):
+            groups.setdefault(node, []).append(position)
+        commands = []
+        for node, positions in groups.items():
+            node_args = [args[0]]
+            for position in positions:
+                start = 1 + position*step
+                node_args.extend(args[start:start+step])
+            commands.append((node, positions, tuple(node_args)))
+        return commands
+
+
+class ShardedRedisStore(RedisStore):
+    '''A :class:`.RedisStore` sharding keys across several nodes.
+
+    :param nodes: the ``host:port`` addresses, in a list or comma
+        separated, of the nodes other than the one in the store url.
+
+    Other parameters are passed to the :class:`.RedisStore` of each node.
+    '''
+    def _init(self, nodes=None, namespace=None, **kwargs):
+        bits = self._name.split('+')
+        if len(bits) == 2:
+            self._scheme, self._name = bits
+        if namespace:
+            self._urlparams['namespace'] = namespace
+        if nodes and not isinstance(nodes, (list, tuple)):
+            nodes = nodes.split(',')
+        nodes = [parse_node(node) for node in nodes or ()]
+        if nodes:
+            self._urlparams['nodes'] = ','.join(('%s:%s' % n for n in nodes))
+        self._nodes = [RedisStore(self._name, address, self._loop,
+                                  database=self._database, user=self._user,
+                                  password=self._password,
+                                  encoding=self._encoding, **kwargs)
+                       for address in [self._host] + nodes]
+        self._slots = HashSlots(len(self._nodes))
+        self.loaded_scripts = {}
+        self._cache = None
+
+    @property
+    def nodes(self):
+        '''The :class:`.RedisStore` of each node'''
+        return tuple(self._nodes)
+
+    @property
+    def pool(self):
+        '''The connection pool of the first node'''
+        return self._nodes[0].pool
+
+    def node(self, key):
+        '''The :class:`.RedisStore` of the node owning ``key``'''
+        return self._nodes[self._slots.node(key)]
+
+    def pubsub(self, protocol=None):
+        return self._nodes[0].pubsub(protocol=protocol)
+
+    def connect(self, protocol_factory=None):
+        return self._nodes[0].connect(protocol_factory)
+
+    @task
+    def execute(self, *args, **options):
+        name, nodes = self._slots.nodes(args)
+        if nodes:
+            if len(set(nodes)) == 1:
+                result = yield self._nodes[nodes[0]].execute(*args,
+                                                             **options)
+            elif name in SCATTER_COMMANDS:
+                result = yield self._scatter(name, args, nodes, options)
+            else:
+                raise CommandError("CROSSSLOT Keys in request don't hash "
+                                   "to the same node")
+        elif name in BROADCAST_COMMANDS:
+            results = yield multi_async([node.execute(*args, **options)
+                                         for node in self._nodes],
+                                        loop=self._loop)
+            result = BROADCAST_COMMANDS[name](results)
+        else:
+            result = yield self._nodes[0].execute(*args, **options)
+        coroutine_return(result)
+
+    @task
+    def execute_pipeline(self, commands, raise_on_error=True):
+        multi, commands, exec_ = commands[0], commands[1:-1], commands[-1]
+        groups = OrderedDict()
+        for position, (args, options) in enumerate(commands):
+            name, nodes = self._slots.nodes(args)
+            node = nodes[0] if nodes else 0
+            if nodes and len(set(nodes)) > 1:
+                raise CommandError("CROSSSLOT Keys in request don't hash "
+                                   "to the same node")
+            groups.setdefault(node, []).append(position)
+        requests = []
+        for node, positions in groups.items():
+            node_commands = [multi]
+            node_commands.extend((commands[p] for p in positions))
+            node_commands.append(exec_)
+            requests.append(self._nodes[node].execute_pipeline(
+                node_commands, raise_on_error))
+        results = yield multi_async(requests, loop=self._loop)
+        response = [None]*len(commands)
+        for positions, result in zip(groups.values(), results):
+            for position, value in zip(positions, result):
+                response[position] = value
+        coroutine_return(response)
+
+    def close(self):
+        '''Close all open connections of all nodes.'''
+        return multi_async([node.close() for node in self._nodes],
+                           loop=self._loop)
+
+    def _scatter(self, name, args, nodes, options):
+        commands = self._slots.split(args, nodes)
+        results = yield multi_async([self._nodes[node].execute(*node_args,
+                                                               **options)
+                                     for node, _, node_args in commands],
+                                    loop=self._loop)
+        gather = SCATTER_COMMANDS[name]
+        if gather:
+            coroutine_return(gather(results))
+        values = [None]*len(nodes)
+        for (_, positions, _), result in zip(commands, results):
+            for position, value in zip(positions, result):
+                values[position] = value
+        coroutine_return(values)
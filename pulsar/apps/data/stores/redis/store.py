@@ -7,6 +7,8 @@ from pulsar.apps.ds import redis_parser
 
 from .client import RedisClient, Pipeline, Consumer, ResponseError
 from .pubsub import PubSub
+from .cache import NearCache, InvalidationProtocol, INVALIDATE_CHANNEL
+from .pipelining import PipelinedConnection, Multiplexer, POOL_COMMANDS
 
 
 class RedisStoreConnection(Connection):
@@ -14,6 +16,9 @@ class RedisStoreConnection(Connection):
     def __init__(self, *args, **kw):
         super(RedisStoreConnection, self).__init__(*args, **kw)
         self.parser = self._producer._parser_class()
+        # Client id of the connection receiving the invalidation messages
+        # of keys read by this connection
+        self.tracking = None
 
     def execute(self, *args, **options):
         consumer = self.current_consumer()
@@ -28,12 +33,21 @@ class RedisStoreConnection(Connection):
 
 class RedisStore(Store):
     '''Redis :class:`.Store` implementation.
+
+    :param cache_size: when positive, replies of read commands on a single
+        key are kept in a :class:`.NearCache` of at most ``cache_size``
+        replies, invalidated by the server via ``CLIENT TRACKING``.
+        Replies must not be modified by callers.
+    :param pipelining: when positive, commands executed concurrently are
+        pipelined over at most ``pipelining`` connections shared by all
+        callers rather than executed on connections of the :attr:`pool`.
     '''
     protocol_factory = partial(RedisStoreConnection, Consumer)
     supported_queries = frozenset(('filter', 'exclude'))
 
     def _init(self, namespace=None, parser_class=None, pool_size=50,
-              decode_responses=False, **kwargs):
+              decode_responses=False, cache_size=0, pipelining=0,
+              **kwargs):
         self._decode_responses = decode_responses
         if not parser_class:
             actor = get_actor()
@@ -44,11 +58,27 @@ class RedisStore(Store):
             self._urlparams['namespace'] = namespace
         self._pool = Pool(self.connect, pool_size=pool_size, loop=self._loop)
         self.loaded_scripts = {}
+        self._multiplexer = None
+        if pipelining:
+            factory = partial(PipelinedConnection, producer=self)
+            self._multiplexer = Multiplexer(partial(self.connect, factory),
+                                            pipelining)
+        self._cache = None
+        if cache_size:
+            self._cache = NearCache(cache_size, self._encoding)
+        self._cache_link = None
+        self._cache_connection = None
+        self._cache_id = None
 
     @property
     def pool(self):
         return self._pool
 
+    @property
+    def cache(self):
+        '''The :class:`.NearCache` of replies or ``None``'''
+        return self._cache
+
     @property
     def namespace(self):
         '''The prefix namespace to append to all transaction on keys
@@ -75,12 +105,24 @@ class RedisStore(Store):
 
     @task
     def execute(self, *args, **options):
-        connection = yield self._pool.connect()
-        with connection:
-            result = yield connection.execute(*args, **options)
-            if isinstance(result, ResponseError):
-                raise result.exception
-            coroutine_return(result)
+        cache = self._cache
+        entry = cache.entry(args, options) if cache is not None else None
+        if entry is not None and self._cache_id is not None:
+            try:
+                coroutine_return(cache.get(entry))
+            except KeyError:
+                pass
+        multiplexer = self._multiplexer
+        if (multiplexer is not None and
+                args[0].lower() not in POOL_COMMANDS):
+            connection = yield multiplexer.connect()
+            result = yield self._execute(connection, entry, args, options)
+        else:
+            pooled = yield self._pool.connect()
+            with pooled:
+                result = yield self._execute(pooled.connection, entry,
+                                             args, options)
+        coroutine_return(result)
 
     @task
     def execute_pipeline(self, commands, raise_on_error=True):
@@ -143,6 +185,10 @@ class RedisStore(Store):
 
     def close(self):
         '''Close all open connections.'''
+        if self._cache_connection is not None:
+            self._cache_connection.close()
+        if self._multiplexer is not None:
+            self._multiplexer.close()
         return self._pool.close()
 
     def has_query(self, query_type):
@@ -153,6 +199,58 @@ class RedisStore(Store):
         postfix = ':'.join((to_string(p) for p in args if p is not None))
         return '%s:%s' % (key, postfix) if postfix else key
 
+    def _execute(self, connection, entry, args, options):
+        if entry is not None:
+            token = yield self._track(connection, entry)
+        result = yield connection.execute(*args, **options)
+        if isinstance(result, ResponseError):
+            if entry is not None:
+                self._cache.discard(entry, token)
+            raise result.exception
+        if entry is not None:
+            self._cache.set(entry, result, token)
+        coroutine_return(result)
+
+    def _track(self, connection, entry):
+        # Enable tracking on connection and register entry in the cache
+        client_id = yield self._cache_connect()
+        if connection.tracking != client_id:
+            result = yield connection.execute('CLIENT', 'TRACKING', 'ON',
+                                              'REDIRECT', client_id)
+            if isinstance(result, ResponseError):
+                raise result.exception
+            connection.tracking = client_id
+        coroutine_return(self._cache.pending(entry))
+
+    def _cache_connect(self):
+        # The client id of the connection receiving invalidation messages
+        if self._cache_link is None:
+            self._cache_link = self._connect_invalidation()
+        return self._cache_link
+
+    @task
+    def _connect_invalidation(self):
+        factory = partial(InvalidationProtocol, self._cache, producer=self)
+        try:
+            connection = yield self.connect(factory)
+            connection.execute('CLIENT', 'ID')
+            connection.execute('SUBSCRIBE', INVALIDATE_CHANNEL)
+            client_id = yield connection.client_id
+        except Exception:
+            self._cache_link = None
+            raise
+        connection.bind_event('connection_lost', self._cache_lost)
+        self._cache_connection = connection
+        self._cache_id = client_id
+        coroutine_return(client_id)
+
+    def _cache_lost(self, connection, exc=None):
+        # Notifications may have been missed, start again
+        self._cache_link = None
+        self._cache_connection = None
+        self._cache_id = None
+        self._cache.clear()
+
     def meta(self, meta):
         '''Extract model metadata for lua script stdnet/lib/lua/odm.lua'''
         indices = dict(((idx.attname, idx.unique) for idx in meta.indices))
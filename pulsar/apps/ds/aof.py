@@ -0,0 +1,270 @@
+'''Append only file persistence for pulsar-ds.
+
+Write commands which modified the dataset are appended to the file in the
+redis protocol format. The :class:`AppendOnlyFile` buffers them and writes
+the buffer once per event loop iteration, while the ``fsync`` policy
+controls when data is flushed to disk:
+
+* ``always`` writes and fsync after every write command
+* ``everysec`` fsync once per second, in a thread of the executor
+* ``no`` never fsync, the operating system decides when data is flushed
+
+A background rewrite, triggered by the ``BGREWRITEAOF`` command, produces a
+compact file from a snapshot of the dataset in a child process. Commands
+received in the meantime are accumulated and appended to the new file once
+the child terminates.
+'''
+import os
+import time
+import shutil
+from collections import deque
+from multiprocessing import Process
+
+from pulsar.utils.structures import Zset
+
+from .pyparser import Parser
+from .encoding import PackedHash, PackedList, IntSet, PackedZset
+
+
+FSYNC_POLICIES = ('always', 'everysec', 'no')
+# Maximum number of items in a command emitted by a rewrite
+AOF_REWRITE_ITEMS_PER_CMD = 64
+
+
+class AppendOnlyFile(object):
+    '''Append only file of a :class:`.Storage`.
+    '''
+    def __init__(self, store, filename, fsync='everysec'):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError('appendfsync must be one of %s' %
+                             ', '.join(FSYNC_POLICIES))
+        self.store = store
+        self.filename = filename
+        self.fsync = fsync
+        self.logger = store.logger
+        self._loop = store._loop
+        self._pack = store._parser.pack_command
+        self._file = None
+        self._db = None
+        self._buffer = []
+        self._fsync_pending = False
+        self._fsync_running = False
+        self._rewriter = None
+        self._rewrite_buffer = None
+        self._last_rewrite_status = 'ok'
+        self._last_fsync = time.time()
+
+    @property
+    def rewriting(self):
+        return self._rewriter is not None
+
+    def open(self):
+        self._file = open(self.filename, 'ab')
+
+    def close(self):
+        if self._file:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def size(self):
+        try:
+            return os.path.getsize(self.filename)
+        except OSError:
+            return 0
+
+    def feed(self, db, request):
+        '''Append a ``request`` executed on database number ``db``.
+        '''
+        empty = not self._buffer
+        if db != self._db:
+            self._db = db
+            self._append(self._pack(('select', str(db))))
+        self._append(self._pack(request))
+        if self.fsync == 'always':
+            self.flush()
+            os.fsync(self._file.fileno())
+        elif empty:
+            self._loop.call_soon(self.flush)
+
+    def flush(self):
+        '''Write the buffer to the file'''
+        if self._buffer and self._file:
+            buffer, self._buffer = self._buffer, []
+            self._file.write(b''.join(buffer))
+            self._file.flush()
+            self._fsync_pending = True
+
+    def load(self, client):
+        '''Replay commands in the file via a ``client``.
+
+        An incomplete command at the end of the file, usually the result
+        of a crash while writing, is logged and truncated.
+        Return the number of commands executed.
+        '''
+        if not os.path.isfile(self.filename):
+            return 0
+        self.logger.info('loading data from "%s"', self.filename)
+        count = 0
+        with open(self.filename, 'rb') as file:
+            offset = 0
+            for request in read_commands(file):
+                client.execute(request)
+                offset = file.tell()
+                count += 1
+            truncated = file.tell() != offset
+        if truncated:
+            self.logger.warning('Truncated "%s" at %s bytes, last command '
+                                'was incomplete', self.filename, offset)
+            with open(self.filename, 'r+b') as file:
+                file.truncate(offset)
+        return count
+
+    def rewrite(self, data):
+        '''Rewrite the file in a background process.
+
+        ``data`` is the snapshot of databases returned by
+        :meth:`.Storage._dbs`.
+        '''
+        if self._rewriter is not None:
+            return False
+        self.flush()
+        self._rewrite_buffer = []
+        # Force a select for the first command of the rewrite buffer
+        self._db = None
+        self._rewriter = Process(target=rewrite_aof,
+                                 args=(self.store.cfg, self._temp(), data))
+        self._rewriter.start()
+        self.logger.debug('Rewriting append only file in background process')
+        return True
+
+    def info(self):
+        return {'aof_enabled': 1,
+                'aof_fsync': self.fsync,
+                'aof_rewrite_in_progress': int(self.rewriting),
+                'aof_last_rewrite_status': self._last_rewrite_status,
+                'aof_current_size': self.size(),
+                'aof_buffer_length': sum((len(b) for b in self._buffer))}
+
+    def _cron(self):
+        if self._rewriter is not None and not self._rewriter.is_alive():
+            self._rewrite_done()
+        self.flush()
+        if self.fsync == 'everysec':
+            if self._fsync_pending and not self._fsync_running:
+                self._fsync_pending = False
+                self._fsync_running = True
+                fut = self._loop.run_in_executor(None, os.fsync,
+                                                 self._file.fileno())
+                fut.add_done_callback(self._fsync_done)
+
+    def _fsync_done(self, fut):
+        self._fsync_running = False
+        self._last_fsync = time.time()
+
+    def _append(self, chunk):
+        self._buffer.append(chunk)
+        if self._rewrite_buffer is not None:
+            self._rewrite_buffer.append(chunk)
+
+    def _temp(self):
+        dirname, basename = os.path.split(self.filename)
+        return os.path.join(dirname, 'temp-rewrite-' + basename)
+
+    def _rewrite_done(self):
+        process, self._rewriter = self._rewriter, None
+        buffer, self._rewrite_buffer = self._rewrite_buffer, None
+        temp = self._temp()
+        if process.exitcode:
+            self._last_rewrite_status = 'err'
+            self.logger.error('Background append only file rewrite failed')
+            if os.path.isfile(temp):
+                os.remove(temp)
+            return
+        self.flush()
+        with open(temp, 'ab') as file:
+            file.write(b''.join(buffer))
+            file.flush()
+            os.fsync(file.fileno())
+        self._file.close()
+        shutil.move(temp, self.filename)
+        self.open()
+        self._last_rewrite_status = 'ok'
+        self.logger.info('Background append only file rewrite completed')
+
+
+def read_commands(file):
+    '''Generator of requests stored in a binary ``file``.
+
+    Stop at the first incomplete request.
+    '''
+    readline = file.readline
+    read = file.read
+    while True:
+        line = readline()
+        if line[:1] != b'*' or line[-2:] != b'\r\n':
+            break
+        request = []
+        for _ in range(int(line[1:-2])):
+            line = readline()
+            if line[:1] != b'$' or line[-2:] != b'\r\n':
+                return
+            size = int(line[1:-2])
+            value = read(size + 2)
+            if len(value) != size + 2:
+                return
+            request.append(value[:-2])
+        yield request
+
+
+def rewrite_aof(cfg, filename, data):
+    '''Write the commands rebuilding ``data`` into ``filename``.
+
+    Executed in a child process by :meth:`AppendOnlyFile.rewrite`.
+    '''
+    logger = cfg.configured_logger('ds')
+    pack = Parser(None, None).pack_command
+    version, dbs = data
+    with open(filename, 'wb') as file:
+        for num, values, expires in dbs:
+            file.write(pack(('select', str(num))))
+            for key, value in values.items():
+                for request in rebuild_commands(key, value):
+                    file.write(pack(request))
+                when = expires.get(key)
+                if when is not None:
+                    file.write(pack(('pexpireat', key,
+                                     str(int(1000*when)))))
+        file.flush()
+        os.fsync(file.fileno())
+    logger.info('rewrote append only file "%s"', filename)
+
+
+def rebuild_commands(key, value):
+    '''Generator of requests which rebuild ``value`` at ``key``.
+    '''
+    if isinstance(value, bytearray):
+        yield ('set', key, bytes(value))
+        return
+    elif isinstance(value, (dict, PackedHash)):
+        name = 'hmset'
+        items = []
+        for item in value.items():
+            items.extend(item)
+        n = 2*AOF_REWRITE_ITEMS_PER_CMD
+    elif isinstance(value, (deque, PackedList)):
+        name, items, n = 'rpush', list(value), AOF_REWRITE_ITEMS_PER_CMD
+    elif isinstance(value, (set, IntSet)):
+        name, items, n = 'sadd', list(value), AOF_REWRITE_ITEMS_PER_CMD
+    elif isinstance(value, (Zset, PackedZset)):
+        name = 'zadd'
+        items = []
+        for score, member in value.items():
+            items.extend((repr(score), member))
+        n = 2*AOF_REWRITE_ITEMS_PER_CMD
+    else:
+        raise TypeError('Cannot rewrite %s' % type(value))
+    for i in range(0, len(items), n):
+        request = [name, key]
+        request.extend(items[i:i+n])
+        yield request
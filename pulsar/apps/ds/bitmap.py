@@ -0,0 +1,161 @@
+'''Bit operations on the string values of pulsar-ds.
+
+Strings are processed in chunks of :data:`CHUNK_SIZE` bytes with
+operations the interpreter implements in C, rather than one byte at a
+time in python:
+
+* bits are counted with :meth:`int.bit_count` of chunks converted into
+  python integers, when available, otherwise by summing the bytes of
+  chunks translated into their number of bits set;
+* ``AND``, ``OR`` and ``XOR`` operate on chunks converted into python
+  integers, ``NOT`` translates each byte into its complement;
+* the first bit set, or clear, is found after stripping the leading bytes
+  with all bits clear, or set.
+
+``BITFIELD`` integers are read from, and written to, the bytes spanning
+the field converted into a python integer.
+'''
+from binascii import hexlify, unhexlify
+from operator import and_, or_, xor
+
+from pulsar.utils.pep import ispy3k, range
+
+# Number of bytes processed at once
+CHUNK_SIZE = 1 << 20
+# Operations of BITOP, NOT is the complement of a single string
+BITOPS = {b'and': and_, b'or': or_, b'xor': xor, b'not': None}
+# Overflow modes of BITFIELD
+OVERFLOWS = (b'wrap', b'sat', b'fail')
+
+POPCOUNT = bytes(bytearray((bin(n).count('1') for n in range(256))))
+COMPLEMENT = bytes(bytearray((255 - n for n in range(256))))
+
+
+if ispy3k:
+
+    def from_bytes(value):
+        '''The unsigned big-endian integer of the bytes ``value``'''
+        return int.from_bytes(value, 'big')
+
+    def to_bytes(number, size):
+        '''The ``size`` big-endian bytes of the unsigned ``number``'''
+        return number.to_bytes(size, 'big')
+
+else:   # pragma    nocover
+
+    def from_bytes(value):
+        return int(hexlify(value), 16) if value else 0
+
+    def to_bytes(number, size):
+        return unhexlify('%0*x' % (2*size, number))
+
+
+if hasattr(int, 'bit_count'):
+
+    def popcount(value):
+        '''Number of bits set in the bytes ``value``'''
+        return from_bytes(value).bit_count()
+
+else:   # pragma    nocover
+
+    def popcount(value):
+        return sum(value.translate(POPCOUNT))
+
+
+def bit_count(value, start=0, end=None):
+    '''Number of bits set in ``value`` from byte ``start`` to byte ``end``
+    excluded.'''
+    end = len(value) if end is None else min(end, len(value))
+    count = 0
+    for offset in range(max(start, 0), end, CHUNK_SIZE):
+        count += popcount(value[offset:min(offset + CHUNK_SIZE, end)])
+    return count
+
+
+def bit_pos(value, bit, start=0, end=None):
+    '''Position of the first bit equal to ``bit`` in ``value`` from byte
+    ``start`` to byte ``end`` excluded, -1 if not found.'''
+    end = len(value) if end is None else min(end, len(value))
+    skip = b'\x00' if bit else b'\xff'
+    for offset in range(max(start, 0), end, CHUNK_SIZE):
+        chunk = value[offset:min(offset + CHUNK_SIZE, end)]
+        index = len(chunk) - len(chunk.lstrip(skip))
+        if index < len(chunk):
+            byte = chunk[index] if bit else 255 - chunk[index]
+            return 8*(offset + index + 1) - byte.bit_length()
+    return -1
+
+
+def bit_op(op, values):
+    '''The result of the bitwise operation ``op`` on the bytearrays
+    ``values``, the complement of the first one if ``op`` is ``None``.
+
+    Shorter values are padded with zero bytes.
+    '''
+    if op is None:
+        return values[0].translate(COMPLEMENT)
+    size = max((len(value) for value in values))
+    result = bytearray()
+    for offset in range(0, size, CHUNK_SIZE):
+        length = min(CHUNK_SIZE, size - offset)
+        number = None
+        for value in values:
+            chunk = value[offset:offset + length]
+            n = from_bytes(chunk) << 8*(length - len(chunk)) if chunk else 0
+            number = n if number is None else op(number, n)
+        result.extend(to_bytes(number, length))
+    return result
+
+
+def bitfield_type(spec):
+    '''The ``(signed, bits)`` of a ``BITFIELD`` type ``spec`` such as
+    ``i16`` or ``u8``, raise ``ValueError`` if not valid.'''
+    sign = spec[:1].lower()
+    bits = int(spec[1:])
+    if (sign == b'i' and 0 < bits <= 64) or (sign == b'u' and 0 < bits < 64):
+        return sign == b'i', bits
+    raise ValueError(spec)
+
+
+def get_bits(value, offset, bits, signed=False):
+    '''The integer of ``bits`` bits at bit ``offset`` of ``value``.'''
+    start = offset >> 3
+    size = ((offset + bits + 7) >> 3) - start
+    chunk = value[start:start + size]
+    number = from_bytes(chunk) << 8*(size - len(chunk)) if chunk else 0
+    number >>= 8*size - (offset & 7) - bits
+    number &= (1 << bits) - 1
+    if signed and number >> (bits - 1):
+        number -= 1 << bits
+    return number
+
+
+def set_bits(value, offset, bits, number):
+    '''Set the ``bits`` bits at bit ``offset`` of the bytearray ``value``
+    to ``number``, growing ``value`` if needed.'''
+    start = offset >> 3
+    end = (offset + bits + 7) >> 3
+    if len(value) < end:
+        value.extend((end - len(value))*b'\x00')
+    shift = 8*(end - start) - (offset & 7) - bits
+    mask = ((1 << bits) - 1) << shift
+    current = from_bytes(value[start:end]) & ~mask
+    value[start:end] = to_bytes(current | ((number << shift) & mask),
+                                end - start)
+
+
+def overflow_bits(number, bits, signed, overflow):
+    '''Fit ``number`` in an integer of ``bits`` bits according to the
+    ``overflow`` mode, ``None`` if it does not fit in the ``fail`` mode.
+    '''
+    if signed:
+        low, high = -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+    else:
+        low, high = 0, (1 << bits) - 1
+    if low <= number <= high:
+        return number
+    elif overflow == b'wrap':
+        number &= (1 << bits) - 1
+        return number - (1 << bits) if number > high else number
+    elif overflow == b'sat':
+        return high if number > high else low
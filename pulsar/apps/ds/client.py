@@ -3,7 +3,7 @@ from functools import partial
 
 import pulsar
 from pulsar.utils.structures import OrderedDict
-from pulsar.utils.pep import force_native_str, to_bytes
+from pulsar.utils.pep import force_native_str, to_bytes, default_timer
 
 
 COMMANDS_INFO = OrderedDict()
@@ -52,6 +52,7 @@ class ClientMixin(object):
         self.last_command = ''
         self.flag = 0
         self.blocked = None
+        self.tracking = None
 
     @property
     def db(self):
@@ -72,9 +73,16 @@ class ClientMixin(object):
                     return self.reply_error(self.store.PUBSUB_ONLY)
             if self.blocked:
                 return self.reply_error('Blocked client cannot request')
+            cluster = self.store._cluster
+            if cluster and handle and not self.flag & self.store.MASTER:
+                error = cluster.route(request)
+                if error:
+                    if self.transaction is not None:
+                        self.flag |= self.store.DIRTY_EXEC
+                    return self.reply_error(error[1], error[0])
             if self.transaction is not None and command not in 'exec':
                 self.transaction.append((handle, request))
-                return self._transport.write(self.store.QUEUED)
+                return self._write(self.store.QUEUED)
         self._execute_command(handle, request)
 
     def _execute_command(self, handle, request):
@@ -84,11 +92,33 @@ class ClientMixin(object):
                 if not handle:
                     self._loop.logger.info("unknown command '%s'" % command)
                     return self.reply_error("unknown command '%s'" % command)
-                if self.store._password != self.password:
+                store = self.store
+                if store._password != self.password:
                     if command != 'auth':
                         return self.reply_error(
                             'Authentication required', 'NOAUTH')
+                if (store._master and handle._info.write and
+                        not self.flag & store.MASTER and
+                        store.cfg.key_value_replica_read_only):
+                    return self.reply_error(
+                        "You can't write against a read only replica.",
+                        'READONLY')
+                if (store._maxmemory and handle._info.write and
+                        command not in store.MAXMEMORY_ALLOWED and
+                        not store._free_memory()):
+                    return self.reply_error(
+                        "command not allowed when used memory > "
+                        "'maxmemory'.", 'OOM')
+                dirty = store._dirty
+                start = default_timer()
                 handle(self, request, len(request) - 1)
+                store._command_executed(request, default_timer() - start)
+                if self.tracking and not handle._info.write:
+                    store._track(self, request)
+                if store._dirty != dirty and handle._info.write:
+                    store._propagate_command(self.db, request)
+                if store._changed_keys:
+                    store._account_keys()
             else:
                 command = ''
                 return self.reply_error("no command")
@@ -138,6 +168,8 @@ class PulsarStoreClient(pulsar.Protocol, ClientMixin):
     def __init__(self, cfg, *args, **kw):
         super(PulsarStoreClient, self).__init__(*args, **kw)
         ClientMixin.__init__(self, self._producer._key_value_store)
+        self.store._next_client_id += 1
+        self.id = self.store._next_client_id
         self.cfg = cfg
         self.parser = self._producer._parser_class()
         self.started = time.time()
@@ -145,6 +177,10 @@ class PulsarStoreClient(pulsar.Protocol, ClientMixin):
         self.patterns = set()
         self.watched_keys = None
         self.password = b''
+        self._buffer = []
+        self._buffer_size = 0
+        self._soft_limit_reached = None
+        self._reading_paused = False
         self.bind_event('connection_lost',
                         partial(self.store._remove_connection, self))
 
@@ -186,25 +222,64 @@ class PulsarStoreClient(pulsar.Protocol, ClientMixin):
         self._write(self.store._parser.multi_bulk_len(value))
 
     # Protocol Implementaton
+    def connection_made(self, transport):
+        super(PulsarStoreClient, self).connection_made(transport)
+        self.store._clients[self.id] = self
+        if self.store._pause_reading:
+            transport.set_write_buffer_limits(self.store._pause_reading)
+
+    def pause_writing(self):
+        # Stop reading requests from a normal client until its replies
+        # have been sent
+        store = self.store
+        if (store._pause_reading and not self._reading_paused and
+                store._client_class(self) == 'normal'):
+            self._reading_paused = True
+            self._transport.pause_reading()
+
+    def resume_writing(self):
+        if self._reading_paused:
+            self._reading_paused = False
+            self._transport.resume_reading()
+
     def data_received(self, data):
+        store = self.store
         self.parser.feed(data)
         request = self.parser.get()
-        while request is not False:
-            if self.store._monitors:
-                self.store._write_to_monitors(self, request)
-            self.execute(request)
-            request = self.parser.get()
+        store._batching = True
+        try:
+            while request is not False:
+                if store._monitors:
+                    store._write_to_monitors(self, request)
+                self.execute(request)
+                request = self.parser.get()
+        finally:
+            store._batching = False
+            store._flush_writes()
 
     # Internals
     def _write(self, response):
-        if self.transaction is not None:
-            self.transaction.append(response)
-        elif not self._transport._closing:
-            self._transport.write(response)
+        if not self._transport._closing:
+            buffer = self._buffer
+            if not buffer:
+                self.store._pending_write(self)
+            buffer.append(response)
+            self._buffer_size += len(response)
+            if self._buffer_size >= self.store._write_batch:
+                self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            data = b''.join(self._buffer)
+            self._buffer = []
+            self._buffer_size = 0
+            if not self._transport._closing:
+                self._transport.write(data)
+                self.store._check_output_buffer(self)
 
 
 class LuaClient(ClientMixin):
-    not_allowed = ('randomkey', 'srandmember', 'time')
+    not_allowed = ('randomkey', 'spop', 'srandmember', 'time')
     request_stak = None
 
     # Exposed to lua script
@@ -271,6 +346,54 @@ class LuaClient(ClientMixin):
             return self.reply_error(str(e))
 
 
+class ReplayClient(ClientMixin):
+    '''A client replaying commands from the append only file or from the
+    replication stream of a master.
+
+    Replies are discarded.
+    '''
+    def __init__(self, store):
+        super(ReplayClient, self).__init__(store)
+        self._loop = store._loop
+        self.password = store._password
+        self.channels = ()
+        self.patterns = ()
+        self.watched_keys = None
+
+    def reply_ok(self):
+        pass
+
+    def reply_status(self, status):
+        pass
+
+    def reply_error(self, value, prefix=None):
+        pass
+
+    def reply_wrongtype(self):
+        pass
+
+    def reply_int(self, value):
+        pass
+
+    def reply_one(self):
+        pass
+
+    def reply_zero(self):
+        pass
+
+    def reply_bulk(self, value=None):
+        pass
+
+    def reply_multi_bulk(self, value=None):
+        pass
+
+    def reply_multi_bulk_len(self, len):
+        pass
+
+    def _write(self, response):
+        pass
+
+
 class Blocked:
     '''Handle blocked keys for a client
     '''
@@ -0,0 +1,158 @@
+'''Keyspace sharding for pulsar-ds.
+
+When the :ref:`key_value_cluster <setting-key_value_cluster>` setting is
+enabled, each worker of a :class:`.PulsarDS` server owns a range of the
+16384 hash slots of the keyspace and listens on its own address, in
+addition to the address shared by all workers.
+The slot of a key is the CRC16 of the key, or of the hash tag between
+``{`` and ``}`` if present, modulo 16384, as in redis cluster.
+
+* A command on keys owned by another worker is answered with a
+  ``MOVED <slot> <host>:<port>`` error and the client should send it again
+  to that address.
+* A multi-key command must have all its keys in the same worker, otherwise
+  it fails with a ``CROSSSLOT`` error. Hash tags can be used to force
+  related keys into the same slot.
+* Commands queued in a ``MULTI`` block are checked when queued, so that
+  a transaction is always executed by a single worker.
+* Messages published in a worker are delivered to subscribers of all
+  workers, while ``PUBLISH`` returns the number of clients which received
+  the message in the worker which executed it.
+* Commands without keys, such as ``KEYS``, ``SCAN``, ``DBSIZE`` and
+  ``FLUSHDB``, operate on the worker executing them.
+'''
+from binascii import crc_hqx
+
+from pulsar import command, send
+
+
+CLUSTER_SLOTS = 16384
+
+# Commands which do not have keys
+KEYLESS_COMMANDS = frozenset((
+    'auth', 'bgrewriteaof', 'bgsave', 'client', 'cluster', 'config',
+    'dbsize', 'debug', 'discard', 'echo', 'exec', 'flushall', 'flushdb',
+    'info', 'keys', 'lastsave', 'migrate', 'monitor', 'multi', 'ping',
+    'psubscribe', 'psync', 'publish', 'pubsub', 'punsubscribe', 'quit',
+    'randomkey', 'replconf', 'save', 'scan', 'script', 'select',
+    'shutdown', 'slaveof', 'slowlog', 'subscribe', 'sync', 'time',
+    'unsubscribe', 'unwatch'))
+
+# First key, last key (negative values count from the end) and step of
+# commands with keys which do not take a single key as first argument
+KEY_SPECS = {'bitop': (2, -1, 1),
+             'blpop': (1, -2, 1),
+             'brpop': (1, -2, 1),
+             'brpoplpush': (1, 2, 1),
+             'del': (1, -1, 1),
+             'mget': (1, -1, 1),
+             'mset': (1, -1, 2),
+             'msetnx': (1, -1, 2),
+             'object': (2, 2, 1),
+             'rename': (1, 2, 1),
+             'renamenx': (1, 2, 1),
+             'rpoplpush': (1, 2, 1),
+             'sdiff': (1, -1, 1),
+             'sdiffstore': (1, -1, 1),
+             'sinter': (1, -1, 1),
+             'sinterstore': (1, -1, 1),
+             'smove': (1, 2, 1),
+             'sunion': (1, -1, 1),
+             'sunionstore': (1, -1, 1),
+             'unlink': (1, -1, 1),
+             'watch': (1, -1, 1)}
+
+
+def key_slot(key):
+    '''The hash slot of ``key``'''
+    start = key.find(b'{')
+    if start >= 0:
+        end = key.find(b'}', start + 1)
+        if end > start + 1:
+            key = key[start+1:end]
+    return crc_hqx(key, 0) % CLUSTER_SLOTS
+
+
+def command_keys(request):
+    '''The keys of a ``request`` with a lower case command name'''
+    name = request[0]
+    if name in KEYLESS_COMMANDS:
+        return ()
+    elif name in ('eval', 'evalsha', 'zinterstore', 'zunionstore'):
+        try:
+            numkeys = int(request[2])
+        except Exception:
+            return ()
+        keys = request[3:3+numkeys]
+        if name in ('zinterstore', 'zunionstore'):
+            keys.append(request[1])
+        return keys
+    first, last, step = KEY_SPECS.get(name, (1, 1, 1))
+    end = len(request) + last + 1 if last < 0 else last + 1
+    return request[first:end:step]
+
+
+def shard_slots(shards):
+    '''List of ``(start, end)`` slot ranges, ends included, of ``shards``'''
+    edges = [i*CLUSTER_SLOTS//shards for i in range(shards + 1)]
+    return [(edges[i], edges[i+1] - 1) for i in range(shards)]
+
+
+class Cluster(object):
+    '''The sharding configuration of a :class:`.Storage`.
+
+    :param shard: the index of the shard owned by the storage.
+    :param addresses: list of ``(host, port)`` addresses of all shards.
+    '''
+    def __init__(self, shard, addresses):
+        self.shard = shard
+        self.addresses = addresses
+        self.slots = shard_slots(len(addresses))
+        self._owners = []
+        for index, (start, end) in enumerate(self.slots):
+            self._owners.extend([index]*(end - start + 1))
+
+    def owner(self, slot):
+        return self._owners[slot]
+
+    def route(self, request):
+        '''Check if this shard can execute ``request``.
+
+        Return ``None`` or the ``(prefix, message)`` error for the client.
+        '''
+        keys = command_keys(request)
+        if keys:
+            owners = self._owners
+            slot = key_slot(keys[0])
+            owner = owners[slot]
+            for key in keys[1:]:
+                if owners[key_slot(key)] != owner:
+                    return ('CROSSSLOT',
+                            "Keys in request don't hash to the same shard")
+            if owner != self.shard:
+                host, port = self.addresses[owner]
+                return ('MOVED', '%d %s:%d' % (slot, host, port))
+
+    def publish(self, channel, message):
+        '''Forward a published message to the other shards'''
+        send('monitor', 'ds_publish', channel, message)
+
+
+@command(ack=False)
+def ds_publish(request, channel, message):
+    '''Forward a message published in a pulsar-ds shard to the other
+    workers of the monitor.'''
+    monitor = request.actor
+    sender = request.caller.aid
+    for worker in list(monitor.managed_actors.values()):
+        if worker.aid != sender:
+            monitor.send(worker, 'ds_deliver', channel, message)
+
+
+@command(ack=False)
+def ds_deliver(request, channel, message):
+    '''Deliver a message published in another pulsar-ds shard.'''
+    for server in request.actor.servers.values():
+        store = getattr(server, '_key_value_store', None)
+        if store is not None:
+            store._publish(channel, message)
@@ -0,0 +1,892 @@
+'''Compact encodings of small pulsar-ds collections.
+
+Small hashes, lists and sorted sets are stored in packed, array-backed
+containers rather than in a :class:`.Dict`, a :class:`.Deque` or a
+:class:`.Zset`, and sets of integers in an :class:`IntSet`.
+Lookups are linear (or binary searches for :class:`IntSet` and sorted set
+scores), which is as fast as hashing for a few elements while using a
+fraction of the memory.
+
+Hashes, sets and sorted sets in their full encoding, an :class:`IndexedHash`,
+an :class:`IndexedSet` and an :class:`IndexedZset`, also keep their elements
+in a :class:`KeySampler`, so that they are scanned by position as the
+keyspace is.
+
+The :class:`Encodings` of a :class:`.Storage` creates new collections in
+their compact encoding and decides when a collection has grown beyond the
+thresholds of its encoding and must be upgraded, which is never reverted.
+'''
+from array import array
+from bisect import bisect_left, bisect_right
+from random import randrange, sample
+from sys import getsizeof
+
+from pulsar.utils.pep import zip
+from pulsar.utils.structures import Dict, Zset, Deque
+
+try:
+    array('q')
+    INTSET_TYPECODE = 'q'
+except ValueError:     # pragma    nocover
+    INTSET_TYPECODE = 'l'
+
+INTSET_MAX = (1 << (8*array(INTSET_TYPECODE).itemsize - 1)) - 1
+INTSET_MIN = -INTSET_MAX - 1
+# Maximum length of the string representation of an intset integer
+INTSET_DIGITS = len(str(INTSET_MIN))
+
+
+def intset_value(member):
+    '''The integer ``member`` represents in an :class:`IntSet`.
+
+    Return ``None`` if ``member`` is not the canonical representation of an
+    integer within the intset range, so that the member returned by the set
+    is identical to the member added.
+    '''
+    if len(member) > INTSET_DIGITS:
+        return None
+    try:
+        value = int(member)
+    except (TypeError, ValueError):
+        return None
+    if INTSET_MIN <= value <= INTSET_MAX and _int_bytes(value) == member:
+        return value
+
+
+def _int_bytes(value):
+    return str(value).encode('utf-8')
+
+
+def _range(start, end, size):
+    # Bounds of a range by rank, as in the Skiplist
+    if start < 0:
+        start = max(size + start, 0)
+    if end is None:
+        end = size
+    elif end < 0:
+        end = max(size + end, 0)
+    else:
+        end = min(end, size)
+    return start, end
+
+
+class PackedHash(object):
+    '''A small hash stored as a flat list of alternating fields and values.
+    '''
+    __slots__ = ('_items',)
+    encoding = 'ziplist'
+
+    def __init__(self, data=None):
+        self._items = []
+        if data:
+            self.update(data)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+    __str__ = __repr__
+
+    def __len__(self):
+        return len(self._items) // 2
+
+    def __iter__(self):
+        return iter(self._items[::2])
+
+    def __contains__(self, field):
+        return self._index(field) >= 0
+
+    def __eq__(self, other):
+        if isinstance(other, (PackedHash, dict)):
+            return dict(self.items()) == dict(other.items())
+        return False
+
+    def __getitem__(self, field):
+        index = self._index(field)
+        if index < 0:
+            raise KeyError(field)
+        return self._items[index + 1]
+
+    def __setitem__(self, field, value):
+        index = self._index(field)
+        if index < 0:
+            self._items.extend((field, value))
+        else:
+            self._items[index + 1] = value
+
+    def __getstate__(self):
+        return (self._items,)
+
+    def __setstate__(self, state):
+        self._items = state[0]
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + getsizeof(self._items)
+
+    def get(self, field, default=None):
+        index = self._index(field)
+        return default if index < 0 else self._items[index + 1]
+
+    def pop(self, field, default=None):
+        index = self._index(field)
+        if index < 0:
+            return default
+        value = self._items[index + 1]
+        del self._items[index:index + 2]
+        return value
+
+    def update(self, items):
+        for field, value in items:
+            self[field] = value
+
+    def keys(self):
+        return self._items[::2]
+
+    def values(self):
+        return self._items[1::2]
+
+    def items(self):
+        return zip(self._items[::2], self._items[1::2])
+
+    def mget(self, fields):
+        return [self.get(f) for f in fields]
+
+    def flat(self):
+        return list(self._items)
+
+    def upgrade(self):
+        return IndexedHash(self.items())
+
+    def _index(self, field):
+        # Position of ``field`` in the flat list, values are skipped since
+        # a value can be equal to a field
+        items = self._items
+        index = 0
+        try:
+            while True:
+                index = items.index(field, index)
+                if not index % 2:
+                    return index
+                index += 1
+        except ValueError:
+            return -1
+
+
+class PackedList(object):
+    '''A small list stored in a python list.
+    '''
+    __slots__ = ('_items',)
+    encoding = 'ziplist'
+
+    def __init__(self, data=None):
+        self._items = list(data) if data else []
+
+    def __repr__(self):
+        return repr(self._items)
+    __str__ = __repr__
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __eq__(self, other):
+        if isinstance(other, (PackedList, Deque)):
+            return list(self) == list(other)
+        return False
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __setitem__(self, index, value):
+        self._items[index] = value
+
+    def __getstate__(self):
+        return (self._items,)
+
+    def __setstate__(self, state):
+        self._items, = state
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + getsizeof(self._items)
+
+    def append(self, value):
+        self._items.append(value)
+
+    def appendleft(self, value):
+        self._items.insert(0, value)
+
+    def extend(self, values):
+        self._items.extend(values)
+
+    def extendleft(self, values):
+        # same order as deque.extendleft
+        self._items[:0] = reversed(list(values))
+
+    def pop(self):
+        return self._items.pop()
+
+    def popleft(self):
+        return self._items.pop(0)
+
+    def insert_before(self, pivot, value):
+        try:
+            self._items.insert(self._items.index(pivot), value)
+        except ValueError:
+            pass
+
+    def insert_after(self, pivot, value):
+        try:
+            self._items.insert(self._items.index(pivot) + 1, value)
+        except ValueError:
+            pass
+
+    def remove(self, elem, count=1):
+        items = self._items
+        if count:
+            rev = count < 0
+            count = abs(count)
+            if rev:
+                items.reverse()
+            removed = 0
+            while removed < count:
+                try:
+                    items.remove(elem)
+                except ValueError:
+                    break
+                removed += 1
+            if rev:
+                items.reverse()
+        else:
+            self._items = [v for v in items if v != elem]
+            removed = len(items) - len(self._items)
+        return removed
+
+    def trim(self, start, end):
+        self._items = self._items[start:end]
+
+    def upgrade(self):
+        return Deque(self._items)
+
+
+class IntSet(object):
+    '''A set of integers stored in a sorted array.
+
+    Members are the byte representation of integers, as validated by
+    :func:`intset_value`.
+    '''
+    __slots__ = ('_ints',)
+    encoding = 'intset'
+
+    def __init__(self, data=None):
+        self._ints = array(INTSET_TYPECODE)
+        if data:
+            self.update(data)
+
+    def __repr__(self):
+        return repr(set(self))
+    __str__ = __repr__
+
+    def __len__(self):
+        return len(self._ints)
+
+    def __iter__(self):
+        for value in self._ints:
+            yield _int_bytes(value)
+
+    def __contains__(self, member):
+        return self._index(intset_value(member)) is not None
+
+    def __eq__(self, other):
+        if isinstance(other, (IntSet, set)):
+            return set(self) == set(other)
+        return False
+
+    def __getstate__(self):
+        return (self._ints.tolist(),)
+
+    def __setstate__(self, state):
+        self._ints = array(INTSET_TYPECODE, state[0])
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + getsizeof(self._ints)
+
+    @classmethod
+    def accepts(cls, members):
+        '''Check if all ``members`` can be stored in an :class:`IntSet`'''
+        for member in members:
+            if intset_value(member) is None:
+                return False
+        return True
+
+    def add(self, member):
+        value = intset_value(member)
+        if value is None:
+            raise ValueError('%r is not an intset member' % member)
+        ints = self._ints
+        index = bisect_left(ints, value)
+        if index == len(ints) or ints[index] != value:
+            ints.insert(index, value)
+
+    def discard(self, member):
+        index = self._index(intset_value(member))
+        if index is not None:
+            self._ints.pop(index)
+
+    def remove(self, member):
+        index = self._index(intset_value(member))
+        if index is None:
+            raise KeyError(member)
+        self._ints.pop(index)
+
+    def pop(self):
+        if not self._ints:
+            raise KeyError('pop from an empty set')
+        return _int_bytes(self._ints.pop(randrange(len(self._ints))))
+
+    def update(self, members):
+        for member in members:
+            self.add(member)
+
+    def difference_update(self, members):
+        for member in members:
+            self.discard(member)
+
+    def sample(self, count):
+        '''Return at most ``count`` distinct members picked at random'''
+        ints = self._ints
+        if len(ints) > count:
+            ints = sample(ints, count)
+        return [_int_bytes(value) for value in ints]
+
+    def upgrade(self):
+        return IndexedSet(self)
+
+    def _index(self, value):
+        if value is not None:
+            ints = self._ints
+            index = bisect_left(ints, value)
+            if index < len(ints) and ints[index] == value:
+                return index
+
+
+class PackedZset(object):
+    '''A small sorted set stored in an array of scores and a list of
+    members, ordered by score.
+
+    Members with the same score are ordered lexicographically, as in the
+    :class:`.Zset`.
+    '''
+    __slots__ = ('_scores', '_members')
+    encoding = 'ziplist'
+
+    def __init__(self, data=None):
+        self._scores = array('d')
+        self._members = []
+        if data:
+            self.update(data)
+
+    def __repr__(self):
+        return repr(list(self.items()))
+    __str__ = __repr__
+
+    def __len__(self):
+        return len(self._members)
+
+    def __iter__(self):
+        return iter(self._members)
+
+    def __eq__(self, other):
+        if isinstance(other, (PackedZset, Zset)):
+            return list(self.items()) == list(other.items())
+        return False
+
+    def __getstate__(self):
+        return self._scores.tolist(), self._members
+
+    def __setstate__(self, state):
+        scores, self._members = state
+        self._scores = array('d', scores)
+
+    def __sizeof__(self):
+        return (object.__sizeof__(self) + getsizeof(self._scores) +
+                getsizeof(self._members))
+
+    def items(self):
+        '''Iterable over ordered score, value pairs'''
+        return zip(self._scores, self._members)
+
+    def range(self, start, end, scores=False):
+        start, end = _range(start, end, len(self))
+        members = self._members[start:end]
+        if scores:
+            return list(zip(self._scores[start:end], members))
+        return members
+
+    def range_by_score(self, minval, maxval, include_min=True,
+                       include_max=True, start=0, num=None, scores=False):
+        lo, hi = self._bounds(minval, maxval, include_min, include_max)
+        if num is not None:
+            hi = min(hi, lo + start + num)
+        lo += max(start, 0)
+        members = self._members[lo:hi]
+        if scores:
+            return list(zip(self._scores[lo:hi], members))
+        return members
+
+    def range_by_lex(self, minval=None, maxval=None, include_min=True,
+                     include_max=True, start=0, num=None):
+        lo, hi = self._lex_bounds(minval, maxval, include_min, include_max)
+        if num is not None:
+            hi = min(hi, lo + start + num)
+        lo += max(start, 0)
+        return self._members[lo:hi]
+
+    def score(self, member, default=None):
+        '''The score of a given member'''
+        try:
+            return self._scores[self._members.index(member)]
+        except ValueError:
+            return default
+
+    def count(self, minval, maxval, include_min=True, include_max=True):
+        lo, hi = self._bounds(minval, maxval, include_min, include_max)
+        return max(hi - lo, 0)
+
+    def count_by_lex(self, minval=None, maxval=None, include_min=True,
+                     include_max=True):
+        lo, hi = self._lex_bounds(minval, maxval, include_min, include_max)
+        return max(hi - lo, 0)
+
+    def add(self, score, val):
+        if score != score:
+            raise ValueError('Cannot insert score {0}'.format(score))
+        r = 1
+        try:
+            index = self._members.index(val)
+        except ValueError:
+            pass
+        else:
+            if self._scores[index] == score:
+                return 0
+            self._scores.pop(index)
+            self._members.pop(index)
+            r = 0
+        scores = self._scores
+        index = bisect_left(self._members, val, bisect_left(scores, score),
+                            bisect_right(scores, score))
+        self._scores.insert(index, score)
+        self._members.insert(index, val)
+        return r
+
+    def update(self, score_vals):
+        add = self.add
+        for score, value in score_vals:
+            add(score, value)
+
+    def remove_items(self, items):
+        removed = 0
+        for item in items:
+            if self.remove(item) is not None:
+                removed += 1
+        return removed
+
+    def remove(self, item):
+        '''Remove ``item`` and return its score, if found'''
+        try:
+            index = self._members.index(item)
+        except ValueError:
+            return None
+        self._members.pop(index)
+        return self._scores.pop(index)
+
+    def remove_range(self, start, end):
+        '''Remove a range by rank.
+        '''
+        start, end = _range(start, end, len(self))
+        return self._remove(start, end)
+
+    def remove_range_by_score(self, minval, maxval,
+                              include_min=True, include_max=True):
+        '''Remove a range by score.
+        '''
+        return self._remove(*self._bounds(minval, maxval, include_min,
+                                          include_max))
+
+    def remove_range_by_lex(self, minval=None, maxval=None,
+                            include_min=True, include_max=True):
+        '''Remove a range by member.
+        '''
+        return self._remove(*self._lex_bounds(minval, maxval, include_min,
+                                              include_max))
+
+    def clear(self):
+        self._scores = array('d')
+        self._members = []
+
+    def rank(self, item):
+        '''Return the rank (index) of ``item``'''
+        try:
+            return self._members.index(item)
+        except ValueError:
+            return None
+
+    def flat(self):
+        result = []
+        [result.extend(pair) for pair in self.items()]
+        return tuple(result)
+
+    def upgrade(self):
+        return IndexedZset(self.items())
+
+    def _bounds(self, minval, maxval, include_min, include_max):
+        scores = self._scores
+        if include_min:
+            lo = bisect_left(scores, minval)
+        else:
+            lo = bisect_right(scores, minval)
+        if include_max:
+            hi = bisect_right(scores, maxval)
+        else:
+            hi = bisect_left(scores, maxval)
+        return lo, hi
+
+    def _lex_bounds(self, minval, maxval, include_min, include_max):
+        # members with the score of the first member are sorted
+        members = self._members
+        if not members:
+            return 0, 0
+        end = bisect_right(self._scores, self._scores[0])
+        if minval is None:
+            lo = 0
+        elif include_min:
+            lo = bisect_left(members, minval, 0, end)
+        else:
+            lo = bisect_right(members, minval, 0, end)
+        if maxval is None:
+            hi = len(members)
+        elif include_max:
+            hi = bisect_right(members, maxval, 0, end)
+        else:
+            hi = bisect_left(members, maxval, 0, end)
+        return lo, hi
+
+    def _remove(self, start, end):
+        if start >= end:
+            return 0
+        del self._scores[start:end]
+        del self._members[start:end]
+        return end - start
+
+
+class KeySampler(object):
+    '''A set of keys which can be sampled at random in constant time.
+
+    Keys are kept in a list, and a dictionary maps keys to their position
+    in the list, so that a key is removed by moving the last key into its
+    slot.
+    '''
+    __slots__ = ('_keys', '_index')
+
+    def __init__(self):
+        self._keys = []
+        self._index = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def add(self, key):
+        if key not in self._index:
+            self._index[key] = len(self._keys)
+            self._keys.append(key)
+
+    def discard(self, key):
+        index = self._index.pop(key, None)
+        if index is not None:
+            last = self._keys.pop()
+            if last != key:
+                self._keys[index] = last
+                self._index[last] = index
+
+    def clear(self):
+        self._keys = []
+        self._index.clear()
+
+    def sample(self, count):
+        '''Return at most ``count`` keys picked at random'''
+        keys = self._keys
+        size = len(keys)
+        if size <= count:
+            return list(keys)
+        return [keys[randrange(size)] for _ in range(count)]
+
+    def scan(self, cursor, count):
+        '''Return the next cursor and at most ``count`` keys in the slots
+        before the ``cursor`` position, ``0`` to start from the last slot.
+
+        Slots are visited from the last to the first, since a removed key
+        is replaced by the last key, which is then returned again rather
+        than hiding a key not yet visited.
+        '''
+        keys = self._keys
+        end = min(cursor, len(keys)) if cursor else len(keys)
+        start = max(end - count, 0)
+        return start, keys[start:end]
+
+
+class IndexedHash(Dict):
+    '''A hash in its full encoding.
+
+    Fields are also kept in a :class:`KeySampler`, whose slots are scanned
+    by HSCAN. The hash must be modified through the methods below.
+    '''
+    __slots__ = ('_slots',)
+
+    def __init__(self, data=None):
+        self._slots = KeySampler()
+        if data:
+            self.update(data)
+
+    def __reduce__(self):
+        return self.__class__, (list(self.items()),)
+
+    def __setitem__(self, field, value):
+        dict.__setitem__(self, field, value)
+        self._slots.add(field)
+
+    def __delitem__(self, field):
+        dict.__delitem__(self, field)
+        self._slots.discard(field)
+
+    def pop(self, field, *default):
+        value = dict.pop(self, field, *default)
+        self._slots.discard(field)
+        return value
+
+    def popitem(self):
+        item = dict.popitem(self)
+        self._slots.discard(item[0])
+        return item
+
+    def setdefault(self, field, default=None):
+        if field not in self:
+            self[field] = default
+        return dict.__getitem__(self, field)
+
+    def update(self, items):
+        if isinstance(items, dict):
+            items = items.items()
+        for field, value in items:
+            self[field] = value
+
+    def clear(self):
+        dict.clear(self)
+        self._slots.clear()
+
+    def scan(self, cursor, count):
+        return self._slots.scan(cursor, count)
+
+
+class IndexedSet(set):
+    '''A set in its full encoding.
+
+    Members are also kept in a :class:`KeySampler`, whose slots are scanned
+    by SSCAN and sampled by SPOP and SRANDMEMBER. The set must be modified
+    through the methods below.
+    '''
+    __slots__ = ('_slots',)
+
+    def __init__(self, data=None):
+        set.__init__(self)
+        self._slots = KeySampler()
+        if data:
+            self.update(data)
+
+    def add(self, member):
+        set.add(self, member)
+        self._slots.add(member)
+
+    def discard(self, member):
+        set.discard(self, member)
+        self._slots.discard(member)
+
+    def remove(self, member):
+        set.remove(self, member)
+        self._slots.discard(member)
+
+    def pop(self):
+        '''Remove and return a member picked at random'''
+        if not self:
+            raise KeyError('pop from an empty set')
+        member = self._slots.sample(1)[0]
+        self.remove(member)
+        return member
+
+    def sample(self, count):
+        '''Return at most ``count`` distinct members picked at random'''
+        members = self._slots._keys
+        if len(members) <= count:
+            return list(members)
+        return sample(members, count)
+
+    def update(self, members):
+        for member in members:
+            self.add(member)
+
+    def difference_update(self, members):
+        for member in members:
+            self.discard(member)
+
+    def clear(self):
+        set.clear(self)
+        self._slots.clear()
+
+    def scan(self, cursor, count):
+        return self._slots.scan(cursor, count)
+
+
+class IndexedZset(Zset):
+    '''A sorted set in its full encoding.
+
+    Members are also kept in a :class:`KeySampler`, whose slots are scanned
+    by ZSCAN.
+    '''
+    def __init__(self, data=None):
+        self._slots = KeySampler()
+        super(IndexedZset, self).__init__(data)
+
+    def __setstate__(self, state):
+        super(IndexedZset, self).__setstate__(state)
+        self._slots = KeySampler()
+        for member in state:
+            self._slots.add(member)
+
+    def add(self, score, val):
+        result = super(IndexedZset, self).add(score, val)
+        self._slots.add(val)
+        return result
+
+    def remove(self, item):
+        score = super(IndexedZset, self).remove(item)
+        self._slots.discard(item)
+        return score
+
+    def clear(self):
+        super(IndexedZset, self).clear()
+        self._slots.clear()
+
+    def scan(self, cursor, count):
+        return self._slots.scan(cursor, count)
+
+    def _remove(self, start, end):
+        pop = self._dict.pop
+        discard = self._slots.discard
+        removed = self._sl.remove_range(start, end)
+        for _, value in removed:
+            pop(value)
+            discard(value)
+        return len(removed)
+
+
+COMPACT_TYPES = (PackedHash, PackedList, IntSet, PackedZset)
+
+
+class Encodings(object):
+    '''Encodings of the collections of a :class:`.Storage`.
+
+    A threshold of ``0`` entries disables the compact encoding of a type.
+    '''
+    def __init__(self, hash_entries=128, hash_value=64, list_entries=512,
+                 list_value=64, set_entries=512, zset_entries=128,
+                 zset_value=64):
+        self.hash_entries = hash_entries
+        self.hash_value = hash_value
+        self.list_entries = list_entries
+        self.list_value = list_value
+        self.set_entries = set_entries
+        self.zset_entries = zset_entries
+        self.zset_value = zset_value
+        self.names = {bytearray: 'raw',
+                      Dict: 'hashtable',
+                      Deque: 'linkedlist',
+                      set: 'hashtable',
+                      Zset: 'skiplist',
+                      IndexedHash: 'hashtable',
+                      IndexedSet: 'hashtable',
+                      IndexedZset: 'skiplist'}
+        self.names.update(((t, t.encoding) for t in COMPACT_TYPES))
+
+    def encoding(self, value):
+        '''The name of the encoding of ``value``'''
+        return self.names[type(value)]
+
+    def hash(self):
+        return PackedHash() if self.hash_entries else IndexedHash()
+
+    def list(self):
+        return PackedList() if self.list_entries else Deque()
+
+    def set(self, members=()):
+        '''A new set for ``members``, which are not added'''
+        if self.set_entries and IntSet.accepts(members):
+            return IntSet()
+        return IndexedSet()
+
+    def zset(self):
+        return PackedZset() if self.zset_entries else IndexedZset()
+
+    def overflow(self, value, written):
+        '''Check if a compact ``value`` exceeds the thresholds of its
+        encoding once the ``written`` elements were added to it.
+
+        Elements already in ``value`` fit, so that only the number of
+        entries and the length of the ``written`` elements are checked.
+        '''
+        size = len(value)
+        if isinstance(value, PackedHash):
+            return size > self.hash_entries or not _fits(written,
+                                                         self.hash_value)
+        elif isinstance(value, PackedList):
+            return size > self.list_entries or not _fits(written,
+                                                         self.list_value)
+        elif isinstance(value, IntSet):
+            return size > self.set_entries
+        else:
+            return size > self.zset_entries or not _fits(written,
+                                                         self.zset_value)
+
+    def compact(self, value):
+        '''Return ``value`` in its compact encoding if it fits, otherwise
+        in its full encoding.
+        '''
+        size = len(value)
+        if isinstance(value, Dict):
+            if (size <= self.hash_entries and _fits(value, self.hash_value)
+                    and _fits(value.values(), self.hash_value)):
+                return PackedHash(value.items())
+            elif type(value) is not IndexedHash:
+                return IndexedHash(value.items())
+        elif isinstance(value, Deque):
+            if size <= self.list_entries and _fits(value, self.list_value):
+                return PackedList(value)
+        elif isinstance(value, set):
+            if size <= self.set_entries and IntSet.accepts(value):
+                return IntSet(value)
+            elif type(value) is not IndexedSet:
+                return IndexedSet(value)
+        elif isinstance(value, Zset):
+            if size <= self.zset_entries and _fits(value, self.zset_value):
+                return PackedZset(value.items())
+            elif type(value) is not IndexedZset:
+                return IndexedZset(value.items())
+        return value
+
+
+def _fits(values, max_length):
+    # numbers stored by HINCRBY and HINCRBYFLOAT always fit
+    for value in values:
+        if isinstance(value, bytes) and len(value) > max_length:
+            return False
+    return True
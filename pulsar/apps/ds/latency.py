@@ -0,0 +1,109 @@
+'''Command statistics and slow log for pulsar-ds.
+
+The duration of each command is added to the :class:`CommandStats` of the
+command, which keeps the number of calls, the total time and a histogram
+of latencies with power of two buckets in microseconds. Percentiles are
+estimated from the histogram by linear interpolation within a bucket.
+Commands slower than a threshold are added to the :class:`SlowLog`.
+'''
+import time
+from itertools import islice
+from collections import deque
+
+from pulsar.utils.pep import to_bytes
+
+# Bucket ``n`` holds latencies with ``n`` bits, from 2**(n-1) to 2**n - 1
+# microseconds, the last bucket holds anything above 2**31 microseconds
+BUCKETS = 33
+# Percentiles reported by INFO latencystats
+PERCENTILES = (50, 99, 99.9)
+# Maximum number of arguments and bytes per argument in a slowlog entry
+SLOWLOG_ENTRY_MAX_ARGC = 32
+SLOWLOG_ENTRY_MAX_STRING = 128
+
+
+class CommandStats(object):
+    '''Calls, total time and latency histogram of a command.
+    '''
+    __slots__ = ('calls', 'usec', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.usec = 0
+        self.buckets = [0]*BUCKETS
+
+    def add(self, usec):
+        '''Add a call which took ``usec`` microseconds.
+        '''
+        self.calls += 1
+        self.usec += usec
+        self.buckets[min(usec.bit_length(), BUCKETS - 1)] += 1
+
+    def percentile(self, p):
+        '''Estimate the ``p`` percentile of latencies in microseconds.
+        '''
+        target = 0.01*p*self.calls
+        total = 0
+        for bit, count in enumerate(self.buckets):
+            if count and total + count >= target:
+                if not bit:
+                    return 0.
+                low = 1 << (bit - 1)
+                return low + low*(target - total)/count
+            total += count
+        return 0.
+
+    def info(self):
+        calls = self.calls
+        per_call = float(self.usec)/calls if calls else 0
+        return {'calls': calls,
+                'usec': self.usec,
+                'usec_per_call': '%.2f' % per_call}
+
+    def latency_info(self):
+        return dict((('p%s' % p, '%.3f' % self.percentile(p))
+                     for p in PERCENTILES))
+
+
+class SlowLog(object):
+    '''Keep the last ``max_len`` commands slower than the threshold.
+
+    Each entry is a tuple with a unique id, the unix time when the command
+    was logged, its duration in microseconds and its arguments.
+    '''
+    def __init__(self, max_len):
+        self.entries = deque(maxlen=max(max_len, 0))
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, request, usec):
+        argc = len(request)
+        args = [to_bytes(arg) for arg in request[:SLOWLOG_ENTRY_MAX_ARGC]]
+        if argc > SLOWLOG_ENTRY_MAX_ARGC:
+            args[-1] = ('... (%d more arguments)' %
+                        (argc - SLOWLOG_ENTRY_MAX_ARGC + 1)).encode('utf-8')
+        for n, arg in enumerate(args):
+            size = len(arg)
+            if size > SLOWLOG_ENTRY_MAX_STRING:
+                args[n] = arg[:SLOWLOG_ENTRY_MAX_STRING] + (
+                    '... (%d more bytes)' %
+                    (size - SLOWLOG_ENTRY_MAX_STRING)).encode('utf-8')
+        self.entries.appendleft((self._next_id, int(time.time()), usec,
+                                 args))
+        self._next_id += 1
+
+    def get(self, count=10):
+        '''The latest ``count`` entries, newest first.
+        '''
+        if count < 0:
+            return list(self.entries)
+        return list(islice(self.entries, count))
+
+    def reset(self):
+        self.entries.clear()
+
+    def resize(self, max_len):
+        max_len = max(max_len, 0)
+        self.entries = deque(islice(self.entries, max_len), maxlen=max_len)
@@ -13,6 +13,10 @@ else:   # pragma    nocover
 nil = b'$-1\r\n'
 null_array = b'*-1\r\n'
 
+# Bulk strings longer than this are copied out of the buffer via a
+# memoryview, which avoids the intermediate bytearray of a slice
+LARGE_BULK = 4096
+
 REPLAY_TYPE = frozenset((b'$',   # REDIS_REPLY_STRING,
                          b'*',   # REDIS_REPLY_ARRAY,
                          b':',   # REDIS_REPLY_INTEGER,
@@ -20,6 +24,13 @@ REPLAY_TYPE = frozenset((b'$',   # REDIS_REPLY_STRING,
                          b'-'))  # REDIS_REPLY_ERROR
 
 
+def _slice(b, start, end):
+    if end - start > LARGE_BULK:
+        return memoryview(b)[start:end].tobytes()
+    else:
+        return bytes(b[start:end])
+
+
 class String(object):
     __slots__ = ('_length', 'next')
 
@@ -32,8 +43,11 @@ class String(object):
         length = self._length
         if length >= 0:
             b = parser._inbuffer
-            if len(b) >= length+2:
-                parser._inbuffer, chunk = b[length+2:], bytes(b[:length])
+            start = parser._pos
+            end = start + length
+            if len(b) >= end+2:
+                parser._pos = end + 2
+                chunk = _slice(b, start, end)
                 if parser.encoding:
                     return chunk.decode(parser.encoding)
                 else:
@@ -72,7 +86,11 @@ class ArrayTask(object):
 
 
 class Parser(object):
-    '''A python parser for redis.'''
+    '''A python parser for redis.
+
+    Data is parsed in place: ``_pos`` is the offset of the first unparsed
+    byte of the buffer, which is compacted when new data is fed.
+    '''
     encoding = None
 
     def __init__(self, protocolError, responseError):
@@ -80,6 +98,7 @@ class Parser(object):
         self.responseError = responseError
         self._current = None
         self._inbuffer = bytearray()
+        self._pos = 0
 
     def on_connect(self, connection):
         if connection.decode_responses:
@@ -90,14 +109,22 @@ class Parser(object):
 
     def feed(self, buffer):
         '''Feed new data into the buffer'''
+        if self._pos:
+            # only the unparsed data is moved
+            del self._inbuffer[:self._pos]
+            self._pos = 0
         self._inbuffer.extend(buffer)
 
     def get(self):
         '''Called by the protocol consumer'''
         if self._current:
-            return self._resume(self._current, False)
+            result = self._resume(self._current, False)
         else:
-            return self._get(None)
+            result = self._get(None)
+        if self._pos and self._pos == len(self._inbuffer):
+            self._inbuffer = bytearray()
+            self._pos = 0
+        return result
 
     def bulk(self, value):
         if value is None:
@@ -176,32 +203,34 @@ class Parser(object):
 
     def _get(self, next):
         b = self._inbuffer
-        length = b.find(b'\r\n')
-        if length >= 0:
-            self._inbuffer, response = b[length+2:], bytes(b[:length])
-            rtype, response = response[:1], response[1:]
-            if rtype == b'-':
+        pos = self._pos
+        end = b.find(b'\r\n', pos)
+        if end >= 0:
+            self._pos = end + 2
+            rtype, response = b[pos], bytes(b[pos+1:end])
+            if rtype == 45:     # -
                 return self.responseError(response.decode('utf-8'))
-            elif rtype == b':':
+            elif rtype == 58:   # :
                 return long(response)
-            elif rtype == b'+':
+            elif rtype == 43:   # +
                 return response
-            elif rtype == b'$':
+            elif rtype == 36:   # $
                 task = String(long(response), next)
                 return task.decode(self, False)
-            elif rtype == b'*':
+            elif rtype == 42:   # *
                 task = ArrayTask(long(response), next)
                 return task.decode(self, False)
             else:
                 # Clear the buffer and raise
                 self._inbuffer = bytearray()
+                self._pos = 0
                 raise self.protocolError('Protocol Error')
         else:
             return False
 
     def buffer(self):
         '''Current buffer'''
-        return bytes(self._inbuffer)
+        return bytes(self._inbuffer[self._pos:])
 
     def _resume(self, task, result):
         result = task.decode(self, result)
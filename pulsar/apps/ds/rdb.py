@@ -0,0 +1,235 @@
+'''Snapshot files of pulsar-ds.
+
+A snapshot is a binary file written and read incrementally, one key at a
+time, so that neither saving nor loading requires a second copy of the
+dataset in memory. The file starts with a header::
+
+    PULSARDS <version:2 bytes>
+
+followed by a sequence of chunks. Each chunk is a 9 bytes frame containing
+the chunk flags, the payload length and the crc32 checksum of the payload,
+followed by the payload, optionally compressed with zlib.
+The uncompressed payload is a sequence of records, a record never spans two
+chunks:
+
+* ``SELECTDB <db:4 bytes>`` the database of the following keys
+* ``EXPIRETIME_MS <timestamp:8 bytes>`` the expiry of the next key
+* ``<type:1 byte> <key> <value>`` a key-value pair
+* ``EOF`` the end of the snapshot
+
+Strings are prefixed by their length (4 bytes), lists, sets and hashes by
+the number of elements (4 bytes) and sorted set members by their score
+(8 bytes double).
+'''
+import zlib
+from struct import Struct
+
+from pulsar.utils.pep import to_bytes, range
+from pulsar.utils.structures import Dict, Zset, Deque
+
+from .encoding import (PackedHash, PackedList, IntSet, PackedZset,
+                       IndexedHash, IndexedSet, IndexedZset)
+
+
+MAGIC = b'PULSARDS'
+RDB_VERSION = 3
+# Size after which a chunk is written to the file
+RDB_CHUNK_SIZE = 65536
+
+TYPE_STRING = 0
+TYPE_LIST = 1
+TYPE_SET = 2
+TYPE_ZSET = 3
+TYPE_HASH = 4
+OP_EXPIRETIME_MS = 252
+OP_SELECTDB = 254
+OP_EOF = 255
+
+CHUNK_COMPRESSED = 1
+
+_version = Struct('>H')
+_chunk = Struct('>BII')
+_byte = Struct('>B')
+_uint = Struct('>I')
+_double = Struct('>d')
+_select = Struct('>BI')
+_expire = Struct('>BQ')
+
+
+def is_snapshot(file):
+    '''Check if ``file`` starts with a snapshot header and rewind it'''
+    magic = file.read(len(MAGIC))
+    file.seek(-len(magic), 1)
+    return magic == MAGIC
+
+
+def write_snapshot(file, data, compress=0, chunk_size=RDB_CHUNK_SIZE):
+    '''Write ``data`` into a binary ``file``.
+
+    :param data: the snapshot of databases returned by :meth:`.Storage._dbs`
+    :param compress: zlib compression level of chunks, ``0`` for no
+        compression.
+    '''
+    _, dbs = data
+    writer = _ChunkWriter(file, compress)
+    file.write(MAGIC + _version.pack(RDB_VERSION))
+    for num, values, expires in dbs:
+        writer.append(_select.pack(OP_SELECTDB, num))
+        for key, value in values.items():
+            when = expires.get(key)
+            if when is not None:
+                writer.append(_expire.pack(OP_EXPIRETIME_MS,
+                                           int(1000*when)))
+            _encode(writer.append, key, value)
+            if writer.size >= chunk_size:
+                writer.flush()
+    writer.append(_byte.pack(OP_EOF))
+    writer.flush()
+
+
+def read_snapshot(file):
+    '''Generator of ``(db, key, value, expiry)`` stored in a binary ``file``.
+
+    ``expiry`` is a timestamp in seconds or ``None`` for persistent keys.
+    Raise ``ValueError`` if the file is not a valid snapshot.
+    '''
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError('Not a snapshot file')
+    version, = _version.unpack(file.read(_version.size))
+    if version > RDB_VERSION:
+        raise ValueError('Cannot load snapshot version %s' % version)
+    db = 0
+    when = None
+    while True:
+        frame = file.read(_chunk.size)
+        if len(frame) != _chunk.size:
+            raise ValueError('Snapshot terminated unexpectedly')
+        flags, length, crc = _chunk.unpack(frame)
+        payload = file.read(length)
+        if len(payload) != length or zlib.crc32(payload) & 0xffffffff != crc:
+            raise ValueError('Snapshot chunk checksum mismatch')
+        if flags & CHUNK_COMPRESSED:
+            payload = zlib.decompress(payload)
+        offset = 0
+        end = len(payload)
+        while offset < end:
+            op = _byte.unpack_from(payload, offset)[0]
+            if op == OP_SELECTDB:
+                db = _select.unpack_from(payload, offset)[1]
+                offset += _select.size
+            elif op == OP_EXPIRETIME_MS:
+                when = 0.001*_expire.unpack_from(payload, offset)[1]
+                offset += _expire.size
+            elif op == OP_EOF:
+                return
+            else:
+                key, value, offset = _decode(op, payload, offset + 1)
+                yield db, key, value, when
+                when = None
+
+
+class _ChunkWriter(object):
+    __slots__ = ('file', 'compress', 'size', '_buffer')
+
+    def __init__(self, file, compress):
+        self.file = file
+        self.compress = compress
+        self.size = 0
+        self._buffer = []
+
+    def append(self, chunk):
+        self._buffer.append(chunk)
+        self.size += len(chunk)
+
+    def flush(self):
+        payload = b''.join(self._buffer)
+        self._buffer = []
+        self.size = 0
+        flags = 0
+        if self.compress:
+            compressed = zlib.compress(payload, self.compress)
+            if len(compressed) < len(payload):
+                payload = compressed
+                flags |= CHUNK_COMPRESSED
+        crc = zlib.crc32(payload) & 0xffffffff
+        self.file.write(_chunk.pack(flags, len(payload), crc))
+        self.file.write(payload)
+
+
+def _string(value):
+    if isinstance(value, bytearray):
+        value = bytes(value)
+    elif not isinstance(value, bytes):
+        value = to_bytes(value)
+    return _uint.pack(len(value)) + value
+
+
+def _encode(append, key, value):
+    if isinstance(value, bytearray):
+        append(_byte.pack(TYPE_STRING) + _string(key) + _string(value))
+        return
+    elif isinstance(value, (Deque, PackedList)):
+        rtype = TYPE_LIST
+    elif isinstance(value, (set, IntSet)):
+        rtype = TYPE_SET
+    elif isinstance(value, (Zset, PackedZset)):
+        append(_byte.pack(TYPE_ZSET) + _string(key) +
+               _uint.pack(len(value)))
+        for score, member in value.items():
+            append(_double.pack(score) + _string(member))
+        return
+    elif isinstance(value, (Dict, PackedHash)):
+        append(_byte.pack(TYPE_HASH) + _string(key) + _uint.pack(len(value)))
+        for field, v in value.items():
+            append(_string(field) + _string(v))
+        return
+    else:
+        raise TypeError('Cannot save %s' % type(value))
+    append(_byte.pack(rtype) + _string(key) + _uint.pack(len(value)))
+    for v in value:
+        append(_string(v))
+
+
+def _decode(rtype, payload, offset):
+    unpack = _uint.unpack_from
+    size = _uint.size
+    length = unpack(payload, offset)[0]
+    offset += size
+    key = payload[offset:offset+length]
+    offset += length
+    length = unpack(payload, offset)[0]
+    offset += size
+    if rtype == TYPE_STRING:
+        value = bytearray(payload[offset:offset+length])
+        return key, value, offset + length
+    elif rtype == TYPE_ZSET:
+        items = []
+        append = items.append
+        dsize = _double.size
+        for _ in range(length):
+            score = _double.unpack_from(payload, offset)[0]
+            offset += dsize
+            n = unpack(payload, offset)[0]
+            offset += size
+            append((score, payload[offset:offset+n]))
+            offset += n
+        value = IndexedZset(items)
+        return key, value, offset
+    elif rtype == TYPE_HASH:
+        length *= 2
+    elif rtype not in (TYPE_LIST, TYPE_SET):
+        raise ValueError('Unknown snapshot type %s' % rtype)
+    items = []
+    append = items.append
+    for _ in range(length):
+        n = unpack(payload, offset)[0]
+        offset += size
+        append(payload[offset:offset+n])
+        offset += n
+    if rtype == TYPE_LIST:
+        value = Deque(items)
+    elif rtype == TYPE_SET:
+        value = IndexedSet(items)
+    else:
+        value = IndexedHash(zip(items[::2], items[1::2]))
+    return key, value, offset
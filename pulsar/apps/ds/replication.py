@@ -0,0 +1,224 @@
+'''Master-replica replication for pulsar-ds.
+
+A replica connects to its master and sends a ``PSYNC`` command with the
+replication id and offset of the last stream it received. If the master
+can continue the stream from its backlog it replies ``+CONTINUE`` and
+sends the missing commands, otherwise it replies ``+FULLRESYNC`` followed
+by a snapshot of its dataset as a bulk string. The snapshot is written by
+a child process, so that the master keeps serving clients, and it is
+followed by the commands executed meanwhile. From then on the master
+sends the write commands it executes, which the replica replays.
+Replicas acknowledge the processed offset once per second.
+'''
+import time
+from io import BytesIO
+from collections import deque
+from asyncio import Protocol
+
+from pulsar import async
+
+from .client import ReplayClient
+from .rdb import write_snapshot
+
+
+def write_resync(cfg, filename, data):
+    '''Write the snapshot of ``data`` sent to replicas into ``filename``.
+
+    Executed in a child process by :meth:`.Storage._full_resync`.
+    '''
+    with open(filename, 'wb') as file:
+        write_snapshot(file, data, cfg.key_value_compression)
+
+
+class ReplicationBacklog(object):
+    '''Keep the last ``size`` bytes, at least, of the replication stream.
+
+    .. attribute:: offset
+
+        The offset of the replication stream after the last byte added.
+
+    .. attribute:: start
+
+        The offset of the replication stream before the first byte held.
+    '''
+    def __init__(self, size, offset):
+        self.size = size
+        self.offset = offset
+        self.start = offset
+        self._chunks = deque()
+
+    @property
+    def histlen(self):
+        return self.offset - self.start
+
+    def append(self, data):
+        self._chunks.append(data)
+        self.offset += len(data)
+        chunks = self._chunks
+        while self.histlen - len(chunks[0]) >= self.size:
+            self.start += len(chunks.popleft())
+
+    def read(self, offset):
+        '''Return the stream after ``offset`` or ``None`` if not available.
+        '''
+        if self.start <= offset <= self.offset:
+            data = b''.join(self._chunks)
+            return data[offset-self.start:]
+
+
+class MasterLink(Protocol):
+    '''The connection of a replica with its master.
+
+    Data received before the replication stream starts is kept in a
+    ``bytearray`` where ``_pos`` is the offset of the first unread byte.
+
+    .. attribute:: replaying
+
+        ``True`` while commands received from the master are executed.
+    '''
+    def __init__(self, store, host, port):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.logger = store.logger
+        self.state = 'disconnected'
+        self.replid = '?'
+        self.offset = -1
+        self.last_io = time.time()
+        self.replaying = False
+        self._loop = store._loop
+        self._transport = None
+        self._buffer = bytearray()
+        self._pos = 0
+        self._bulk = None
+        self._pack = store._parser.pack_command
+        self._parser = store._server._parser_class()
+        self._client = ReplayClient(store)
+        self._client.flag |= store.MASTER
+        self._last_connect = 0
+
+    @property
+    def link_up(self):
+        return self.state == 'connected'
+
+    def connect(self):
+        self.state = 'connecting'
+        self._last_connect = time.time()
+        future = async(self._loop.create_connection(lambda: self, self.host,
+                                                    self.port), self._loop)
+        future.add_done_callback(self._connect_done)
+
+    def close(self):
+        self.state = 'closed'
+        if self._transport:
+            self._transport.close()
+
+    def cron(self):
+        if self.state == 'connected':
+            self._send(('replconf', 'ack', self.offset))
+        elif self.state == 'disconnected':
+            if time.time() - self._last_connect >= 1:
+                self.connect()
+
+    # Protocol implementation
+    def connection_made(self, transport):
+        self._transport = transport
+        self._buffer = bytearray()
+        self._pos = 0
+        self._parser = self.store._server._parser_class()
+        self.state = 'handshake'
+        self.logger.info('Connected to master %s:%s, sending PSYNC',
+                         self.host, self.port)
+        self._send(('psync', self.replid, self.offset + 1))
+
+    def connection_lost(self, exc):
+        self._transport = None
+        if self.state != 'closed':
+            self.logger.warning('Lost connection with master %s:%s',
+                                self.host, self.port)
+            self.state = 'disconnected'
+
+    def data_received(self, data):
+        self.last_io = time.time()
+        if self.state == 'connected':
+            return self._replay(data)
+        if self._pos:
+            # only the unread data is moved
+            del self._buffer[:self._pos]
+            self._pos = 0
+        self._buffer.extend(data)
+        if self.state == 'handshake':
+            line = self._line()
+            if line is None:
+                return
+            if line.startswith(b'+FULLRESYNC'):
+                _, replid, offset = line.split()
+                self.replid = replid.decode('utf-8')
+                self.offset = int(offset)
+                self.state = 'sync'
+            elif line.startswith(b'+CONTINUE'):
+                self.logger.info('Partial resynchronization with master')
+                self.state = 'connected'
+                return self._replay(self._pop_buffer())
+            else:
+                # The master does not support PSYNC
+                self.logger.warning('PSYNC failed: %s', line.decode('utf-8'))
+                self.state = 'sync'
+                self._send(('sync',))
+        if self.state == 'sync':
+            if self._bulk is None:
+                line = self._line()
+                if line is None:
+                    return
+                if line[:1] != b'$':
+                    self.logger.error('Bad snapshot from master: %s', line)
+                    return self._transport.close()
+                self._bulk = int(line[1:])
+            start = self._pos
+            end = start + self._bulk
+            if len(self._buffer) >= end:
+                snapshot = memoryview(self._buffer)[start:end].tobytes()
+                self._pos = end
+                self._bulk = None
+                self.store._load_snapshot(BytesIO(snapshot))
+                self.logger.info('Loaded %s bytes snapshot from master',
+                                 len(snapshot))
+                self.state = 'connected'
+                self._replay(self._pop_buffer())
+
+    # INTERNALS
+    def _connect_done(self, future):
+        if future.cancelled() or future.exception():
+            if self.state != 'closed':
+                self.logger.error('Could not connect to master %s:%s',
+                                  self.host, self.port)
+                self.state = 'disconnected'
+
+    def _send(self, request):
+        self._transport.write(self._pack(request))
+
+    def _line(self):
+        index = self._buffer.find(b'\r\n', self._pos)
+        if index >= 0:
+            line = bytes(self._buffer[self._pos:index])
+            self._pos = index + 2
+            return line
+
+    def _pop_buffer(self):
+        data = bytes(self._buffer[self._pos:])
+        self._buffer = bytearray()
+        self._pos = 0
+        return data
+
+    def _replay(self, data):
+        parser = self._parser
+        parser.feed(data)
+        request = parser.get()
+        self.replaying = True
+        try:
+            while request is not False:
+                self.offset += len(self._pack(request))
+                self._client.execute(request)
+                request = parser.get()
+        finally:
+            self.replaying = False
@@ -44,18 +44,22 @@ import os
 import re
 import time
 import math
-from random import choice
+from random import choice, random
 from hashlib import sha1
+from uuid import uuid4
 from itertools import islice, chain
 from functools import partial, reduce
-from collections import namedtuple
 from multiprocessing import Process
+from asyncio import Protocol
 
 import pulsar
 from pulsar.apps.socket import SocketServer
+from pulsar.utils.internet import WrapSocket
 from pulsar.utils.config import Global
 from pulsar.utils.structures import Dict, Zset, Deque
-from pulsar.utils.pep import map, range, zip, ispy3k, pickle
+from pulsar.utils.pep import (map, range, zip, ispy3k, pickle, default_timer,
+                              native_str, string_type)
+from pulsar.utils.security import gen_unique_id
 try:
     from pulsar.utils.lua import Lua
 except ImportError:     # pragma    nocover
@@ -63,9 +67,22 @@ except ImportError:     # pragma    nocover
 
 
 from .parser import redis_parser
-from .utils import sort_command, count_bytes, and_op, or_op, xor_op, save_data
+from .utils import (sort_command, save_data, TimerWheel, PatternIndex,
+                    LazyFree, value_size, lfu_incr, lfu_decr)
+from .encoding import (Encodings, PackedHash, PackedList, IntSet,
+                       PackedZset, KeySampler, IndexedHash, IndexedSet,
+                       IndexedZset, COMPACT_TYPES)
+from .bitmap import (BITOPS, OVERFLOWS, bit_count, bit_pos, bit_op,
+                     bitfield_type, get_bits, set_bits, overflow_bits)
+from .aof import AppendOnlyFile, FSYNC_POLICIES
+from .rdb import is_snapshot, read_snapshot
+from .replication import ReplicationBacklog, MasterLink, write_resync
+from .cluster import Cluster, CLUSTER_SLOTS, key_slot, command_keys
+from .latency import CommandStats, SlowLog
+from .tracking import ClientTracking, TrackingTable, INVALIDATE_CHANNEL
 from .client import (command, PulsarStoreClient, LuaClient, Blocked,
-                     COMMANDS_INFO, check_input, redis_to_py_pattern)
+                     ReplayClient, COMMANDS_INFO, CommandError, check_input,
+                     redis_to_py_pattern)
 
 
 DEFAULT_PULSAR_STORE_ADDRESS = '127.0.0.1:6410'
@@ -78,14 +95,33 @@ def pulsards_url(address=None, db=3):
 
 # Keyspace changes notification classes
 STRING_LIMIT = 2**32
+# Number of keys expired between two checks of the active expire time budget
+ACTIVE_EXPIRE_CYCLE_LOOKUPS = 20
+# Time budget, in seconds, of an active expire cycle
+ACTIVE_EXPIRE_CYCLE_TIME = 0.025
+# Default number of elements examined by a SCAN call
+SCAN_DEFAULT_COUNT = 10
+# Policies for choosing the keys to evict when the memory limit is reached
+MAXMEMORY_POLICIES = ('noeviction', 'allkeys-lru', 'volatile-lru',
+                      'allkeys-lfu', 'volatile-lfu', 'allkeys-random',
+                      'volatile-random', 'volatile-ttl')
+# Classes of clients with separate output buffer limits
+CLIENT_CLASSES = ('normal', 'slave', 'pubsub')
+# Collections with more elements are released in the background when
+# deleted lazily
+LAZYFREE_THRESHOLD = 64
+# Number of elements released by a step of the lazy free
+LAZYFREE_STEP_ELEMENTS = 1000
+# Lazy free policies in CONFIG and their Storage attributes
+LAZYFREE_OPTIONS = {'lazyfree-lazy-eviction': '_lazyfree_eviction',
+                    'lazyfree-lazy-expire': '_lazyfree_expire',
+                    'lazyfree-lazy-server-del': '_lazyfree_server_del'}
 
 nan = float('nan')
 
 if ispy3k:
-    from itertools import zip_longest
     _ord = lambda x: x
 else:   # pragma    nocover
-    from itertools import izip_longest as zip_longest
     _ord = lambda x: ord(x)
 
 
@@ -121,6 +157,29 @@ def validate_list_of_pairs(val):
     return new_val
 
 
+def validate_output_buffer_limits(val):
+    '''Validate a list of ``(class, hard, soft, seconds)`` tuples.
+
+    A string in the redis ``client-output-buffer-limit`` format is
+    accepted too.
+    '''
+    if isinstance(val, (string_type, bytes)):
+        val = native_str(val).split()
+        val = [val[i:i+4] for i in range(0, len(val), 4)]
+    new_val = []
+    if val:
+        if not isinstance(val, (list, tuple)):
+            raise TypeError("Not a list: %s" % val)
+        for elem in val:
+            if not isinstance(elem, (list, tuple)) or len(elem) != 4:
+                raise TypeError("Not a client class limit: %s" % str(elem))
+            if elem[0] not in CLIENT_CLASSES:
+                raise ValueError("Invalid client class: %s" % elem[0])
+            new_val.append((elem[0], int(elem[1]), int(elem[2]),
+                            int(elem[3])))
+    return new_val
+
+
 # #############################################################################
 # #    CONFIGURATION PARAMETERS
 class KeyValueDatabases(PulsarDsSetting):
@@ -157,6 +216,131 @@ class KeyValueSave(PulsarDsSetting):
     '''
 
 
+class KeyValueMaxMemory(PulsarDsSetting):
+    name = "key_value_maxmemory"
+    flags = ["--key-value-maxmemory"]
+    type = int
+    default = 0
+    desc = '''\
+        Approximate memory limit, in bytes, of the data store.
+
+        When the limit is reached, keys are evicted according to the
+        :ref:`key_value_maxmemory_policy <setting-key_value_maxmemory_policy>`
+        before executing write commands. If no key can be evicted, commands
+        which may increase the memory used fail with an ``OOM`` error.
+        The memory of a key is estimated from its value, ``0`` means no
+        limit.
+    '''
+
+
+class KeyValueMaxMemoryPolicy(PulsarDsSetting):
+    name = "key_value_maxmemory_policy"
+    flags = ["--key-value-maxmemory-policy"]
+    choices = MAXMEMORY_POLICIES
+    default = 'noeviction'
+    desc = '''\
+        How keys are evicted when the memory limit is reached.
+
+        ``allkeys-*`` policies evict any key, ``volatile-*`` policies only
+        keys with an expiry. ``lru`` evicts the least recently used keys,
+        ``lfu`` the least frequently used, ``random`` any key and
+        ``volatile-ttl`` the keys closest to their expiry.
+        ``noeviction`` rejects write commands instead.
+    '''
+
+
+class KeyValueMaxMemorySamples(PulsarDsSetting):
+    name = "key_value_maxmemory_samples"
+    flags = ["--key-value-maxmemory-samples"]
+    type = int
+    default = 5
+    desc = '''\
+        Number of keys sampled, in each database, for an eviction.
+
+        Larger samples approximate the eviction policy more closely, at
+        the cost of more CPU time.
+    '''
+
+
+class KeyValueHashMaxZiplistEntries(PulsarDsSetting):
+    name = "key_value_hash_max_ziplist_entries"
+    flags = ["--key-value-hash-max-ziplist-entries"]
+    type = int
+    default = 128
+    desc = '''\
+        Maximum number of fields of a hash in the compact encoding.
+
+        Small hashes are stored in packed arrays, which use much less
+        memory than a hash table. A hash is converted to a hash table once
+        it has more fields or a field or value is longer than
+        :ref:`key_value_hash_max_ziplist_value
+        <setting-key_value_hash_max_ziplist_value>`.
+        Set to 0 to disable the compact encoding.
+    '''
+
+
+class KeyValueHashMaxZiplistValue(PulsarDsSetting):
+    name = "key_value_hash_max_ziplist_value"
+    flags = ["--key-value-hash-max-ziplist-value"]
+    type = int
+    default = 64
+    desc = '''Maximum length of fields and values of a compact hash.'''
+
+
+class KeyValueListMaxZiplistEntries(PulsarDsSetting):
+    name = "key_value_list_max_ziplist_entries"
+    flags = ["--key-value-list-max-ziplist-entries"]
+    type = int
+    default = 512
+    desc = '''\
+        Maximum number of elements of a list in the compact encoding.
+
+        Set to 0 to disable the compact encoding of lists.
+    '''
+
+
+class KeyValueListMaxZiplistValue(PulsarDsSetting):
+    name = "key_value_list_max_ziplist_value"
+    flags = ["--key-value-list-max-ziplist-value"]
+    type = int
+    default = 64
+    desc = '''Maximum length of the elements of a compact list.'''
+
+
+class KeyValueSetMaxIntsetEntries(PulsarDsSetting):
+    name = "key_value_set_max_intset_entries"
+    flags = ["--key-value-set-max-intset-entries"]
+    type = int
+    default = 512
+    desc = '''\
+        Maximum number of members of a set of integers in the compact
+        encoding.
+
+        Sets of 64 bits integers are stored in sorted arrays. Set to 0 to
+        disable the compact encoding of sets.
+    '''
+
+
+class KeyValueZsetMaxZiplistEntries(PulsarDsSetting):
+    name = "key_value_zset_max_ziplist_entries"
+    flags = ["--key-value-zset-max-ziplist-entries"]
+    type = int
+    default = 128
+    desc = '''\
+        Maximum number of members of a sorted set in the compact encoding.
+
+        Set to 0 to disable the compact encoding of sorted sets.
+    '''
+
+
+class KeyValueZsetMaxZiplistValue(PulsarDsSetting):
+    name = "key_value_zset_max_ziplist_value"
+    flags = ["--key-value-zset-max-ziplist-value"]
+    type = int
+    default = 64
+    desc = '''Maximum length of the members of a compact sorted set.'''
+
+
 class KeyValueFileName(PulsarDsSetting):
     name = "key_value_filename"
     flags = ["--key-value-filename"]
@@ -164,6 +348,227 @@ class KeyValueFileName(PulsarDsSetting):
     desc = '''The filename where to dump the DB.'''
 
 
+class KeyValueCompression(PulsarDsSetting):
+    name = "key_value_compression"
+    flags = ["--key-value-compression"]
+    type = int
+    default = 1
+    desc = '''\
+        The zlib compression level of chunks in the DB dump.
+
+        Set to 0 to save the DB without compression.
+    '''
+
+
+class KeyValueWriteBatch(PulsarDsSetting):
+    name = "key_value_write_batch"
+    flags = ["--key-value-write-batch"]
+    type = int
+    default = 65536
+    desc = '''\
+        Maximum size in bytes of the replies buffered for a client.
+
+        Replies to the commands received in one read from a client are
+        collected and written once, when all commands have been executed or
+        when the buffered replies exceed this size.
+    '''
+
+
+class KeyValueClientOutputBufferLimit(PulsarDsSetting):
+    name = "key_value_client_output_buffer_limit"
+    default = [('normal', 0, 0, 0),
+               ('slave', 268435456, 67108864, 60),
+               ('pubsub', 33554432, 8388608, 60)]
+    validator = validate_output_buffer_limits
+    desc = '''\
+        Limits, in bytes, of the replies waiting to be sent to a client.
+
+        A list of ``(class, hard, soft, seconds)`` tuples, where class is
+        ``normal``, ``slave`` for replicas or ``pubsub`` for clients
+        subscribed to channels or patterns and monitors. A client is
+        disconnected when its output buffer reaches the hard limit, or
+        stays above the soft limit for ``seconds``. ``0`` disables a
+        limit.
+    '''
+
+
+class KeyValueClientPauseReading(PulsarDsSetting):
+    name = "key_value_client_pause_reading"
+    flags = ["--key-value-client-pause-reading"]
+    type = int
+    default = 1048576
+    desc = '''\
+        Size in bytes of the output buffer of a normal client above which
+        the server stops reading its requests.
+
+        Reading resumes once the client has received most of its replies.
+        ``0`` disables the backpressure.
+    '''
+
+
+class KeyValueAppendOnly(PulsarDsSetting):
+    name = "key_value_appendonly"
+    flags = ["--key-value-appendonly"]
+    validator = pulsar.validate_bool
+    action = "store_true"
+    default = False
+    desc = '''\
+        Log every write operation into an append only file.
+
+        When enabled, the append only file rather than the
+        :ref:`key_value_filename <setting-key_value_filename>` dump is used
+        to rebuild the dataset at startup.
+    '''
+
+
+class KeyValueAppendFileName(PulsarDsSetting):
+    name = "key_value_appendfilename"
+    flags = ["--key-value-appendfilename"]
+    default = 'pulsards.aof'
+    desc = '''The filename of the append only file.'''
+
+
+class KeyValueAppendFsync(PulsarDsSetting):
+    name = "key_value_appendfsync"
+    flags = ["--key-value-appendfsync"]
+    choices = FSYNC_POLICIES
+    default = 'everysec'
+    desc = '''\
+        When the append only file is flushed to disk.
+
+        ``always`` after every write command, ``everysec`` once per second
+        and ``no`` to let the operating system decide.
+    '''
+
+
+class KeyValueCluster(PulsarDsSetting):
+    name = "key_value_cluster"
+    flags = ["--key-value-cluster"]
+    validator = pulsar.validate_bool
+    action = "store_true"
+    default = False
+    desc = '''\
+        Shard the keyspace across workers.
+
+        Each worker owns a range of hash slots, listens on its own address,
+        consecutive to the :ref:`bind <setting-bind>` address, and redirects
+        commands on keys of other workers with a ``MOVED`` error.
+        Without sharding the data store runs on a single worker.
+    '''
+
+
+class KeyValueReplicaOf(PulsarDsSetting):
+    name = "key_value_replicaof"
+    flags = ["--key-value-replicaof"]
+    default = ''
+    desc = '''\
+        The ``host:port`` address of a master to replicate.
+
+        Can be changed at runtime with the ``SLAVEOF`` command.
+    '''
+
+
+class KeyValueReplicaReadOnly(PulsarDsSetting):
+    name = "key_value_replica_read_only"
+    flags = ["--key-value-replica-read-write"]
+    validator = pulsar.validate_bool
+    action = "store_false"
+    default = True
+    desc = '''Allow clients to write into a replica.'''
+
+
+class KeyValueReplBacklogSize(PulsarDsSetting):
+    name = "key_value_repl_backlog_size"
+    flags = ["--key-value-repl-backlog-size"]
+    type = int
+    default = 1048576
+    desc = '''\
+        Size in bytes of the replication backlog.
+
+        The backlog keeps the latest commands sent to replicas so that a
+        replica reconnecting to the master can continue the replication
+        without a full resynchronization.
+    '''
+
+
+class KeyValueSlowlogLogSlowerThan(PulsarDsSetting):
+    name = "key_value_slowlog_log_slower_than"
+    flags = ["--key-value-slowlog-log-slower-than"]
+    type = int
+    default = 10000
+    desc = '''\
+        Execution time, in microseconds, above which a command is logged
+        in the slow log.
+
+        Set to 0 to log every command, a negative value disables the slow
+        log.
+    '''
+
+
+class KeyValueSlowlogMaxLen(PulsarDsSetting):
+    name = "key_value_slowlog_max_len"
+    flags = ["--key-value-slowlog-max-len"]
+    type = int
+    default = 128
+    desc = '''\
+        Maximum number of entries in the slow log, older entries are
+        discarded.
+    '''
+
+
+class KeyValueLazyfreeLazyEviction(PulsarDsSetting):
+    name = "key_value_lazyfree_lazy_eviction"
+    flags = ["--key-value-lazyfree-lazy-eviction"]
+    validator = pulsar.validate_bool
+    action = "store_true"
+    default = False
+    desc = '''\
+        Release large values of keys evicted by the memory limit in the
+        background.
+
+        Values are released a few elements at a time between client
+        requests, as done by the ``UNLINK`` command.
+    '''
+
+
+class KeyValueLazyfreeLazyExpire(PulsarDsSetting):
+    name = "key_value_lazyfree_lazy_expire"
+    flags = ["--key-value-lazyfree-lazy-expire"]
+    validator = pulsar.validate_bool
+    action = "store_true"
+    default = False
+    desc = '''\
+        Release large values of expired keys in the background.
+    '''
+
+
+class KeyValueLazyfreeLazyServerDel(PulsarDsSetting):
+    name = "key_value_lazyfree_lazy_server_del"
+    flags = ["--key-value-lazyfree-lazy-server-del"]
+    validator = pulsar.validate_bool
+    action = "store_true"
+    default = False
+    desc = '''\
+        Release large values in the background when a command overwrites
+        a key, such as ``SET`` or ``RENAME`` on an existing key.
+    '''
+
+
+class KeyValueTrackingTableMaxKeys(PulsarDsSetting):
+    name = "key_value_tracking_table_max_keys"
+    flags = ["--key-value-tracking-table-max-keys"]
+    type = int
+    default = 1000000
+    desc = '''\
+        Maximum number of keys remembered for clients with tracking
+        enabled.
+
+        When the limit is reached, keys are forgotten and their clients
+        receive an invalidation message as if the keys were modified.
+        Set to 0 for no limit.
+    '''
+
+
 class TcpServer(pulsar.TcpServer):
 
     def __init__(self, cfg, *args, **kwargs):
@@ -177,6 +582,15 @@ class TcpServer(pulsar.TcpServer):
         info.update(self._key_value_store._info())
         return info
 
+    def close(self):
+        # Close the append only file once client connections are closed
+        return pulsar.chain_future(super(TcpServer, self).close(),
+                                   callback=self._close_store)
+
+    def _close_store(self, server):
+        self._key_value_store._close()
+        return server
+
 
 class PulsarDS(SocketServer):
     '''A :class:`.SocketServer` serving a pulsar datastore.
@@ -194,16 +608,46 @@ class PulsarDS(SocketServer):
 
     def monitor_start(self, monitor):
         cfg = self.cfg
-        workers = min(1, cfg.workers)
-        cfg.set('workers', workers)
-        return super(PulsarDS, self).monitor_start(monitor)
+        if not cfg.key_value_cluster:
+            cfg.set('workers', min(1, cfg.workers))
+        yield super(PulsarDS, self).monitor_start(monitor)
+        monitor.shards = []
+        if cfg.key_value_cluster and cfg.workers:
+            host, port = cfg.addresses[0][:2]
+            loop = monitor._loop
+            for shard in range(cfg.workers):
+                shard_port = port + shard + 1 if port else 0
+                server = yield loop.create_server(Protocol, host, shard_port)
+                sock = server.sockets[0]
+                server.loop.remove_reader(sock.fileno())
+                monitor.shards.append([WrapSocket(sock),
+                                       sock.getsockname()[:2], None])
+
+    def actorparams(self, monitor, params):
+        super(PulsarDS, self).actorparams(monitor, params)
+        shards = monitor.shards
+        for shard, entry in enumerate(shards):
+            if entry[2] not in monitor.managed_actors:
+                entry[2] = params['aid'] = gen_unique_id()[:8]
+                cfg = params['cfg']
+                for name in ('key_value_filename', 'key_value_appendfilename'):
+                    base, ext = os.path.splitext(cfg.get(name))
+                    cfg.set(name, '%s-%s%s' % (base, shard, ext))
+                params['sockets'] = params['sockets'] + [entry[0]]
+                params['shard'] = shard
+                params['shard_addresses'] = [e[1] for e in shards]
+                break
+
+    def worker_start(self, worker, exc=None):
+        super(PulsarDS, self).worker_start(worker, exc)
+        shard = getattr(worker, 'shard', None)
+        if not exc and shard is not None:
+            store = worker.servers[self.name]._key_value_store
+            store._cluster = Cluster(shard, worker.shard_addresses)
 
 
 # #############################################################################
 # #    DATA STORE
-pubsub_patterns = namedtuple('pubsub_patterns', 're clients')
-
-
 class Storage(object):
     '''Implement redis commands.
     '''
@@ -212,21 +656,75 @@ class Storage(object):
         self._password = cfg.key_value_password.encode('utf-8')
         self._filename = cfg.key_value_filename
         self._writer = None
+        self._aof = None
+        self._rewrites = []
         self._server = server
         self._loop = server._loop
         self._parser = server._parser_class()
         self._missed_keys = 0
         self._hit_keys = 0
         self._expired_keys = 0
+        self._expire_cycles = 0
+        self._expire_cycle_time = 0
+        self._expire_time_cap_reached = 0
+        self._expire_db = 0
         self._dirty = 0
+        # Memory limit
+        self._maxmemory = cfg.key_value_maxmemory
+        self._maxmemory_policy = cfg.key_value_maxmemory_policy
+        self._maxmemory_samples = cfg.key_value_maxmemory_samples
+        self._lfu = self._maxmemory_policy.endswith('lfu')
+        self._used_memory = 0
+        self._used_memory_compact = 0
+        self._evicted_keys = 0
+        self._changed_keys = []
         self._bpop_blocked_clients = 0
         self._last_save = int(time.time())
         self._channels = {}
-        self._patterns = {}
-        # The set of clients which are watching keys
-        self._watching = set()
+        self._patterns = PatternIndex()
+        # Replication
+        self._replid = uuid4().hex
+        self._master_repl_offset = 0
+        self._repl_backlog = None
+        self._repl_db = None
+        self._replicas = {}
+        self._master = None
+        # The child process writing the snapshot of a full resync, with its
+        # replication offset and replicas, and the replicas waiting for the
+        # next snapshot
+        self._resync = None
+        self._resync_waiting = []
+        # Sharding configuration when running in cluster mode
+        self._cluster = None
         # The set of clients which issued the monitor command
         self._monitors = set()
+        # Clients with buffered replies
+        self._write_batch = cfg.key_value_write_batch
+        self._pending_writes = set()
+        self._batching = False
+        self._flush_handle = None
+        # Output buffer limits of client classes
+        self._output_buffer_limits = {}
+        self._set_output_buffer_limits(
+            cfg.key_value_client_output_buffer_limit)
+        self._pause_reading = cfg.key_value_client_pause_reading
+        self._output_buffer_disconnections = 0
+        # Command statistics and slow log
+        self._command_stats = {}
+        self._slowlog = SlowLog(cfg.key_value_slowlog_max_len)
+        self._slowlog_slower_than = cfg.key_value_slowlog_log_slower_than
+        # Connected clients by id and keys tracked for client side caching
+        self._clients = {}
+        self._next_client_id = 0
+        self._tracking = TrackingTable()
+        self._tracking_clients = set()
+        self._tracking_max_keys = cfg.key_value_tracking_table_max_keys
+        # Large values released in the background
+        self._lazyfree = LazyFree(LAZYFREE_THRESHOLD)
+        self._lazyfree_handle = None
+        self._lazyfree_eviction = cfg.key_value_lazyfree_lazy_eviction
+        self._lazyfree_expire = cfg.key_value_lazyfree_lazy_expire
+        self._lazyfree_server_del = cfg.key_value_lazyfree_lazy_server_del
         self.logger = server.logger
         #
         self.NOTIFY_KEYSPACE = (1 << 0)
@@ -248,8 +746,12 @@ class Storage(object):
         self.MULTI = (1 << 3)
         self.BLOCKED = (1 << 4)
         self.DIRTY_CAS = (1 << 5)
+        self.SLAVE = (1 << 6)
+        self.MASTER = (1 << 7)
+        self.DIRTY_EXEC = (1 << 8)
         #
         self._event_handlers = {self.NOTIFY_GENERIC: self._generic_event,
+                                self.NOTIFY_EVICTED: self._generic_event,
                                 self.NOTIFY_STRING: self._string_event,
                                 self.NOTIFY_SET: self._set_event,
                                 self.NOTIFY_HASH: self._hash_event,
@@ -266,30 +768,58 @@ class Storage(object):
         self.PUBSUB_ONLY = ('only (P)SUBSCRIBE / (P)UNSUBSCRIBE / QUIT '
                             'allowed in this context')
         self.INVALID_SCORE = 'Invalid score value'
+        self.INVALID_LEX_RANGE = 'min or max not valid string range item'
+        self.INVALID_BITFIELD_TYPE = ('Invalid bitfield type. Use something '
+                                      'like i16 u8. Note that u64 is not '
+                                      'supported but i64 is.')
+        self.INVALID_OVERFLOW = 'Invalid OVERFLOW type specified'
+        self.INVALID_INTEGER = 'value is not an integer or out of range'
         self.NOT_SUPPORTED = 'Command not yet supported'
         self.OUT_OF_BOUND = 'Out of bound'
         self.SYNTAX_ERROR = 'Syntax error'
+        self.INVALID_CURSOR = 'invalid cursor'
         self.SUBSCRIBE_COMMANDS = ('psubscribe', 'punsubscribe', 'subscribe',
                                    'unsubscribe', 'quit')
+        # Write commands allowed when the memory limit is reached and no key
+        # can be evicted, since they do not increase the memory used
+        self.MAXMEMORY_ALLOWED = frozenset((
+            'del', 'expire', 'expireat', 'pexpire', 'pexpireat', 'persist',
+            'flushdb', 'flushall', 'lpop', 'rpop', 'blpop', 'brpop', 'lrem',
+            'ltrim', 'spop', 'srem', 'hdel', 'zrem', 'zremrangebyrank',
+            'zremrangebyscore', 'zremrangebylex', 'unlink'))
         self.encoder = pickle
-        self.hash_type = Dict
+        self.encodings = Encodings(
+            cfg.key_value_hash_max_ziplist_entries,
+            cfg.key_value_hash_max_ziplist_value,
+            cfg.key_value_list_max_ziplist_entries,
+            cfg.key_value_list_max_ziplist_value,
+            cfg.key_value_set_max_intset_entries,
+            cfg.key_value_zset_max_ziplist_entries,
+            cfg.key_value_zset_max_ziplist_value)
+        self.hash_type = IndexedHash
         self.list_type = Deque
-        self.zset_type = Zset
-        self.data_types = (bytearray, set, self.hash_type,
-                           self.list_type, self.zset_type)
+        self.zset_type = IndexedZset
+        # Types of each data type, in their full and compact encodings, and
+        # the base types of full encodings, which RESTORE accepts
+        self.hash_types = (self.hash_type, PackedHash, Dict)
+        self.list_types = (self.list_type, PackedList)
+        self.set_types = (IndexedSet, IntSet, set)
+        self.zset_types = (self.zset_type, PackedZset, Zset)
+        self.data_types = ((bytearray,) + self.set_types + self.hash_types +
+                           self.list_types + self.zset_types)
         self.zset_aggregate = {b'min': min,
                                b'max': max,
                                b'sum': sum}
-        self._type_event_map = {bytearray: self.NOTIFY_STRING,
-                                self.hash_type: self.NOTIFY_HASH,
-                                self.list_type: self.NOTIFY_LIST,
-                                set: self.NOTIFY_SET,
-                                self.zset_type: self.NOTIFY_ZSET}
-        self._type_name_map = {bytearray: 'string',
-                               self.hash_type: 'hash',
-                               self.list_type: 'list',
-                               set: 'set',
-                               self.zset_type: 'zset'}
+        self._type_event_map = {bytearray: self.NOTIFY_STRING}
+        self._type_name_map = {bytearray: 'string'}
+        for types, event, name in (
+                (self.hash_types, self.NOTIFY_HASH, 'hash'),
+                (self.list_types, self.NOTIFY_LIST, 'list'),
+                (self.set_types, self.NOTIFY_SET, 'set'),
+                (self.zset_types, self.NOTIFY_ZSET, 'zset')):
+            for data_type in types:
+                self._type_event_map[data_type] = event
+                self._type_name_map[data_type] = name
         self.databases = dict(((num, Db(num, self))
                                for num in range(cfg.key_value_databases)))
         # Initialise lua
@@ -302,7 +832,14 @@ class Storage(object):
         else:   # pragma    nocover
             self.lua = None
             self.version = '2.4.10'
-        self._loaddb()
+        if cfg.key_value_appendonly:
+            self._loadaof()
+        else:
+            self._loaddb()
+        self._reset_memory()
+        if cfg.key_value_replicaof:
+            host, port = cfg.key_value_replicaof.split(':')
+            self._replicaof(host, int(port))
         pulsar.call_repeatedly(self._loop, 1, self._cron)
 
     # #########################################################################
@@ -342,7 +879,10 @@ class Storage(object):
             if timeout:
                 if timeout < 0:
                     return client.reply_error(self.INVALID_TIMEOUT)
-                if client.db.expire(request[1], m*timeout):
+                db = client.db
+                if db.expire(request[1], m*timeout):
+                    self._signal(self.NOTIFY_GENERIC, db, request[0],
+                                 request[1], 1)
                     return client.reply_one()
             client.reply_zero()
 
@@ -358,7 +898,10 @@ class Storage(object):
                 if timeout < 0:
                     return client.reply_error(self.INVALID_TIMEOUT)
                 timeout = M*timeout - time.time()
-                if client.db.expire(request[1], timeout):
+                db = client.db
+                if db.expire(request[1], timeout):
+                    self._signal(self.NOTIFY_GENERIC, db, request[0],
+                                 request[1], 1)
                     return client.reply_one()
             client.reply_zero()
 
@@ -400,14 +943,27 @@ class Storage(object):
         self._signal(self._type_event_map[type(value)], db2, 'set', key, 1)
         client.reply_one()
 
-    @command('Keys', supported=False)
+    @command('Keys', subcommands=['encoding', 'refcount'])
     def object(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N != 2)
+        subcommand = request[1].decode('utf-8').lower()
+        value = client.db.get(request[2])
+        if subcommand not in ('encoding', 'refcount'):
+            client.reply_error("'object %s' not valid" % subcommand)
+        elif value is None:
+            client.reply_bulk()
+        elif subcommand == 'encoding':
+            encoding = self.encodings.encoding(value)
+            client.reply_bulk(encoding.encode('utf-8'))
+        else:
+            client.reply_one()
 
     @command('Keys', True)
     def persist(self, client, request, N):
         check_input(request, N != 1)
-        if client.db.persist(request[1]):
+        db = client.db
+        if db.persist(request[1]):
+            self._signal(self.NOTIFY_GENERIC, db, request[0], request[1], 1)
             client.reply_one()
         else:
             client.reply_zero()
@@ -452,7 +1008,7 @@ class Storage(object):
                 result = 1
             else:
                 result = 0
-                if db.pop(key2) is not None:
+                if db.discard(key2):
                     self._signal(self.NOTIFY_GENERIC, db, 'del', key2)
             db.pop(key1)
             event = self._type_event_map[type(value)]
@@ -480,11 +1036,13 @@ class Storage(object):
             ttl = int(request[2])
         except Exception:
             return client.reply_error(self.INVALID_TIMEOUT)
-        if db.pop(key) is not None:
+        if db.discard(key):
             self._signal(self.NOTIFY_GENERIC, db, 'del', key)
+        value = self.encodings.compact(value)
         db._data[key] = value
         if ttl > 0:
             db.expire(key, ttl)
+        self._signal(self._type_event_map[type(value)], db, request[0], key, 1)
         client.reply_ok()
 
     @command('Keys', True)
@@ -493,16 +1051,17 @@ class Storage(object):
         value = client.db.get(request[1])
         if value is None:
             value = self.list_type()
-        elif not isinstance(value, (set, self.list_type, self.zset_type)):
+        elif not isinstance(value, self.set_types + self.list_types +
+                            self.zset_types):
             return client.reply_wrongtype()
         sort_command(self, client, request, value)
 
-    @command('Keys', True)
+    @command('Keys')
     def ttl(self, client, request, N):
         check_input(request, N != 1)
         client.reply_int(client.db.ttl(request[1]))
 
-    @command('Keys', True)
+    @command('Keys')
     def type(self, client, request, N):
         check_input(request, N != 1)
         value = client.db.get(request[1])
@@ -512,9 +1071,28 @@ class Storage(object):
             result = self._type_name_map[type(value)]
         client.reply_status(result)
 
-    @command('Keys', supported=False)
+    @command('Keys', True)
+    def unlink(self, client, request, N):
+        check_input(request, not N)
+        rem = client.db.rem
+        result = reduce(lambda x, y: x + rem(y, True), request[1:], 0)
+        client.reply_int(result)
+
+    @command('Keys')
     def scan(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, not N)
+        db = client.db
+        if self._changed_keys:
+            self._account_keys()
+        scan = self._scan(client, request, 1, db._keys, True)
+        if scan:
+            cursor, keys, type_name = scan
+            keys = [key for key in keys if db.exists(key)]
+            if type_name:
+                names = self._type_name_map
+                keys = [key for key in keys
+                        if names[type(db._data[key])] == type_name]
+            client.reply_multi_bulk((cursor, keys))
 
     # #########################################################################
     # #    STRING COMMANDS
@@ -547,29 +1125,90 @@ class Storage(object):
             return client.reply_wrongtype()
         else:
             assert value
+            start, end = 0, None
             if N > 1:
                 start = request[2]
                 end = request[3] if N == 3 else -1
                 start, end = self._range_values(value, start, end)
-                value = value[start:end]
-            client.reply_int(count_bytes(value))
+            client.reply_int(bit_count(value, start, end))
+
+    @command('Strings', True)
+    def bitfield(self, client, request, N):
+        check_input(request, N < 1)
+        key = request[1]
+        db = client.db
+        value = db.get(key)
+        if value is not None and not isinstance(value, bytearray):
+            return client.reply_wrongtype()
+        operations = []
+        overflow = b'wrap'
+        args = request[2:]
+        while args:
+            name = args[0].lower()
+            if name == b'overflow' and len(args) > 1:
+                overflow = args[1].lower()
+                if overflow not in OVERFLOWS:
+                    return client.reply_error(self.INVALID_OVERFLOW)
+                args = args[2:]
+                continue
+            elif name == b'get' and len(args) > 2:
+                size = 3
+            elif name in (b'set', b'incrby') and len(args) > 3:
+                size = 4
+            else:
+                return client.reply_error(self.SYNTAX_ERROR)
+            try:
+                signed, bits = bitfield_type(args[1])
+            except ValueError:
+                return client.reply_error(self.INVALID_BITFIELD_TYPE)
+            try:
+                offset = args[2]
+                if offset[:1] == b'#':
+                    offset = bits*int(offset[1:])
+                else:
+                    offset = int(offset)
+                if offset < 0 or offset + bits > STRING_LIMIT:
+                    raise ValueError
+            except ValueError:
+                return client.reply_error(
+                    "bit offset is not an integer or out of range")
+            try:
+                number = int(args[3]) if size == 4 else None
+            except ValueError:
+                return client.reply_error(self.INVALID_INTEGER)
+            operations.append((name, signed, bits, offset, number, overflow))
+            args = args[size:]
+        client.reply_multi_bulk_len(len(operations))
+        changes = 0
+        for name, signed, bits, offset, number, overflow in operations:
+            current = get_bits(value or b'', offset, bits, signed)
+            if name == b'get':
+                client.reply_int(current)
+                continue
+            elif name == b'incrby':
+                number += current
+            number = overflow_bits(number, bits, signed, overflow)
+            if number is None:
+                client.reply_bulk()
+                continue
+            if value is None:
+                value = bytearray()
+                db._data[key] = value
+            set_bits(value, offset, bits, number)
+            changes += 1
+            client.reply_int(current if name == b'set' else number)
+        if changes:
+            self._signal(self.NOTIFY_STRING, db, request[0], key, changes)
 
     @command('Strings', True)
     def bitop(self, client, request, N):
         check_input(request, N < 3)
         db = client.db
         op = request[1].lower()
-        if op == b'and':
-            reduce_op = and_op
-        elif op == b'or':
-            reduce_op = or_op
-        elif op == b'xor':
-            reduce_op = xor_op
+        if op not in BITOPS:
+            return client.reply_error('bad command')
         elif op == b'not':
-            reduce_op = None
             check_input(request, N != 3)
-        else:
-            return client.reply_error('bad command')
         empty = bytearray()
         keys = []
         for key in request[3:]:
@@ -580,16 +1219,10 @@ class Storage(object):
                 keys.append(value)
             else:
                 return client.reply_wrongtype()
-        result = bytearray()
-        if reduce_op is None:
-            for value in keys[0]:
-                result.append(~value & 255)
-        else:
-            for values in zip_longest(*keys, **{'fillvalue': 0}):
-                result.append(reduce(reduce_op, values))
+        result = bit_op(BITOPS[op], keys)
         if result:
             dest = request[2]
-            if db.pop(dest):
+            if db.discard(dest):
                 self._signal(self.NOTIFY_GENERIC, db, 'del', dest)
             db._data[dest] = result
             self._signal(self.NOTIFY_STRING, db, 'set', dest, 1)
@@ -597,6 +1230,38 @@ class Storage(object):
         else:
             client.reply_zero()
 
+    @command('Strings')
+    def bitpos(self, client, request, N):
+        check_input(request, N < 2 or N > 4)
+        try:
+            bit = int(request[2])
+            if bit not in (0, 1):
+                raise ValueError
+        except ValueError:
+            return client.reply_error('The bit argument must be 1 or 0.')
+        value = client.db.get(request[1])
+        if value is None:
+            client.reply_int(-1 if bit else 0)
+        elif not isinstance(value, bytearray):
+            client.reply_wrongtype()
+        else:
+            assert value
+            start, end = 0, len(value)
+            if N > 2:
+                try:
+                    start, end = self._range_values(
+                        value, request[3], request[4] if N == 4 else -1)
+                except ValueError:
+                    return client.reply_error(self.INVALID_INTEGER)
+                start, end = max(start, 0), min(end, len(value))
+            if start >= end:
+                return client.reply_int(-1)
+            position = bit_pos(value, bit, start, end)
+            if position < 0 and not bit and N < 4:
+                # the string is padded with clear bits on the right
+                position = 8*end
+            client.reply_int(position)
+
     @command('Strings', True)
     def decr(self, client, request, N):
         check_input(request, N != 1)
@@ -730,7 +1395,7 @@ class Storage(object):
         check_input(request, N < 2 or D * 2 != N)
         db = client.db
         for key, value in zip(request[1::2], request[2::2]):
-            db.pop(key)
+            db.discard(key)
             db._data[key] = bytearray(value)
             self._signal(self.NOTIFY_STRING, db, 'set', key, 1)
         client.reply_ok()
@@ -898,7 +1563,7 @@ class Storage(object):
         value = db.get(key)
         if value is None:
             client.reply_zero()
-        elif isinstance(value, self.hash_type):
+        elif isinstance(value, self.hash_types):
             rem = 0
             for field in request[2:]:
                 rem += 0 if value.pop(field, None) is None else 1
@@ -915,7 +1580,7 @@ class Storage(object):
         value = client.db.get(request[1])
         if value is None:
             client.reply_zero()
-        elif isinstance(value, self.hash_type):
+        elif isinstance(value, self.hash_types):
             client.reply_int(int(request[2] in value))
         else:
             client.reply_wrongtype()
@@ -926,7 +1591,7 @@ class Storage(object):
         value = client.db.get(request[1])
         if value is None:
             client.reply_bulk()
-        elif isinstance(value, self.hash_type):
+        elif isinstance(value, self.hash_types):
             client.reply_bulk(value.get(request[2]))
         else:
             client.reply_wrongtype()
@@ -937,7 +1602,7 @@ class Storage(object):
         value = client.db.get(request[1])
         if value is None:
             client.reply_multi_bulk(())
-        elif isinstance(value, self.hash_type):
+        elif isinstance(value, self.hash_types):
             client.reply_multi_bulk(value.flat())
         else:
             client.reply_wrongtype()
@@ -960,7 +1625,7 @@ class Storage(object):
         value = client.db.get(request[1])
         if value is None:
             client.reply_multi_bulk(())
-        elif isinstance(value, self.hash_type):
+        elif isinstance(value, self.hash_types):
             client.reply_multi_bulk(value)
         else:
             client.reply_wrongtype()
@@ -971,7 +1636,7 @@ class Storage(object):
         value = client.db.get(request[1])
         if value is None:
             client.reply_zero()
-        elif isinstance(value, self.hash_type):
+        elif isinstance(value, self.hash_types):
             client.reply_int(len(value))
         else:
             client.reply_wrongtype()
@@ -982,7 +1647,7 @@ class Storage(object):
         value = client.db.get(request[1])
         if value is None:
             client.reply_multi_bulk(())
-        elif isinstance(value, self.hash_type):
+        elif isinstance(value, self.hash_types):
             result = value.mget(request[2:])
             client.reply_multi_bulk(result)
         else:
@@ -996,13 +1661,13 @@ class Storage(object):
         db = client.db
         value = db.get(key)
         if value is None:
-            value = self.hash_type()
+            value = self.encodings.hash()
             db._data[key] = value
-        elif not isinstance(value, self.hash_type):
+        elif not isinstance(value, self.hash_types):
             return client.reply_wrongtype()
         it = iter(request[2:])
         value.update(zip(it, it))
-        self._signal(self.NOTIFY_HASH, db, request[0], key, D)
+        self._signal(self.NOTIFY_HASH, db, request[0], key, D, request[2:])
         client.reply_ok()
 
     @command('Hashes', True)
@@ -1012,13 +1677,13 @@ class Storage(object):
         db = client.db
         value = db.get(key)
         if value is None:
-            value = self.hash_type()
+            value = self.encodings.hash()
             db._data[key] = value
-        elif not isinstance(value, self.hash_type):
+        elif not isinstance(value, self.hash_types):
             return client.reply_wrongtype()
         avail = (field in value)
         value[field] = request[3]
-        self._signal(self.NOTIFY_HASH, db, request[0], key, 1)
+        self._signal(self.NOTIFY_HASH, db, request[0], key, 1, request[2:])
         client.reply_zero() if avail else client.reply_one()
 
     @command('Hashes', True)
@@ -1028,15 +1693,16 @@ class Storage(object):
         db = client.db
         value = db.get(key)
         if value is None:
-            value = self.hash_type()
+            value = self.encodings.hash()
             db._data[key] = value
-        elif not isinstance(value, self.hash_type):
+        elif not isinstance(value, self.hash_types):
             return client.reply_wrongtype()
         if field in value:
             client.reply_zero()
         else:
             value[field] = request[3]
-            self._signal(self.NOTIFY_HASH, db, request[0], key, 1)
+            self._signal(self.NOTIFY_HASH, db, request[0], key, 1,
+                         request[2:])
             client.reply_one()
 
     @command('Hashes')
@@ -1045,14 +1711,30 @@ class Storage(object):
         value = client.db.get(request[1])
         if value is None:
             client.reply_multi_bulk(())
-        elif isinstance(value, self.hash_type):
+        elif isinstance(value, self.hash_types):
             client.reply_multi_bulk(tuple(value.values()))
         else:
             client.reply_wrongtype()
 
-    @command('Hashes', supported=False)
+    @command('Hashes')
     def hscan(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N < 2)
+        db = client.db
+        value = db.get(request[1])
+        if value is None:
+            client.reply_multi_bulk((b'0', ()))
+        elif not isinstance(value, self.hash_types):
+            client.reply_wrongtype()
+        else:
+            scan = self._scan(client, request, 2, value)
+            if scan:
+                cursor, fields, _ = scan
+                result = []
+                for field in fields:
+                    v = value.get(field)
+                    if v is not None:
+                        result.extend((field, v))
+                client.reply_multi_bulk((cursor, result))
 
     # #########################################################################
     # #    LIST COMMANDS
@@ -1089,7 +1771,7 @@ class Storage(object):
         value = client.db.get(request[1])
         if value is None:
             client.reply_bulk()
-        elif isinstance(value, self.list_type):
+        elif isinstance(value, self.list_types):
             assert value
             index = int(request[2])
             if index >= 0 and index < len(value):
@@ -1109,7 +1791,7 @@ class Storage(object):
         value = db.get(key)
         if value is None:
             client.reply_zero()
-        elif not isinstance(value, self.list_type):
+        elif not isinstance(value, self.list_types):
             client.reply_wrongtype()
         else:
             assert value
@@ -1123,7 +1805,8 @@ class Storage(object):
                 return client.reply_error('cannot insert to list')
             l2 = len(value)
             if l2 - l1:
-                self._signal(self.NOTIFY_LIST, db, request[0], key, 1)
+                self._signal(self.NOTIFY_LIST, db, request[0], key, 1,
+                             request[4:])
                 client.reply_int(l2)
             else:
                 client.reply_int(-1)
@@ -1134,7 +1817,7 @@ class Storage(object):
         value = client.db.get(request[1])
         if value is None:
             client.reply_zero()
-        elif isinstance(value, self.list_type):
+        elif isinstance(value, self.list_types):
             assert value
             client.reply_int(len(value))
         else:
@@ -1148,7 +1831,7 @@ class Storage(object):
         value = db.get(key)
         if value is None:
             client.reply_bulk()
-        elif not isinstance(value, self.list_type):
+        elif not isinstance(value, self.list_types):
             client.reply_wrongtype()
         else:
             assert value
@@ -1172,9 +1855,9 @@ class Storage(object):
         db = client.db
         value = db.get(key)
         if value is None:
-            value = self.list_type()
+            value = self.encodings.list()
             db._data[key] = value
-        elif not isinstance(value, self.list_type):
+        elif not isinstance(value, self.list_types):
             return client.reply_wrongtype()
         else:
             assert value
@@ -1183,7 +1866,8 @@ class Storage(object):
         else:
             value.extend(request[2:])
         client.reply_int(len(value))
-        self._signal(self.NOTIFY_LIST, db, request[0], key, N - 1)
+        self._signal(self.NOTIFY_LIST, db, request[0], key, N - 1,
+                     request[2:])
 
     @command('Lists', True)
     def rpush(self, client, request, N):
@@ -1197,7 +1881,7 @@ class Storage(object):
         value = db.get(key)
         if value is None:
             client.reply_zero()
-        elif not isinstance(value, self.list_type):
+        elif not isinstance(value, self.list_types):
             client.reply_wrongtype()
         else:
             assert value
@@ -1206,13 +1890,14 @@ class Storage(object):
             else:
                 value.append(request[2])
             client.reply_int(len(value))
-            self._signal(self.NOTIFY_LIST, db, request[0], key, 1)
+            self._signal(self.NOTIFY_LIST, db, request[0], key, 1,
+                         request[2:])
 
     @command('Lists', True)
     def rpushx(self, client, request, N):
         return self.lpushx(client, request, N)
 
-    @command('Lists', True)
+    @command('Lists')
     def lrange(self, client, request, N):
         check_input(request, N != 3)
         db = client.db
@@ -1224,7 +1909,7 @@ class Storage(object):
             return client.reply_error('invalid range')
         if value is None:
             client.reply_multi_bulk(())
-        elif not isinstance(value, self.list_type):
+        elif not isinstance(value, self.list_types):
             client.reply_wrongtype()
         else:
             assert value
@@ -1240,7 +1925,7 @@ class Storage(object):
         value = db.get(key)
         if value is None:
             client.reply_zero()
-        elif not isinstance(value, self.list_type):
+        elif not isinstance(value, self.list_types):
             client.reply_wrongtype()
         else:
             assert value
@@ -1263,7 +1948,7 @@ class Storage(object):
         value = db.get(key)
         if value is None:
             client.reply_error(self.OUT_OF_BOUND)
-        elif not isinstance(value, self.list_type):
+        elif not isinstance(value, self.list_types):
             client.reply_wrongtype()
         else:
             assert value
@@ -1273,7 +1958,8 @@ class Storage(object):
                 index = -1
             if index >= 0 and index < len(value):
                 value[index] = request[3]
-                self._signal(self.NOTIFY_LIST, db, request[0], key, 1)
+                self._signal(self.NOTIFY_LIST, db, request[0], key, 1,
+                             request[3:])
                 client.reply_ok()
             else:
                 client.reply_error(self.OUT_OF_BOUND)
@@ -1290,7 +1976,7 @@ class Storage(object):
             return client.reply_error('invalid range')
         if value is None:
             client.reply_ok()
-        elif not isinstance(value, self.list_type):
+        elif not isinstance(value, self.list_types):
             client.reply_wrongtype()
         else:
             assert value
@@ -1312,21 +1998,21 @@ class Storage(object):
         dest = db.get(key2)
         if orig is None:
             client.reply_bulk()
-        elif not isinstance(orig, self.list_type):
+        elif not isinstance(orig, self.list_types):
             client.reply_wrongtype()
         else:
             assert orig
             if dest is None:
-                dest = self.list_type()
+                dest = self.encodings.list()
                 db._data[key2] = dest
-            elif not isinstance(dest, self.list_type):
+            elif not isinstance(dest, self.list_types):
                 return client.reply_wrongtype()
             else:
                 assert dest
             value = orig.pop()
             self._signal(self.NOTIFY_LIST, db, 'rpop', key1, 1)
             dest.appendleft(value)
-            self._signal(self.NOTIFY_LIST, db, 'lpush', key2, 1)
+            self._signal(self.NOTIFY_LIST, db, 'lpush', key2, 1, (value,))
             if db.pop(key1, orig) is not None:
                 self._signal(self.NOTIFY_GENERIC, db, 'del', key1)
             client.reply_bulk(value)
@@ -1339,15 +2025,18 @@ class Storage(object):
         key = request[1]
         db = client.db
         value = db.get(key)
+        members = request[2:]
         if value is None:
-            value = set()
+            value = self.encodings.set(members)
             db._data[key] = value
-        elif not isinstance(value, set):
+        elif not isinstance(value, self.set_types):
             return client.reply_wrongtype()
+        elif type(value) is IntSet and not IntSet.accepts(members):
+            value = self._upgrade(db, key, value)
         n = len(value)
-        value.update(request[2:])
+        value.update(members)
         n = len(value) - n
-        self._signal(self.NOTIFY_SET, db, request[0], key, n)
+        self._signal(self.NOTIFY_SET, db, request[0], key, n, members)
         client.reply_int(n)
 
     @command('Sets')
@@ -1356,7 +2045,7 @@ class Storage(object):
         value = client.db.get(request[1])
         if value is None:
             client.reply_zero()
-        elif not isinstance(value, set):
+        elif not isinstance(value, self.set_types):
             client.reply_wrongtype()
         else:
             client.reply_int(len(value))
@@ -1387,7 +2076,7 @@ class Storage(object):
         value = client.db.get(request[1])
         if value is None:
             client.reply_zero()
-        elif not isinstance(value, set):
+        elif not isinstance(value, self.set_types):
             client.reply_wrongtype()
         else:
             client.reply_int(int(request[2] in value))
@@ -1398,7 +2087,7 @@ class Storage(object):
         value = client.db.get(request[1])
         if value is None:
             client.reply_multi_bulk(())
-        elif not isinstance(value, set):
+        elif not isinstance(value, self.set_types):
             client.reply_wrongtype()
         else:
             client.reply_multi_bulk(value)
@@ -1413,21 +2102,23 @@ class Storage(object):
         dest = db.get(key2)
         if orig is None:
             client.reply_zero()
-        elif not isinstance(orig, set):
+        elif not isinstance(orig, self.set_types):
             client.reply_wrongtype()
         else:
             member = request[3]
             if member in orig:
                 # we my be able to move
                 if dest is None:
-                    dest = set()
-                    db._data[request[2]] = dest
-                elif not isinstance(dest, set):
+                    dest = self.encodings.set((member,))
+                    db._data[key2] = dest
+                elif not isinstance(dest, self.set_types):
                     return client.reply_wrongtype()
+                elif type(dest) is IntSet and not IntSet.accepts((member,)):
+                    dest = self._upgrade(db, key2, dest)
                 orig.remove(member)
                 dest.add(member)
                 self._signal(self.NOTIFY_SET, db, 'srem', key1)
-                self._signal(self.NOTIFY_SET, db, 'sadd', key2, 1)
+                self._signal(self.NOTIFY_SET, db, 'sadd', key2, 1, (member,))
                 if db.pop(key1, orig) is not None:
                     self._signal(self.NOTIFY_GENERIC, db, 'del', key1)
                 client.reply_one()
@@ -1442,20 +2133,23 @@ class Storage(object):
         value = db.get(key)
         if value is None:
             client.reply_bulk()
-        elif not isinstance(value, set):
+        elif not isinstance(value, self.set_types):
             client.reply_wrongtype()
         else:
             result = value.pop()
             self._signal(self.NOTIFY_SET, db, request[0], key, 1)
             if db.pop(key, value) is not None:
                 self._signal(self.NOTIFY_GENERIC, db, 'del', key)
+                self._rewrites.append((db, ['del', key]))
+            else:
+                self._rewrites.append((db, ['srem', key, result]))
             client.reply_bulk(result)
 
     @command('Sets')
     def srandmember(self, client, request, N):
         check_input(request, N < 1 or N > 2)
         value = client.db.get(request[1])
-        if value is not None and not isinstance(value, set):
+        if value is not None and not isinstance(value, self.set_types):
             return client.reply_wrongtype()
         if N == 2:
             try:
@@ -1467,11 +2161,7 @@ class Storage(object):
                 if not value:
                     result = (None,) * count
                 else:
-                    result = []
-                    for _ in range(count):
-                        el = value.pop()
-                        result.append(el)
-                        value.add(el)
+                    result = [value.sample(1)[0] for _ in range(count)]
             elif count > 0:
                 if not value:
                     result = (None,)
@@ -1479,21 +2169,12 @@ class Storage(object):
                     result = list(value)
                     result.extend((None,)*(count-len(value)))
                 else:
-                    result = []
-                    for _ in range(count):
-                        el = value.pop()
-                        result.append(el)
-                    value.update(result)
+                    result = value.sample(count)
             else:
                 result = []
             client.reply_multi_bulk(result)
         else:
-            if not value:
-                result = None
-            else:
-                result = value.pop()
-                value.add(result)
-            client.reply_bulk(result)
+            client.reply_bulk(value.sample(1)[0] if value else None)
 
     @command('Sets', True)
     def srem(self, client, request, N):
@@ -1503,7 +2184,7 @@ class Storage(object):
         value = db.get(key)
         if value is None:
             client.reply_zero()
-        elif not isinstance(value, set):
+        elif not isinstance(value, self.set_types):
             client.reply_wrongtype()
         else:
             start = len(value)
@@ -1524,9 +2205,21 @@ class Storage(object):
         check_input(request, N < 2)
         self._setoper(client, 'union', request[2:], request[1])
 
-    @command('Sets', supported=False)
+    @command('Sets')
     def sscan(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N < 2)
+        db = client.db
+        value = db.get(request[1])
+        if value is None:
+            client.reply_multi_bulk((b'0', ()))
+        elif not isinstance(value, self.set_types):
+            client.reply_wrongtype()
+        else:
+            scan = self._scan(client, request, 2, value)
+            if scan:
+                cursor, members, _ = scan
+                client.reply_multi_bulk(
+                    (cursor, [m for m in members if m in value]))
 
     # #########################################################################
     # #    SORTED SETS COMMANDS
@@ -1538,14 +2231,19 @@ class Storage(object):
         db = client.db
         value = db.get(key)
         if value is None:
-            value = self.zset_type()
+            value = self.encodings.zset()
             db._data[key] = value
-        elif not isinstance(value, self.zset_type):
+        elif not isinstance(value, self.zset_types):
             return client.reply_wrongtype()
         start = len(value)
-        value.update(zip(map(float, request[2::2]), request[3::2]))
+        changed = 0
+        for score, member in zip(map(float, request[2::2]), request[3::2]):
+            if value.score(member) != score:
+                value.add(score, member)
+                changed += 1
         result = len(value) - start
-        self._signal(self.NOTIFY_ZSET, db, request[0], key, result)
+        self._signal(self.NOTIFY_ZSET, db, request[0], key, changed,
+                     request[3::2])
         client.reply_int(result)
 
     @command('Sorted Sets')
@@ -1554,7 +2252,7 @@ class Storage(object):
         value = client.db.get(request[1])
         if value is None:
             client.reply_zero()
-        elif not isinstance(value, self.zset_type):
+        elif not isinstance(value, self.zset_types):
             client.reply_wrongtype()
         else:
             client.reply_int(len(value))
@@ -1565,7 +2263,7 @@ class Storage(object):
         value = client.db.get(request[1])
         if value is None:
             client.reply_zero()
-        elif not isinstance(value, self.zset_type):
+        elif not isinstance(value, self.zset_types):
             client.reply_wrongtype()
         else:
             min_value, max_value = request[2], request[3]
@@ -1592,8 +2290,8 @@ class Storage(object):
         db = client.db
         value = db.get(key)
         if value is None:
-            db._data[key] = value = self.zset_type()
-        elif not isinstance(value, self.zset_type):
+            db._data[key] = value = self.encodings.zset()
+        elif not isinstance(value, self.zset_types):
             return client.reply_wrongtype()
         try:
             increment = float(request[2])
@@ -1603,20 +2301,35 @@ class Storage(object):
             member = request[3]
             score = value.score(member, 0) + increment
             value.add(score, member)
-            self._signal(self.NOTIFY_ZSET, db, request[0], key, 1)
+            self._signal(self.NOTIFY_ZSET, db, request[0], key, 1, (member,))
             client.reply_bulk(str(score).encode('utf-8'))
 
     @command('Sorted Sets', True)
     def zinterstore(self, client, request, N):
         self._zsetoper(client, request, N)
 
+    @command('Sorted Sets')
+    def zlexcount(self, client, request, N):
+        check_input(request, N != 3)
+        value = client.db.get(request[1])
+        if value is None:
+            client.reply_zero()
+        elif not isinstance(value, self.zset_types):
+            client.reply_wrongtype()
+        else:
+            try:
+                bounds = self._lex_values(request[2], request[3])
+            except ValueError:
+                return client.reply_error(self.INVALID_LEX_RANGE)
+            client.reply_int(value.count_by_lex(*bounds) if bounds else 0)
+
     @command('Sorted Sets')
     def zrange(self, client, request, N):
         check_input(request, N < 3 or N > 4)
         value = client.db.get(request[1])
         if value is None:
             client.reply_multi_bulk(())
-        elif not isinstance(value, self.zset_type):
+        elif not isinstance(value, self.zset_types):
             client.reply_wrongtype()
         else:
             try:
@@ -1635,13 +2348,44 @@ class Storage(object):
                 result = list(value.range(start, end))
             client.reply_multi_bulk(result)
 
+    @command('Sorted Sets')
+    def zrangebylex(self, client, request, N):
+        check_input(request, N != 3 and N != 6)
+        value = client.db.get(request[1])
+        if value is None:
+            client.reply_multi_bulk(())
+        elif not isinstance(value, self.zset_types):
+            client.reply_wrongtype()
+        else:
+            try:
+                bounds = self._lex_values(request[2], request[3])
+            except ValueError:
+                return client.reply_error(self.INVALID_LEX_RANGE)
+            offset = 0
+            count = None
+            if N == 6:
+                if request[4].lower() != b'limit':
+                    return client.reply_error(self.SYNTAX_ERROR)
+                try:
+                    offset = int(request[5])
+                    count = int(request[6])
+                except Exception:
+                    return client.reply_error(self.SYNTAX_ERROR)
+                if count < 0:
+                    count = None
+            if bounds:
+                client.reply_multi_bulk(list(value.range_by_lex(
+                    *bounds, start=offset, num=count)))
+            else:
+                client.reply_multi_bulk(())
+
     @command('Sorted Sets')
     def zrangebyscore(self, client, request, N):
         check_input(request, N < 3 or N > 7)
         value = client.db.get(request[1])
         if value is None:
             client.reply_multi_bulk(())
-        elif not isinstance(value, self.zset_type):
+        elif not isinstance(value, self.zset_types):
             client.reply_wrongtype()
         else:
             try:
@@ -1686,7 +2430,7 @@ class Storage(object):
         value = client.db.get(request[1])
         if value is None:
             client.reply_bulk()
-        elif not isinstance(value, self.zset_type):
+        elif not isinstance(value, self.zset_types):
             client.reply_wrongtype()
         else:
             rank = value.rank(request[2])
@@ -1703,7 +2447,7 @@ class Storage(object):
         value = db.get(key)
         if value is None:
             client.reply_zero()
-        elif not isinstance(value, self.zset_type):
+        elif not isinstance(value, self.zset_types):
             client.reply_wrongtype()
         else:
             removed = value.remove_items(request[2:])
@@ -1713,6 +2457,28 @@ class Storage(object):
                 self._signal(self.NOTIFY_GENERIC, db, 'del', key)
             client.reply_int(removed)
 
+    @command('Sorted Sets', True)
+    def zremrangebylex(self, client, request, N):
+        check_input(request, N != 3)
+        key = request[1]
+        db = client.db
+        value = db.get(key)
+        if value is None:
+            client.reply_zero()
+        elif not isinstance(value, self.zset_types):
+            client.reply_wrongtype()
+        else:
+            try:
+                bounds = self._lex_values(request[2], request[3])
+            except ValueError:
+                return client.reply_error(self.INVALID_LEX_RANGE)
+            removed = value.remove_range_by_lex(*bounds) if bounds else 0
+            if removed:
+                self._signal(self.NOTIFY_ZSET, db, request[0], key, removed)
+            if db.pop(key, value) is not None:
+                self._signal(self.NOTIFY_GENERIC, db, 'del', key)
+            client.reply_int(removed)
+
     @command('Sorted Sets', True)
     def zremrangebyrank(self, client, request, N):
         check_input(request, N != 3)
@@ -1721,7 +2487,7 @@ class Storage(object):
         value = db.get(key)
         if value is None:
             client.reply_zero()
-        elif not isinstance(value, self.zset_type):
+        elif not isinstance(value, self.zset_types):
             client.reply_wrongtype()
         else:
             try:
@@ -1743,7 +2509,7 @@ class Storage(object):
         value = db.get(key)
         if value is None:
             client.reply_zero()
-        elif not isinstance(value, self.zset_type):
+        elif not isinstance(value, self.zset_types):
             client.reply_wrongtype()
         else:
             try:
@@ -1775,7 +2541,7 @@ class Storage(object):
         value = db.get(key)
         if value is None:
             client.reply_bulk(None)
-        elif not isinstance(value, self.zset_type):
+        elif not isinstance(value, self.zset_types):
             client.reply_wrongtype()
         else:
             score = value.score(request[2], None)
@@ -1787,9 +2553,25 @@ class Storage(object):
     def zunionstore(self, client, request, N):
         self._zsetoper(client, request, N)
 
-    @command('Sorted Sets', supported=False)
+    @command('Sorted Sets')
     def zscan(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N < 2)
+        db = client.db
+        value = db.get(request[1])
+        if value is None:
+            client.reply_multi_bulk((b'0', ()))
+        elif not isinstance(value, self.zset_types):
+            client.reply_wrongtype()
+        else:
+            scan = self._scan(client, request, 2, value)
+            if scan:
+                cursor, members, _ = scan
+                result = []
+                for member in members:
+                    score = value.score(member)
+                    if score is not None:
+                        result.extend((member, score))
+                client.reply_multi_bulk((cursor, result))
 
     # #########################################################################
     # #    PUBSUB COMMANDS
@@ -1797,15 +2579,9 @@ class Storage(object):
     def psubscribe(self, client, request, N):
         check_input(request, not N)
         for pattern in request[1:]:
-            p = self._patterns.get(pattern)
-            if not p:
-                pre = redis_to_py_pattern(pattern.decode('utf-8'))
-                p = pubsub_patterns(re.compile(pre), set())
-                self._patterns[pattern] = p
-            p.clients.add(client)
+            self._patterns.add(pattern, client)
             client.patterns.add(pattern)
-            count = reduce(lambda x, y: x + int(client in y.clients),
-                           self._patterns.values())
+            count = len(client.channels) + len(client.patterns)
             client.reply_multi_bulk((b'psubscribe', pattern, count))
 
     @command('Pub/Sub')
@@ -1832,9 +2608,7 @@ class Storage(object):
             client.reply_multi_bulk(count)
         elif subcommand == 'numpat':
             check_input(request, N > 1)
-            count = reduce(lambda x, y: x + len(y.clients),
-                           self._patterns.values())
-            client.reply_int(count)
+            client.reply_int(len(self._patterns))
         else:
             client.reply_error("Unknown command 'pubsub %s'" % subcommand)
 
@@ -1842,27 +2616,20 @@ class Storage(object):
     def publish(self, client, request, N):
         check_input(request, N != 2)
         channel, message = request[1:]
-        ch = channel.decode('utf-8')
-        msg = self._parser.multi_bulk((b'message', channel, message))
-        count = self._publish_clients(msg, self._channels.get(channel, ()))
-        for pattern in self._patterns.values():
-            g = pattern.re.match(ch)
-            if g:
-                count += self._publish_clients(msg, pattern.clients)
+        count = self._publish(channel, message)
+        if self._cluster:
+            self._cluster.publish(channel, message)
         client.reply_int(count)
 
     @command('Pub/Sub', script=0)
     def punsubscribe(self, client, request, N):
-        patterns = request[1:] if N else list(self._patterns)
+        patterns = request[1:] if N else list(client.patterns)
         for pattern in patterns:
-            if pattern in self._patterns:
-                p = self._patterns[pattern]
-                if client in p.clients:
-                    client.patterns.discard(pattern)
-                    p.clients.remove(client)
-                    if not p.clients:
-                        self._patterns.pop(pattern)
-                    client.reply_multi_bulk((b'punsubscribe', pattern))
+            if pattern in client.patterns:
+                client.patterns.discard(pattern)
+                self._patterns.discard(pattern, client)
+                count = len(client.channels) + len(client.patterns)
+                client.reply_multi_bulk((b'punsubscribe', pattern, count))
 
     @command('Pub/Sub', script=0)
     def subscribe(self, client, request, N):
@@ -1873,20 +2640,18 @@ class Storage(object):
                 self._channels[channel] = clients = set()
             clients.add(client)
             client.channels.add(channel)
-            client.reply_multi_bulk((b'subscribe', channel, len(clients)))
+            count = len(client.channels) + len(client.patterns)
+            client.reply_multi_bulk((b'subscribe', channel, count))
 
     @command('Pub/Sub', script=0)
     def unsubscribe(self, client, request, N):
-        channels = request[1:] if N else list(self._channels)
+        channels = request[1:] if N else list(client.channels)
         for channel in channels:
-            if channel in self._channels:
-                clients = self._channels[channel]
-                if client in clients:
-                    client.channels.discard(channel)
-                    clients.remove(client)
-                    if not clients:
-                        self._channels.pop(channel)
-                    client.reply_multi_bulk((b'unsubscribe', channel))
+            if channel in client.channels:
+                client.channels.discard(channel)
+                self._unsubscribe(client, channel)
+                count = len(client.channels) + len(client.patterns)
+                client.reply_multi_bulk((b'unsubscribe', channel, count))
 
     # #########################################################################
     # #    TRANSACTION COMMANDS
@@ -1906,7 +2671,11 @@ class Storage(object):
             client.reply_error("EXEC without MULTI")
         else:
             requests = client.transaction
-            if client.flag & self.DIRTY_CAS:
+            if client.flag & self.DIRTY_EXEC:
+                self._close_transaction(client)
+                client.reply_error('Transaction discarded because of '
+                                   'previous errors.', 'EXECABORT')
+            elif client.flag & self.DIRTY_CAS:
                 self._close_transaction(client)
                 client.reply_multi_bulk(())
             else:
@@ -1930,11 +2699,16 @@ class Storage(object):
         if client.transaction is not None:
             client.reply_error("WATCH inside MULTI is not allowed")
         else:
+            db = client.db
             wkeys = client.watched_keys
             if not wkeys:
                 client.watched_keys = wkeys = set()
-                self._watching.add(client)
-            wkeys.update(request[1:])
+            for key in request[1:]:
+                clients = db._watchers.get(key)
+                if clients is None:
+                    db._watchers[key] = clients = set()
+                clients.add(client)
+                wkeys.add((db, key))
             client.reply_ok()
 
     @command('Transactions', script=0)
@@ -2016,6 +2790,7 @@ class Storage(object):
     def quit(self, client, request, N):
         check_input(request, N)
         client.reply_ok()
+        client._flush()
         client.close()
 
     @command('Connections')
@@ -2035,9 +2810,17 @@ class Storage(object):
 
     # #########################################################################
     # #    SERVER COMMANDS
-    @command('Server', supported=False)
+    @command('Server')
     def bgrewriteaof(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N)
+        if self._aof is None:
+            client.reply_error('Append only file is not enabled')
+        elif self._aof.rewrite(self._dbs()):
+            client.reply_status('Background append only file rewriting '
+                                'started')
+        else:
+            client.reply_error('Background append only file rewriting '
+                               'already in progress')
 
     @command('Server')
     def bgsave(self, client, request, N):
@@ -2053,9 +2836,52 @@ class Storage(object):
             check_input(request, N != 1)
             value = '\n'.join(self._client_list(client))
             client.reply_bulk(value.encode('utf-8'))
+        elif subcommand == 'id':
+            check_input(request, N != 1)
+            client.reply_int(client.id)
+        elif subcommand == 'tracking':
+            check_input(request, N < 2)
+            try:
+                tracking = self._tracking_options(request[2:])
+            except ValueError as e:
+                return client.reply_error(str(e))
+            self._set_tracking(client, tracking)
+            client.reply_ok()
         else:
             client.reply_error("unknown command 'client %s'" % subcommand)
 
+    @command('Server', script=0)
+    def cluster(self, client, request, N):
+        check_input(request, not N)
+        subcommand = request[1].decode('utf-8').lower()
+        cluster = self._cluster
+        if subcommand == 'keyslot':
+            check_input(request, N != 2)
+            client.reply_int(key_slot(request[2]))
+        elif not cluster:
+            client.reply_error('This instance has cluster support disabled')
+        elif subcommand == 'slots':
+            check_input(request, N != 1)
+            client.reply_multi_bulk_len(len(cluster.slots))
+            for (start, end), (host, port) in zip(cluster.slots,
+                                                  cluster.addresses):
+                client.reply_multi_bulk_len(3)
+                client.reply_int(start)
+                client.reply_int(end)
+                client.reply_multi_bulk((host, port))
+        elif subcommand == 'info':
+            check_input(request, N != 1)
+            info = ('cluster_state:ok\r\n'
+                    'cluster_slots_assigned:%d\r\n'
+                    'cluster_known_nodes:%d\r\n'
+                    'cluster_size:%d\r\n'
+                    'cluster_my_shard:%d\r\n' %
+                    (CLUSTER_SLOTS, len(cluster.addresses),
+                     len(cluster.addresses), cluster.shard))
+            client.reply_bulk(info.encode('utf-8'))
+        else:
+            client.reply_error("unknown command 'cluster %s'" % subcommand)
+
     @command('Server')
     def config(self, client, request, N):
         check_input(request, not N)
@@ -2072,7 +2898,7 @@ class Storage(object):
             try:
                 if N != 3:
                     raise ValueError("'config set' no argument")
-                self._set_config(request[2].decode('utf-8'))
+                self._set_config(request[2].decode('utf-8'), request[3])
             except Exception as e:
                 client.reply_error(str(e))
             else:
@@ -2081,6 +2907,13 @@ class Storage(object):
             self._hit_keys = 0
             self._missed_keys = 0
             self._expired_keys = 0
+            self._expire_cycles = 0
+            self._expire_cycle_time = 0
+            self._expire_time_cap_reached = 0
+            self._evicted_keys = 0
+            self._output_buffer_disconnections = 0
+            self._lazyfree.freed = 0
+            self._command_stats.clear()
             server = client._producer
             server._received = 0
             server._requests_processed = 0
@@ -2099,21 +2932,21 @@ class Storage(object):
 
     @command('Server', True)
     def flushdb(self, client, request, N):
-        check_input(request, N)
-        client.db.flush()
+        client.db.flush(self._async_option(request, N))
         client.reply_ok()
 
     @command('Server', True)
     def flushall(self, client, request, N):
-        check_input(request, N)
+        lazy = self._async_option(request, N)
         for db in self.databases.values():
-            db.flush()
+            db.flush(lazy)
         client.reply_ok()
 
     @command('Server')
     def info(self, client, request, N):
-        check_input(request, N)
-        info = '\n'.join(self._flat_info())
+        check_input(request, N > 1)
+        section = request[1].decode('utf-8').lower() if N else None
+        info = '\n'.join(self._flat_info(section))
         client.reply_bulk(info.encode('utf-8'))
 
     @command('Server')
@@ -2138,17 +2971,95 @@ class Storage(object):
     def shutdown(self, client, request, N):
         client.reply_error(self.NOT_SUPPORTED)
 
-    @command('Server', supported=False)
+    @command('Server', script=0)
+    def psync(self, client, request, N):
+        check_input(request, N != 2)
+        if client.flag & self.SLAVE:
+            return client.reply_error('Replica already synchronizing')
+        try:
+            offset = int(request[2]) - 1
+        except Exception:
+            return client.reply_error(self.SYNTAX_ERROR)
+        backlog = self._repl_backlog
+        replid = request[1].decode('utf-8')
+        stream = None
+        if backlog and replid == self._replid:
+            stream = backlog.read(offset)
+        if stream is None:
+            self._full_resync(client, True)
+        else:
+            client.reply_status('CONTINUE')
+            client._write(stream)
+            self._add_replica(client, offset)
+
+    @command('Server', script=0)
+    def replconf(self, client, request, N):
+        check_input(request, N % 2 or not N)
+        option = request[1].lower()
+        if option == b'ack':
+            if client in self._replicas:
+                self._replicas[client] = int(request[2])
+        elif option in (b'listening-port', b'capa'):
+            client.reply_ok()
+        else:
+            client.reply_error('Unrecognized REPLCONF option: %s' %
+                               option.decode('utf-8'))
+
+    @command('Server', script=0)
     def slaveof(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N != 2)
+        host = request[1].decode('utf-8')
+        port = request[2].decode('utf-8')
+        if host.lower() == 'no' and port.lower() == 'one':
+            if self._master:
+                self._master.close()
+                self._master = None
+                # A new history starts here
+                self._replid = uuid4().hex
+                self.logger.info('Replication stopped, now a master')
+            client.reply_ok()
+        else:
+            try:
+                port = int(port)
+            except Exception:
+                return client.reply_error(self.SYNTAX_ERROR)
+            self._replicaof(host, port)
+            client.reply_ok()
 
-    @command('Server', supported=False)
+    @command('Server', subcommands=['get', 'len', 'reset'])
     def slowlog(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, not N)
+        subcommand = request[1].decode('utf-8').lower()
+        if subcommand == 'get':
+            check_input(request, N > 2)
+            try:
+                count = int(request[2]) if N == 2 else 10
+            except ValueError:
+                return client.reply_error(self.SYNTAX_ERROR)
+            entries = self._slowlog.get(count)
+            client.reply_multi_bulk_len(len(entries))
+            for entry_id, timestamp, usec, args in entries:
+                client.reply_multi_bulk_len(4)
+                client.reply_int(entry_id)
+                client.reply_int(timestamp)
+                client.reply_int(usec)
+                client.reply_multi_bulk(args)
+        elif subcommand == 'len':
+            check_input(request, N != 1)
+            client.reply_int(len(self._slowlog))
+        elif subcommand == 'reset':
+            check_input(request, N != 1)
+            self._slowlog.reset()
+            client.reply_ok()
+        else:
+            client.reply_error("unknown command 'slowlog %s'" % subcommand)
 
-    @command('Server', supported=False)
+    @command('Server', script=0)
     def sync(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N)
+        if client.flag & self.SLAVE:
+            return client.reply_error('Replica already synchronizing')
+        self._full_resync(client, False)
 
     @command('Server')
     def time(self, client, request, N):
@@ -2161,6 +3072,17 @@ class Storage(object):
     # #########################################################################
     # #    INTERNALS
     def _cron(self):
+        if self._master:
+            # keys expire in the master which propagates deletes
+            self._master.cron()
+        else:
+            self._active_expire_cycle()
+        if self._resync and not self._resync[0].is_alive():
+            self._resync_done()
+        if self._changed_keys:
+            self._account_keys()
+        if self._aof:
+            self._aof._cron()
         dirty = self._dirty
         if dirty:
             now = time.time()
@@ -2170,11 +3092,37 @@ class Storage(object):
                     self._save()
                     break
 
+    def _active_expire_cycle(self):
+        '''Remove expired keys from the databases, within a time budget.
+
+        Databases are visited in a round-robin fashion, and the next cycle
+        starts from the database where the previous one ran out of time.
+        '''
+        start = default_timer()
+        deadline = start + ACTIVE_EXPIRE_CYCLE_TIME
+        now = time.time()
+        databases = self.databases
+        num = len(databases)
+        lookups = ACTIVE_EXPIRE_CYCLE_LOOKUPS
+        timedout = False
+        for _ in range(num):
+            db = databases[self._expire_db]
+            while db._expires and db._active_expire(now, lookups) == lookups:
+                if default_timer() > deadline:
+                    timedout = True
+                    break
+            if timedout:
+                self._expire_time_cap_reached += 1
+                break
+            self._expire_db = (self._expire_db + 1) % num
+        self._expire_cycles += 1
+        self._expire_cycle_time += default_timer() - start
+
     def _set(self, client, key, value, seconds=0, milliseconds=0,
              nx=False, xx=False):
         try:
             seconds = int(seconds)
-            milliseconds = 0.000001*int(milliseconds)
+            milliseconds = 0.001*int(milliseconds)
             if seconds < 0 or milliseconds < 0:
                 raise ValueError
         except Exception:
@@ -2186,13 +3134,11 @@ class Storage(object):
         skip = (exists and nx) or (not exists and xx)
         if not skip:
             if exists:
-                db.pop(key)
+                db.discard(key)
+            db._data[key] = bytearray(value)
             if timeout > 0:
-                db._expires[key] = (self._loop.call_later(
-                    timeout, db._do_expire, key), bytearray(value))
+                db.expire(key, timeout)
                 self._signal(self.NOTIFY_STRING, db, 'expire', key)
-            else:
-                db._data[key] = bytearray(value)
             self._signal(self.NOTIFY_STRING, db, 'set', key, 1)
             return True
 
@@ -2217,11 +3163,11 @@ class Storage(object):
         return tv
 
     def _bpop(self, client, request, keys, dest=None):
-        list_type = self.list_type
+        list_types = self.list_types
         db = client.db
         for key in keys:
             value = db.get(key)
-            if isinstance(value, list_type):
+            if isinstance(value, list_types):
                 self._block_callback(client, request[0], key, value, dest)
                 return True
             elif value is not None:
@@ -2235,18 +3181,22 @@ class Storage(object):
             if dest is not None:
                 dval = db.get(dest)
                 if dval is None:
-                    dval = self.list_type()
+                    dval = self.encodings.list()
                     db._data[dest] = dval
-                elif not isinstance(dval, self.list_type):
+                elif not isinstance(dval, self.list_types):
                     return client.reply_wrongtype()
             elem = value.pop()
             self._signal(self.NOTIFY_LIST, db, 'rpop', key, 1)
             if dest is not None:
                 dval.appendleft(elem)
-                self._signal(self.NOTIFY_LIST, db, 'lpush', dest, 1)
+                self._signal(self.NOTIFY_LIST, db, 'lpush', dest, 1, (elem,))
+                self._rewrites.append((db, ['rpoplpush', key, dest]))
+            else:
+                self._rewrites.append((db, ['rpop', key]))
         else:
             elem = value.popleft()
             self._signal(self.NOTIFY_LIST, db, 'lpop', key, 1)
+            self._rewrites.append((db, ['lpop', key]))
         if not value:
             db.pop(key)
             self._signal(self.NOTIFY_GENERIC, db, 'del', key, 1)
@@ -2269,13 +3219,33 @@ class Storage(object):
 
     def _close_transaction(self, client):
         client.transaction = None
+        client.flag &= ~(self.DIRTY_CAS | self.DIRTY_EXEC)
+        self._unwatch(client)
+
+    def _unwatch(self, client):
+        wkeys = client.watched_keys
+        if wkeys:
+            for db, key in wkeys:
+                clients = db._watchers.get(key)
+                if clients is not None:
+                    clients.discard(client)
+                    if not clients:
+                        db._watchers.pop(key)
         client.watched_keys = None
-        client.flag &= ~self.DIRTY_CAS
-        self._watching.discard(client)
 
-    def _flat_info(self):
+    def _flat_info(self, section=None):
         info = self._server.info()
         info['server']['redis_version'] = self.version
+        if section in ('all', 'everything', 'commandstats'):
+            info['commandstats'] = dict(
+                (('cmdstat_%s' % name, stats.info())
+                 for name, stats in self._command_stats.items()))
+        if section in ('all', 'everything', 'latencystats'):
+            info['latencystats'] = dict(
+                (('latency_percentiles_usec_%s' % name, stats.latency_info())
+                 for name, stats in self._command_stats.items()))
+        if section not in (None, 'all', 'everything', 'default'):
+            info = {section: info.get(section, {})}
         e = self._encode_info_value
         for k, values in info.items():
             if isinstance(values, dict):
@@ -2284,17 +3254,42 @@ class Storage(object):
                     if isinstance(value, (list, tuple)):
                         value = ', '.join((e(v) for v in value))
                     elif isinstance(value, dict):
-                        value = ', '.join(('%s=%s' % (k, e(v))
-                                           for k, v in value.items()))
+                        value = ','.join(('%s=%s' % (k, e(v))
+                                          for k, v in value.items()))
                     else:
                         value = e(value)
                     yield '%s:%s' % (key, value)
 
     def _get_config(self, name):
+        if name == 'client-output-buffer-limit':
+            return ' '.join(('%s %s %s %s' % ((cls,) + limits) for cls, limits
+                             in sorted(self._output_buffer_limits.items()))
+                            ).encode('utf-8')
+        elif name == 'slowlog-log-slower-than':
+            return str(self._slowlog_slower_than).encode('utf-8')
+        elif name == 'slowlog-max-len':
+            return str(self._slowlog.entries.maxlen).encode('utf-8')
+        elif name == 'tracking-table-max-keys':
+            return str(self._tracking_max_keys).encode('utf-8')
+        elif name in LAZYFREE_OPTIONS:
+            return b'yes' if getattr(self, LAZYFREE_OPTIONS[name]) else b'no'
         return b''
 
     def _set_config(self, name, value):
-        pass
+        if name == 'client-output-buffer-limit':
+            self._set_output_buffer_limits(
+                validate_output_buffer_limits(value))
+        elif name == 'slowlog-log-slower-than':
+            self._slowlog_slower_than = int(value)
+        elif name == 'slowlog-max-len':
+            self._slowlog.resize(int(value))
+        elif name == 'tracking-table-max-keys':
+            self._tracking_max_keys = int(value)
+        elif name in LAZYFREE_OPTIONS:
+            value = value.lower()
+            if value not in (b'yes', b'no'):
+                raise ValueError('argument must be yes or no')
+            setattr(self, LAZYFREE_OPTIONS[name], value == b'yes')
 
     def _encode_info_value(self, value):
         return str(value).replace('=',
@@ -2312,9 +3307,9 @@ class Storage(object):
         db = client.db
         hash = db.get(key)
         if hash is None:
-            hash = self.hash_type()
+            hash = self.encodings.hash()
             db._data[key] = hash
-        elif not isinstance(hash, self.hash_type):
+        elif not isinstance(hash, self.hash_types):
             return client.reply_wrongtype()
         if field in hash:
             try:
@@ -2324,7 +3319,7 @@ class Storage(object):
                     'hash value is not an %s' % type.__name__)
             increment += value
         hash[field] = increment
-        self._signal(self.NOTIFY_HASH, db, request[0], key, 1)
+        self._signal(self.NOTIFY_HASH, db, request[0], key, 1, (field,))
         return increment
 
     def _setoper(self, client, oper, keys, dest=None):
@@ -2334,16 +3329,18 @@ class Storage(object):
             value = db.get(key)
             if value is None:
                 value = set()
-            elif not isinstance(value, set):
+            elif not isinstance(value, self.set_types):
                 return client.reply_wrongtype()
             if result is None:
-                result = value
+                result = set(value)
             else:
                 result = getattr(result, oper)(value)
         if dest is not None:
-            db.pop(dest)
+            if db.discard(dest):
+                self._signal(self.NOTIFY_GENERIC, db, 'del', dest, 1)
             if result:
-                db._data[dest] = result
+                db._data[dest] = self.encodings.compact(result)
+                self._signal(self.NOTIFY_SET, db, 'sadd', dest, len(result))
                 client.reply_int(len(result))
             else:
                 client.reply_zero()
@@ -2368,7 +3365,7 @@ class Storage(object):
                 value = db.get(key)
                 if value is None:
                     value = self.zset_type()
-                elif not isinstance(value, self.zset_type):
+                elif not isinstance(value, self.zset_types):
                     return client.reply_wrongtype()
                 sets.append(value)
             if len(sets) != numkeys:
@@ -2401,12 +3398,67 @@ class Storage(object):
             result = self.zset_type.union(sets, weights, aggregate)
         else:
             result = self.zset_type.inter(sets, weights, aggregate)
-        if db.pop(des) is not None:
+        if db.discard(des):
             self._signal(self.NOTIFY_GENERIC, db, 'del', des, 1)
-        db._data[des] = result
+        db._data[des] = self.encodings.compact(result)
         self._signal(self.NOTIFY_ZSET, db, cmnd, des, len(result))
         client.reply_int(len(result))
 
+    def _scan(self, client, request, index, container, type_option=False):
+        '''Parse a SCAN ``request`` and return the next keys of ``container``
+
+        The cursor is at ``index`` in the ``request`` and it is followed by
+        the MATCH, COUNT and, when ``type_option`` is true, TYPE options.
+        The cursor is a position in ``container``, so that no state is kept
+        between calls and a call can be repeated with the same cursor.
+        The keyspace, a :class:`.KeySampler`, and collections in their full
+        encoding are walked from their last slot, so that keys present for
+        the whole scan are returned, while collections in a compact encoding
+        are returned in one call. Keys added during a scan may not be
+        returned while keys removed are filtered out by the caller, which
+        receives the cursor, the keys matching MATCH and the TYPE option.
+
+        If the request is invalid, reply with an error and return ``None``.
+        '''
+        try:
+            cursor = int(request[index])
+            if cursor < 0:
+                raise ValueError
+        except Exception:
+            return client.reply_error(self.INVALID_CURSOR)
+        count = SCAN_DEFAULT_COUNT
+        match = None
+        type_name = None
+        options = request[index+1:]
+        try:
+            while options:
+                name = options[0].lower()
+                value = options[1]
+                if name == b'match':
+                    pattern = value.decode('utf-8', 'ignore')
+                    if pattern != '*':
+                        pattern = redis_to_py_pattern(pattern)
+                        match = re.compile('%s$' % pattern)
+                elif name == b'count':
+                    count = int(value)
+                    if count < 1:
+                        raise ValueError
+                elif name == b'type' and type_option:
+                    type_name = value.decode('utf-8').lower()
+                else:
+                    raise ValueError
+                options = options[2:]
+        except Exception:
+            return client.reply_error(self.SYNTAX_ERROR)
+        if type(container) in COMPACT_TYPES:
+            cursor, result = 0, list(container)
+        else:
+            cursor, result = container.scan(cursor, count)
+        if match:
+            result = [key for key in result
+                      if match.match(key.decode('utf-8', 'ignore'))]
+        return ('%d' % cursor).encode('utf-8'), result, type_name
+
     def _score_values(self, min_value, max_value):
         include_min = include_max = True
         if min_value and _ord(min_value[0]) == 40:
@@ -2417,35 +3469,217 @@ class Storage(object):
             max_value = max_value[1:]
         return float(min_value), include_min, float(max_value), include_max
 
+    def _lex_values(self, min_value, max_value):
+        '''Parse the bounds of a range by member.
+
+        Return the ``minval, maxval, include_min, include_max`` arguments
+        of :meth:`.Zset.range_by_lex`, or ``None`` for an empty range.
+        '''
+        bounds = []
+        for value, unbounded in ((min_value, b'-'), (max_value, b'+')):
+            if value == unbounded:
+                bounds.append((None, True))
+            elif value in (b'-', b'+'):
+                return None
+            elif value[:1] == b'[':
+                bounds.append((value[1:], True))
+            elif value[:1] == b'(':
+                bounds.append((value[1:], False))
+            else:
+                raise ValueError(value)
+        (minval, include_min), (maxval, include_max) = bounds
+        return minval, maxval, include_min, include_max
+
+    def _command_executed(self, request, duration):
+        '''Update the statistics of a command which took ``duration``
+        seconds and log it if slow.
+        '''
+        usec = int(1000000*duration)
+        stats = self._command_stats.get(request[0])
+        if stats is None:
+            stats = self._command_stats[request[0]] = CommandStats()
+        stats.add(usec)
+        if 0 <= self._slowlog_slower_than <= usec:
+            self._slowlog.add(request, usec)
+
+    def _tracking_options(self, options):
+        '''Parse the ``options`` of ``CLIENT TRACKING``.
+
+        Return a :class:`.ClientTracking` or ``None`` when tracking is
+        switched off.
+        '''
+        state = options[0].lower()
+        if state == b'off' and len(options) == 1:
+            return None
+        elif state != b'on':
+            raise ValueError(self.SYNTAX_ERROR)
+        redirect = None
+        bcast = False
+        prefixes = []
+        options = options[1:]
+        while options:
+            name = options[0].lower()
+            if name == b'bcast':
+                bcast = True
+                options = options[1:]
+            elif name in (b'redirect', b'prefix') and len(options) > 1:
+                value = options[1]
+                options = options[2:]
+                if name == b'prefix':
+                    prefixes.append(value)
+                    continue
+                try:
+                    redirect = int(value)
+                except ValueError:
+                    raise ValueError('Invalid client ID')
+                if redirect not in self._clients:
+                    raise ValueError('The client ID you want redirect to '
+                                     'does not exist')
+            else:
+                raise ValueError(self.SYNTAX_ERROR)
+        if prefixes and not bcast:
+            raise ValueError('PREFIX option requires BCAST mode to be '
+                             'enabled')
+        if redirect is None:
+            raise ValueError('CLIENT TRACKING requires the REDIRECT option')
+        return ClientTracking(redirect, bcast, prefixes)
+
+    def _set_tracking(self, client, tracking):
+        previous = client.tracking
+        if previous and previous.bcast:
+            self._tracking.discard_prefixes(client.id, previous.prefixes)
+        client.tracking = tracking
+        if tracking:
+            self._tracking_clients.add(client)
+            if tracking.bcast:
+                self._tracking.add_prefixes(client.id, tracking.prefixes)
+        else:
+            self._tracking_clients.discard(client)
+
+    def _track(self, client, request):
+        '''Remember the keys read by ``request`` of a tracking ``client``
+        in the default mode.
+        '''
+        if not client.tracking.bcast:
+            keys = command_keys(request)
+            if keys:
+                table = self._tracking
+                table.add(client.id, keys)
+                max_keys = self._tracking_max_keys
+                while max_keys and len(table) > max_keys:
+                    self._send_invalidation(*table.popitem())
+
+    def _send_invalidation(self, key, ids):
+        '''Send the invalidation of ``key``, all keys when ``None``, to the
+        connections the clients with ``ids`` redirect to.
+        '''
+        clients = self._clients
+        targets = set()
+        for client_id in ids:
+            client = clients.get(client_id)
+            if client is not None and client.tracking:
+                target = clients.get(client.tracking.redirect)
+                if target is not None:
+                    targets.add(target)
+        if targets:
+            parser = self._parser
+            msg = (parser.multi_bulk_len(3) + parser.bulk(b'message') +
+                   parser.bulk(INVALIDATE_CHANNEL))
+            if key is None:
+                msg += self.NULL_ARRAY
+            else:
+                msg += parser.multi_bulk((key,))
+            for target in targets:
+                target._write(msg)
+
     def _info(self):
         keyspace = {}
         stats = {'keyspace_hits': self._hit_keys,
                  'keyspace_misses': self._missed_keys,
                  'expired_keys': self._expired_keys,
+                 'expire_cycles': self._expire_cycles,
+                 'expire_cycle_cpu_milliseconds': int(
+                     1000*self._expire_cycle_time),
+                 'expired_time_cap_reached_count':
+                 self._expire_time_cap_reached,
+                 'evicted_keys': self._evicted_keys,
+                 'lazyfreed_objects': self._lazyfree.freed,
+                 'client_output_buffer_limit_disconnections':
+                 self._output_buffer_disconnections,
                  'keys_changed': self._dirty,
                  'pubsub_channels': len(self._channels),
                  'pubsub_patterns': len(self._patterns),
+                 'tracking_clients': len(self._tracking_clients),
+                 'tracking_total_keys': len(self._tracking),
+                 'tracking_total_prefixes': len(self._tracking.prefixes),
                  'blocked_clients': self._bpop_blocked_clients}
         persistance = {'rdb_changes_since_last_save': self._dirty,
                        'rdb_last_save_time': self._last_save}
+        if self._aof:
+            persistance.update(self._aof.info())
+        else:
+            persistance['aof_enabled'] = 0
         for db in self.databases.values():
             if len(db):
                 keyspace[str(db)] = db.info()
+        memory = {'used_memory': self._used_memory,
+                  'used_memory_compact': self._used_memory_compact,
+                  'compact_keys': sum((len(db._compact) for db
+                                       in self.databases.values())),
+                  'maxmemory': self._maxmemory,
+                  'maxmemory_policy': self._maxmemory_policy,
+                  'lazyfree_pending_objects': len(self._lazyfree)}
         return {'keyspace': keyspace,
                 'stats': stats,
-                'persistance': persistance}
+                'memory': memory,
+                'persistance': persistance,
+                'replication': self._replication_info()}
+
+    def _replication_info(self):
+        master = self._master
+        if master:
+            info = {'role': 'slave',
+                    'master_host': master.host,
+                    'master_port': master.port,
+                    'master_link_status': 'up' if master.link_up else 'down',
+                    'master_last_io_seconds_ago': int(time.time() -
+                                                      master.last_io),
+                    'master_sync_in_progress': int(master.state == 'sync'),
+                    'slave_repl_offset': master.offset,
+                    'slave_read_only': int(
+                        self.cfg.key_value_replica_read_only)}
+        else:
+            info = {'role': 'master'}
+        info['connected_slaves'] = len(self._replicas)
+        for n, (client, offset) in enumerate(self._replicas.items()):
+            address = client._transport.get_extra_info('addr')
+            info['slave%s' % n] = {'ip': address[0],
+                                   'port': address[1],
+                                   'state': 'online',
+                                   'offset': offset}
+        backlog = self._repl_backlog
+        info['master_replid'] = self._replid
+        info['master_repl_offset'] = self._master_repl_offset
+        info['repl_backlog_active'] = int(backlog is not None)
+        if backlog:
+            info['repl_backlog_size'] = backlog.size
+            info['repl_backlog_first_byte_offset'] = backlog.start + 1
+            info['repl_backlog_histlen'] = backlog.histlen
+        return info
 
     def _client_list(self, client):
         for client in client._producer._concurrent_connections:
             yield ' '.join(self._client_info(client))
 
     def _client_info(self, client):
+        yield 'id=%s' % client.id
         yield 'addr=%s:%s' % client._transport.get_extra_info('addr')
         yield 'fd=%s' % client._transport._sock_fd
         yield 'age=%s' % int(time.time() - client.started)
         yield 'db=%s' % client.database
         yield 'sub=%s' % len(client.channels)
         yield 'psub=%s' % len(client.patterns)
+        yield 'omem=%s' % client._transport.get_write_buffer_size()
         yield 'cmd=%s' % client.last_command
 
     def _save(self, async=True):
@@ -2466,32 +3700,231 @@ class Storage(object):
                 save_data(self.cfg, self._filename, data)
 
     def _dbs(self):
-        data = [(db._num, db._data) for db in self.databases.values()
-                if len(db._data)]
-        return (1, data)
+        data = [(db._num, db._data, db._expires.deadlines)
+                for db in self.databases.values() if len(db._data)]
+        return (2, data)
 
     def _loaddb(self):
         filename = self._filename
         if os.path.isfile(filename):
             self.logger.info('loading data from "%s"', filename)
+            start = default_timer()
             with open(filename, 'rb') as file:
-                data = pickle.load(file)
-            version, dbs = data
-            for num, data in dbs:
-                db = self.databases.get(num)
-                if db is not None:
-                    db._data = data
-
-    def _signal(self, type, db, command, key=None, dirty=0):
+                if not is_snapshot(file):
+                    return self._loadpickle(file, time.time())
+                self._load_snapshot(file)
+            self.logger.info('loaded data in %.3f seconds',
+                             default_timer() - start)
+
+    def _load_snapshot(self, file):
+        now = time.time()
+        databases = self.databases
+        for db in databases.values():
+            db._data.clear()
+            db._expires.clear()
+        for num, key, value, when in read_snapshot(file):
+            db = databases.get(num)
+            if db is not None and (when is None or when > now):
+                db._data[key] = self.encodings.compact(value)
+                if when is not None:
+                    db._expires.add(key, when)
+        self._reset_memory()
+
+    def _loadpickle(self, file, now):
+        # Dumps created before the snapshot format
+        version, dbs = pickle.load(file)
+        for entry in dbs:
+            num, data = entry[:2]
+            db = self.databases.get(num)
+            if db is not None:
+                db._data = data
+                for key, value in data.items():
+                    data[key] = self.encodings.compact(value)
+                # version 1 files did not store volatile keys
+                if version > 1:
+                    for key, when in entry[2].items():
+                        if when > now:
+                            db._expires.add(key, when)
+                        else:
+                            data.pop(key, None)
+
+    def _loadaof(self):
+        cfg = self.cfg
+        aof = AppendOnlyFile(self, cfg.key_value_appendfilename,
+                             cfg.key_value_appendfsync)
+        if os.path.isfile(aof.filename):
+            start = default_timer()
+            count = aof.load(ReplayClient(self))
+            self.logger.info('replayed %s commands in %.3f seconds', count,
+                             default_timer() - start)
+            self._dirty = 0
+            aof.open()
+        else:
+            # Switching from dumps to the append only file
+            self._loaddb()
+            aof.open()
+            if sum((len(db) for db in self.databases.values())):
+                aof.rewrite(self._dbs())
+        self._aof = aof
+
+    def _close(self):
+        # Write pending commands to the append only file
+        if self._aof:
+            self._aof.close()
+
+    def _propagate(self, db, request):
+        '''Propagate a ``request`` which modified database ``db``.
+        '''
+        if self._aof:
+            self._aof.feed(db._num, request)
+        if self._repl_backlog is not None:
+            pack = self._parser.pack_command
+            data = pack(request)
+            if db._num != self._repl_db:
+                self._repl_db = db._num
+                data = pack(('select', str(db._num))) + data
+            self._master_repl_offset += len(data)
+            self._repl_backlog.append(data)
+            for client in self._replicas:
+                client._write(data)
+
+    def _full_resync(self, client, psync):
+        '''Send a snapshot of the dataset to a replica.
+
+        The snapshot is written in a child process, which the replica waits
+        for in ``_resync_waiting`` when another snapshot is in progress.
+        '''
+        if self._repl_backlog is None:
+            self._repl_backlog = ReplicationBacklog(
+                self.cfg.key_value_repl_backlog_size,
+                self._master_repl_offset)
+        client.flag |= self.SLAVE
+        self._resync_waiting.append((client, psync))
+        if self._resync is None:
+            self._resync_start()
+
+    def _resync_start(self):
+        clients, self._resync_waiting = self._resync_waiting, []
+        # Replicas start from an unknown database
+        self._repl_db = None
+        offset = self._master_repl_offset
+        for client, psync in clients:
+            if psync:
+                client.reply_status('FULLRESYNC %s %s' % (self._replid,
+                                                          offset))
+        process = Process(target=write_resync,
+                          args=(self.cfg, self._resync_file(), self._dbs()))
+        process.start()
+        self._resync = (process, offset, [c for c, _ in clients])
+        self.logger.debug('Writing replication snapshot in background '
+                          'process')
+
+    def _resync_done(self):
+        (process, offset, clients), self._resync = self._resync, None
+        filename = self._resync_file()
+        snapshot = stream = None
+        if process.exitcode:
+            self.logger.error('Background replication snapshot failed')
+        else:
+            with open(filename, 'rb') as file:
+                snapshot = file.read()
+            stream = self._repl_backlog.read(offset)
+            if stream is None:
+                self.logger.warning('Replication backlog exceeded while '
+                                    'writing the snapshot')
+        if os.path.isfile(filename):
+            os.remove(filename)
+        for client in clients:
+            if client._transport._closing:
+                continue
+            if stream is None:
+                # the replica connects again for a new full resync
+                client.close()
+            else:
+                client._write(('$%d\r\n' % len(snapshot)).encode('utf-8'))
+                client._write(snapshot)
+                client._write(stream)
+                self._add_replica(client, offset)
+        if stream is not None:
+            self.logger.info('Sent %s bytes snapshot to %s replicas',
+                             len(snapshot), len(clients))
+        if self._resync_waiting:
+            self._resync_start()
+
+    def _resync_file(self):
+        dirname, basename = os.path.split(self._filename)
+        return os.path.join(dirname, 'temp-resync-%s' % basename)
+
+    def _add_replica(self, client, offset):
+        client.flag |= self.SLAVE
+        self._replicas[client] = offset
+
+    def _replicaof(self, host, port):
+        if self._master:
+            self._master.close()
+        self.logger.info('Replicating master %s:%s', host, port)
+        self._master = MasterLink(self, host, port)
+        self._master.connect()
+
+    def _propagate_command(self, db, request):
+        '''Propagate a write command executed by a client.
+
+        Relative expire times are converted into absolute ones while
+        blocking pops, propagated by :meth:`_block_callback` as the
+        equivalent non-blocking commands, and SPOP, propagated as the
+        SREM of the popped member, queue their own ``_rewrites``.
+        '''
+        name = request[0]
+        if name not in ('blpop', 'brpop', 'brpoplpush', 'spop'):
+            if name in ('expire', 'pexpire', 'expireat'):
+                request = self._pexpireat(db, request[1]) or request
+                self._propagate(db, request)
+            else:
+                self._propagate(db, request)
+                if name in ('set', 'setex', 'psetex', 'restore'):
+                    expire = self._pexpireat(db, request[1])
+                    if expire:
+                        self._propagate(db, expire)
+        if self._rewrites:
+            rewrites, self._rewrites = self._rewrites, []
+            for db, request in rewrites:
+                self._propagate(db, request)
+
+    def _pexpireat(self, db, key):
+        when = db._expires.get(key)
+        if when is not None:
+            return ['pexpireat', key, str(int(1000*when)).encode('utf-8')]
+
+    def _signal(self, type, db, command, key=None, dirty=0, written=None):
+        '''Signal a ``command`` on ``key`` of ``db``.
+
+        ``written`` are the elements added to a collection by the command,
+        fields and values of a hash, which may overflow its compact
+        encoding.
+        '''
         self._dirty += dirty
-        self._event_handlers[type](db, key, COMMANDS_INFO[command])
+        if db is not None:
+            self._changed_keys.append((db, key))
+        self._event_handlers[type](db, key, COMMANDS_INFO[command], written)
+
+    def _publish(self, channel, message):
+        count = 0
+        clients = self._channels.get(channel)
+        if clients:
+            msg = self._parser.multi_bulk((b'message', channel, message))
+            count = self._publish_clients(msg, clients)
+        for sub in self._patterns.match(channel):
+            msg = self._parser.multi_bulk((b'pmessage', sub.pattern,
+                                           channel, message))
+            count += self._publish_clients(msg, sub.clients)
+        return count
 
     def _publish_clients(self, msg, clients):
         remove = set()
         count = 0
         for client in clients:
             try:
-                client._transport.write(msg)
+                client._write(msg)
                 count += 1
             except Exception:
                 remove.add(client)
@@ -2500,46 +3933,238 @@ class Storage(object):
         return count
 
     # EVENT HANDLERS
-    def _modified_key(self, key):
-        for client in self._watching:
-            if key is None or key in client.watched_keys:
+    def _modified_key(self, db, key):
+        # Flag the clients watching key, or all keys of db when key is None
+        watchers = db._watchers
+        if watchers:
+            if key is None:
+                clients = chain.from_iterable(watchers.values())
+            else:
+                clients = watchers.get(key, ())
+            for client in clients:
                 client.flag |= self.DIRTY_CAS
+        # Invalidate the key in the cache of tracking clients
+        if self._tracking_clients:
+            if key is None:
+                self._tracking.clear()
+                self._send_invalidation(
+                    None, [client.id for client in self._tracking_clients])
+            else:
+                ids = self._tracking.pop(key)
+                if ids:
+                    self._send_invalidation(key, ids)
 
-    def _generic_event(self, db, key, command):
+    def _generic_event(self, db, key, command, written):
         if command.write:
-            self._modified_key(key)
+            self._modified_key(db, key)
 
     _string_event = _generic_event
-    _set_event = _generic_event
-    _hash_event = _generic_event
-    _zset_event = _generic_event
 
-    def _list_event(self, db, key, command):
+    def _collection_event(self, db, key, command, written):
         if command.write:
-            self._modified_key(key)
+            self._modified_key(db, key)
+            if written is not None:
+                value = db._data.get(key)
+                if (type(value) in COMPACT_TYPES and
+                        self.encodings.overflow(value, written)):
+                    self._upgrade(db, key, value)
+
+    _set_event = _collection_event
+    _hash_event = _collection_event
+    _zset_event = _collection_event
+
+    def _list_event(self, db, key, command, written):
+        self._collection_event(db, key, command, written)
         # the key is blocking clients
         if key in db._blocking_keys:
-            if key in db._data:
-                value = db._data[key]
-            elif key in self._expires:
-                value = db._expires[key]
-            else:
-                value = None
+            value = db._data.get(key)
             for client in db._blocking_keys.pop(key):
                 client.blocked.unblock(client, key, value)
 
+    def _upgrade(self, db, key, value):
+        # Convert the compact value of key to its full encoding
+        value = value.upgrade()
+        db._data[key] = value
+        return value
+
     def _remove_connection(self, client, _, **kw):
         # Remove a client from the server
         self._monitors.discard(client)
-        self._watching.discard(client)
-        for channel, clients in list(self._channels.items()):
+        self._pending_writes.discard(client)
+        self._replicas.pop(client, None)
+        self._clients.pop(client.id, None)
+        if client.tracking:
+            self._set_tracking(client, None)
+        self._unwatch(client)
+        for channel in client.channels:
+            self._unsubscribe(client, channel)
+        for pattern in client.patterns:
+            self._patterns.discard(pattern, client)
+
+    def _unsubscribe(self, client, channel):
+        clients = self._channels.get(channel)
+        if clients is not None:
             clients.discard(client)
             if not clients:
                 self._channels.pop(channel)
-        for pattern, p in list(self._patterns.items()):
-            p.clients.discard(client)
-            if not p.clients:
-                self._patterns.pop(pattern)
+
+    def _reset_memory(self):
+        # Account the memory of all keys, after loading a dataset
+        self._used_memory = 0
+        self._used_memory_compact = 0
+        self._changed_keys = []
+        for db in self.databases.values():
+            if self._maxmemory:
+                db._reset_memory()
+            else:
+                db._index(None)
+
+    def _account_keys(self):
+        # Update the keyspace index, and the memory when a limit is set, of
+        # keys changed since the last call
+        keys, self._changed_keys = self._changed_keys, []
+        if self._maxmemory:
+            for db, key in keys:
+                db._account(key)
+        else:
+            for db, key in keys:
+                db._index(key)
+
+    def _free_memory(self):
+        '''Evict keys until the used memory is below the limit.
+
+        Return ``False`` if the memory limit cannot be honoured.
+        '''
+        if self._changed_keys:
+            self._account_keys()
+        if self._master:
+            # replicas receive deletes of evicted keys from the master
+            return True
+        while self._used_memory > self._maxmemory:
+            if self._maxmemory_policy == 'noeviction':
+                return False
+            candidate = self._eviction_candidate()
+            if candidate is None:
+                return False
+            self._evict(*candidate)
+        return True
+
+    def _eviction_candidate(self):
+        # Sample keys from all databases and return the (db, key) pair
+        # which best fits the eviction policy
+        policy = self._maxmemory_policy
+        volatile = policy.startswith('volatile')
+        now = time.time()
+        minutes = int(now // 60)
+        best = None
+        best_score = None
+        for db in self.databases.values():
+            keys = db._volatile if volatile else db._keys
+            for key in keys.sample(self._maxmemory_samples):
+                if key not in db._data:
+                    db._account(key)
+                    continue
+                if policy.endswith('lru'):
+                    score = now - db._usage.get(key, 0)
+                elif policy.endswith('lfu'):
+                    score = 255 - lfu_decr(db._usage.get(key, 0), minutes)
+                elif policy == 'volatile-ttl':
+                    score = now - db._expires.get(key, now)
+                else:
+                    score = random()
+                if best is None or score > best_score:
+                    best = (db, key)
+                    best_score = score
+        return best
+
+    def _evict(self, db, key):
+        self._free(db._data.pop(key, None), self._lazyfree_eviction)
+        db._expires.discard(key)
+        db._account(key)
+        self._evicted_keys += 1
+        self._signal(self.NOTIFY_EVICTED, db, 'del', key, 1)
+        self._propagate(db, ['del', key])
+
+    def _free(self, value, lazy=True):
+        '''Drop ``value``, removed from a database.
+
+        When ``lazy``, a large collection is released in the background.
+        '''
+        if lazy and self._lazyfree.free(value):
+            self._lazyfree_start()
+
+    def _lazyfree_start(self):
+        if self._lazyfree_handle is None:
+            self._lazyfree_handle = self._loop.call_soon(self._lazyfree_step)
+
+    def _lazyfree_step(self):
+        self._lazyfree_handle = None
+        if self._lazyfree.release(LAZYFREE_STEP_ELEMENTS):
+            self._lazyfree_handle = self._loop.call_soon(self._lazyfree_step)
+
+    def _async_option(self, request, N):
+        # The optional ASYNC or SYNC argument of FLUSHDB and FLUSHALL
+        check_input(request, N > 1)
+        if N:
+            option = request[1].lower()
+            if option not in (b'async', b'sync'):
+                raise CommandError(self.SYNTAX_ERROR)
+            return option == b'async'
+        return False
+
+    def _pending_write(self, client):
+        # Register a client with buffered replies and make sure they are
+        # written when the current batch of requests, if any, is done
+        self._pending_writes.add(client)
+        if not self._batching and self._flush_handle is None:
+            self._flush_handle = self._loop.call_soon(self._flush_writes)
+
+    def _set_output_buffer_limits(self, limits):
+        for cls, hard, soft, seconds in limits:
+            self._output_buffer_limits[cls] = (hard, soft, seconds)
+
+    def _client_class(self, client):
+        if client.flag & self.SLAVE:
+            return 'slave'
+        elif client.flag & self.MONITOR or client.channels or client.patterns:
+            return 'pubsub'
+        else:
+            return 'normal'
+
+    def _check_output_buffer(self, client):
+        '''Disconnect ``client`` if its output buffer is over the limits
+        of its class.
+        '''
+        hard, soft, seconds = self._output_buffer_limits.get(
+            self._client_class(client), (0, 0, 0))
+        if hard or soft:
+            size = client._transport.get_write_buffer_size()
+            exceeded = None
+            if hard and size >= hard:
+                exceeded = 'hard'
+            elif soft and size >= soft:
+                now = time.time()
+                since = client._soft_limit_reached
+                if since is None:
+                    client._soft_limit_reached = since = now
+                if now - since >= seconds:
+                    exceeded = 'soft'
+            else:
+                client._soft_limit_reached = None
+            if exceeded:
+                self._output_buffer_disconnections += 1
+                self.logger.warning('Closing %s, output buffer of %d bytes '
+                                    'over the %s limit', client, size,
+                                    exceeded)
+                client._transport.abort()
+
+    def _flush_writes(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        clients, self._pending_writes = self._pending_writes, set()
+        for client in clients:
+            client._flush()
 
     def _write_to_monitors(self, client, request):
         # addr = '%s:%s' % self._transport.get_extra_info('addr')
@@ -2548,7 +4173,7 @@ class Storage(object):
         remove = set()
         for m in self._monitors:
             try:
-                m._transport.write(message)
+                m._write(message)
             except Exception:
                 remove.add(m)
         if remove:
@@ -2605,83 +4230,96 @@ class Storage(object):
 
 class Db(object):
     '''The database.
+
+    All values are stored in the ``_data`` dictionary while the deadlines
+    of volatile keys are kept in the ``_expires`` :class:`.TimerWheel`.
+    Expired keys are removed lazily when accessed and actively, within a
+    time budget, by the :meth:`Storage._active_expire_cycle`.
+    ``_watchers`` maps watched keys to the set of clients watching them.
+    Keys are indexed in the ``_keys`` :class:`.KeySampler`, whose slots are
+    walked by SCAN cursors.
+
+    When a memory limit is set, the estimated size of keys is kept in
+    ``_sizes``, keys in a compact encoding are listed in ``_compact``, and
+    keys are sampled from ``_keys`` for eviction,
+    together with their last access time or access frequency in ``_usage``.
     '''
     def __init__(self, num, store):
         self.store = store
         self._num = num
         self._loop = store._loop
         self._data = {}
-        self._expires = {}
+        self._expires = TimerWheel()
         self._events = {}
         self._blocking_keys = {}
+        self._watchers = {}
+        self._sizes = {}
+        self._compact = set()
+        self._keys = KeySampler()
+        self._volatile = KeySampler()
+        self._usage = None
 
     def __repr__(self):
         return 'db%s' % self._num
     __str__ = __repr__
 
     def __len__(self):
-        return len(self._data) + len(self._expires)
+        return len(self._data)
 
     def __iter__(self):
-        return chain(self._data, self._expires)
+        if not self._expires:
+            return iter(self._data)
+        return self._alive_keys()
 
     # #########################################################################
     # #    INTERNALS
-    def flush(self):
+    def flush(self, lazy=False):
         removed = len(self._data)
-        self._data.clear()
-        [handle.cancel() for handle, _ in self._expires.values()]
+        if lazy and removed:
+            # queued even with few keys, which may hold large values
+            self.store._lazyfree.add(self._data)
+            self.store._lazyfree_start()
+            self._data = {}
+        else:
+            self._data.clear()
         self._expires.clear()
         self.store._signal(self.store.NOTIFY_GENERIC, self, 'flushdb',
                            dirty=removed)
 
     def get(self, key, default=None):
-        if key in self._data:
+        if key in self._data and not self._check_expire(key):
             self.store._hit_keys += 1
+            if self._usage is not None:
+                self._touch(key)
             return self._data[key]
-        elif key in self._expires:
-            self.store._hit_keys += 1
-            return self._expires[key]
         else:
             self.store._missed_keys += 1
             return default
 
     def exists(self, key):
-        return key in self._data or key in self._expires
+        return key in self._data and not self._check_expire(key)
 
     def expire(self, key, timeout):
-        if key in self._expires:
-            handle, value = self._expires.pop(key)
-            handle.cancel()
-        elif key in self._data:
-            value = self._data.pop(key)
-        else:
-            return False
-        self._expires[key] = (self._loop.call_later(
-            timeout, self._do_expire, key), value)
-        return True
+        if self.exists(key):
+            self._expires.add(key, time.time() + timeout)
+            return True
+        return False
 
     def persist(self, key):
-        if key in self._expires:
-            self.store._hit_keys += 1
-            handle, value = self._expires.pop(key)
-            handle.cancel()
-            self._data[key] = value
-            return True
-        elif key in self._data:
+        if self.exists(key):
             self.store._hit_keys += 1
+            return self._expires.discard(key) is not None
         else:
             self.store._missed_keys += 1
         return False
 
     def ttl(self, key, m=1):
-        if key in self._expires:
-            self.store._hit_keys += 1
-            handle, value = self._expires[key]
-            return max(0, int(m*(handle._when - self._loop.time())))
-        elif key in self._data:
+        if self.exists(key):
             self.store._hit_keys += 1
-            return -1
+            when = self._expires.get(key)
+            if when is None:
+                return -1
+            return max(0, int(m*(when - time.time())))
         else:
             self.store._missed_keys += 1
             return -2
@@ -2692,32 +4330,129 @@ class Db(object):
 
     def pop(self, key, value=None):
         if not value:
-            if key in self._data:
-                value = self._data.pop(key)
-                return value
-            elif key in self._expires:
-                handle, value = self._expires.pop(key)
-                handle.cancel()
-                return value
-
-    def rem(self, key):
-        if key in self._data:
-            self.store._hit_keys += 1
-            self._data.pop(key)
-            self.store._signal(self.store.NOTIFY_GENERIC, self, 'del', key, 1)
-            return 1
-        elif key in self._expires:
+            if key in self._data and not self._check_expire(key):
+                self._expires.discard(key)
+                return self._data.pop(key)
+
+    def rem(self, key, lazy=False):
+        if key in self._data and not self._check_expire(key):
             self.store._hit_keys += 1
-            handle, _ = self._expires.pop(key)
-            handle.cancel()
+            self.store._free(self._data.pop(key), lazy)
+            self._expires.discard(key)
             self.store._signal(self.store.NOTIFY_GENERIC, self, 'del', key, 1)
             return 1
         else:
             self.store._missed_keys += 1
             return 0
 
+    def discard(self, key):
+        '''Remove ``key`` overwritten by a command, return ``True`` if it
+        existed.
+        '''
+        value = self.pop(key)
+        if value is not None:
+            self.store._free(value, self.store._lazyfree_server_del)
+            return True
+        return False
+
+    def _check_expire(self, key):
+        # Lazy expiry, return True if the key has expired
+        expires = self._expires
+        if expires:
+            when = expires.get(key)
+            if when is not None and when <= time.time():
+                master = self.store._master
+                if master:
+                    # replicas leave deletes to the master, whose commands
+                    # still find the key
+                    return not master.replaying
+                expires.discard(key)
+                self._do_expire(key)
+                return True
+        return False
+
+    def _active_expire(self, now, count):
+        # Expire at most count keys, return the number of keys expired
+        keys = self._expires.pop_expired(now, count)
+        for key in keys:
+            self._do_expire(key)
+        return len(keys)
+
     def _do_expire(self, key):
-        if key in self._expires:
-            handle, value, = self._expires.pop(key)
-            handle.cancel()
-            self.store._expired_keys += 1
+        value = self._data.pop(key, None)
+        if value is not None:
+            store = self.store
+            store._free(value, store._lazyfree_expire)
+            store._expired_keys += 1
+            store._signal(store.NOTIFY_GENERIC, self, 'del', key, 1)
+            store._propagate(self, ['del', key])
+
+    def _reset_memory(self):
+        self._sizes.clear()
+        self._compact.clear()
+        self._keys.clear()
+        self._volatile.clear()
+        policy = self.store._maxmemory_policy
+        self._usage = {} if policy.endswith(('lru', 'lfu')) else None
+        for key in self._data:
+            self._account(key)
+
+    def _index(self, key):
+        # Update the keyspace index of key, None for the whole database
+        if key is None:
+            self._keys.clear()
+            for key in self._data:
+                self._keys.add(key)
+        elif key in self._data:
+            self._keys.add(key)
+        else:
+            self._keys.discard(key)
+
+    def _account(self, key):
+        # Update the memory used by key, None for the whole database
+        store = self.store
+        if key is None:
+            store._used_memory -= sum(self._sizes.values())
+            store._used_memory_compact -= sum(
+                (self._sizes[k] for k in self._compact))
+            return self._reset_memory()
+        size = self._sizes.pop(key, 0)
+        store._used_memory -= size
+        if key in self._compact:
+            self._compact.discard(key)
+            store._used_memory_compact -= size
+        value = self._data.get(key)
+        if value is None:
+            self._keys.discard(key)
+            self._volatile.discard(key)
+            if self._usage is not None:
+                self._usage.pop(key, None)
+        else:
+            size = value_size(key, value)
+            self._sizes[key] = size
+            store._used_memory += size
+            if type(value) in COMPACT_TYPES:
+                self._compact.add(key)
+                store._used_memory_compact += size
+            self._keys.add(key)
+            if key in self._expires:
+                self._volatile.add(key)
+            else:
+                self._volatile.discard(key)
+            if self._usage is not None:
+                self._touch(key)
+
+    def _touch(self, key):
+        if self.store._lfu:
+            now = int(time.time() // 60)
+            self._usage[key] = lfu_incr(self._usage.get(key), now)
+        else:
+            self._usage[key] = time.time()
+
+    def _alive_keys(self):
+        now = time.time()
+        get = self._expires.get
+        for key in self._data:
+            when = get(key)
+            if when is None or when > now:
+                yield key
@@ -0,0 +1,100 @@
+'''Server assisted client side caching for pulsar-ds.
+
+A client enables tracking with ``CLIENT TRACKING ON REDIRECT <id>``, where
+``<id>`` is the ``CLIENT ID`` of a connection subscribed to the
+``__redis__:invalidate`` channel, as in the RESP2 protocol of redis.
+When a key read by a tracking client is modified, expired, evicted or
+flushed, the connection ``<id>`` receives a ``message`` on that channel
+with the list of invalidated keys, or a null list when a database is
+flushed.
+
+* In the default mode the server remembers, in the :class:`TrackingTable`,
+  which clients have read each key. A key is forgotten once invalidated,
+  so that a client is notified only once until it reads the key again.
+* In the broadcasting mode (``BCAST``) keys are not remembered and a
+  client is notified of modifications of all keys starting with one of
+  its prefixes (``PREFIX``), or of all keys if it has no prefix.
+
+Keys are tracked by name regardless of the database, a modification of a
+key in any database invalidates it.
+'''
+import re
+
+from .utils import PatternIndex
+
+INVALIDATE_CHANNEL = b'__redis__:invalidate'
+
+_escape_glob = re.compile(b'([*?[\\\\])')
+
+
+def prefix_pattern(prefix):
+    '''The glob-style pattern matching keys starting with ``prefix``'''
+    return _escape_glob.sub(b'\\\\\\1', prefix) + b'*'
+
+
+class ClientTracking(object):
+    '''The tracking options of a client.
+    '''
+    __slots__ = ('redirect', 'bcast', 'prefixes')
+
+    def __init__(self, redirect, bcast=False, prefixes=()):
+        self.redirect = redirect
+        self.bcast = bcast
+        self.prefixes = tuple(prefixes) if bcast else ()
+
+
+class TrackingTable(object):
+    '''The clients to notify when a key is modified.
+
+    ``keys`` maps keys to the ids of the clients in the default mode which
+    have read them, while ``prefixes`` is a :class:`.PatternIndex` of the
+    ids of clients in the broadcasting mode. Ids of disconnected clients
+    are discarded lazily, when their keys are invalidated.
+    '''
+    __slots__ = ('keys', 'prefixes')
+
+    def __init__(self):
+        self.keys = {}
+        self.prefixes = PatternIndex()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, client_id, keys):
+        '''Remember that ``client_id`` has read ``keys``'''
+        table = self.keys
+        for key in keys:
+            ids = table.get(key)
+            if ids is None:
+                table[key] = ids = set()
+            ids.add(client_id)
+
+    def add_prefixes(self, client_id, prefixes):
+        '''Broadcast to ``client_id`` modifications of keys starting with
+        one of ``prefixes``, or of all keys when empty.
+        '''
+        for prefix in prefixes or (b'',):
+            self.prefixes.add(prefix_pattern(prefix), client_id)
+
+    def discard_prefixes(self, client_id, prefixes):
+        for prefix in prefixes or (b'',):
+            self.prefixes.discard(prefix_pattern(prefix), client_id)
+
+    def pop(self, key):
+        '''Forget ``key`` and return the ids of the clients to notify.
+        '''
+        ids = self.keys.pop(key, None)
+        if self.prefixes:
+            ids = set(ids) if ids else set()
+            for sub in self.prefixes.match(key):
+                ids.update(sub.clients)
+        return ids or ()
+
+    def popitem(self):
+        '''Forget an arbitrary key, return it with the ids of the clients
+        in the default mode which have read it.
+        '''
+        return self.keys.popitem()
+
+    def clear(self):
+        self.keys.clear()
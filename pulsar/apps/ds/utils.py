@@ -1,19 +1,42 @@
+import re
 import shutil
+from sys import getsizeof
+from random import random
+from itertools import islice
+from heapq import heappush, heappop
+from collections import deque
 
-from pulsar.utils.pep import pickle
+from pulsar.utils.structures import Zset
+
+from .rdb import write_snapshot
+from .encoding import PackedHash, IntSet
+
+# Number of elements sampled to estimate the size of a collection
+SIZE_SAMPLES = 5
+# Estimated memory of a sorted set entry besides its member: the score,
+# the (score, member) key in the sorted list and the dictionary entry
+ZSET_ENTRY_SIZE = 110
+# Logarithmic access counter of the LFU eviction policy
+LFU_INIT_VAL = 5
+LFU_LOG_FACTOR = 10
+# Minutes of inactivity after which the LFU counter of a key is decremented
+LFU_DECAY_TIME = 1
+# Special characters of glob-style patterns
+_glob_special = re.compile(b'[*?[\\\\]')
+# Collections released a few elements at a time by LazyFree
+LAZYFREE_TYPES = (dict, set, list, deque, Zset)
 
 
 def save_data(cfg, filename, data):
     logger = cfg.configured_logger('ds')
     temp = 'temp_%s' % filename
     with open(temp, 'wb') as file:
-        pickle.dump(data, file, protocol=2)
+        write_snapshot(file, data, cfg.key_value_compression)
     shutil.move(temp, filename)
     logger.info('wrote data into "%s"', filename)
 
 
 def sort_command(store, client, request, value):
-    sort_type = type(value)
     right = 0
     desc = False
     alpha = None
@@ -58,7 +81,7 @@ def sort_command(store, client, request, value):
         j += 1
 
     db = client.db
-    if sort_type is store.zset_type and dontsort:
+    if isinstance(value, store.zset_types) and dontsort:
         dontsort = False
         alpha = True
         sortby = None
@@ -103,15 +126,15 @@ def sort_command(store, client, request, value):
             vector = result
         client.reply_multi_bulk(vector)
     else:
+        vals = store.encodings.list()
         if getops:
-            vals = store.list_type()
             empty = b''
             for val in vector:
                 for getv in getops:
                     vals.append(lookup(store, db, getv, val) or empty)
         else:
-            vals = store.list_type(vector)
-        if db.pop(storekey) is not None:
+            vals.extend(vector)
+        if db.discard(storekey):
             store._signal(store.NOTIFY_GENERIC, db, 'del', storekey)
         result = len(vals)
         if result:
@@ -131,7 +154,7 @@ def lookup(store, db, pattern, repl):
     else:
         key, field = bits
         hash = db.get(key)
-        return hash.get(field) if isinstance(hash, store.hash_type) else None
+        return hash.get(field) if isinstance(hash, store.hash_types) else None
 
 
 class Null:
@@ -169,23 +192,354 @@ class SortableDesc:
             return self.value > other.value
 
 
-def count_bytes(array):
-    '''Count the number of bits in a byte ``array``.
+class TimerWheel(object):
+    '''Index of deadlines for the volatile keys of a database.
+
+    Deadlines are hashed into buckets of ``resolution`` seconds so that
+    adding, updating and removing a timeout are O(1) operations, while a
+    heap of bucket numbers (one entry per bucket rather than per key)
+    keeps track of the next bucket due for expiry.
+
+    .. attribute:: deadlines
+
+        Dictionary mapping keys to their absolute deadline (as returned by
+        :func:`time.time`).
+    '''
+    __slots__ = ('resolution', 'deadlines', '_buckets', '_heap')
+
+    def __init__(self, resolution=1):
+        self.resolution = resolution
+        self.deadlines = {}
+        self._buckets = {}
+        self._heap = []
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key):
+        return key in self.deadlines
+
+    def __iter__(self):
+        return iter(self.deadlines)
+
+    def get(self, key, default=None):
+        return self.deadlines.get(key, default)
+
+    def add(self, key, when):
+        '''Set the deadline of ``key`` to ``when``'''
+        self.discard(key)
+        self.deadlines[key] = when
+        slot = int(when // self.resolution)
+        bucket = self._buckets.get(slot)
+        if bucket is None:
+            self._buckets[slot] = bucket = set()
+            heappush(self._heap, slot)
+        bucket.add(key)
+
+    def discard(self, key):
+        '''Remove ``key`` from the index and return its deadline'''
+        when = self.deadlines.pop(key, None)
+        if when is not None:
+            # empty buckets are removed, together with their heap entry,
+            # by pop_expired
+            self._buckets[int(when // self.resolution)].discard(key)
+        return when
+
+    def clear(self):
+        self.deadlines.clear()
+        self._buckets.clear()
+        self._heap = []
+
+    def pop_expired(self, now, count):
+        '''Remove and return at most ``count`` keys expired at ``now``.
+
+        Only buckets entirely in the past are visited, so no deadline is
+        compared and each key costs a single set ``pop``.
+        '''
+        keys = []
+        heap = self._heap
+        buckets = self._buckets
+        deadlines = self.deadlines
+        end = int(now // self.resolution)
+        while heap and heap[0] < end and len(keys) < count:
+            bucket = buckets[heap[0]]
+            while bucket and len(keys) < count:
+                key = bucket.pop()
+                deadlines.pop(key)
+                keys.append(key)
+            if not bucket:
+                buckets.pop(heappop(heap))
+        return keys
+
+
+def glob_regex(pattern):
+    '''Compile the redis glob-style ``pattern``, a bytes string, into a
+    regular expression matching bytes.
+    '''
+    regex = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i:i+1]
+        i += 1
+        if c == b'*':
+            regex.append(b'.*')
+        elif c == b'?':
+            regex.append(b'.')
+        elif c == b'\\' and i < n:
+            regex.append(re.escape(pattern[i:i+1]))
+            i += 1
+        elif c == b'[' and pattern.find(b']', i + 1) > 0:
+            regex.append(b'[')
+            if pattern[i:i+1] == b'^':
+                regex.append(b'^')
+                i += 1
+            # a ']' right after the opening bracket is a literal
+            first = i
+            while i < n and (i == first or pattern[i:i+1] != b']'):
+                c = pattern[i:i+1]
+                if c == b'\\' and i + 1 < n:
+                    i += 1
+                    c = pattern[i:i+1]
+                regex.append(c if c == b'-' else re.escape(c))
+                i += 1
+            regex.append(b']')
+            i += 1
+        else:
+            regex.append(re.escape(c))
+    regex.append(b'\\Z')
+    return re.compile(b''.join(regex), re.DOTALL)
+
+
+def literal_prefix(pattern):
+    '''The bytes of a glob-style ``pattern`` before its first special
+    character.
+    '''
+    match = _glob_special.search(pattern)
+    return pattern[:match.start()] if match else pattern
+
+
+class PatternSubscription(object):
+    '''The clients subscribed to a pub/sub ``pattern``.
+
+    Only the part of the pattern after its literal ``prefix`` is matched
+    against channels, with a regular expression unless it is empty or a
+    single ``*``.
+    '''
+    __slots__ = ('pattern', 'prefix', 'clients', '_re', '_any')
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.prefix = literal_prefix(pattern)
+        self.clients = set()
+        rest = pattern[len(self.prefix):]
+        self._any = rest == b'*'
+        self._re = glob_regex(rest) if rest and not self._any else None
+
+    def match(self, channel):
+        '''Match a ``channel`` starting with :attr:`prefix`'''
+        if self._re:
+            return self._re.match(channel, len(self.prefix)) is not None
+        return self._any or len(channel) == len(self.prefix)
+
+
+class _PrefixNode(object):
+    __slots__ = ('children', 'subscriptions')
+
+    def __init__(self):
+        self.children = {}
+        self.subscriptions = []
+
+
+class PatternIndex(object):
+    '''Index of pub/sub pattern subscriptions.
+
+    Subscriptions are stored in a trie of the literal prefixes of their
+    patterns. Matching a channel walks the trie along the channel, so
+    only the patterns whose prefix is a prefix of the channel are
+    candidates and patterns are never scanned one by one.
+    '''
+    __slots__ = ('_subscriptions', '_root')
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._root = _PrefixNode()
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def __contains__(self, pattern):
+        return pattern in self._subscriptions
+
+    def __iter__(self):
+        return iter(self._subscriptions)
+
+    def get(self, pattern, default=None):
+        return self._subscriptions.get(pattern, default)
+
+    def add(self, pattern, client):
+        '''Subscribe ``client`` to ``pattern``'''
+        sub = self._subscriptions.get(pattern)
+        if sub is None:
+            self._subscriptions[pattern] = sub = PatternSubscription(pattern)
+            node = self._root
+            for i in range(len(sub.prefix)):
+                c = sub.prefix[i:i+1]
+                child = node.children.get(c)
+                if child is None:
+                    node.children[c] = child = _PrefixNode()
+                node = child
+            node.subscriptions.append(sub)
+        sub.clients.add(client)
+
+    def discard(self, pattern, client):
+        '''Unsubscribe ``client`` from ``pattern``, the pattern is removed
+        when it has no more clients.
+        '''
+        sub = self._subscriptions.get(pattern)
+        if sub is not None:
+            sub.clients.discard(client)
+            if not sub.clients:
+                self._remove(sub)
+
+    def match(self, channel):
+        '''Generator of the subscriptions matching ``channel``'''
+        node = self._root
+        depth = 0
+        size = len(channel)
+        while node is not None:
+            for sub in node.subscriptions:
+                if sub.match(channel):
+                    yield sub
+            if depth == size:
+                break
+            node = node.children.get(channel[depth:depth+1])
+            depth += 1
 
-    It uses the Hamming weight popcount algorithm
+    def _remove(self, sub):
+        self._subscriptions.pop(sub.pattern)
+        prefix = sub.prefix
+        path = [self._root]
+        for i in range(len(prefix)):
+            path.append(path[-1].children[prefix[i:i+1]])
+        path[-1].subscriptions.remove(sub)
+        # prune the branch of nodes left empty
+        for i in range(len(prefix), 0, -1):
+            node = path[i]
+            if node.children or node.subscriptions:
+                break
+            path[i-1].children.pop(prefix[i-1:i])
+
+
+class LazyFree(object):
+    '''Release large collections a few elements at a time.
+
+    Dropping the last reference to a collection deallocates all its
+    elements at once, blocking the event loop for a time proportional to
+    its size. Collections with more than ``threshold`` elements are queued
+    instead and emptied by :meth:`release`, which removes a bounded number
+    of elements and is called between client requests until the queue is
+    empty. Values of a queued dictionary, such as the data of a flushed
+    database, are freed in the same way.
     '''
-    # this algorithm can be rewritten as
-    # for i in array:
-    #     count += sum(b=='1' for b in bin(i)[2:])
-    # but this version is almost 2 times faster
-    count = 0
-    for i in array:
-        i = i - ((i >> 1) & 0x55555555)
-        i = (i & 0x33333333) + ((i >> 2) & 0x33333333)
-        count += (((i + (i >> 4)) & 0x0F0F0F0F) * 0x01010101) >> 24
-    return count
-
-
-and_op = lambda x, y: x & y
-or_op = lambda x, y: x | y
-xor_op = lambda x, y: x ^ y
+    __slots__ = ('threshold', 'freed', '_values')
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.freed = 0
+        self._values = deque()
+
+    def __len__(self):
+        return len(self._values)
+
+    def free(self, value):
+        '''Queue ``value`` if it is a large collection, return ``True``
+        if queued.
+        '''
+        if isinstance(value, LAZYFREE_TYPES) and len(value) > self.threshold:
+            self._values.append(value)
+            return True
+        return False
+
+    def add(self, value):
+        '''Queue the collection ``value`` regardless of its size.'''
+        self._values.append(value)
+
+    def release(self, count):
+        '''Remove up to ``count`` elements from the queued collections.
+
+        Return the number of collections still queued.
+        '''
+        values = self._values
+        while values and count > 0:
+            value = values[0]
+            n = min(count, len(value))
+            count -= n
+            if isinstance(value, dict):
+                popitem = value.popitem
+                for _ in range(n):
+                    self.free(popitem()[1])
+            elif isinstance(value, Zset):
+                value.remove_range(0, n)
+            elif isinstance(value, list):
+                del value[-n:]
+            else:
+                pop = value.pop
+                for _ in range(n):
+                    pop()
+            if not value:
+                values.popleft()
+                self.freed += 1
+        return len(values)
+
+
+def value_size(key, value):
+    '''Approximate memory, in bytes, used by ``key`` and its ``value``.
+
+    The size of a collection is estimated from the size of a sample of
+    its elements rather than by visiting all of them. The size of compact
+    encodings includes their arrays, but not the elements they refer to.
+    '''
+    size = getsizeof(key) + getsizeof(value)
+    if isinstance(value, (bytearray, IntSet)):
+        return size
+    if isinstance(value, Zset):
+        items = value._dict
+        size += getsizeof(items)
+        sample = [getsizeof(member) + ZSET_ENTRY_SIZE
+                  for member in islice(items, SIZE_SAMPLES)]
+    elif isinstance(value, (dict, PackedHash)):
+        sample = [getsizeof(field) + getsizeof(v) for field, v
+                  in islice(value.items(), SIZE_SAMPLES)]
+    else:
+        sample = [getsizeof(v) for v in islice(value, SIZE_SAMPLES)]
+    if sample:
+        size += len(value)*sum(sample)//len(sample)
+    return size
+
+
+def lfu_decr(usage, minutes):
+    '''The LFU counter of ``usage``, decayed at time ``minutes``.
+
+    ``usage`` packs the time, in minutes, of the last access with the
+    counter in the lowest 8 bits.
+    '''
+    counter = usage & 255
+    periods = (minutes - (usage >> 8))//LFU_DECAY_TIME
+    return max(0, counter - periods) if periods > 0 else counter
+
+
+def lfu_incr(usage, minutes):
+    '''Register an access in the ``usage`` at time ``minutes``.
+
+    The counter grows logarithmically, an access increments it with
+    probability ``1/((counter-LFU_INIT_VAL)*LFU_LOG_FACTOR+1)``.
+    '''
+    if usage is None:
+        counter = LFU_INIT_VAL
+    else:
+        counter = lfu_decr(usage, minutes)
+        if counter < 255:
+            base = max(0, counter - LFU_INIT_VAL)
+            if random() < 1.0/(base*LFU_LOG_FACTOR + 1):
+                counter += 1
+    return (minutes << 8) | counter
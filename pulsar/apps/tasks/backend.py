@@ -778,10 +778,18 @@ class PulsarTaskBackend(TaskBackend):
     def store_client(self):
         return self.store.client()
 
+    def key(self, name):
+        '''The store key of ``name``.
+
+        The backend name is a hash tag, so that all keys are owned by the
+        same node of a :class:`.ShardedRedisStore`.
+        '''
+        return '{%s}_%s' % (self.name, name)
+
     def maybe_queue_task(self, task):
         free = True
         store = self.store
-        c = self.channel
+        c = self.key
         if task['lock_id']:
             free = yield store.execute('hsetnx', c('locks'),
                                        task['lock_id'], task['id'])
@@ -797,8 +805,8 @@ class PulsarTaskBackend(TaskBackend):
     def get_task(self, task_id=None):
         store = self.store
         if not task_id:
-            inq = self.channel('inqueue')
-            ouq = self.channel('outqueue')
+            inq = self.key('inqueue')
+            ouq = self.key('outqueue')
             task_id = yield store.execute('brpoplpush', inq, ouq,
                                           self.poll_timeout)
             if not task_id:
@@ -810,9 +818,9 @@ class PulsarTaskBackend(TaskBackend):
         store = self.store
         pipe = store.pipeline()
         if lock_id:
-            pipe.hdel(self.channel('locks'), lock_id)
+            pipe.hdel(self.key('locks'), lock_id)
         # Remove the task_id from the inqueue list
-        pipe.lrem(self.channel('inqueue'), 0, task_id)
+        pipe.lrem(self.key('inqueue'), 0, task_id)
         return pipe.commit()
 
     def get_tasks(self, ids):
@@ -28,6 +28,9 @@ class DummyTransport(asyncio.Transport):
 server :attr:`connection`.'''
         self.connection.data_received(data)
 
+    def writelines(self, list_of_data):
+        self.write(b''.join(list_of_data))
+
     @property
     def address(self):
         return self.connection.address
@@ -69,7 +69,9 @@ from .wrappers import *
 from .server import *
 from .route import *
 from .handlers import *
+from .files import *
 from .routers import *
+from .cache import *
 from .auth import *
 
 
@@ -0,0 +1,323 @@
+'''A :class:`ResponseCache` wraps a :ref:`WSGI middleware <wsgi-middleware>`,
+usually a :ref:`Router <wsgi-router>`, and stores the responses it returns
+so that subsequent ``GET`` and ``HEAD`` requests for the same resource are
+served without invoking it::
+
+    from pulsar.apps import wsgi
+
+    handler = wsgi.WsgiHandler([wsgi.ResponseCache(Site())])
+
+Responses are cached for the ``s-maxage`` or ``max-age`` of their
+``Cache-Control`` header, or for the ``timeout`` of the cache if they
+don't have one. Responses with a ``no-store``, ``no-cache`` or ``private``
+directive, or setting cookies, are not cached. The cache key is made of the
+method, host, path and query of the request and of the values of the
+request headers listed in the ``Vary`` header of the response.
+
+Concurrent requests for a resource not in the cache wait for the first one
+to be served rather than invoking the middleware again.
+
+Response Cache
+=====================
+
+.. autoclass:: ResponseCache
+   :members:
+   :member-order: bysource
+
+
+Cache Backends
+=====================
+
+.. autoclass:: MemoryCache
+   :members:
+   :member-order: bysource
+
+.. autoclass:: StoreCache
+   :members:
+   :member-order: bysource
+'''
+import time
+from collections import namedtuple
+
+from pulsar import (Future, async, get_event_loop, chain_future,
+                    coroutine_return)
+from pulsar.utils.pep import pickle
+from pulsar.utils.structures import OrderedDict
+from pulsar.utils.httpurl import SimpleCookie, parse_dict_header
+from pulsar.apps.data import create_store
+
+from .wrappers import WsgiResponse
+
+
+__all__ = ['ResponseCache', 'MemoryCache', 'StoreCache']
+
+CACHEABLE_METHODS = frozenset(('GET', 'HEAD'))
+CACHEABLE_STATUS = frozenset((200, 203, 300, 301, 404, 410))
+NOT_CACHEABLE = ('no-store', 'no-cache', 'private')
+
+
+CachedResponse = namedtuple('CachedResponse', 'status_code encoding headers '
+                                              'content created vary')
+
+
+class MemoryCache(object):
+    '''A cache backend keeping responses in the memory of the process.
+
+    :param max_entries: maximum number of responses in the cache, the least
+        recently used are dropped first.
+    :param max_size: maximum number of bytes of the content of all cached
+        responses.
+    '''
+    def __init__(self, max_entries=1000, max_size=67108864):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        '''The response at ``key``, ``None`` if missing or expired'''
+        entry = self._pop(key)
+        if entry is not None and entry[0] > time.time():
+            self._entries[key] = entry
+            self.size += self._size(entry[1])
+            return entry[1]
+
+    def set(self, key, value, timeout):
+        '''Cache ``value`` at ``key`` for ``timeout`` seconds'''
+        self._pop(key)
+        self._entries[key] = (time.time() + timeout, value)
+        self.size += self._size(value)
+        while self._entries and (len(self._entries) > self.max_entries or
+                                 self.size > self.max_size):
+            self._pop(next(iter(self._entries)))
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def info(self):
+        return {'backend': 'memory',
+                'entries': len(self._entries),
+                'size': self.size}
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= self._size(entry[1])
+        return entry
+
+    def _size(self, value):
+        return len(value.content) if value.content else 0
+
+
+class StoreCache(object):
+    '''A cache backend keeping responses in a pulsar-ds or redis
+    :class:`.Store`, shared by all the processes using it.
+
+    :param url: the url of the :class:`.Store`, the store is created the
+        first time it is used in a process.
+    :param namespace: prefix of the keys of cached responses.
+    '''
+    def __init__(self, url, namespace='wsgi-cache:'):
+        self.url = url
+        self.namespace = namespace
+        self._store = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_store'] = None
+        return state
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = create_store(self.url)
+        return self._store
+
+    def get(self, key):
+        '''The response at ``key``, ``None`` if missing'''
+        return chain_future(self.store.execute('get', self.namespace + key),
+                            callback=self._loads)
+
+    def set(self, key, value, timeout):
+        '''Cache ``value`` at ``key`` for ``timeout`` seconds'''
+        return self.store.execute('set', self.namespace + key,
+                                  pickle.dumps(value, 2), 'px',
+                                  max(int(1000*timeout), 1))
+
+    def info(self):
+        return {'backend': 'store',
+                'url': self.url}
+
+    def _loads(self, value):
+        if value is not None:
+            return pickle.loads(value)
+
+
+class ResponseCache(object):
+    '''A :ref:`WSGI middleware <wsgi-middleware>` caching the responses of
+    ``middleware``.
+
+    :param middleware: the :ref:`WSGI middleware <wsgi-middleware>` to
+        cache.
+    :param backend: the cache backend, a :class:`MemoryCache` by default.
+    :param timeout: seconds to cache responses without a ``max-age``
+        directive, ``None`` to cache only responses with one.
+
+    .. attribute:: stats
+
+        Dictionary of counters: ``hits``, ``misses``, ``waits`` for requests
+        which waited for a concurrent request for the same resource,
+        ``stores`` for responses added to the cache and ``bypasses`` for
+        requests not served by the cache.
+    '''
+    def __init__(self, middleware, backend=None, timeout=None):
+        self.middleware = middleware
+        self.backend = backend if backend is not None else MemoryCache()
+        self.timeout = timeout
+        self.stats = dict.fromkeys(('hits', 'misses', 'waits', 'stores',
+                                    'bypasses'), 0)
+        self._pending = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pending'] = {}
+        return state
+
+    def __call__(self, environ, start_response):
+        if not self.cacheable_request(environ):
+            self.stats['bypasses'] += 1
+            return self.middleware(environ, start_response)
+        c = environ.get('pulsar.connection')
+        loop = c._loop if c else get_event_loop()
+        return async(self._call(environ, start_response, loop), loop)
+
+    def info(self):
+        '''Dictionary of :attr:`stats` and backend information.'''
+        info = self.stats.copy()
+        requests = info['hits'] + info['misses']
+        info['hit_rate'] = float(info['hits'])/requests if requests else 0
+        info.update(self.backend.info())
+        return info
+
+    def cacheable_request(self, environ):
+        '''Check if the response to the request of ``environ`` can be
+        served by, and stored in, the cache.'''
+        if (environ.get('REQUEST_METHOD') not in CACHEABLE_METHODS or
+                'HTTP_AUTHORIZATION' in environ):
+            return False
+        directives = parse_dict_header(environ.get('HTTP_CACHE_CONTROL', ''))
+        return 'no-store' not in directives
+
+    def cache_timeout(self, environ, response):
+        '''Number of seconds ``response`` can be cached for, ``None`` if it
+        should not be cached.'''
+        if (not isinstance(response, WsgiResponse) or
+                response.status_code not in CACHEABLE_STATUS or
+                response.is_streamed or self.sets_cookies(environ, response)):
+            return
+        headers = response.headers
+        if headers.get('Vary', '').strip() == '*':
+            return
+        directives = parse_dict_header(headers.get('Cache-Control', ''))
+        if any((d in directives for d in NOT_CACHEABLE)):
+            return
+        maxage = directives.get('s-maxage') or directives.get('max-age')
+        if maxage is not None:
+            try:
+                maxage = int(maxage)
+            except ValueError:
+                return
+            return maxage if maxage > 0 else None
+        return self.timeout
+
+    def sets_cookies(self, environ, response):
+        '''Check if ``response`` sets cookies not in the request.'''
+        if response.cookies:
+            cookies = SimpleCookie(environ.get('HTTP_COOKIE', ''))
+            for key, morsel in response.cookies.items():
+                if (key not in cookies or
+                        cookies[key].OutputString() != morsel.OutputString()):
+                    return True
+        return False
+
+    def _call(self, environ, start_response, loop):
+        base = '%s:%s%s?%s' % (environ['REQUEST_METHOD'],
+                               environ.get('HTTP_HOST', ''),
+                               environ.get('PATH_INFO', ''),
+                               environ.get('QUERY_STRING', ''))
+        directives = parse_dict_header(environ.get('HTTP_CACHE_CONTROL', ''))
+        refresh = ('no-cache' in directives or
+                   directives.get('max-age') == '0' or
+                   environ.get('HTTP_PRAGMA') == 'no-cache')
+        key = base
+        waited = False
+        while not refresh:
+            cached = self.backend.get(base)
+            if isinstance(cached, Future):
+                cached = yield cached
+            if cached is not None and cached.content is None:
+                # the response varies with the request headers
+                key = self._vary_key(base, cached.vary, environ)
+                cached = self.backend.get(key)
+                if isinstance(cached, Future):
+                    cached = yield cached
+            if cached is not None:
+                self.stats['hits'] += 1
+                coroutine_return(self._response(environ, cached))
+            pending = self._pending.get(key)
+            if pending is None or waited:
+                break
+            # a concurrent request is computing the response
+            self.stats['waits'] += 1
+            waited = True
+            yield pending
+        self.stats['misses'] += 1
+        pending = Future(loop=loop)
+        self._pending[key] = pending
+        try:
+            response = yield self.middleware(environ, start_response)
+            timeout = self.cache_timeout(environ, response)
+            if timeout:
+                yield self._set(base, response, timeout, environ)
+        finally:
+            if self._pending.get(key) is pending:
+                self._pending.pop(key)
+            pending.set_result(None)
+        coroutine_return(response)
+
+    def _set(self, base, response, timeout, environ):
+        headers = response.headers
+        vary = tuple(sorted(set((h.strip().lower() for h in
+                                 headers.get('Vary', '').split(',')
+                                 if h.strip()))))
+        content = b''.join(response.content)
+        response.content = content
+        cached = CachedResponse(response.status_code, response.encoding,
+                                list(headers), content, time.time(), vary)
+        if vary:
+            # the base key stores the Vary header of the response
+            marker = CachedResponse(None, None, None, None, None, vary)
+            result = self.backend.set(base, marker, timeout)
+            if isinstance(result, Future):
+                yield result
+            base = self._vary_key(base, vary, environ)
+        result = self.backend.set(base, cached, timeout)
+        if isinstance(result, Future):
+            yield result
+        self.stats['stores'] += 1
+
+    def _vary_key(self, base, vary, environ):
+        values = (environ.get('HTTP_%s' % h.upper().replace('-', '_'), '')
+                  for h in vary)
+        return '%s|%s' % (base, '|'.join(values))
+
+    def _response(self, environ, cached):
+        response = WsgiResponse(cached.status_code, cached.content,
+                                response_headers=cached.headers,
+                                encoding=cached.encoding, environ=environ)
+        response['Age'] = str(int(max(time.time() - cached.created, 0)))
+        return response
@@ -0,0 +1,246 @@
+'''Utilities for serving files from the file system.
+
+The :class:`.MediaRouter` and :class:`.FileRouter` look up the files they
+serve in a :class:`FileCache`, which keeps the result of ``os.stat``, the
+mime type and, for small files, the content of recently served files.
+Larger files are served with a :class:`FileWrapper`, which the
+:class:`.HttpServerResponse` sends with ``os.sendfile`` when available,
+so that the file is copied from the page cache to the socket by the
+kernel rather than read in memory.
+
+
+File Wrapper
+=====================
+
+.. autoclass:: FileWrapper
+   :members:
+   :member-order: bysource
+
+
+File Cache
+=====================
+
+.. autoclass:: FileCache
+   :members:
+   :member-order: bysource
+
+.. autofunction:: parse_range
+
+.. autofunction:: etag_match
+'''
+import os
+import re
+import time
+import mimetypes
+
+from pulsar.utils.httpurl import http_date
+from pulsar.utils.structures import OrderedDict
+
+
+__all__ = ['FileWrapper', 'FileCache', 'StaticFile', 'parse_range',
+           'etag_match']
+
+# Number of bytes read at once from files
+FILE_BLOCK_SIZE = 65536
+
+_range = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class FileWrapper(object):
+    '''The ``wsgi.file_wrapper`` of pulsar WSGI servers.
+
+    An iterable over blocks of at most ``block_size`` bytes of the ``count``
+    bytes of ``file`` starting at ``offset``, of all the remaining bytes if
+    ``count`` is not given.
+    '''
+    def __init__(self, file, block_size=FILE_BLOCK_SIZE, offset=0,
+                 count=None):
+        self.file = file
+        self.block_size = block_size
+        self.offset = offset
+        if count is None and hasattr(file, 'fileno'):
+            count = os.fstat(file.fileno()).st_size - offset
+        self.count = count
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def __iter__(self):
+        file = self.file
+        if self.offset:
+            file.seek(self.offset)
+        remaining = self.count
+        while remaining is None or remaining > 0:
+            size = self.block_size
+            if remaining is not None:
+                size = min(size, remaining)
+                remaining -= size
+            block = file.read(size)
+            if not block:
+                break
+            yield block
+
+    def close(self):
+        '''Close the file'''
+        self.file.close()
+
+
+class StaticFile(object):
+    '''The information needed to serve the file at ``path``.
+
+    .. attribute:: content
+
+        The content of the file if small enough to be kept in memory,
+        otherwise ``None``.
+    '''
+    __slots__ = ('path', 'size', 'mtime', 'content_type', 'encoding',
+                 'etag', 'last_modified', 'content', 'checked')
+
+    def __init__(self, path, stat, content=None, checked=None):
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.content_type, self.encoding = mimetypes.guess_type(path)
+        self.etag = '"%x-%x"' % (int(self.mtime*1000000), self.size)
+        self.last_modified = http_date(self.mtime)
+        self.content = content
+        self.checked = checked
+
+    def modified(self, stat):
+        '''``True`` if ``stat`` does not describe this file anymore'''
+        return stat.st_mtime != self.mtime or stat.st_size != self.size
+
+
+class FileCache(object):
+    '''A bounded cache of the :class:`StaticFile` of served files.
+
+    :param max_entries: maximum number of files in the cache, the least
+        recently served are dropped first.
+    :param max_file_size: files up to this size are kept in memory.
+    :param max_size: maximum number of bytes of all files kept in memory.
+    :param check_interval: seconds after which a cached file is checked
+        again for modifications.
+    '''
+    def __init__(self, max_entries=1000, max_file_size=65536,
+                 max_size=16777216, check_interval=1):
+        self.max_entries = max_entries
+        self.max_file_size = max_file_size
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self.size = 0
+        self._files = OrderedDict()
+        self._missing = OrderedDict()
+
+    def __len__(self):
+        return len(self._files)
+
+    def __contains__(self, path):
+        return path in self._files
+
+    def get(self, path):
+        '''The :class:`StaticFile` at ``path``.
+
+        Raise ``OSError`` if the file does not exist.
+        '''
+        now = time.time()
+        file = self._pop(path)
+        if file and now - file.checked >= self.check_interval:
+            stat = os.stat(path)
+            if file.modified(stat):
+                file = None
+            else:
+                file.checked = now
+        if file is None:
+            file = self._load(path, now)
+        self._files[path] = file
+        if file.content is not None:
+            self.size += file.size
+        while self._files and (len(self._files) > self.max_entries or
+                               self.size > self.max_size):
+            self._pop(next(iter(self._files)))
+        return file
+
+    def find(self, path):
+        '''The :class:`StaticFile` at ``path``, ``None`` if the file does
+        not exist.
+
+        Missing files are remembered for :attr:`check_interval` seconds.
+        '''
+        now = time.time()
+        checked = self._missing.get(path)
+        if checked is not None and now - checked < self.check_interval:
+            return None
+        try:
+            file = self.get(path)
+        except (IOError, OSError):
+            self._missing.pop(path, None)
+            self._missing[path] = now
+            while len(self._missing) > self.max_entries:
+                self._missing.popitem(last=False)
+            return None
+        self._missing.pop(path, None)
+        return file
+
+    def clear(self):
+        self._files.clear()
+        self._missing.clear()
+        self.size = 0
+
+    def _pop(self, path):
+        file = self._files.pop(path, None)
+        if file and file.content is not None:
+            self.size -= file.size
+        return file
+
+    def _load(self, path, now):
+        stat = os.stat(path)
+        content = None
+        if stat.st_size <= self.max_file_size:
+            with open(path, 'rb') as f:
+                content = f.read()
+            # the file changed while reading
+            if len(content) != stat.st_size:
+                content = None
+        return StaticFile(path, stat, content, now)
+
+
+def parse_range(header, size):
+    '''The ``(start, end)`` bytes, ``end`` excluded, of the ``Range``
+    ``header`` of a request for a file of ``size`` bytes.
+
+    Return ``None`` if the header is not a single byte range, which is
+    then ignored, and an empty tuple if the range is not satisfiable.
+    '''
+    match = _range.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if start:
+        start = int(start)
+        if end:
+            if int(end) < start:
+                return None
+            end = min(int(end) + 1, size)
+        else:
+            end = size
+    elif end:
+        start, end = max(size - int(end), 0), size
+    else:
+        return None
+    if start >= size:
+        return ()
+    return start, end
+
+
+def etag_match(header, etag):
+    '''Check if ``etag`` matches one of the entity tags of the
+    ``If-None-Match`` ``header``, using the weak comparison.'''
+    if header.strip() == '*':
+        return True
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
@@ -13,6 +13,12 @@ Interface
    :members:
    :member-order: bysource
 
+Compression Middleware
+=======================
+.. autoclass:: CompressionMiddleware
+   :members:
+   :member-order: bysource
+
 GZip Middleware
 =================
 .. autoclass:: GZipMiddleware
@@ -27,16 +33,20 @@ AccessControl
    :member-order: bysource
 
 '''
-import re
-from gzip import GzipFile
+import zlib
+from functools import partial
 
-from pulsar.utils.httpurl import BytesIO
+from pulsar import chain_future
+from pulsar.utils.structures import OrderedDict
 
+from .utils import parse_accept_header
 
-re_accepts_gzip = re.compile(r'\bgzip\b')
 
+__all__ = ['AccessControl', 'CompressionMiddleware', 'GZipMiddleware']
 
-__all__ = ['AccessControl', 'GZipMiddleware']
+# zlib window bits of the supported content codings
+WBITS = {'gzip': 16 + zlib.MAX_WBITS,
+         'deflate': zlib.MAX_WBITS}
 
 
 class ResponseMiddleware(object):
@@ -90,49 +100,168 @@ class AccessControl(ResponseMiddleware):
             response.headers['Access-Control-Allow-Methods'] = self.methods
 
 
-class GZipMiddleware(ResponseMiddleware):
-    """A :class:`ResponseMiddleware` for compressing content if the request
-allows gzip compression. It sets the Vary header accordingly.
+class CompressedStream(object):
+    '''An iterable over the chunks of a streamed ``content`` compressed
+    with the zlib ``compressor``.
+
+    Each chunk is flushed so that clients receive the content as soon as
+    it is produced.
+    '''
+    def __init__(self, content, compressor, charset='utf-8'):
+        self.content = content
+        self.compressor = compressor
+        self.charset = charset
+
+    def __iter__(self):
+        compressor = self.compressor
+        for chunk in self.content:
+            if chunk:
+                if not isinstance(chunk, bytes):
+                    chunk = chunk.encode(self.charset)
+                yield (compressor.compress(chunk) +
+                       compressor.flush(zlib.Z_SYNC_FLUSH))
+        yield compressor.flush()
+
+    def close(self):
+        if hasattr(self.content, 'close'):
+            self.content.close()
+
+
+class CompressionMiddleware(ResponseMiddleware):
+    """A :class:`ResponseMiddleware` for compressing content with the
+content coding, ``gzip`` or ``deflate``, accepted by the client.
+It sets the Vary header accordingly.
 
-The compression implementation is from
-http://jython.xhaus.com/http-compression-in-python-and-jython
+Streamed responses are compressed incrementally, one chunk at a time.
+The compressed content of responses with a strong ``ETag``, which
+identifies a representation of a resource, is cached by host, path, query
+string, ``ETag``, request headers listed in ``Vary`` and content coding.
+
+:param min_length: responses shorter than this are not compressed.
+:param level: the zlib compression level.
+:param encodings: the content codings supported, in order of preference.
+:param executor_length: content at least this long is compressed in the
+    executor of the event loop rather than in the event loop, ``None``
+    to always compress in the event loop.
+:param cache_size: maximum number of compressed contents in the cache.
+:param cache_length: content longer than this is not cached.
     """
-    def __init__(self, min_length=200):
+    def __init__(self, min_length=200, level=6,
+                 encodings=('gzip', 'deflate'), executor_length=1048576,
+                 cache_size=100, cache_length=1048576):
         self.min_length = min_length
+        self.level = level
+        self.encodings = tuple(encodings)
+        self.executor_length = executor_length
+        self.cache_size = cache_size
+        self.cache_length = cache_length
+        self._cache = OrderedDict()
 
     def available(self, environ, response):
         # It's not worth compressing non-OK or really short responses
-        try:
-            if response.status_code == 200 and not response.is_streamed:
-                if response.length() < self.min_length:
-                    return False
-                headers = response.headers
-                # Avoid gzipping if we've already got a content-encoding.
-                if 'Content-Encoding' in headers:
-                    return False
-                # MSIE have issues with gzipped response of various
-                # content types.
-                if "msie" in environ.get('HTTP_USER_AGENT', '').lower():
-                    ctype = headers.get('Content-Type', '').lower()
-                    if not ctype.startswith("text/") or "javascript" in ctype:
-                        return False
-                ae = environ.get('HTTP_ACCEPT_ENCODING', '')
-                if not re_accepts_gzip.search(ae):
-                    return False
-                return True
-        except Exception:
-            raise
+        if response.status_code != 200:
+            return False
+        headers = response.headers
+        # Avoid compressing if we've already got a content-encoding.
+        if 'Content-Encoding' in headers:
+            return False
+        if response.is_streamed:
+            length = headers.get('Content-Length')
+            if length and int(length) < self.min_length:
+                return False
+        elif response.length() < self.min_length:
+            return False
+        # MSIE have issues with gzipped response of various
+        # content types.
+        if "msie" in environ.get('HTTP_USER_AGENT', '').lower():
+            ctype = headers.get('Content-Type', '').lower()
+            if not ctype.startswith("text/") or "javascript" in ctype:
+                return False
+        return self.content_encoding(environ) is not None
 
     def execute(self, environ, response):
+        encoding = self.content_encoding(environ)
         headers = response.headers
         headers.add_header('Vary', 'Accept-Encoding')
+        headers['Content-Encoding'] = encoding
+        # the compressed content is a different representation
+        etag = headers.get('ETag')
+        strong = etag and not etag.startswith('W/')
+        if strong:
+            headers['ETag'] = 'W/%s' % etag
+        if response.is_streamed:
+            headers.pop('Content-Length', None)
+            response.content = CompressedStream(response.content,
+                                                self.compressor(encoding),
+                                                response.encoding or 'utf-8')
+            return
+        key = None
+        if (strong and self.cache_size and
+                response.length() <= self.cache_length):
+            key = self.cache_key(environ, headers, etag, encoding)
+        if key is not None:
+            compressed = self._cache.pop(key, None)
+            if compressed is not None:
+                self._cache[key] = compressed
+                response.content = (compressed,)
+                return
         content = b''.join(response.content)
-        response.content = (self.compress_string(content),)
-        response.headers['Content-Encoding'] = 'gzip'
+        connection = environ.get('pulsar.connection')
+        if (connection and self.executor_length is not None and
+                len(content) >= self.executor_length):
+            future = connection._loop.run_in_executor(
+                None, self.compress, content, encoding)
+            return chain_future(future, callback=partial(self._compressed,
+                                                         response, key))
+        self._compressed(response, key, self.compress(content, encoding))
+
+    def content_encoding(self, environ):
+        '''The content coding, one of :attr:`encodings`, accepted by the
+        client, ``None`` if none is accepted.'''
+        accept = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))
+        encoding = accept.best_match(self.encodings)
+        if encoding and accept.quality(encoding) > 0:
+            return encoding
+
+    def cache_key(self, environ, headers, etag, encoding):
+        '''The key of the compressed content of a response with the strong
+        ``etag``, ``None`` if the response varies on any request header.'''
+        vary = []
+        for name in headers.get_all('Vary', ()):
+            if name == '*':
+                return
+            name = name.upper().replace('-', '_')
+            if name != 'ACCEPT_ENCODING':
+                vary.append(environ.get('HTTP_%s' % name))
+        return (environ.get('HTTP_HOST'), environ.get('SCRIPT_NAME'),
+                environ.get('PATH_INFO'), environ.get('QUERY_STRING'),
+                etag, tuple(vary), encoding)
+
+    def compressor(self, encoding):
+        '''A zlib compressor for the content coding ``encoding``'''
+        return zlib.compressobj(self.level, zlib.DEFLATED, WBITS[encoding])
+
+    def compress(self, data, encoding):
+        '''Compress the bytes ``data`` with the content coding
+        ``encoding``'''
+        compressor = self.compressor(encoding)
+        return compressor.compress(data) + compressor.flush()
+
+    def _compressed(self, response, key, compressed):
+        response.content = (compressed,)
+        if key is not None:
+            self._cache[key] = compressed
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return response
+
+
+class GZipMiddleware(CompressionMiddleware):
+    """A :class:`CompressionMiddleware` for the ``gzip`` content coding
+only."""
+    def __init__(self, min_length=200, encodings=('gzip',), **kwargs):
+        super(GZipMiddleware, self).__init__(min_length, encodings=encodings,
+                                             **kwargs)
 
     def compress_string(self, s):
-        zbuf = BytesIO()
-        zfile = GzipFile(mode='wb', compresslevel=6, fileobj=zbuf)
-        zfile.write(s)
-        zfile.close()
-        return zbuf.getvalue()
+        return self.compress(s, 'gzip')
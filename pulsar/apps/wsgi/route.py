@@ -361,6 +361,20 @@ class Route(object):
                 result['__remaining__'] = remaining
             return result
 
+    def static_bit(self, start=0):
+        '''Return the ``(position, bit)`` of the first static url bit at or
+        after ``start``.
+
+        Paths matched by this route have ``bit`` as their ``position``-th
+        ``/`` separated segment. Return ``None`` if there is no such bit or a
+        variable matching several segments precedes it.'''
+        for position, (is_dynamic, bit) in enumerate(self.breadcrumbs):
+            if is_dynamic:
+                if not self._converters[bit].part_isolating:
+                    return
+            elif position >= start:
+                return position, bit
+
     def split(self):
         '''Return a two element tuple containing the parent route and
 the last url bit as route. If this route is the root route, it returns
@@ -392,6 +406,8 @@ class BaseConverter(object):
     """Base class for all converters."""
     regex = '[^/]+'
     weight = 100
+    # True if values never contain a slash
+    part_isolating = True
 
     def to_python(self, value):
         return value
@@ -444,6 +460,7 @@ class AnyConverter(BaseConverter):
 
     def __init__(self, *items):
         self.regex = '(?:%s)' % '|'.join([re.escape(x) for x in items])
+        self.part_isolating = not [x for x in items if '/' in x]
 
 
 class PathConverter(BaseConverter):
@@ -456,6 +473,7 @@ class PathConverter(BaseConverter):
     regex = '[^/].*?'
     regex = '.*'
     weight = 200
+    part_isolating = False
 
 
 class NumberConverter(BaseConverter):
@@ -47,6 +47,10 @@ Media Router
 
 The :class:`MediaRouter` is a specialised :class:`Router` for serving static
 files such ass ``css``, ``javascript``, images and so forth.
+Files are looked up in the :class:`.FileCache` of the router and served
+with support for conditional and range requests. When the ``precompressed``
+attribute is ``True``, the default, clients accepting the ``gzip`` content
+coding are served the ``.gz`` sibling of a file, if present.
 
 .. autoclass:: MediaRouter
    :members:
@@ -64,11 +68,9 @@ RouterParam
 '''
 import os
 import re
-import stat
-import mimetypes
 from email.utils import parsedate_tz, mktime_tz
 
-from pulsar.utils.httpurl import http_date, CacheControl
+from pulsar.utils.httpurl import CacheControl
 from pulsar.utils.structures import AttributeDictionary, OrderedDict
 from pulsar import (Http404, PermissionDenied, HttpException, HttpRedirect,
                     multi_async)
@@ -77,6 +79,7 @@ from .route import Route
 from .utils import wsgi_request
 from .content import Html
 from .structures import ContentAccept
+from .files import FileCache, FileWrapper, parse_range, etag_match
 
 __all__ = ['Router', 'MediaRouter', 'FileRouter', 'MediaMixin',
            'RouterParam']
@@ -176,6 +179,8 @@ class Router(RouterType('RouterBase', (object,), {})):
     .. attribute:: routes
 
         List of children :class:`Router` of this :class:`Router`.
+        Use :meth:`add_child` and :meth:`remove_child` to change it, they
+        keep the dispatch index used by :meth:`resolve` up to date.
 
     .. attribute:: parent
 
@@ -208,6 +213,8 @@ class Router(RouterType('RouterBase', (object,), {})):
     _creation_count = 0
     _parent = None
     _name = None
+    _full_route = None
+    _dispatch = None
 
     response_content_types = RouterParam(None)
     allows_redirects = RouterParam(False)
@@ -242,11 +249,15 @@ class Router(RouterType('RouterBase', (object,), {})):
         '''The relative :class:`.Route` served by this
         :class:`Router`.
         '''
-        parent = self._parent
-        if parent and parent._route.is_leaf:
-            return parent.route + self._route
-        else:
-            return self._route
+        route = self._full_route
+        if route is None:
+            parent = self._parent
+            if parent and parent._route.is_leaf:
+                route = parent.route + self._route
+            else:
+                route = self._route
+            self._full_route = route
+        return route
 
     @property
     def full_route(self):
@@ -395,7 +406,7 @@ class Router(RouterType('RouterBase', (object,), {})):
         else:
             return self, update_args(urlargs, match)
         #
-        for handler in self.routes:
+        for handler in self._candidates(path):
             view_args = handler.resolve(path, urlargs)
             if view_args is None:
                 continue
@@ -434,6 +445,8 @@ class Router(RouterType('RouterBase', (object,), {})):
             router.parent.remove_child(router)
         router._parent = self
         self.routes.append(router)
+        self._dispatch = None
+        router._reset()
         return router
 
     def remove_child(self, router):
@@ -441,6 +454,8 @@ class Router(RouterType('RouterBase', (object,), {})):
         if router in self.routes:
             self.routes.remove(router)
             router._parent = None
+            self._dispatch = None
+            router._reset()
 
     def get_route(self, name):
         '''Get a child :class:`Router` by its :attr:`name`.'''
@@ -488,6 +503,66 @@ class Router(RouterType('RouterBase', (object,), {})):
         By default it returns ``utf-8``.'''
         return 'utf-8'
 
+    def _candidates(self, path):
+        # Children which can match path, in the order of routes
+        dispatch = self._dispatch
+        if dispatch is None:
+            dispatch = self._dispatch = self._compile()
+        index, unindexed, order, maxsplit = dispatch
+        if not index:
+            return unindexed
+        bits = path.split('/', maxsplit)
+        found = None
+        for position, bit_index in index:
+            if position < len(bits):
+                handlers = bit_index.get(bits[position])
+                if handlers is None:
+                    continue
+                elif found is None:
+                    found = handlers
+                else:
+                    found = sorted(set(found).union(handlers), key=order.get)
+        return unindexed if found is None else found
+
+    def _compile(self):
+        '''Compile the children of this router into a dispatch index.
+
+        Children are indexed by the first static bit of their :attr:`route`,
+        only children whose bit matches the corresponding segment of the path
+        are matched, so that the cost of :meth:`resolve` does not depend on
+        the number of static siblings preceding a route.
+        '''
+        route = self.route
+        # children of a leaf router match the path matched by the router
+        start = route.level if route.is_leaf else 0
+        positions = {}
+        unindexed = []
+        order = {}
+        for handler in self.routes:
+            order[handler] = len(order)
+            static = handler.route.static_bit(start)
+            if static is None:
+                unindexed.append(handler)
+            else:
+                position, bit = static
+                positions.setdefault(position, {}).setdefault(
+                    bit, []).append(handler)
+        index = []
+        for position in sorted(positions):
+            bit_index = positions[position]
+            for bit, handlers in bit_index.items():
+                bit_index[bit] = sorted(handlers + unindexed, key=order.get)
+            index.append((position, bit_index))
+        maxsplit = index[-1][0] + 1 if index else 0
+        return index, unindexed, order, maxsplit
+
+    def _reset(self):
+        # The route of this router and its children may have changed
+        self._full_route = None
+        self._dispatch = None
+        for router in self.routes:
+            router._reset()
+
 
 class MediaMixin(Router):
     response_content_types = RouterParam(('application/octet-stream',
@@ -495,30 +570,87 @@ class MediaMixin(Router):
                                           'application/javascript',
                                           'text/html'))
     cache_control = CacheControl(maxage=86400)
+    file_cache = FileCache()
+    precompressed = True
     _file_path = ''
 
     def serve_file(self, request, fullpath, status_code=None):
-        # Respect the If-Modified-Since header.
-        statobj = os.stat(fullpath)
-        content_type, encoding = mimetypes.guess_type(fullpath)
+        file = self.file_cache.get(fullpath)
+        environ = request.environ
         response = request.response
-        if content_type:
-            response.content_type = content_type
-        response.encoding = encoding
-        if not (status_code or self.was_modified_since(
-                request.environ.get('HTTP_IF_MODIFIED_SINCE'),
-                statobj[stat.ST_MTIME],
-                statobj[stat.ST_SIZE])):
+        if file.content_type:
+            response.content_type = file.content_type
+        response.encoding = file.encoding
+        if self.precompressed and not file.encoding:
+            gzipped = self.file_cache.find('%s.gz' % fullpath)
+            if gzipped:
+                response.headers.add_header('Vary', 'Accept-Encoding')
+                if request.encodings.quality('gzip') > 0:
+                    response.headers['Content-Encoding'] = 'gzip'
+                    file = gzipped
+        if status_code:
+            response.status_code = status_code
+            response.content = self.file_content(request, file)
+            return response
+        response.headers['Last-Modified'] = file.last_modified
+        response.headers['ETag'] = file.etag
+        response.headers['Accept-Ranges'] = 'bytes'
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            modified = not etag_match(if_none_match, file.etag)
+        else:
+            modified = self.was_modified_since(
+                environ.get('HTTP_IF_MODIFIED_SINCE'), file.mtime, file.size)
+        if not modified:
             response.status_code = 304
+            return response
+        byte_range = None
+        if 'HTTP_RANGE' in environ and self.if_range(request, file):
+            byte_range = parse_range(environ['HTTP_RANGE'], file.size)
+        if byte_range is None:
+            response.content = self.file_content(request, file)
+        elif byte_range:
+            start, end = byte_range
+            response.status_code = 206
+            response.headers['Content-Range'] = 'bytes %d-%d/%d' % (
+                start, end - 1, file.size)
+            response.content = self.file_content(request, file, start, end)
         else:
-            response.content = open(fullpath, 'rb').read()
-            if status_code:
-                response.status_code = status_code
-            else:
-                response.headers["Last-Modified"] = http_date(
-                    statobj[stat.ST_MTIME])
+            response.status_code = 416
+            response.headers['Content-Range'] = 'bytes */%d' % file.size
         return response
 
+    def file_content(self, request, file, start=0, end=None):
+        '''The content of the bytes from ``start`` to ``end`` excluded of
+        the :class:`.StaticFile` ``file``.
+
+        Files not in the :attr:`file_cache` are served with a
+        :class:`.FileWrapper`, which the server sends with ``sendfile``
+        when available.
+        '''
+        end = file.size if end is None else end
+        if file.content is not None:
+            if start or end < file.size:
+                return file.content[start:end]
+            return file.content
+        elif request.method == 'HEAD':
+            return None
+        else:
+            request.response.headers['Content-Length'] = str(end - start)
+            return FileWrapper(open(file.path, 'rb'), offset=start,
+                               count=end - start)
+
+    def if_range(self, request, file):
+        '''Check the ``If-Range`` header, ``True`` if the ``Range`` header
+        of the request should be honoured.'''
+        if_range = request.environ.get('HTTP_IF_RANGE')
+        if not if_range:
+            return True
+        elif if_range.startswith('"'):
+            return if_range == file.etag
+        else:
+            return if_range == file.last_modified
+
     def was_modified_since(self, header=None, mtime=0, size=0):
         '''Check if an item was modified since the user last downloaded it
 
@@ -609,6 +741,11 @@ class MediaRouter(MediaMixin):
 
     def get(self, request):
         fullpath = self.filesystem_path(request)
+        if fullpath in self.file_cache:
+            try:
+                return self.serve_file(request, fullpath)
+            except (IOError, OSError):     # the file was removed
+                pass
         if os.path.isdir(fullpath) and self._default_file:
             file = os.path.join(fullpath, self._default_file)
             if os.path.isfile(file):
@@ -643,6 +780,12 @@ class FileRouter(MediaMixin):
 
     def get(self, request):
         fullpath = self.filesystem_path(request)
+        if fullpath in self.file_cache:
+            try:
+                return self.serve_file(request, fullpath,
+                                       status_code=self._status_code)
+            except (IOError, OSError):     # the file was removed
+                pass
         if os.path.isfile(fullpath):
             return self.serve_file(request, fullpath,
                                    status_code=self._status_code)
@@ -20,7 +20,7 @@ from wsgiref.handlers import format_date_time
 
 import pulsar
 from pulsar import HttpException, ProtocolError, Future, in_loop, chain_future
-from pulsar.utils.pep import is_string, native_str, reraise
+from pulsar.utils.pep import is_string, native_str, reraise, ispy3k, range
 from pulsar.utils.httpurl import (Headers, unquote, has_empty_content,
                                   host_and_port_default, http_parser,
                                   urlparse, iri_to_uri, DEFAULT_CHARSET)
@@ -29,12 +29,24 @@ from pulsar.utils.internet import format_address, is_tls
 from pulsar.async.protocols import ProtocolConsumer
 
 from .utils import handle_wsgi_error, wsgi_request, HOP_HEADERS
+from .files import FileWrapper
 
 
 __all__ = ['HttpServerResponse', 'MAX_CHUNK_SIZE', 'test_wsgi_environ']
 
 
 MAX_CHUNK_SIZE = 65536
+# File responses wait for the transport buffer to drop below this size
+FILE_WRITE_BUFFER = 16*MAX_CHUNK_SIZE
+
+# Maximum number of status lines in the cache of encoded status lines
+MAX_STATUS_LINES = 1000
+LAST_CHUNK = b'0\r\n\r\n'
+
+sendfile = getattr(os, 'sendfile', None)
+_status_lines = {}
+_server_lines = {}
+_date_line = (0, b'')
 
 
 class FakeConnection(object):
@@ -245,6 +257,58 @@ If the size is 0, this is the last chunk, and an extra CRLF is appended.
     return head + chunk + b'\r\n'
 
 
+def chunk_lines(data, lines):
+    '''Append the chunks of ``data``, at most :data:`MAX_CHUNK_SIZE` bytes
+    long, to the list of bytes ``lines``.
+
+    On python 3 large ``data`` is sliced via a ``memoryview`` so that chunks
+    are not copied until written.
+    '''
+    size = len(data)
+    if ispy3k and size > MAX_CHUNK_SIZE:
+        data = memoryview(data)
+    for start in range(0, size, MAX_CHUNK_SIZE):
+        chunk = data[start:start+MAX_CHUNK_SIZE]
+        lines.append(("%X\r\n" % len(chunk)).encode('utf-8'))
+        lines.append(chunk)
+        lines.append(b'\r\n')
+    return lines
+
+
+def status_line(version, status):
+    '''The encoded status line of a response, cached by ``version`` and
+    ``status``.'''
+    key = (version, status)
+    line = _status_lines.get(key)
+    if line is None:
+        line = ('HTTP/%s.%s %s\r\n' % (version + (status,))).encode(
+            DEFAULT_CHARSET)
+        if len(_status_lines) < MAX_STATUS_LINES:
+            _status_lines[key] = line
+    return line
+
+
+def server_line(server_software):
+    '''The encoded ``Server`` header line.'''
+    line = _server_lines.get(server_software)
+    if line is None:
+        line = ('Server: %s\r\n' % server_software).encode(DEFAULT_CHARSET)
+        _server_lines[server_software] = line
+    return line
+
+
+def date_line():
+    '''The encoded ``Date`` header line, rendered once per second.'''
+    global _date_line
+    now = int(time.time())
+    second, line = _date_line
+    if second != now:
+        line = ('Date: %s\r\n' % format_date_time(now)).encode(
+            DEFAULT_CHARSET)
+        _date_line = (now, line)
+    return line
+
+
 def keep_alive(headers, version):
         """ return True if the connection should be kept alive"""
         conn = set((v.lower() for v in headers.get_all('connection', ())))
@@ -404,24 +468,26 @@ class HttpServerResponse(ProtocolConsumer):
         :param data: bytes to write
         :param force: Optional flag used internally.
         '''
+        lines = []
         if not self._headers_sent:
-            tosend = self.get_headers()
-            self._headers_sent = tosend.flat(self.version, self.status)
+            self._headers_sent = self._header_bytes(self.get_headers())
             self.fire_event('on_headers')
-            self.transport.write(self._headers_sent)
+            lines.append(self._headers_sent)
         if data:
             if self.chunked:
-                chunks = []
-                while len(data) >= MAX_CHUNK_SIZE:
-                    chunk, data = data[:MAX_CHUNK_SIZE], data[MAX_CHUNK_SIZE:]
-                    chunks.append(chunk_encoding(chunk))
-                if data:
-                    chunks.append(chunk_encoding(data))
-                self.transport.write(b''.join(chunks))
+                chunk_lines(data, lines)
             else:
-                self.transport.write(data)
+                if lines and len(data) > MAX_CHUNK_SIZE:
+                    # don't copy a large body to join it with the headers
+                    self.transport.write(lines.pop())
+                lines.append(data)
         elif force and self.chunked:
-            self.transport.write(chunk_encoding(data))
+            lines.append(LAST_CHUNK)
+        # headers and body are sent with one write
+        if len(lines) == 1:
+            self.transport.write(lines[0])
+        elif lines:
+            self.transport.writelines(lines)
 
     ########################################################################
     #    INTERNALS
@@ -447,10 +513,22 @@ class HttpServerResponse(ProtocolConsumer):
                     self.start_response(response.status,
                                         response.get_headers(), exc_info)
                 #
-                for chunk in response:
-                    if isinstance(chunk, Future):
-                        chunk = yield chunk
-                    self.write(chunk)
+                content = getattr(response, 'content', response)
+                if isinstance(content, FileWrapper):
+                    yield self._write_file(content)
+                elif isinstance(content, (list, tuple)):
+                    # the whole body is available, write it at once
+                    body = []
+                    for chunk in response:
+                        if isinstance(chunk, Future):
+                            chunk = yield chunk
+                        body.append(chunk)
+                    self.write(b''.join(body))
+                else:
+                    for chunk in response:
+                        if isinstance(chunk, Future):
+                            chunk = yield chunk
+                        self.write(chunk)
                 #
                 # make sure we write headers
                 self.write(b'', True)
@@ -477,6 +555,65 @@ class HttpServerResponse(ProtocolConsumer):
                         self.logger.exception(
                             'Error while closing wsgi iterator')
 
+    def _write_file(self, wrapper):
+        # Write the file of a FileWrapper with sendfile if the transport
+        # writes directly to a plain socket, otherwise in blocks
+        self.write(b'')
+        transport = self.transport
+        sock = transport.get_extra_info('socket')
+        if (sendfile and sock and wrapper.count is not None and
+                not self.chunked and not is_tls(sock) and
+                not transport.get_extra_info('sslcontext')):
+            if transport.get_write_buffer_size():
+                yield self._drain(0)
+            yield self._sendfile(sock, wrapper)
+        else:
+            for chunk in wrapper:
+                if self.connection.closed:
+                    raise IOError('Connection closed')
+                self.write(chunk)
+                if transport.get_write_buffer_size() > FILE_WRITE_BUFFER:
+                    yield self._drain(FILE_WRITE_BUFFER)
+
+    def _drain(self, limit):
+        # Wait until the transport buffer drops to limit bytes. With both
+        # water marks at limit the transport pauses the connection now and
+        # resumes it once the buffer is down to limit
+        transport = self.transport
+        transport.set_write_buffer_limits(limit, limit)
+        try:
+            waiter = self.connection.drain()
+            if waiter is not None:
+                yield waiter
+        finally:
+            transport.set_write_buffer_limits()
+        if self.connection.closed:
+            raise IOError('Connection closed')
+
+    def _sendfile(self, sock, wrapper):
+        # Send the file with os.sendfile, waiting for the socket to be
+        # writable when it would block
+        loop = self._loop
+        fd = sock.fileno()
+        offset, count = wrapper.offset, wrapper.count
+        while count > 0:
+            try:
+                sent = sendfile(fd, wrapper.fileno(), offset, count)
+            except (BlockingIOError, InterruptedError):
+                waiter = Future(loop=loop)
+                loop.add_writer(fd, waiter.set_result, None)
+                try:
+                    yield waiter
+                finally:
+                    loop.remove_writer(fd)
+                if self.connection.closed:
+                    raise IOError('Connection closed')
+            else:
+                if not sent:    # the file was truncated
+                    raise IOError('Unexpected end of file')
+                offset += sent
+                count -= sent
+
     def is_chunked(self):
         '''Check if the response uses chunked transfer encoding.
 
@@ -523,12 +660,22 @@ class HttpServerResponse(ProtocolConsumer):
                                https=https,
                                extra={'pulsar.connection': self.connection,
                                       'pulsar.cfg': self.cfg,
+                                      'wsgi.file_wrapper': FileWrapper,
                                       'wsgi.multiprocess': multiprocess})
         self.keep_alive = keep_alive(self.headers, self.parser.get_version())
-        self.headers.update([('Server', self.SERVER_SOFTWARE),
-                             ('Date', format_date_time(time.time()))])
         return environ
 
+    def _header_bytes(self, headers):
+        # The status line, Server and Date lines are cached, the latter
+        # unless set by the application
+        lines = [status_line(self.version, self.status)]
+        if 'Server' not in headers:
+            lines.append(server_line(self.SERVER_SOFTWARE))
+        if 'Date' not in headers:
+            lines.append(date_line())
+        lines.append(str(headers).encode(DEFAULT_CHARSET))
+        return b''.join(lines)
+
     def _new_request(self, response):
         connection = response._connection
         if not connection.closed:
@@ -4,7 +4,7 @@ from functools import partial
 import pulsar
 from pulsar.utils.internet import nice_address, format_address
 
-from .futures import multi_async, in_loop, task, coroutine_return
+from .futures import Future, multi_async, in_loop, task, coroutine_return
 from .events import EventHandler
 from .access import asyncio, get_event_loop, new_event_loop
 
@@ -382,6 +382,7 @@ class Connection(Protocol):
         number of separate requests processed.
     '''
     _current_consumer = None
+    _write_waiter = None
 
     def __init__(self, consumer_factory=None, **kw):
         super(Connection, self).__init__(**kw)
@@ -418,6 +419,27 @@ class Connection(Protocol):
             data = consumer._data_received(data)
         self._add_idle_timeout()
 
+    def pause_writing(self):
+        '''The :attr:`~Protocol.transport` buffer went over its high-water
+        mark, :meth:`drain` waits for :meth:`resume_writing`.
+        '''
+        if self._write_waiter is None:
+            self._write_waiter = Future(loop=self._loop)
+
+    def resume_writing(self):
+        '''The :attr:`~Protocol.transport` buffer dropped to its low-water
+        mark.
+        '''
+        waiter, self._write_waiter = self._write_waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def drain(self):
+        '''A :class:`.Future` called back when writing is resumed, or
+        ``None`` if writing is not paused.
+        '''
+        return self._write_waiter
+
     def upgrade(self, consumer_factory):
         '''Upgrade the :func:`_consumer_factory` callable.
 
@@ -459,7 +481,9 @@ class Connection(Protocol):
         * Cancel the idle timeout if set.
         * Invokes the :meth:`ProtocolConsumer.connection_lost` method in the
           :meth:`current_consumer`.
+        * Resumes writing, so that nothing waits on :meth:`drain`.
           '''
+        conn.resume_writing()
         if conn._current_consumer:
             conn._current_consumer.connection_lost(exc)
 
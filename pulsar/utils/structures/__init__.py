@@ -38,6 +38,15 @@ Skiplist
    :member-order: bysource
 
 
+.. module:: pulsar.utils.structures.sortedlist
+
+Sortedlist
+~~~~~~~~~~~~~~~
+.. autoclass:: Sortedlist
+   :members:
+   :member-order: bysource
+
+
 .. module:: pulsar.utils.structures.zset
 
 Zset
@@ -49,6 +58,7 @@ Zset
 from collections import *
 
 from .skiplist import Skiplist
+from .sortedlist import Sortedlist
 from .zset import Zset
 from .misc import (MultiValueDict, AttributeDictionary, FrozenDict,
                    Dict, Deque, merge_prefix, recursive_update,
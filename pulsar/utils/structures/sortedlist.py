@@ -0,0 +1,295 @@
+'''A sorted list stored in blocks of sorted python lists.
+
+Keys are kept in a list of blocks, each a sorted list of at most twice
+:attr:`Sortedlist.load` keys, together with the largest key of each block
+and a binary indexed tree of the block lengths. Therefore a key is found
+with a bisection of the block maxima and one of its block, and the
+position of a key, or the key at a position, is found in the tree,
+in O(log n). Inserting or removing a key shifts at most one block.
+'''
+import sys
+from bisect import bisect_left, bisect_right, insort
+from itertools import chain
+
+ispy3k = int(sys.version[0]) >= 3
+
+if not ispy3k:
+    range = xrange
+
+
+class Top(object):
+    '''A value greater than any other value.
+
+    A ``(score, TOP)`` tuple is greater than all the ``(score, member)``
+    tuples with the same score.
+    '''
+    __slots__ = ()
+
+    def __lt__(self, other):
+        return False
+
+    def __le__(self, other):
+        return self is other
+
+    def __gt__(self, other):
+        return self is not other
+
+    def __ge__(self, other):
+        return True
+
+    def __repr__(self):
+        return 'TOP'
+
+
+TOP = Top()
+
+
+class Sortedlist(object):
+    '''Sorted collection of keys supporting O(log n) insertion, removal
+    and lookup by key or by position.
+
+    :param data: optional iterable over keys.
+    :param load: half the maximum number of keys in a block.
+    '''
+    __slots__ = ('load', '_len', '_lists', '_maxes', '_tree')
+
+    def __init__(self, data=None, load=500):
+        self.load = load
+        self.clear()
+        if data is not None:
+            self.update(data)
+
+    def __repr__(self):
+        return repr(list(self))
+    __str__ = __repr__
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return chain.from_iterable(self._lists)
+
+    def __contains__(self, key):
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return False
+        block = self._lists[i]
+        j = bisect_left(block, key)
+        return block[j] == key
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('sortedlist index out of range')
+        i, j = self._locate(index)
+        return self._lists[i][j]
+
+    def clear(self):
+        '''Clear the container from all data.'''
+        self._len = 0
+        self._lists = []
+        self._maxes = []
+        self._tree = [0]
+
+    def update(self, data):
+        '''Add the keys of the iterable ``data``.'''
+        data = sorted(data)
+        if not data:
+            return
+        if self._lists:
+            if self._len > len(data):
+                for key in data:
+                    self.insert(key)
+                return
+            data = sorted(chain(self, data))
+        size = 2*self.load
+        self._lists = [data[i:i+size] for i in range(0, len(data), size)]
+        self._maxes = [block[-1] for block in self._lists]
+        self._len = len(data)
+        self._build()
+
+    def insert(self, key):
+        '''Insert ``key`` in the list.'''
+        maxes = self._maxes
+        if not maxes:
+            self._lists.append([key])
+            maxes.append(key)
+            self._len = 1
+            self._build()
+            return
+        i = bisect_right(maxes, key)
+        if i == len(maxes):
+            i -= 1
+            self._lists[i].append(key)
+            maxes[i] = key
+        else:
+            insort(self._lists[i], key)
+        self._len += 1
+        if len(self._lists[i]) > 2*self.load:
+            self._split(i)
+            self._build()
+        else:
+            self._add(i, 1)
+
+    def remove(self, key):
+        '''Remove ``key`` from the list, return ``True`` if found.'''
+        maxes = self._maxes
+        i = bisect_left(maxes, key)
+        if i == len(maxes):
+            return False
+        block = self._lists[i]
+        j = bisect_left(block, key)
+        if block[j] != key:
+            return False
+        del block[j]
+        self._len -= 1
+        if len(block) < self.load//2:
+            self._join(i)
+            self._build()
+        else:
+            maxes[i] = block[-1]
+            self._add(i, -1)
+        return True
+
+    def index(self, key):
+        '''The position of ``key``, ``None`` if not in the list.'''
+        i = bisect_left(self._maxes, key)
+        if i < len(self._maxes):
+            block = self._lists[i]
+            j = bisect_left(block, key)
+            if block[j] == key:
+                return self._prefix(i) + j
+
+    def bisect_left(self, key):
+        '''The position where ``key`` would be inserted, before any equal
+        key.'''
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return self._len
+        return self._prefix(i) + bisect_left(self._lists[i], key)
+
+    def bisect_right(self, key):
+        '''The position where ``key`` would be inserted, after any equal
+        key.'''
+        i = bisect_right(self._maxes, key)
+        if i == len(self._maxes):
+            return self._len
+        return self._prefix(i) + bisect_right(self._lists[i], key)
+
+    def islice(self, start, end):
+        '''Iterator over the keys from position ``start`` to ``end``
+        excluded. Positions must be within the list.'''
+        if start >= end:
+            return
+        i, j = self._locate(start)
+        lists = self._lists
+        count = end - start
+        while count > 0:
+            block = lists[i]
+            keys = block[j:j+count]
+            for key in keys:
+                yield key
+            count -= len(keys)
+            i += 1
+            j = 0
+
+    def remove_range(self, start, end):
+        '''Remove the keys from position ``start`` to ``end`` excluded and
+        return them in a list. Positions must be within the list.'''
+        if start >= end:
+            return []
+        i, j = self._locate(start)
+        lists = self._lists
+        removed = []
+        count = end - start
+        first = i
+        while count > 0:
+            block = lists[i]
+            keys = block[j:j+count]
+            del block[j:j+count]
+            removed.extend(keys)
+            count -= len(keys)
+            i += 1
+            j = 0
+        self._len -= len(removed)
+        # drop the emptied blocks and join the small ones
+        lists[first:i] = [block for block in lists[first:i] if block]
+        self._maxes = [block[-1] for block in lists]
+        half = self.load//2
+        for i in (first + 1, first):
+            if i < len(lists) and len(lists[i]) < half:
+                self._join(i)
+        self._build()
+        return removed
+
+    #    INTERNALS
+    def _split(self, i):
+        block = self._lists[i]
+        half = block[self.load:]
+        del block[self.load:]
+        self._lists.insert(i+1, half)
+        self._maxes[i] = block[-1]
+        self._maxes.insert(i+1, half[-1])
+
+    def _join(self, i):
+        # join the small block i with a neighbour, if any
+        lists = self._lists
+        maxes = self._maxes
+        if not lists[i]:
+            del lists[i]
+            del maxes[i]
+        elif len(lists) > 1:
+            if i == len(lists) - 1:
+                i -= 1
+            lists[i].extend(lists.pop(i+1))
+            del maxes[i+1]
+            maxes[i] = lists[i][-1]
+            if len(lists[i]) > 2*self.load:
+                self._split(i)
+        else:
+            maxes[i] = lists[i][-1]
+
+    def _build(self):
+        # binary indexed tree of the block lengths, 1-based
+        tree = [0]
+        tree.extend((len(block) for block in self._lists))
+        n = len(tree)
+        for k in range(1, n):
+            p = k + (k & -k)
+            if p < n:
+                tree[p] += tree[k]
+        self._tree = tree
+
+    def _add(self, i, delta):
+        tree = self._tree
+        n = len(tree)
+        k = i + 1
+        while k < n:
+            tree[k] += delta
+            k += k & -k
+
+    def _prefix(self, i):
+        # number of keys in the blocks before block i
+        tree = self._tree
+        total = 0
+        while i:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, index):
+        # block and offset of the key at position index
+        tree = self._tree
+        n = len(tree)
+        pos = 0
+        step = 1
+        while 2*step < n:
+            step *= 2
+        while step:
+            k = pos + step
+            if k < n and tree[k] <= index:
+                index -= tree[k]
+                pos = k
+            step //= 2
+        return pos, index
@@ -1,12 +1,17 @@
-from .skiplist import Skiplist
+from .sortedlist import Sortedlist, TOP
 from ..pep import iteritems, zip
 
 
 class Zset(object):
     '''Ordered-set equivalent of redis zset.
+
+    Members are ordered by score and members with the same score are
+    ordered lexicographically, as in redis. The ``(score, member)`` pairs
+    are kept in a :class:`.Sortedlist`, so that adding, removing and
+    ranking a member are O(log n) operations.
     '''
     def __init__(self, data=None):
-        self._sl = Skiplist()
+        self._sl = Sortedlist()
         self._dict = {}
         if data:
             self.update(data)
@@ -27,8 +32,8 @@ class Zset(object):
 
     def __setstate__(self, state):
         self._dict = state
-        self._sl = Skiplist(((score, member) for member, score
-                             in iteritems(state)))
+        self._sl = Sortedlist(((score, member) for member, score
+                               in iteritems(state)))
 
     def __eq__(self, other):
         if isinstance(other, Zset):
@@ -41,32 +46,51 @@ class Zset(object):
         return iter(self._sl)
 
     def range(self, start, end, scores=False):
-        return self._sl.range(start, end, scores)
+        start, end = self._range(start, end)
+        items = self._sl.islice(start, end)
+        return items if scores else (value for _, value in items)
 
     def range_by_score(self, minval, maxval, include_min=True,
                        include_max=True, start=0, num=None, scores=False):
-        return self._sl.range_by_score(minval, maxval, start=start,
-                                       num=num, include_min=include_min,
-                                       include_max=include_max,
-                                       scores=scores)
+        start, end = self._slice(self._bounds(minval, maxval, include_min,
+                                              include_max), start, num)
+        return self.range(start, end, scores)
+
+    def range_by_lex(self, minval=None, maxval=None, include_min=True,
+                     include_max=True, start=0, num=None):
+        '''Members between ``minval`` and ``maxval``, ``None`` for no
+        bound, when all members have the same score.'''
+        start, end = self._slice(self._lex_bounds(minval, maxval,
+                                                  include_min, include_max),
+                                 start, num)
+        return self.range(start, end)
 
     def score(self, member, default=None):
         '''The score of a given member'''
         return self._dict.get(member, default)
 
     def count(self, minval, maxval, include_min=True, include_max=True):
-        return self._sl.count(minval, maxval, include_min, include_max)
+        start, end = self._bounds(minval, maxval, include_min, include_max)
+        return max(end - start, 0)
+
+    def count_by_lex(self, minval=None, maxval=None, include_min=True,
+                     include_max=True):
+        start, end = self._lex_bounds(minval, maxval, include_min,
+                                      include_max)
+        return max(end - start, 0)
 
     def add(self, score, val):
+        if score != score:
+            raise ValueError('Cannot insert score {0}'.format(score))
         r = 1
         if val in self._dict:
             sc = self._dict[val]
             if sc == score:
                 return 0
-            self.remove(val)
+            self._sl.remove((sc, val))
             r = 0
         self._dict[val] = score
-        self._sl.insert(score, val)
+        self._sl.insert((score, val))
         return r
 
     def update(self, score_vals):
@@ -90,41 +114,101 @@ scores and values.'''
         '''
         score = self._dict.pop(item, None)
         if score is not None:
-            index = self._sl.rank(score)
-            assert index >= 0, 'could not find start range'
-            for i, v in enumerate(self._sl.range(index)):
-                if v == item:
-                    assert self._sl.remove_range(index + i, index+i + 1) == 1
-                    return score
-            assert False, 'could not find element'
+            self._sl.remove((score, item))
+            return score
 
     def remove_range(self, start, end):
-        '''Remove a range by score.
+        '''Remove a range by rank.
         '''
-        return self._sl.remove_range(
-            start, end, callback=lambda sc, value: self._dict.pop(value))
+        return self._remove(*self._range(start, end))
 
     def remove_range_by_score(self, minval, maxval,
                               include_min=True, include_max=True):
         '''Remove a range by score.
         '''
-        return self._sl.remove_range_by_score(
-            minval, maxval, include_min=include_min, include_max=include_max,
-            callback=lambda sc, value: self._dict.pop(value))
+        return self._remove(*self._bounds(minval, maxval, include_min,
+                                          include_max))
+
+    def remove_range_by_lex(self, minval=None, maxval=None,
+                            include_min=True, include_max=True):
+        '''Remove a range by member, when all members have the same score.
+        '''
+        return self._remove(*self._lex_bounds(minval, maxval, include_min,
+                                              include_max))
 
     def clear(self):
         '''Clear this :class:`zset`.'''
-        self._sl = skiplist()
+        self._sl.clear()
         self._dict.clear()
 
     def rank(self, item):
         '''Return the rank (index) of ``item`` in this :class:`zset`.'''
         score = self._dict.get(item)
         if score is not None:
-            return self._sl.rank(score)
+            return self._sl.index((score, item))
 
     def flat(self):
-        return self._sl.flat()
+        result = []
+        [result.extend(pair) for pair in self._sl]
+        return tuple(result)
+
+    #    INTERNALS
+    def _range(self, start, end):
+        # Bounds of a range by rank, as in the Skiplist
+        size = len(self._sl)
+        if start < 0:
+            start = max(size + start, 0)
+        if end is None:
+            end = size
+        elif end < 0:
+            end = max(size + end, 0)
+        else:
+            end = min(end, size)
+        return start, max(start, end)
+
+    def _slice(self, bounds, start, num):
+        lo, hi = bounds
+        if num is not None:
+            hi = min(hi, lo + start + num)
+        return lo + max(start, 0), hi
+
+    def _bounds(self, minval, maxval, include_min, include_max):
+        sl = self._sl
+        if include_min:
+            lo = sl.bisect_left((minval,))
+        else:
+            lo = sl.bisect_right((minval, TOP))
+        if include_max:
+            hi = sl.bisect_right((maxval, TOP))
+        else:
+            hi = sl.bisect_left((maxval,))
+        return lo, hi
+
+    def _lex_bounds(self, minval, maxval, include_min, include_max):
+        sl = self._sl
+        if not sl:
+            return 0, 0
+        score = sl[0][0]
+        if minval is None:
+            lo = 0
+        elif include_min:
+            lo = sl.bisect_left((score, minval))
+        else:
+            lo = sl.bisect_right((score, minval))
+        if maxval is None:
+            hi = len(sl)
+        elif include_max:
+            hi = sl.bisect_right((score, maxval))
+        else:
+            hi = sl.bisect_left((score, maxval))
+        return lo, hi
+
+    def _remove(self, start, end):
+        pop = self._dict.pop
+        removed = self._sl.remove_range(start, end)
+        for _, value in removed:
+            pop(value)
+        return len(removed)
 
     @classmethod
     def union(cls, zsets, weights, oper):
@@ -132,15 +216,14 @@ scores and values.'''
         for zset, weight in zip(zsets, weights):
             if result is None:
                 result = cls()
-                sl = result._sl
-                for score, value in zset._sl:
+                for score, value in zset.items():
                     result.add(score*weight, value)
             else:
-                for score, value in zset._sl:
+                for score, value in zset.items():
                     score *= weight
-                    existing = sl.score(value)
+                    existing = result.score(value)
                     if existing is not None:
-                        score = oper(score, existing)
+                        score = oper((score, existing))
                     result.add(score, value)
         return result
 
@@ -157,12 +240,11 @@ scores and values.'''
         for zset, weight in zip(zsets, weights):
             if result is None:
                 result = cls()
-                sl = result._sl
-                for score, value in zset._sl:
+                for score, value in zset.items():
                     if value in values:
                         result.add(score*weight, value)
             else:
-                for score, value in zset._sl:
+                for score, value in zset.items():
                     if value in values:
                         existing = result.score(value)
                         score = oper((score*weight, existing))
@@ -0,0 +1,54 @@
+'''Throughput of the bit operations of pulsar-ds on large strings.
+
+Each test runs the bit operation of a command on random strings of
+``size`` bytes: ``bitcount`` counts the bits set, ``bitop`` computes the
+``AND`` and the ``NOT`` of two strings and ``bitpos`` finds the first
+bit set in a string of clear bits, so that the whole string is scanned.
+Sizes map to the length of the strings: ``tiny`` 1MB, ``normal`` 64MB and
+``huge`` 512MB.
+'''
+import unittest
+from os import urandom
+
+from pulsar.apps.ds.bitmap import BITOPS, bit_count, bit_op, bit_pos
+
+MB = 1 << 20
+
+
+class BitmapBench(unittest.TestCase):
+    __benchmark__ = True
+    __number__ = 5
+    _sizes = {'tiny': MB,
+              'small': 16*MB,
+              'normal': 64*MB,
+              'big': 256*MB,
+              'huge': 512*MB}
+    benchmark_template = ('{0[name]}: repeated {0[number]} times, '
+                          'average {0[mean]} secs, stdev {0[std]}, '
+                          '{0[mbs]} MB per second')
+
+    @classmethod
+    def setUpClass(cls):
+        cls.size = cls._sizes[cls.cfg.size]
+        cls.value1 = bytearray(urandom(cls.size))
+        cls.value2 = bytearray(urandom(cls.size))
+        cls.clear = bytearray(cls.size)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.value1 = cls.value2 = cls.clear = None
+
+    def getInfo(self, info, delta, dt):
+        info['mbs'] = round(self.size/dt/MB, 1)
+
+    def test_bitcount(self):
+        bit_count(self.value1)
+
+    def test_bitop_and(self):
+        bit_op(BITOPS[b'and'], (self.value1, self.value2))
+
+    def test_bitop_not(self):
+        bit_op(BITOPS[b'not'], (self.value1,))
+
+    def test_bitpos(self):
+        self.assertEqual(bit_pos(self.clear, 1), -1)
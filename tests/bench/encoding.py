@@ -0,0 +1,103 @@
+'''Memory of small collections in the compact and full pulsar-ds encodings.
+
+Each test builds a database of small hashes, lists, sets or sorted sets in
+a child process and measures the increase of the peak resident memory,
+reported in bytes per key.
+Sizes map to the number of keys: ``big`` 1M and ``huge`` 10M.
+'''
+import unittest
+from multiprocessing import Process, Pipe
+
+try:
+    from resource import getrusage, RUSAGE_SELF
+except ImportError:     # pragma    nocover
+    getrusage = None
+
+from pulsar.utils.pep import range
+from pulsar.utils.structures import Dict, Zset, Deque
+from pulsar.apps.ds.encoding import PackedHash, PackedList, IntSet, PackedZset
+
+# Number of elements of each collection
+ELEMENTS = 5
+
+
+def hash_items(n):
+    return [(('field%s' % i).encode('utf-8'), str(n + i).encode('utf-8'))
+            for i in range(ELEMENTS)]
+
+
+def list_items(n):
+    return [('item:%s' % (n + i)).encode('utf-8') for i in range(ELEMENTS)]
+
+
+def set_items(n):
+    return [str(n + i).encode('utf-8') for i in range(ELEMENTS)]
+
+
+def zset_items(n):
+    return [(float(i), ('member:%s' % (n + i)).encode('utf-8'))
+            for i in range(ELEMENTS)]
+
+
+def _measure(factory, items, size, connection):
+    start = getrusage(RUSAGE_SELF).ru_maxrss
+    data = {}
+    for n in range(size):
+        data[('key:%s' % n).encode('utf-8')] = factory(items(n))
+    # ru_maxrss is in KB
+    connection.send(1024*(getrusage(RUSAGE_SELF).ru_maxrss - start)//size)
+
+
+@unittest.skipUnless(getrusage, 'Requires the resource module')
+class EncodingBench(unittest.TestCase):
+    __benchmark__ = True
+    __number__ = 1
+    _sizes = {'tiny': 10000,
+              'small': 100000,
+              'normal': 300000,
+              'big': 1000000,
+              'huge': 10000000}
+    benchmark_template = ('{0[name]}: repeated {0[number]} times, '
+                          'average {0[mean]} secs, stdev {0[std]}, '
+                          '{0[bytes]} bytes per key')
+
+    @classmethod
+    def setUpClass(cls):
+        cls.size = cls._sizes[cls.cfg.size]
+
+    def startUp(self):
+        self.bytes = 0
+
+    def getInfo(self, info, delta, dt):
+        info['bytes'] = max(info.get('bytes', 0), self.bytes)
+
+    def measure(self, factory, items):
+        reader, writer = Pipe(False)
+        p = Process(target=_measure, args=(factory, items, self.size, writer))
+        p.start()
+        self.bytes = reader.recv()
+        p.join()
+
+    def test_hash_hashtable(self):
+        self.measure(Dict, hash_items)
+
+    def test_hash_ziplist(self):
+        self.measure(PackedHash, hash_items)
+
+    def test_list_linkedlist(self):
+        self.measure(Deque, list_items)
+
+    def test_list_ziplist(self):
+        self.measure(PackedList, list_items)
+
+    def test_set_hashtable(self):
+        self.measure(set, set_items)
+
+    def test_set_intset(self):
+        self.measure(IntSet, set_items)
+
+    def test_zset_skiplist(self):
+        self.measure(Zset, zset_items)
+
+    def test_zset_ziplist(self):
+        self.measure(PackedZset, zset_items)
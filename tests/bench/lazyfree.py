@@ -0,0 +1,76 @@
+'''Release large values inline and with the lazy free of pulsar-ds.
+
+Each test builds ``size`` collections of 100K elements and releases them.
+The ``inline`` tests drop the last reference, blocking for the whole
+deallocation, the ``lazy`` tests release them with :class:`.LazyFree`
+steps of 1000 elements, as done between client requests. The longest
+pause, in milliseconds, is the time clients wait for the server.
+Sizes map to the number of collections: ``normal`` 10 and ``big`` 50.
+'''
+import unittest
+
+from pulsar.utils.pep import range, default_timer
+from pulsar.utils.structures import Zset
+from pulsar.apps.ds.utils import LazyFree
+
+ELEMENTS = 100000
+STEP = 1000
+
+
+class LazyFreeBench(unittest.TestCase):
+    __benchmark__ = True
+    __number__ = 3
+    _sizes = {'tiny': 1,
+              'small': 5,
+              'normal': 10,
+              'big': 50,
+              'huge': 100}
+    benchmark_template = ('{0[name]}: repeated {0[number]} times, '
+                          'average {0[mean]} secs, stdev {0[std]}, '
+                          'longest pause {0[pause]} ms')
+
+    @classmethod
+    def setUpClass(cls):
+        cls.size = cls._sizes[cls.cfg.size]
+
+    def startUp(self):
+        self.pause = 0
+
+    def getInfo(self, info, delta, dt):
+        info['pause'] = max(info.get('pause', 0), round(1000*self.pause, 1))
+
+    def values(self, factory):
+        return [factory(('%s:%s' % (n, i)).encode('utf-8')
+                        for i in range(ELEMENTS))
+                for n in range(self.size)]
+
+    def inline(self, values):
+        for n in range(len(values)):
+            start = default_timer()
+            values[n] = None
+            self.pause = max(self.pause, default_timer() - start)
+
+    def lazy(self, values):
+        lazy = LazyFree(64)
+        for value in values:
+            lazy.free(value)
+        del values[:]
+        pending = True
+        while pending:
+            start = default_timer()
+            pending = lazy.release(STEP)
+            self.pause = max(self.pause, default_timer() - start)
+
+    def test_set_inline(self):
+        self.inline(self.values(set))
+
+    def test_set_lazy(self):
+        self.lazy(self.values(set))
+
+    def test_zset_inline(self):
+        self.inline(self.values(
+            lambda members: Zset(enumerate(members))))
+
+    def test_zset_lazy(self):
+        self.lazy(self.values(
+            lambda members: Zset(enumerate(members))))
@@ -0,0 +1,76 @@
+'''Parse large pipelines and large bulk strings with the redis parsers.
+
+Data is fed in chunks of 64KB, as read from a socket, and parsed after
+each chunk. The pipeline tests parse ``size`` SET commands, the bulk tests
+a single bulk string of ``size`` KB. The ``one_read`` tests feed the whole
+pipeline at once, as a client reading a large batch of replies does.
+Sizes map to the number of commands: ``normal`` 10K and ``big`` 100K.
+'''
+import unittest
+
+import pulsar
+from pulsar.utils.pep import range
+from pulsar.apps.ds import redis_parser
+
+CHUNK_SIZE = 65536
+
+
+class ParserBench(unittest.TestCase):
+    __benchmark__ = True
+    __number__ = 5
+    _sizes = {'tiny': 1000,
+              'small': 5000,
+              'normal': 10000,
+              'big': 100000,
+              'huge': 1000000}
+    benchmark_template = ('{0[name]}: repeated {0[number]} times, '
+                          'average {0[mean]} secs, stdev {0[std]}, '
+                          '{0[mbs]} MB per second')
+
+    @classmethod
+    def setUpClass(cls):
+        size = cls._sizes[cls.cfg.size]
+        pack = redis_parser(True)().pack_command
+        cls.commands = b''.join((pack(('set', 'key:%s' % n, 'x'*20))
+                                 for n in range(size)))
+        cls.bulk = pack(('set', 'key', b'x'*(1024*size)))
+        cls.size = size
+
+    def getInfo(self, info, delta, dt):
+        info['mbs'] = round(self.bytes/dt/1048576, 1)
+
+    def parse(self, parser, data, number, chunk_size=CHUNK_SIZE):
+        self.bytes = len(data)
+        get = parser.get
+        feed = parser.feed
+        parsed = 0
+        for start in range(0, len(data), chunk_size):
+            feed(data[start:start+chunk_size])
+            request = get()
+            while request is not False:
+                parsed += 1
+                request = get()
+        self.assertEqual(parsed, number)
+
+    def test_pipeline_python(self):
+        self.parse(redis_parser(True)(), self.commands, self.size)
+
+    @unittest.skipUnless(pulsar.HAS_C_EXTENSIONS, 'Requires C extensions')
+    def test_pipeline_cython(self):
+        self.parse(redis_parser()(), self.commands, self.size)
+
+    def test_pipeline_one_read_python(self):
+        self.parse(redis_parser(True)(), self.commands, self.size,
+                   len(self.commands))
+
+    @unittest.skipUnless(pulsar.HAS_C_EXTENSIONS, 'Requires C extensions')
+    def test_pipeline_one_read_cython(self):
+        self.parse(redis_parser()(), self.commands, self.size,
+                   len(self.commands))
+
+    def test_bulk_python(self):
+        self.parse(redis_parser(True)(), self.bulk, 1)
+
+    @unittest.skipUnless(pulsar.HAS_C_EXTENSIONS, 'Requires C extensions')
+    def test_bulk_cython(self):
+        self.parse(redis_parser()(), self.bulk, 1)
@@ -0,0 +1,76 @@
+'''Throughput of a :class:`.RedisStore` with and without auto pipelining.
+
+Each test executes ``requests`` PING commands on a pulsar-ds server, in
+groups of ``concurrency`` concurrent calls of :meth:`.RedisStore.execute`.
+The ``pool`` tests check out a connection of a pool of 10 connections for
+each command, the ``pipelining`` tests pipeline them over 2 shared
+connections.
+Sizes map to the number of requests: ``normal`` 20K and ``big`` 100K.
+'''
+import unittest
+
+import pulsar
+from pulsar import async, multi_async, new_event_loop
+from pulsar.utils.pep import range
+from pulsar.apps.ds import PulsarDS
+from pulsar.apps.data import create_store
+
+
+class PipeliningBench(unittest.TestCase):
+    __benchmark__ = True
+    __number__ = 5
+    _sizes = {'tiny': 1000,
+              'small': 5000,
+              'normal': 20000,
+              'big': 100000,
+              'huge': 1000000}
+    benchmark_template = ('{0[name]}: repeated {0[number]} times, '
+                          'average {0[mean]} secs, stdev {0[std]}, '
+                          '{0[rps]} requests per second')
+    app_cfg = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.requests = cls._sizes[cls.cfg.size]
+        server = PulsarDS(name=cls.__name__.lower(),
+                          bind='127.0.0.1:0',
+                          concurrency='process')
+        cls.app_cfg = yield pulsar.send('arbiter', 'run', server)
+        uri = 'pulsar://%s:%s' % cls.app_cfg.addresses[0]
+        cls.pool = create_store(uri, pool_size=10, loop=new_event_loop())
+        cls.pipelined = create_store(uri, pipelining=2,
+                                     loop=new_event_loop())
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.app_cfg is not None:
+            cls.pool.close()
+            cls.pipelined.close()
+            yield pulsar.send('arbiter', 'kill_actor', cls.app_cfg.name)
+
+    def getInfo(self, info, delta, dt):
+        info['rps'] = int(self.requests/dt)
+
+    def run_requests(self, store, concurrency):
+        loop = store._loop
+
+        def requests():
+            for _ in range(self.requests//concurrency):
+                results = yield multi_async([store.execute('ping')
+                                             for _ in range(concurrency)],
+                                            loop=loop)
+                self.assertTrue(all(results))
+
+        loop.run_until_complete(async(requests(), loop))
+
+    def test_pool_10(self):
+        self.run_requests(self.pool, 10)
+
+    def test_pipelining_10(self):
+        self.run_requests(self.pipelined, 10)
+
+    def test_pool_100(self):
+        self.run_requests(self.pool, 100)
+
+    def test_pipelining_100(self):
+        self.run_requests(self.pipelined, 100)
@@ -0,0 +1,58 @@
+'''Match published channels against many pattern subscriptions.
+
+Compare the prefix index used by pulsar-ds with matching the regular
+expression of every pattern. Patterns are ``room:<n>:*``, plus a few
+patterns without a literal prefix, and each test publishes to 1000
+channels.
+Sizes map to the number of patterns: ``normal`` 10K and ``big`` 100K.
+'''
+import re
+import unittest
+
+from pulsar.utils.pep import range
+from pulsar.apps.ds import redis_to_py_pattern
+from pulsar.apps.ds.utils import PatternIndex
+
+MESSAGES = 1000
+
+
+class PubSubBench(unittest.TestCase):
+    __benchmark__ = True
+    __number__ = 5
+    _sizes = {'tiny': 100,
+              'small': 1000,
+              'normal': 10000,
+              'big': 100000,
+              'huge': 1000000}
+    benchmark_template = ('{0[name]}: repeated {0[number]} times, '
+                          'average {0[mean]} secs, stdev {0[std]}, '
+                          '{0[mps]} messages per second')
+
+    @classmethod
+    def setUpClass(cls):
+        size = cls._sizes[cls.cfg.size]
+        patterns = [('room:%s:*' % n).encode('utf-8') for n in range(size)]
+        patterns.extend((b'*:alert', b'?oom:x:*'))
+        cls.index = PatternIndex()
+        cls.regexes = []
+        for pattern in patterns:
+            cls.index.add(pattern, None)
+            regex = redis_to_py_pattern(pattern.decode('utf-8'))
+            cls.regexes.append(re.compile(regex))
+        step = max(size // MESSAGES, 1)
+        cls.channels = [('room:%s:message' % (n*step % size)).encode('utf-8')
+                        for n in range(MESSAGES)]
+
+    def getInfo(self, info, delta, dt):
+        info['mps'] = int(MESSAGES/dt)
+
+    def test_index(self):
+        match = self.index.match
+        for channel in self.channels:
+            self.assertEqual(len(list(match(channel))), 1)
+
+    def test_scan(self):
+        regexes = self.regexes
+        for channel in self.channels:
+            ch = channel.decode('utf-8')
+            self.assertEqual(len([r for r in regexes if r.match(ch)]), 1)
@@ -0,0 +1,80 @@
+'''Throughput of pulsar-ds with and without pipelining.
+
+A python version of the ``redis-benchmark`` runs used for the pulsar-ds
+benchmarks: each test sends ``requests`` commands to a pulsar-ds server,
+in groups of ``pipeline`` commands, and waits for all replies.
+Sizes map to the number of requests: ``big`` 100K and ``huge`` 1M.
+'''
+import socket
+import unittest
+
+import pulsar
+from pulsar.utils.pep import range
+from pulsar.apps.ds import PulsarDS, redis_parser
+
+
+class PulsarDsBench(unittest.TestCase):
+    __benchmark__ = True
+    __number__ = 5
+    _sizes = {'tiny': 1000,
+              'small': 5000,
+              'normal': 20000,
+              'big': 100000,
+              'huge': 1000000}
+    benchmark_template = ('{0[name]}: repeated {0[number]} times, '
+                          'average {0[mean]} secs, stdev {0[std]}, '
+                          '{0[rps]} requests per second')
+    app_cfg = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.requests = cls._sizes[cls.cfg.size]
+        server = PulsarDS(name=cls.__name__.lower(),
+                          bind='127.0.0.1:0',
+                          concurrency='process')
+        cls.app_cfg = yield pulsar.send('arbiter', 'run', server)
+        cls.sock = socket.create_connection(cls.app_cfg.addresses[0][:2])
+        cls.parser = redis_parser()()
+        cls.sock.sendall(cls.parser.pack_command(('set', 'key', 'xxx')))
+        cls.sock.recv(5)
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.app_cfg is not None:
+            cls.sock.close()
+            yield pulsar.send('arbiter', 'kill_actor', cls.app_cfg.name)
+
+    def getInfo(self, info, delta, dt):
+        info['rps'] = int(self.requests/dt)
+
+    def run_requests(self, command, reply, pipeline):
+        '''Send ``self.requests`` ``command`` in groups of ``pipeline``
+        and check the replies are all equal to ``reply``.'''
+        chunk = self.parser.pack_command(command)*pipeline
+        expected = reply*pipeline
+        size = len(expected)
+        sock = self.sock
+        for _ in range(self.requests//pipeline):
+            sock.sendall(chunk)
+            data = b''
+            while len(data) < size:
+                data += sock.recv(size - len(data))
+            self.assertEqual(data, expected)
+
+    def test_ping(self):
+        self.run_requests(('ping',), b'+PONG\r\n', 1)
+
+    def test_ping_pipeline(self):
+        self.run_requests(('ping',), b'+PONG\r\n', 100)
+
+    def test_set(self):
+        self.run_requests(('set', 'key', 'xxx'), b'+OK\r\n', 1)
+
+    def test_set_pipeline(self):
+        self.run_requests(('set', 'key', 'xxx'), b'+OK\r\n', 100)
+
+    def test_get(self):
+        self.run_requests(('get', 'key'), b'$3\r\nxxx\r\n', 1)
+
+    def test_get_pipeline(self):
+        self.run_requests(('get', 'key'), b'$3\r\nxxx\r\n', 100)
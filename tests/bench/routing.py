@@ -0,0 +1,81 @@
+'''Cost of resolving a path with a :class:`.Router` with ``size`` children.
+
+Each child serves a ``r<n>/<id>`` route. The ``first``, ``middle`` and
+``last`` tests resolve a path served by the first, middle and last child,
+the ``linear`` test resolves the path of the last child trying each child
+in turn, as the :class:`.Router` did before compiling its children into a
+dispatch index.
+Sizes map to the number of routes: ``tiny`` 10, ``small`` 100 and
+``normal`` 1000.
+'''
+import unittest
+
+from pulsar.utils.pep import range
+from pulsar.apps.wsgi import Router
+from pulsar.apps.wsgi.routers import update_args
+
+# Number of paths resolved by each test
+RESOLVES = 1000
+
+
+def linear_resolve(router, path, urlargs=None):
+    match = router.route.match(path)
+    if match is None:
+        if not router.route.is_leaf:
+            return
+    elif '__remaining__' in match:
+        path = match.pop('__remaining__')
+        urlargs = update_args(urlargs, match)
+    else:
+        return router, update_args(urlargs, match)
+    for handler in router.routes:
+        view_args = linear_resolve(handler, path, urlargs)
+        if view_args is not None:
+            return view_args
+
+
+class RoutingBench(unittest.TestCase):
+    __benchmark__ = True
+    __number__ = 10
+    _sizes = {'tiny': 10,
+              'small': 100,
+              'normal': 1000,
+              'big': 5000,
+              'huge': 10000}
+    benchmark_template = ('{0[name]}: repeated {0[number]} times, '
+                          'average {0[mean]} secs, stdev {0[std]}, '
+                          '{0[us]} microseconds per path')
+
+    @classmethod
+    def setUpClass(cls):
+        cls.size = size = cls._sizes[cls.cfg.size]
+        cls.router = Router('/', *[Router('r%s/<id>' % n)
+                                   for n in range(size)])
+
+    def getInfo(self, info, delta, dt):
+        info['us'] = round(1000000*dt/RESOLVES, 2)
+
+    def resolve(self, n, resolve=None):
+        router = self.router
+        path = 'r%s/%s' % (n, n)
+        if resolve is None:
+            resolve = router.resolve
+            args = (path,)
+        else:
+            args = (router, path)
+        for _ in range(RESOLVES):
+            handler, urlargs = resolve(*args)
+        self.assertEqual(handler, router.routes[n])
+        self.assertEqual(urlargs, {'id': str(n)})
+
+    def test_first(self):
+        self.resolve(0)
+
+    def test_middle(self):
+        self.resolve(self.size // 2)
+
+    def test_last(self):
+        self.resolve(self.size - 1)
+
+    def test_linear(self):
+        self.resolve(self.size - 1, linear_resolve)
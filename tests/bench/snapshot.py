@@ -0,0 +1,111 @@
+'''Compare the pulsar-ds snapshot format with pickle.
+
+Each operation runs in a child process so that the increase of the peak
+resident memory can be measured.
+Sizes map to the number of keys: ``big`` 1M and ``huge`` 10M.
+'''
+import os
+import shutil
+import tempfile
+import unittest
+from multiprocessing import Process, Pipe
+
+try:
+    from resource import getrusage, RUSAGE_SELF
+except ImportError:     # pragma    nocover
+    getrusage = None
+
+from pulsar.utils.pep import pickle, range
+from pulsar.utils.structures import Dict
+from pulsar.apps.ds.rdb import write_snapshot, read_snapshot
+
+
+def _measure(target, args, connection):
+    start = getrusage(RUSAGE_SELF).ru_maxrss
+    target(*args)
+    connection.send(getrusage(RUSAGE_SELF).ru_maxrss - start)
+
+
+def save_pickle(filename, data):
+    with open(filename, 'wb') as file:
+        pickle.dump(data, file, protocol=2)
+
+
+def save_snapshot(filename, data):
+    with open(filename, 'wb') as file:
+        write_snapshot(file, data, 1)
+
+
+def load_pickle(filename):
+    with open(filename, 'rb') as file:
+        return pickle.load(file)
+
+
+def load_snapshot(filename):
+    data = {}
+    with open(filename, 'rb') as file:
+        for _, key, value, _ in read_snapshot(file):
+            data[key] = value
+    return data
+
+
+@unittest.skipUnless(getrusage, 'Requires the resource module')
+class SnapshotBench(unittest.TestCase):
+    __benchmark__ = True
+    __number__ = 3
+    _sizes = {'tiny': 1000,
+              'small': 10000,
+              'normal': 100000,
+              'big': 1000000,
+              'huge': 10000000}
+    benchmark_template = ('{0[name]}: repeated {0[number]} times, '
+                          'average {0[mean]} secs, stdev {0[std]}, '
+                          'peak memory increase {0[rss]} KB')
+
+    @classmethod
+    def setUpClass(cls):
+        size = cls._sizes[cls.cfg.size]
+        data = {}
+        expires = {}
+        for n in range(size):
+            key = ('key:%s' % n).encode('utf-8')
+            if n % 10:
+                data[key] = bytearray(key * 2)
+            else:
+                data[key] = Dict(((b'a', key), (b'b', key)))
+                expires[key] = 2000000000.0 + n
+        cls.data = (2, [(0, data, expires)])
+        cls.dir = tempfile.mkdtemp()
+        cls.pickle_file = os.path.join(cls.dir, 'data.pickle')
+        cls.snapshot_file = os.path.join(cls.dir, 'data.rdb')
+        save_pickle(cls.pickle_file, cls.data)
+        save_snapshot(cls.snapshot_file, cls.data)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir)
+
+    def startUp(self):
+        self.rss = 0
+
+    def getInfo(self, info, delta, dt):
+        info['rss'] = max(info.get('rss', 0), self.rss)
+
+    def measure(self, target, *args):
+        reader, writer = Pipe(False)
+        p = Process(target=_measure, args=(target, args, writer))
+        p.start()
+        self.rss = reader.recv()
+        p.join()
+
+    def test_save_pickle(self):
+        self.measure(save_pickle, self.pickle_file, self.data)
+
+    def test_save_snapshot(self):
+        self.measure(save_snapshot, self.snapshot_file, self.data)
+
+    def test_load_pickle(self):
+        self.measure(load_pickle, self.pickle_file)
+
+    def test_load_snapshot(self):
+        self.measure(load_snapshot, self.snapshot_file)
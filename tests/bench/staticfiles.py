@@ -0,0 +1,134 @@
+'''Throughput and memory of static file responses.
+
+Each test downloads a file of ``size`` bytes with ``10`` concurrent
+requests from a WSGI server with one worker process. The ``sendfile``
+tests serve the file with a :class:`.MediaRouter`, which sends it with
+``os.sendfile``, the ``read`` tests with a router reading the whole file
+in memory and writing it to the transport, as the :class:`.MediaRouter`
+did before. The peak resident memory of the worker, sampled during the
+downloads, is reported when psutil_ is available.
+Sizes map to the size of the file: ``tiny`` 1MB, ``normal`` 16MB and
+``huge`` 256MB.
+
+.. _psutil: https://pypi.python.org/pypi/psutil
+'''
+import os
+import shutil
+import tempfile
+import unittest
+import mimetypes
+
+import pulsar
+from pulsar import (asyncio, async, multi_async, new_event_loop,
+                    coroutine_return)
+from pulsar.utils.pep import range
+from pulsar.utils.system import process_info
+from pulsar.apps import wsgi
+from pulsar.apps.http import HttpClient
+
+MB = 1 << 20
+# Number of concurrent downloads
+CONCURRENCY = 10
+# Seconds between samples of the worker memory
+SAMPLE_INTERVAL = 0.01
+
+
+class ReadMediaRouter(wsgi.MediaRouter):
+    '''Serve files reading them in memory'''
+    def serve_file(self, request, fullpath, status_code=None):
+        content_type, encoding = mimetypes.guess_type(fullpath)
+        response = request.response
+        response.content_type = content_type
+        response.encoding = encoding
+        with open(fullpath, 'rb') as f:
+            response.content = f.read()
+        return response
+
+
+class StaticFilesBench(unittest.TestCase):
+    __benchmark__ = True
+    __number__ = 5
+    _sizes = {'tiny': MB,
+              'small': 4*MB,
+              'normal': 16*MB,
+              'big': 64*MB,
+              'huge': 256*MB}
+    benchmark_template = ('{0[name]}: repeated {0[number]} times, '
+                          'average {0[mean]} secs, stdev {0[std]}, '
+                          '{0[mbs]} MB per second, peak worker memory '
+                          '{0[rss]}')
+    servers = ()
+
+    @classmethod
+    def setUpClass(cls):
+        cls.size = cls._sizes[cls.cfg.size]
+        cls.dir = tempfile.mkdtemp()
+        with open(os.path.join(cls.dir, 'data.bin'), 'wb') as f:
+            for _ in range(0, cls.size, MB):
+                f.write(os.urandom(MB))
+        cls.servers = []
+        cls.sendfile = yield cls.start(wsgi.MediaRouter)
+        cls.read = yield cls.start(ReadMediaRouter)
+        cls.client = HttpClient(pool_size=CONCURRENCY, loop=new_event_loop())
+
+    @classmethod
+    def tearDownClass(cls):
+        for name in cls.servers:
+            yield pulsar.send('arbiter', 'kill_actor', name)
+        if cls.servers:
+            cls.client.close()
+            shutil.rmtree(cls.dir)
+
+    @classmethod
+    def start(cls, router):
+        # Start a server with one worker, return its address and pid
+        name = '%s-%s' % (cls.__name__.lower(), router.__name__.lower())
+        server = wsgi.WSGIServer(wsgi.WsgiHandler([router('media', cls.dir)]),
+                                 name=name, bind='127.0.0.1:0',
+                                 concurrency='process', workers=1)
+        app_cfg = yield pulsar.send('arbiter', 'run', server)
+        cls.servers.append(app_cfg.name)
+        info = yield pulsar.send(app_cfg.name, 'info')
+        while not info.get('workers'):
+            yield asyncio.sleep(0.1)
+            info = yield pulsar.send(app_cfg.name, 'info')
+        pid = info['workers'][0]['actor']['process_id']
+        coroutine_return((app_cfg.addresses[0], pid))
+
+    def getInfo(self, info, delta, dt):
+        info['mbs'] = round(CONCURRENCY*self.size/dt/MB, 1)
+        info['rss'] = ('%.1fMB' % (float(self.peak)/MB) if self.peak
+                       else 'not available')
+
+    def download(self, server):
+        (host, port), pid = server
+        url = 'http://%s:%s/media/data.bin' % (host, port)
+        client = self.client
+        loop = client._loop
+        self.peak = getattr(self, 'peak', 0)
+        sampling = [True]
+
+        def sample():
+            self.peak = max(self.peak, process_info(pid).get('memory', 0))
+            if sampling[0]:
+                loop.call_later(SAMPLE_INTERVAL, sample)
+
+        def requests():
+            sample()
+            try:
+                responses = yield multi_async([client.get(url) for _ in
+                                               range(CONCURRENCY)],
+                                              loop=loop)
+            finally:
+                sampling[0] = False
+            for response in responses:
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.get_content()), self.size)
+
+        loop.run_until_complete(async(requests(), loop))
+
+    def test_sendfile(self):
+        self.download(self.sendfile)
+
+    def test_read(self):
+        self.download(self.read)
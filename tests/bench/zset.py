@@ -0,0 +1,72 @@
+'''Sorted containers backing the sorted sets of pulsar-ds.
+
+Each test executes ``size`` operations with random scores, in a small
+range so that many members share a score, on a :class:`.Skiplist` of
+``(score, member)`` nodes and on a :class:`.Sortedlist` of
+``(score, member)`` keys, the container of :class:`.Zset`.
+The ``rank`` and ``range`` tests run on containers of ``size`` elements,
+the ``range`` tests read 10 elements from 1000 random positions.
+Sizes map to the number of operations: ``normal`` 100K and ``big`` 1M.
+'''
+import unittest
+from random import randint
+
+from pulsar.utils.pep import range
+from pulsar.utils.structures import Skiplist, Sortedlist, Zset
+
+# Number of reads of the range tests
+RANGES = 1000
+
+
+class ZsetBench(unittest.TestCase):
+    __benchmark__ = True
+    __number__ = 3
+    _sizes = {'tiny': 10000,
+              'small': 30000,
+              'normal': 100000,
+              'big': 1000000,
+              'huge': 3000000}
+
+    @classmethod
+    def setUpClass(cls):
+        size = cls._sizes[cls.cfg.size]
+        cls.items = [(float(randint(0, 1000)), ('member:%s' % n).encode())
+                     for n in range(size)]
+        cls.positions = [randint(0, size - 10) for _ in range(RANGES)]
+        cls.skiplist = Skiplist(cls.items)
+        cls.sortedlist = Sortedlist(cls.items)
+
+    def test_skiplist_insert(self):
+        sl = Skiplist()
+        for score, member in self.items:
+            sl.insert(score, member)
+
+    def test_sortedlist_insert(self):
+        sl = Sortedlist()
+        for item in self.items:
+            sl.insert(item)
+
+    def test_zset_add_remove(self):
+        zset = Zset(self.items)
+        for _, member in self.items:
+            zset.remove(member)
+
+    def test_skiplist_rank(self):
+        rank = self.skiplist.rank
+        for score, _ in self.items:
+            rank(score)
+
+    def test_sortedlist_rank(self):
+        index = self.sortedlist.index
+        for item in self.items:
+            index(item)
+
+    def test_skiplist_range(self):
+        sl = self.skiplist
+        for start in self.positions:
+            list(sl.range(start, start + 10))
+
+    def test_sortedlist_range(self):
+        sl = self.sortedlist
+        for start in self.positions:
+            list(sl.islice(start, start + 10))
@@ -559,6 +559,50 @@ class TestHttpClient(TestHttpClientBase, unittest.TestCase):
         self.assertEqual(response.status_code, 304)
         self.assertFalse('Content-length' in response.headers)
 
+    def test_media_file_etag(self):
+        http = self._client
+        response = yield http.get(self.httpbin('media/httpbin.js'))
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['etag']
+        self.assertTrue(etag.startswith('"'))
+        self.assertEqual(response.headers['accept-ranges'], 'bytes')
+        response = yield http.get(self.httpbin('media/httpbin.js'),
+                                  headers=[('If-none-match', etag)])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['etag'], etag)
+        response = yield http.get(self.httpbin('media/httpbin.js'),
+                                  headers=[('If-none-match', '"foo"')])
+        self.assertEqual(response.status_code, 200)
+
+    def test_media_file_range(self):
+        http = self._client
+        response = yield http.get(self.httpbin('media/httpbin.js'))
+        self.assertEqual(response.status_code, 200)
+        content = response.get_content()
+        size = len(content)
+        response = yield http.get(self.httpbin('media/httpbin.js'),
+                                  headers=[('Range', 'bytes=10-29')])
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers['content-range'],
+                         'bytes 10-29/%s' % size)
+        self.assertEqual(response.headers['content-length'], '20')
+        self.assertEqual(response.get_content(), content[10:30])
+        response = yield http.get(self.httpbin('media/httpbin.js'),
+                                  headers=[('Range', 'bytes=-10')])
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.get_content(), content[-10:])
+        response = yield http.get(self.httpbin('media/httpbin.js'),
+                                  headers=[('Range', 'bytes=%s-' % size)])
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers['content-range'],
+                         'bytes */%s' % size)
+        # Range ignored when the file has changed
+        response = yield http.get(self.httpbin('media/httpbin.js'),
+                                  headers=[('Range', 'bytes=10-29'),
+                                           ('If-range', '"foo"')])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_content(), content)
+
     def test_http_get_timeit(self):
         N = 10
         client = self._client
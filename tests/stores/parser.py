@@ -134,6 +134,31 @@ class TestParser(unittest.TestCase):
         self.assertEqual(res2[0], b'100')
         self.assertEqual(res2[1], result[1])
 
+    def test_pipeline(self):
+        p = self.parser()
+        commands = [[b'set', ('key%s' % n).encode('utf-8'), b'x'*n]
+                    for n in range(1000)]
+        p.feed(b''.join((p.pack_command(c) for c in commands)))
+        for command in commands:
+            self.assertEqual(p.get(), command)
+        self.assertEqual(p.get(), False)
+        self.assertEqual(p.buffer(), b'')
+
+    def test_large_bulk_in_chunks(self):
+        p = self.parser()
+        value = b'0123456789'*100000
+        data = p.bulk(value) + b'*2\r\n$3\r\nget'
+        size = 65536
+        for start in range(0, len(data), size):
+            self.assertEqual(p.get(), False)
+            p.feed(data[start:start+size])
+        self.assertEqual(p.get(), value)
+        self.assertEqual(p.get(), False)
+        self.assertEqual(p.buffer(), b'get')
+        p.feed(b'\r\n$1\r\na\r\n')
+        self.assertEqual(p.get(), [b'get', b'a'])
+        self.assertEqual(p.buffer(), b'')
+
     # CLIENT ENCODERS
     def test_encode_commands(self):
         p = self.parser()
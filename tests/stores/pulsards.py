@@ -1,10 +1,14 @@
+import os
+import shutil
 import binascii
+import socket
+import tempfile
 import time
 import unittest
-from asyncio import Queue
+from asyncio import Queue, sleep
 
 import pulsar
-from pulsar import new_event_loop
+from pulsar import new_event_loop, multi_async
 from pulsar.utils.security import random_string
 from pulsar.utils.structures import Zset
 from pulsar.apps.ds import PulsarDS, redis_parser, ResponseError
@@ -32,6 +36,32 @@ class StringProtocol:
         return message.decode('utf-8')
 
 
+class Connection:
+    '''A blocking connection to a pulsar-ds server.
+
+    Used by tests which need several commands on the same connection.
+    '''
+    def __init__(self, address, db=0):
+        self.sock = socket.create_connection(address)
+        self.parser = redis_parser()()
+        if db:
+            self.execute('select', db)
+
+    def execute(self, *args):
+        self.sock.sendall(self.parser.pack_command(args))
+        return self.read()
+
+    def read(self):
+        response = self.parser.get()
+        while response is False:
+            self.parser.feed(self.sock.recv(65536))
+            response = self.parser.get()
+        return response
+
+    def close(self):
+        self.sock.close()
+
+
 class StoreMixin(object):
     client = None
     pulsar_app_cfg = None
@@ -137,6 +167,30 @@ class RedisCommands(StoreMixin):
         yield eq(c.ttl(key), -1)
         yield eq(c.persist(key), False)
 
+    def test_set_with_expiry(self):
+        key = self.randomkey()
+        c = self.client
+        eq = self.async.assertEqual
+        yield eq(c.set(key, 'hello', 'ex', 10), True)
+        yield eq(c.get(key), b'hello')
+        ttl = yield c.ttl(key)
+        self.assertTrue(ttl > 0 and ttl <= 10)
+        yield eq(c.set(key, 'foo', 'px', 10000), True)
+        ttl = yield c.pttl(key)
+        self.assertTrue(ttl > 1000 and ttl <= 10000)
+
+    def test_lazy_expire(self):
+        key = self.randomkey()
+        c = self.client
+        eq = self.async.assertEqual
+        yield eq(c.set(key, 'hello', 'px', 10), True)
+        yield sleep(0.05)
+        yield eq(c.exists(key), False)
+        yield eq(c.get(key), None)
+        yield eq(c.ttl(key), -2)
+        keys = yield c.keys('%s*' % key)
+        self.assertEqual(keys, [])
+
     def test_keys(self):
         key = self.randomkey()
         keya = '%s_a' % key
@@ -194,6 +248,31 @@ class RedisCommands(StoreMixin):
         yield eq(c.renamenx(key, des+'a'), True)
         yield eq(c.exists(key), False)
 
+    def test_scan(self):
+        key = self.randomkey()
+        c = self.client
+        keys = set((('%s%s' % (key, i)).encode('utf-8') for i in range(30)))
+        values = []
+        for k in keys:
+            values.extend((k, 1))
+        yield self.async.assertEqual(c.mset(*values), True)
+        yield self.async.assertEqual(c.sadd(key, 1), 1)
+        found = set()
+        cursor = 0
+        while True:
+            cursor, result = yield c.scan(cursor, 'match', '%s?*' % key,
+                                          'count', 7)
+            found.update(result)
+            if cursor == b'0':
+                break
+        self.assertEqual(found, keys)
+        cursor, result = yield c.scan(0, 'match', key, 'count', 10000)
+        self.assertEqual(result, [key.encode('utf-8')])
+        cursor, result = yield c.scan(2**40, 'match', key, 'count', 10000)
+        self.assertEqual(result, [key.encode('utf-8')])
+        yield self.async.assertRaises(ResponseError, c.scan, 'bla')
+        yield self.async.assertRaises(ResponseError, c.scan, 0, 'count', 0)
+
     def test_watch(self):
         key1 = self.randomkey()
         key2 = key1 + '2'
@@ -247,6 +326,33 @@ class RedisCommands(StoreMixin):
         yield self._remove_and_push(key)
         yield self.async.assertRaises(ResponseError, c.bitcount, key)
 
+    def test_bitfield(self):
+        key = self.randomkey()
+        c = self.client
+        eq = self.async.assertEqual
+        yield eq(c.bitfield(key, 'GET', 'u8', 0), [0])
+        yield eq(c.exists(key), False)
+        yield eq(c.bitfield(key, 'SET', 'u8', 0, 255, 'GET', 'u4', 4,
+                            'SET', 'i8', '#1', -2), [0, 15, 0])
+        yield eq(c.get(key), b'\xff\xfe')
+        yield eq(c.bitfield(key, 'GET', 'i8', 8, 'GET', 'u16', 0),
+                 [-2, 0xfffe])
+        yield eq(c.bitfield(key, 'INCRBY', 'u2', 100, 1,
+                            'OVERFLOW', 'SAT', 'INCRBY', 'u2', 102, 5,
+                            'OVERFLOW', 'FAIL', 'INCRBY', 'u2', 102, 1),
+                 [1, 3, None])
+        yield eq(c.bitfield(key, 'OVERFLOW', 'WRAP', 'INCRBY', 'i8', 8, -127),
+                 [127])
+        yield self.async.assertRaises(ResponseError, c.bitfield, key,
+                                      'GET', 'u64', 0)
+        yield self.async.assertRaises(ResponseError, c.bitfield, key,
+                                      'OVERFLOW', 'foo')
+        yield self.async.assertRaises(ResponseError, c.bitfield, key,
+                                      'SET', 'i8', 0)
+        yield self._remove_and_push(key)
+        yield self.async.assertRaises(ResponseError, c.bitfield, key,
+                                      'GET', 'u8', 0)
+
     def test_bitop_not_empty_string(self):
         key = self.randomkey()
         des = key + 'd'
@@ -313,6 +419,26 @@ class RedisCommands(StoreMixin):
         self.assertEqual(int(binascii.hexlify(res2), 16), 0x0102FFFF)
         self.assertEqual(int(binascii.hexlify(res3), 16), 0x000000FF)
 
+    def test_bitpos(self):
+        key = self.randomkey()
+        c = self.client
+        eq = self.async.assertEqual
+        yield eq(c.bitpos(key, 1), -1)
+        yield eq(c.bitpos(key, 0), 0)
+        yield eq(c.set(key, b'\xff\xf0\x00'), True)
+        yield eq(c.bitpos(key, 0), 12)
+        yield eq(c.bitpos(key, 1, 1), 8)
+        yield eq(c.bitpos(key, 1, 2), -1)
+        yield eq(c.bitpos(key, 0, 2, -1), 16)
+        yield eq(c.set(key, b'\xff\xff'), True)
+        yield eq(c.bitpos(key, 0), 16)
+        yield eq(c.bitpos(key, 0, 0), 16)
+        yield eq(c.bitpos(key, 0, 0, -1), -1)
+        yield eq(c.bitpos(key, 1, -1), 8)
+        yield self.async.assertRaises(ResponseError, c.bitpos, key, 2)
+        yield self._remove_and_push(key)
+        yield self.async.assertRaises(ResponseError, c.bitpos, key, 1)
+
     def test_getbit(self):
         key = self.randomkey()
         c = self.client
@@ -483,6 +609,43 @@ class RedisCommands(StoreMixin):
         yield self.async.assertRaises(ResponseError, c.hlen, key)
         yield self.async.assertRaises(ResponseError, c.hmget, key, 'f1', 'f2')
 
+    def test_hscan(self):
+        key = self.randomkey()
+        eq = self.async.assertEqual
+        c = self.client
+        h = dict(((('f%s' % i).encode('utf-8'), b'v') for i in range(30)))
+        yield eq(c.hscan(key, 0), [b'0', []])
+        yield eq(c.hmset(key, h), True)
+        found = {}
+        cursor = 0
+        while True:
+            cursor, result = yield c.hscan(key, cursor, 'count', 7)
+            found.update(zip(result[::2], result[1::2]))
+            if cursor == b'0':
+                break
+        self.assertEqual(found, h)
+        yield eq(c.hscan(key, 0, 'match', 'f1', 'count', 100),
+                 [b'0', [b'f1', b'v']])
+        yield self._remove_and_push(key)
+        yield self.async.assertRaises(ResponseError, c.hscan, key, 0)
+
+    def test_hscan_delete(self):
+        key = self.randomkey()
+        c = self.client
+        fields = [('f%s' % i).encode('utf-8') for i in range(300)]
+        yield self.async.assertEqual(c.hmset(key, dict.fromkeys(fields, 1)),
+                                     True)
+        found = set()
+        cursor = 0
+        removed = iter(fields[1::2])
+        while True:
+            cursor, result = yield c.hscan(key, cursor, 'count', 20)
+            found.update(result[::2])
+            yield c.hdel(key, *[f for _, f in zip(range(10), removed)])
+            if cursor == b'0':
+                break
+        self.assertTrue(found.issuperset(fields[::2]))
+
     def test_hsetnx(self):
         key = self.randomkey()
         eq = self.async.assertEqual
@@ -798,6 +961,39 @@ class RedisCommands(StoreMixin):
         yield eq(c.srem(key, 2, 4), 2)
         yield eq(c.smembers(key), set([b'1', b'3']))
 
+    def test_sscan(self):
+        key = self.randomkey()
+        c = self.client
+        members = set((str(i).encode('utf-8') for i in range(30)))
+        yield self.async.assertEqual(c.sadd(key, *members), 30)
+        found = set()
+        cursor = 0
+        while True:
+            cursor, result = yield c.sscan(key, cursor, 'count', 7)
+            found.update(result)
+            if cursor == b'0':
+                break
+        self.assertEqual(found, members)
+        yield self._remove_and_push(key)
+        yield self.async.assertRaises(ResponseError, c.sscan, key, 0)
+
+    def test_sscan_delete(self):
+        key = self.randomkey()
+        c = self.client
+        members = [('m%s' % i).encode('utf-8') for i in range(300)]
+        yield self.async.assertEqual(c.sadd(key, *members), 300)
+        found = set()
+        cursor = 0
+        removed = iter(members[1::2])
+        while True:
+            cursor, result = yield c.sscan(key, cursor, 'count', 20)
+            found.update(result)
+            # members removed during the scan are not missed by the others
+            yield c.srem(key, *[m for _, m in zip(range(10), removed)])
+            if cursor == b'0':
+                break
+        self.assertTrue(found.issuperset(members[::2]))
+
     def test_sunion(self):
         key = self.randomkey()
         key2 = key + '2'
@@ -909,6 +1105,18 @@ class RedisCommands(StoreMixin):
         yield eq(c.zrange(des, 0, -1, withscores=True),
                  Zset(((20.0, b'a3'), (23.0, b'a1'))))
 
+    def test_zlexcount(self):
+        key = self.randomkey()
+        eq = self.async.assertEqual
+        c = self.client
+        yield eq(c.zadd(key, a=0, b=0, c=0, d=0, e=0), 5)
+        yield eq(c.zlexcount(key, '-', '+'), 5)
+        yield eq(c.zlexcount(key, '[b', '(d'), 2)
+        yield eq(c.zlexcount(key, '(b', '+'), 3)
+        yield eq(c.zlexcount(key, '+', '-'), 0)
+        yield self.async.assertRaises(ResponseError, c.zlexcount, key,
+                                      'b', '+')
+
     def test_zrange(self):
         key = self.randomkey()
         eq = self.async.assertEqual
@@ -934,6 +1142,20 @@ class RedisCommands(StoreMixin):
         yield eq(c.zrangebyscore(key, 2, 4, withscores=True),
                  Zset([(2.0, b'a2'), (3.0, b'a3'), (4.0, b'a4')]))
 
+    def test_zrangebylex(self):
+        key = self.randomkey()
+        eq = self.async.assertEqual
+        c = self.client
+        yield eq(c.zadd(key, e=0, d=0, c=0, b=0, a=0), 5)
+        yield eq(c.zrange(key, 0, -1), [b'a', b'b', b'c', b'd', b'e'])
+        yield eq(c.zrangebylex(key, '-', '[c'), [b'a', b'b', b'c'])
+        yield eq(c.zrangebylex(key, '(a', '(d'), [b'b', b'c'])
+        yield eq(c.zrangebylex(key, '[b', '+', 'LIMIT', 1, 2),
+                 [b'c', b'd'])
+        yield eq(c.zrangebylex(key, '[b', '+', 'LIMIT', 3, -1), [b'e'])
+        yield eq(c.zrangebylex(key, '[d', '[b'), [])
+        yield eq(c.zrank(key, 'd'), 3)
+
     def test_zrank(self):
         key = self.randomkey()
         eq = self.async.assertEqual
@@ -957,6 +1179,16 @@ class RedisCommands(StoreMixin):
         yield eq(c.zrem(key, 'a1', 'a4'), 2)
         yield eq(c.type(key), 'none')
 
+    def test_zremrangebylex(self):
+        key = self.randomkey()
+        eq = self.async.assertEqual
+        c = self.client
+        yield eq(c.zadd(key, a=0, b=0, c=0, d=0, e=0), 5)
+        yield eq(c.zremrangebylex(key, '[b', '(d'), 2)
+        yield eq(c.zrange(key, 0, -1), [b'a', b'd', b'e'])
+        yield eq(c.zremrangebylex(key, '-', '+'), 3)
+        yield eq(c.type(key), 'none')
+
     def test_zremrangebyrank(self):
         key = self.randomkey()
         eq = self.async.assertEqual
@@ -975,6 +1207,42 @@ class RedisCommands(StoreMixin):
         yield eq(c.zremrangebyscore(key, 2, 4), 0)
         yield eq(c.zrange(key, 0, -1), [b'a1', b'a5'])
 
+    def test_zscan(self):
+        key = self.randomkey()
+        c = self.client
+        members = dict((('a%s' % i, i) for i in range(200)))
+        yield self.async.assertEqual(c.zadd(key, **members), 200)
+        found = {}
+        cursor = 0
+        while True:
+            cursor, result = yield c.zscan(key, cursor, 'count', 7)
+            found.update(zip(result[::2], map(float, result[1::2])))
+            if cursor == b'0':
+                break
+            # a cursor can be used again
+            yield self.async.assertEqual(c.zscan(key, cursor, 'count', 7),
+                                         c.zscan(key, cursor, 'count', 7))
+        self.assertEqual(found, dict(((k.encode('utf-8'), v)
+                                      for k, v in members.items())))
+        yield self._remove_and_push(key)
+        yield self.async.assertRaises(ResponseError, c.zscan, key, 0)
+
+    def test_zscan_delete(self):
+        key = self.randomkey()
+        c = self.client
+        members = dict((('a%s' % i, i) for i in range(300)))
+        yield self.async.assertEqual(c.zadd(key, **members), 300)
+        found = set()
+        cursor = 0
+        while True:
+            cursor, result = yield c.zscan(key, cursor, 'count', 20)
+            found.update(result[::2])
+            yield c.zremrangebyrank(key, 0, 9)
+            if cursor == b'0':
+                break
+        self.assertTrue(found.issuperset((('a%s' % i).encode('utf-8')
+                                          for i in range(150, 300))))
+
     ###########################################################################
     #    CONNECTION
     def test_ping(self):
@@ -1111,6 +1379,370 @@ class TestPulsarStore(RedisCommands, unittest.TestCase):
                                           loop=new_event_loop())
         cls.client = cls.store.client()
 
+    def test_object_encoding(self):
+        key = self.randomkey()
+        eq = self.async.assertEqual
+        c = self.client
+        encoding = lambda: c.execute('object', 'encoding', key)
+        yield eq(encoding(), None)
+        yield eq(c.hset(key, 'foo', 4), 1)
+        yield eq(encoding(), b'ziplist')
+        yield eq(c.hset(key, 'bla', 'x'*100), 1)
+        yield eq(encoding(), b'hashtable')
+        yield eq(c.hgetall(key), {b'foo': b'4', b'bla': b'x'*100})
+        yield eq(c.delete(key), 1)
+        yield eq(c.sadd(key, 3, 1, 2), 3)
+        yield eq(encoding(), b'intset')
+        yield eq(c.sadd(key, 'a'), 1)
+        yield eq(encoding(), b'hashtable')
+        yield eq(c.smembers(key), set((b'1', b'2', b'3', b'a')))
+        yield eq(c.delete(key), 1)
+        yield eq(c.rpush(key, 'a', 'b'), 2)
+        yield eq(encoding(), b'ziplist')
+        yield eq(c.rpush(key, *range(600)), 602)
+        yield eq(encoding(), b'linkedlist')
+        yield eq(c.lindex(key, 1), b'b')
+        yield eq(c.delete(key), 1)
+        yield eq(c.zadd(key, a1=1, a2=2), 2)
+        yield eq(encoding(), b'ziplist')
+        yield eq(c.zincrby(key, 5, 'a1'), 6.0)
+        yield eq(c.zrange(key, 0, -1), [b'a2', b'a1'])
+        yield eq(c.zadd(key, **dict((('m%s' % n, n) for n in range(200)))),
+                 200)
+        yield eq(encoding(), b'skiplist')
+        yield eq(c.zcard(key), 202)
+        yield eq(c.set(key, 'foo'), True)
+        yield eq(encoding(), b'raw')
+
+    def test_compact_memory_info(self):
+        info = yield self.client.info()
+        self.assertTrue('used_memory_compact' in info)
+        self.assertTrue('compact_keys' in info)
+
+    def test_watch_index(self):
+        key = self.randomkey()
+        address = self.pulsar_app_cfg.addresses[0]
+        c1 = Connection(address, 2)
+        c2 = Connection(address, 2)
+        try:
+            # Writes to other keys, or to the key in another database, do
+            # not abort the transaction
+            self.assertEqual(c1.execute('watch', key), b'OK')
+            self.assertEqual(c2.execute('set', key + 'x', 1), b'OK')
+            self.assertEqual(c2.execute('select', 3), b'OK')
+            self.assertEqual(c2.execute('set', key, 1), b'OK')
+            self.assertEqual(c1.execute('multi'), b'OK')
+            self.assertEqual(c1.execute('set', key, 2), b'QUEUED')
+            self.assertEqual(c1.execute('exec'), [b'OK'])
+            # A write to the watched key does
+            self.assertEqual(c1.execute('watch', key), b'OK')
+            self.assertEqual(c2.execute('select', 2), b'OK')
+            self.assertEqual(c2.execute('set', key, 3), b'OK')
+            self.assertEqual(c1.execute('multi'), b'OK')
+            self.assertEqual(c1.execute('set', key, 4), b'QUEUED')
+            self.assertEqual(c1.execute('exec'), [])
+            self.assertEqual(c1.execute('get', key), b'3')
+            # So does flushing the database
+            self.assertEqual(c1.execute('watch', key + 'y'), b'OK')
+            self.assertEqual(c2.execute('flushdb'), b'OK')
+            self.assertEqual(c1.execute('multi'), b'OK')
+            self.assertEqual(c1.execute('set', key, 5), b'QUEUED')
+            self.assertEqual(c1.execute('exec'), [])
+            # Unwatched keys are removed from the index
+            self.assertEqual(c1.execute('watch', key), b'OK')
+            self.assertEqual(c1.execute('unwatch'), b'OK')
+            self.assertEqual(c2.execute('set', key, 6), b'OK')
+            self.assertEqual(c1.execute('multi'), b'OK')
+            self.assertEqual(c1.execute('get', key), b'QUEUED')
+            self.assertEqual(c1.execute('exec'), [b'6'])
+        finally:
+            c1.close()
+            c2.close()
+
+    def test_output_buffer_limit(self):
+        c = self.client
+        channel = self.randomkey()
+        limit = yield c.execute('config', 'get', 'client-output-buffer-limit')
+        yield c.execute('config', 'set', 'client-output-buffer-limit',
+                        'pubsub 65536 0 0')
+        subscriber = Connection(self.pulsar_app_cfg.addresses[0])
+        try:
+            self.assertEqual(subscriber.execute('subscribe', channel),
+                             [b'subscribe', channel.encode('utf-8'), 1])
+            # The subscriber does not read messages, it is disconnected
+            # once the socket buffers are full
+            message = b'x'*262144
+            for _ in range(1000):
+                count = yield c.execute('publish', channel, message)
+                if not count:
+                    break
+            self.assertEqual(count, 0)
+            info = yield c.info()
+            self.assertTrue(
+                info['client_output_buffer_limit_disconnections'] >= 1)
+        finally:
+            subscriber.close()
+            yield c.execute('config', 'set', 'client-output-buffer-limit',
+                            limit)
+
+    def test_client_tracking(self):
+        key = self.randomkey().encode('utf-8')
+        address = self.pulsar_app_cfg.addresses[0]
+        redirect = Connection(address)
+        tracker = Connection(address, 4)
+        writer = Connection(address, 4)
+        invalidate = [b'message', b'__redis__:invalidate']
+        try:
+            client_id = redirect.execute('client', 'id')
+            self.assertEqual(redirect.execute('subscribe',
+                                              '__redis__:invalidate'),
+                             [b'subscribe', b'__redis__:invalidate', 1])
+            self.assertTrue(isinstance(
+                tracker.execute('client', 'tracking', 'on'), ResponseError))
+            self.assertTrue(isinstance(
+                tracker.execute('client', 'tracking', 'on', 'redirect',
+                                client_id, 'prefix', 'x'), ResponseError))
+            self.assertEqual(tracker.execute('client', 'tracking', 'on',
+                                             'redirect', client_id), b'OK')
+            # Keys read by the tracker are invalidated once
+            self.assertEqual(tracker.execute('get', key), None)
+            self.assertEqual(writer.execute('set', key, 1), b'OK')
+            self.assertEqual(redirect.read(), invalidate + [[key]])
+            self.assertEqual(writer.execute('set', key, 2), b'OK')
+            self.assertEqual(tracker.execute('get', key), b'2')
+            self.assertEqual(writer.execute('del', key), 1)
+            self.assertEqual(redirect.read(), invalidate + [[key]])
+            # Flushing a database invalidates all keys
+            self.assertEqual(writer.execute('flushdb'), b'OK')
+            self.assertEqual(redirect.read(), invalidate + [None])
+            # In broadcasting mode keys with a prefix are invalidated
+            self.assertEqual(tracker.execute('client', 'tracking', 'on',
+                                             'redirect', client_id, 'bcast',
+                                             'prefix', key + b':'), b'OK')
+            self.assertEqual(writer.execute('set', key, 3), b'OK')
+            self.assertEqual(writer.execute('set', key + b':a', 3), b'OK')
+            self.assertEqual(redirect.read(), invalidate + [[key + b':a']])
+            self.assertEqual(tracker.execute('client', 'tracking', 'off'),
+                             b'OK')
+            self.assertEqual(writer.execute('set', key + b':a', 4), b'OK')
+            self.assertEqual(writer.execute('client', 'tracking', 'on',
+                                            'redirect', client_id), b'OK')
+            self.assertEqual(writer.execute('get', key), b'3')
+            self.assertEqual(writer.execute('set', key, 4), b'OK')
+            self.assertEqual(redirect.read(), invalidate + [[key]])
+        finally:
+            redirect.close()
+            tracker.close()
+            writer.close()
+
+    def test_unlink(self):
+        eq = self.async.assertEqual
+        key1, key2 = self.randomkey(), self.randomkey()
+        c = self.client
+        yield eq(c.sadd(key1, *range(1000)), 1000)
+        yield eq(c.set(key2, 'a'), True)
+        yield eq(c.unlink(key1, key2, key1), 2)
+        yield eq(c.exists(key1), False)
+        info = yield c.info()
+        self.assertTrue(info['lazyfreed_objects'] >= 0)
+        self.assertTrue('lazyfree_pending_objects' in info)
+        # flushing a database in the background
+        conn = Connection(self.pulsar_app_cfg.addresses[0], 5)
+        try:
+            self.assertEqual(conn.execute('rpush', key1, *range(1000)), 1000)
+            self.assertEqual(conn.execute('flushdb', 'async'), b'OK')
+            self.assertEqual(conn.execute('dbsize'), 0)
+            self.assertTrue(isinstance(conn.execute('flushdb', 'foo'),
+                                       ResponseError))
+        finally:
+            conn.close()
+
+    def test_lazyfree_config(self):
+        c = self.client
+        eq = self.async.assertEqual
+        yield eq(c.execute('config', 'get', 'lazyfree-lazy-server-del'),
+                 b'no')
+        yield eq(c.execute('config', 'set', 'lazyfree-lazy-server-del',
+                           'yes'), b'OK')
+        key = self.randomkey()
+        yield eq(c.sadd(key, *range(100)), 100)
+        yield eq(c.set(key, 'a'), True)
+        yield eq(c.get(key), b'a')
+        yield eq(c.execute('config', 'set', 'lazyfree-lazy-server-del',
+                           'no'), b'OK')
+        yield self.async.assertRaises(
+            ResponseError, c.execute, 'config', 'set',
+            'lazyfree-lazy-server-del', 'foo')
+
+    def test_near_cache(self):
+        eq = self.async.assertEqual
+        key = self.randomkey()
+        c = self.client
+        store = self.create_store('%s/9' % self.pulsards_uri, cache_size=10)
+        yield eq(c.set(key, 'a'), True)
+        yield eq(store.execute('get', key), b'a')
+        self.assertEqual(len(store.cache), 1)
+        yield eq(store.execute('get', key), b'a')
+        self.assertEqual(store.cache.hits, 1)
+        # The server invalidates the cached reply
+        yield eq(c.set(key, 'b'), True)
+        for _ in range(100):
+            if not len(store.cache):
+                break
+            yield sleep(0.01)
+        self.assertEqual(len(store.cache), 0)
+        yield eq(store.execute('get', key), b'b')
+        yield store.close()
+
+    def test_pipelining(self):
+        eq = self.async.assertEqual
+        key = self.randomkey()
+        store = self.create_store('%s/9' % self.pulsards_uri, pipelining=2)
+        results = yield multi_async([store.execute('incr', key)
+                                     for _ in range(100)])
+        self.assertEqual(sorted(results), list(range(1, 101)))
+        connections = store._multiplexer.connections
+        self.assertTrue(1 <= len(connections) <= 2)
+        yield self.async.assertRaises(ResponseError, store.execute,
+                                      'lpush', key, 'a')
+        # blocking commands are executed on connections of the pool
+        yield eq(store.execute('rpush', key + 'x', 'a'), 1)
+        yield eq(store.execute('blpop', key + 'x', 1),
+                 ((key + 'x').encode('utf-8'), b'a'))
+        self.assertEqual(store._multiplexer.connections, connections)
+        pipe = store.pipeline()
+        pipe.ping()
+        results = yield multi_async([store.execute('get', key),
+                                     store.execute('exists', key + 'x'),
+                                     pipe.commit()])
+        self.assertEqual(results, [b'100', False, [True]])
+        yield store.close()
+
+    def test_aof_spop(self):
+        # SPOP is written to the append only file as the SREM of the
+        # popped member, so that the set is the same once replayed
+        dirname = tempfile.mkdtemp()
+        members = set((('m%s' % i).encode('utf-8') for i in range(100)))
+        try:
+            cfg = yield self._aof_server(dirname, 1)
+            conn = Connection(cfg.addresses[0])
+            self.assertEqual(conn.execute('sadd', 'set', *members), 100)
+            for _ in range(20):
+                members.remove(conn.execute('spop', 'set'))
+            self.assertEqual(conn.execute('sadd', 'set2', 'a'), 1)
+            self.assertEqual(conn.execute('spop', 'set2'), b'a')
+            conn.close()
+            yield pulsar.send('arbiter', 'kill_actor', cfg.name)
+            cfg = yield self._aof_server(dirname, 2)
+            conn = Connection(cfg.addresses[0])
+            self.assertEqual(set(conn.execute('smembers', 'set')), members)
+            self.assertEqual(conn.execute('exists', 'set2'), 0)
+            conn.close()
+            yield pulsar.send('arbiter', 'kill_actor', cfg.name)
+        finally:
+            shutil.rmtree(dirname)
+
+    def _aof_server(self, dirname, num):
+        server = PulsarDS(name='%s%s' % (self.__class__.__name__.lower(),
+                                         num),
+                          bind='127.0.0.1:0',
+                          concurrency=self.cfg.concurrency,
+                          key_value_filename=os.path.join(dirname,
+                                                          'test.rdb'),
+                          key_value_appendonly=True,
+                          key_value_appendfsync='always',
+                          key_value_appendfilename=os.path.join(dirname,
+                                                                'test.aof'))
+        return pulsar.send('arbiter', 'run', server)
+
+    def test_sharded_store(self):
+        eq = self.async.assertEqual
+        address = self.pulsards_uri[len('pulsar://'):]
+        store = create_store('shards+pulsar://%s/11?nodes=%s,%s' %
+                             (address, address, address))
+        self.assertEqual(store.name, 'pulsar')
+        self.assertEqual(len(store.nodes), 3)
+        self.assertEqual(create_store(store.dns).dns, store.dns)
+        key = self.randomkey()
+        keys = ['%s:%s' % (key, n) for n in range(20)]
+        self.assertEqual(len(set((store.node(k) for k in keys))), 3)
+        yield eq(store.execute('mset', *[v for k in keys for v in (k, k)]),
+                 True)
+        yield eq(store.execute('mget', *keys),
+                 [k.encode('utf-8') for k in keys])
+        yield eq(store.execute('get', keys[3]), keys[3].encode('utf-8'))
+        other = [k for k in keys if store.node(k) is not store.node(keys[0])]
+        yield self.async.assertRaises(pulsar.PulsarException, store.execute,
+                                      'rename', keys[0], other[0])
+        self.assertEqual(store.node('{%s}a' % key), store.node('{%s}b' % key))
+        client = store.client()
+        pipe = client.pipeline()
+        for k in keys:
+            pipe.append(k, 'x')
+        result = yield pipe.commit()
+        self.assertEqual(result, [len(k) + 1 for k in keys])
+        yield eq(store.execute('del', *keys), 20)
+        yield eq(store.execute('exists', keys[0]), False)
+        yield store.close()
+
+    def test_pattern_publish(self):
+        eq = self.async.assertEqual
+        channel = self.randomkey()
+        pubsub1 = self.client.pubsub(protocol=StringProtocol())
+        listener = Listener()
+        pubsub1.add_client(listener)
+        yield pubsub1.psubscribe(channel + '.*', channel + '.?')
+        pubsub2 = self.client.pubsub()
+        yield pubsub2.psubscribe('x' + channel + '*')
+        yield eq(pubsub1.publish(channel + '.a', 'hello'), 2)
+        ch, message = yield listener.get()
+        self.assertEqual(ch, channel + '.a')
+        self.assertEqual(message, 'hello')
+        yield eq(pubsub1.publish(channel + 'a', 'hello'), 0)
+        numpat = yield self.client.execute('pubsub', 'numpat')
+        self.assertTrue(numpat >= 3)
+        yield pubsub1.punsubscribe()
+        yield pubsub2.punsubscribe()
+
+    def test_slowlog(self):
+        eq = self.async.assertEqual
+        c = self.client
+        key = self.randomkey()
+        yield eq(c.execute('config', 'set', 'slowlog-log-slower-than', 0),
+                 b'OK')
+        try:
+            yield eq(c.execute('slowlog', 'reset'), b'OK')
+            yield eq(c.set(key, 'x'*200), True)
+            entries = yield c.execute('slowlog', 'get', 1)
+            self.assertEqual(len(entries), 1)
+            entry_id, timestamp, usec, args = entries[0]
+            self.assertTrue(usec >= 0)
+            self.assertEqual(args[:2], [b'set', key.encode('utf-8')])
+            self.assertEqual(args[2], b'x'*128 + b'... (72 more bytes)')
+            length = yield c.execute('slowlog', 'len')
+            self.assertTrue(length >= 2)
+        finally:
+            yield c.execute('config', 'set', 'slowlog-log-slower-than',
+                            10000)
+        yield eq(c.execute('slowlog', 'reset'), b'OK')
+        yield eq(c.execute('slowlog', 'len'), 0)
+        yield self.async.assertRaises(ResponseError, c.execute, 'slowlog',
+                                      'foo')
+
+    def test_commandstats(self):
+        c = self.client
+        key = self.randomkey()
+        yield c.set(key, 'foo')
+        yield c.get(key)
+        info = yield c.info('commandstats')
+        self.assertTrue(info['cmdstat_get']['calls'] >= 1)
+        self.assertTrue('usec' in info['cmdstat_set'])
+        self.assertFalse('keyspace_hits' in info)
+        info = yield c.info('latencystats')
+        latency = info['latency_percentiles_usec_get']
+        self.assertEqual(set(latency), set(('p50', 'p99', 'p99.9')))
+        self.assertTrue(latency['p50'] <= latency['p99.9'])
+
 
 @unittest.skipUnless(pulsar.HAS_C_EXTENSIONS, 'Requires cython extensions')
 class TestPulsarStorePyParser(TestPulsarStore):
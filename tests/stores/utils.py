@@ -1,7 +1,36 @@
+import os
 import re
+import shutil
+import logging
+import tempfile
 import unittest
+from io import BytesIO
+from collections import deque
+from functools import partial
 
+from pulsar.utils.pep import pickle
+from pulsar.utils.structures import Zset, Dict, Deque
 from pulsar.apps.ds import redis_to_py_pattern
+from pulsar.apps.ds.utils import (TimerWheel, value_size, lfu_incr,
+                                  lfu_decr, LFU_INIT_VAL, PatternIndex,
+                                  glob_regex, literal_prefix, LazyFree)
+from pulsar.apps.ds.aof import (read_commands, rebuild_commands,
+                                AppendOnlyFile, AOF_REWRITE_ITEMS_PER_CMD)
+from pulsar.apps.ds.pyparser import Parser
+from pulsar.apps.ds.rdb import write_snapshot, read_snapshot
+from pulsar.apps.ds.replication import ReplicationBacklog, MasterLink
+from pulsar.apps.ds.encoding import (Encodings, PackedHash, PackedList,
+                                     IntSet, PackedZset, KeySampler,
+                                     IndexedHash, IndexedSet, IndexedZset)
+from pulsar.apps.ds.latency import CommandStats, SlowLog
+from pulsar.apps.ds.bitmap import (BITOPS, CHUNK_SIZE, bit_count, bit_pos,
+                                   bit_op, get_bits, set_bits, overflow_bits)
+from pulsar.apps.ds.server import validate_output_buffer_limits
+from pulsar.apps.ds.tracking import TrackingTable, prefix_pattern
+from pulsar.apps.data.stores.redis.cache import NearCache
+from pulsar.apps.data.stores.redis.sharding import HashSlots, parse_node
+from pulsar.apps.ds.cluster import (key_slot, command_keys, shard_slots,
+                                    Cluster)
 
 
 class TestUtils(unittest.TestCase):
@@ -33,3 +62,657 @@ class TestUtils(unittest.TestCase):
         self.match(c, 'hello')
         self.match(c, 'hallo')
         self.not_match(c, 'hollo')
+
+    def test_timer_wheel(self):
+        wheel = TimerWheel()
+        wheel.add('a', 10.5)
+        wheel.add('b', 10.7)
+        wheel.add('c', 12.2)
+        self.assertEqual(len(wheel), 3)
+        self.assertEqual(wheel.get('a'), 10.5)
+        # bucket 10 is not complete at 10.9
+        self.assertEqual(wheel.pop_expired(10.9, 20), [])
+        self.assertEqual(sorted(wheel.pop_expired(11, 20)), ['a', 'b'])
+        self.assertEqual(len(wheel), 1)
+        wheel.add('c', 20)
+        self.assertEqual(wheel.pop_expired(13, 20), [])
+        self.assertEqual(wheel.discard('c'), 20)
+        self.assertEqual(wheel.discard('c'), None)
+        self.assertFalse(wheel)
+
+    def test_timer_wheel_count(self):
+        wheel = TimerWheel()
+        for i in range(50):
+            wheel.add(i, i)
+        self.assertEqual(len(wheel.pop_expired(100, 20)), 20)
+        self.assertEqual(len(wheel.pop_expired(100, 20)), 20)
+        self.assertEqual(len(wheel.pop_expired(100, 20)), 10)
+        self.assertEqual(wheel.pop_expired(100, 20), [])
+        self.assertFalse(wheel)
+
+    def test_key_sampler(self):
+        sampler = KeySampler()
+        for key in range(10):
+            sampler.add(key)
+        sampler.add(3)
+        self.assertEqual(len(sampler), 10)
+        sampler.discard(3)
+        sampler.discard(9)
+        sampler.discard(20)
+        self.assertEqual(len(sampler), 8)
+        self.assertFalse(3 in sampler)
+        self.assertEqual(sorted(sampler.sample(10)), [0, 1, 2, 4, 5, 6, 7, 8])
+        sample = sampler.sample(3)
+        self.assertEqual(len(sample), 3)
+        self.assertTrue(set(sample) <= set((0, 1, 2, 4, 5, 6, 7, 8)))
+        sampler.clear()
+        self.assertEqual(sampler.sample(3), [])
+
+    def test_key_sampler_scan(self):
+        sampler = KeySampler()
+        for key in range(10):
+            sampler.add(key)
+        self.assertEqual(sampler.scan(0, 20), (0, list(range(10))))
+        cursor, keys = sampler.scan(0, 4)
+        self.assertEqual((cursor, keys), (6, [6, 7, 8, 9]))
+        self.assertEqual(sampler.scan(cursor, 4), (2, [2, 3, 4, 5]))
+        # a removed key is replaced by the last key, already visited
+        sampler.discard(3)
+        cursor, keys = sampler.scan(cursor, 4)
+        self.assertEqual((cursor, keys), (2, [2, 9, 4, 5]))
+        self.assertEqual(sampler.scan(cursor, 4), (0, [0, 1]))
+        self.assertEqual(sampler.scan(1000, 4), (5, [5, 6, 7, 8]))
+
+    def test_indexed_scan(self):
+        h = IndexedHash(((b'a', 1), (b'b', 2), (b'c', 3)))
+        s = IndexedSet((b'a', b'b', b'c'))
+        z = IndexedZset(((1, b'a'), (2, b'b'), (3, b'c')))
+        for value in (h, s, z):
+            self.assertEqual(value.scan(0, 2), (1, [b'b', b'c']))
+        # the last element is moved into the slot of a removed one
+        h.pop(b'a')
+        s.discard(b'a')
+        z.remove(b'a')
+        for value in (h, s, z):
+            self.assertEqual(value.scan(1, 2), (0, [b'c']))
+        del h[b'b']
+        h.update({b'd': 4})
+        s.difference_update((b'b', b'x'))
+        s.add(b'd')
+        z.remove_range(0, 1)
+        z.add(4, b'd')
+        for value in (h, s, z):
+            self.assertEqual(value.scan(0, 10), (0, [b'c', b'd']))
+        self.assertEqual(sorted(s.sample(5)), [b'c', b'd'])
+        self.assertTrue(s.pop() in (b'c', b'd'))
+        self.assertEqual(len(s._slots), 1)
+
+    def test_indexed_pickle(self):
+        for value in (IndexedHash(((b'a', 1), (b'b', 2))),
+                      IndexedSet((b'a', b'b')),
+                      IndexedZset(((1, b'a'), (2, b'b')))):
+            clone = pickle.loads(pickle.dumps(value, 2))
+            self.assertEqual(type(clone), type(value))
+            self.assertEqual(clone, value)
+            self.assertEqual(sorted(clone.scan(0, 10)[1]), [b'a', b'b'])
+
+    def test_value_size(self):
+        small = value_size(b'key', bytearray(b'x'))
+        large = value_size(b'key', bytearray(b'x'*1000))
+        self.assertTrue(large >= small + 999)
+        self.assertTrue(value_size(b'l', Deque([b'x']*100)) >
+                        value_size(b'l', Deque([b'x']*10)))
+        self.assertTrue(value_size(b'h', Dict(((b'a', b'b'),))) <
+                        value_size(b'h', Dict(((b'a', b'b'), (b'c', b'd')))))
+        self.assertTrue(value_size(b'z', Zset([(1, b'a'), (2, b'b')])) > 0)
+
+    def test_compact_value_size(self):
+        items = [(n, ('m%s' % n).encode('utf-8')) for n in range(10)]
+        self.assertTrue(value_size(b'z', PackedZset(items)) <
+                        value_size(b'z', Zset(items)))
+        members = [str(n).encode('utf-8') for n in range(10)]
+        self.assertTrue(value_size(b's', IntSet(members)) <
+                        value_size(b's', set(members)))
+
+    def test_packed_hash(self):
+        h = PackedHash(((b'a', b'1'), (b'b', b'2')))
+        h[b'a'] = b'3'
+        h[b'c'] = b'4'
+        self.assertEqual(len(h), 3)
+        self.assertEqual(h.flat(), [b'a', b'3', b'b', b'2', b'c', b'4'])
+        self.assertEqual(h.pop(b'b'), b'2')
+        self.assertEqual(h.pop(b'x'), None)
+        self.assertEqual(h.mget((b'a', b'x')), [b'3', None])
+        self.assertRaises(KeyError, lambda: h[b'x'])
+        self.assertEqual(h.upgrade(), Dict(((b'a', b'3'), (b'c', b'4'))))
+
+    def test_packed_list(self):
+        l = PackedList((b'a', b'b'))
+        l.extendleft((b'x', b'y'))
+        l.append(b'a')
+        self.assertEqual(list(l), [b'y', b'x', b'a', b'b', b'a'])
+        l.insert_after(b'b', b'c')
+        l.insert_before(b'y', b'z')
+        self.assertEqual(l.remove(b'a', -1), 1)
+        self.assertEqual(list(l), [b'z', b'y', b'x', b'a', b'b', b'c'])
+        self.assertEqual(l.popleft(), b'z')
+        self.assertEqual(l.pop(), b'c')
+        self.assertEqual(l.upgrade(), Deque((b'y', b'x', b'a', b'b')))
+
+    def test_intset(self):
+        s = IntSet((b'3', b'-1', b'20'))
+        self.assertEqual(list(s), [b'-1', b'3', b'20'])
+        self.assertTrue(b'3' in s)
+        self.assertFalse(b'03' in s)
+        self.assertFalse(IntSet.accepts((b'1', b'+1')))
+        self.assertFalse(IntSet.accepts((b'a',)))
+        self.assertFalse(IntSet.accepts((b'99999999999999999999',)))
+        self.assertRaises(ValueError, s.add, b'a')
+        s.difference_update((b'3', b'4'))
+        self.assertRaises(KeyError, s.remove, b'3')
+        self.assertTrue(s.pop() in (b'-1', b'20'))
+        self.assertEqual(len(s), 1)
+        self.assertEqual(s.upgrade(), set(s))
+
+    def test_packed_zset(self):
+        items = [(3, b'c'), (1, b'a'), (2, b'b'), (2, b'x'), (5, b'e')]
+        z = PackedZset(items)
+        full = Zset(items)
+        self.assertEqual(list(z.items()), list(full.items()))
+        self.assertEqual(z.range(1, 3), list(full.range(1, 3)))
+        self.assertEqual(z.range_by_score(2, 5, include_max=False,
+                                          scores=True),
+                         list(full.range_by_score(2, 5, include_max=False,
+                                                  scores=True)))
+        self.assertEqual(z.range_by_score(1, 5, start=1, num=2),
+                         [b'b', b'x'])
+        self.assertEqual(z.count(2, 3), 3)
+        self.assertEqual(z.add(4, b'a'), 0)
+        self.assertEqual(z.add(6, b'f'), 1)
+        self.assertEqual(z.score(b'a'), 4)
+        self.assertEqual(z.rank(b'x'), 1)
+        self.assertEqual(z.remove_range_by_score(2, 3), 3)
+        self.assertEqual(z.remove_range(0, 1), 1)
+        self.assertEqual(list(z.items()), [(5, b'e'), (6, b'f')])
+        self.assertEqual(z.upgrade(), Zset(z.items()))
+        union = Zset.union((z, full), (1, 2), sum)
+        self.assertEqual(union.score(b'e'), 15)
+
+    def test_packed_zset_lex(self):
+        items = [(0, b'd'), (0, b'b'), (0, b'a'), (0, b'e'), (0, b'c')]
+        z = PackedZset(items)
+        full = Zset(items)
+        self.assertEqual(list(z), list(full))
+        self.assertEqual(z.range_by_lex(b'b', b'd', True, False),
+                         list(full.range_by_lex(b'b', b'd', True, False)))
+        self.assertEqual(z.range_by_lex(b'b', start=1, num=2), [b'c', b'd'])
+        self.assertEqual(z.count_by_lex(maxval=b'c'), 3)
+        self.assertEqual(z.remove_range_by_lex(b'a', b'c', False), 2)
+        self.assertEqual(list(z), [b'a', b'd', b'e'])
+
+    def test_bitmap(self):
+        # values spanning several chunks
+        value = bytearray(b'\x00')*CHUNK_SIZE + bytearray(b'\x0f\xff')
+        self.assertEqual(bit_count(value), 12)
+        self.assertEqual(bit_count(value, CHUNK_SIZE + 1), 8)
+        self.assertEqual(bit_count(value, 0, CHUNK_SIZE), 0)
+        self.assertEqual(bit_pos(value, 1), 8*CHUNK_SIZE + 4)
+        self.assertEqual(bit_pos(value, 0, CHUNK_SIZE + 1), -1)
+        self.assertEqual(bit_pos(value, 1, 0, CHUNK_SIZE), -1)
+        other = bytearray(b'\xf0')*(CHUNK_SIZE + 1)
+        result = bit_op(BITOPS[b'or'], (value, other))
+        self.assertEqual(len(result), CHUNK_SIZE + 2)
+        self.assertEqual(result[-3:], b'\xf0\xff\xff')
+        result = bit_op(BITOPS[b'and'], (value, other))
+        self.assertEqual(result[-3:], b'\x00\x00\x00')
+        self.assertEqual(bit_op(BITOPS[b'not'], (bytearray(b'\x0f'),)),
+                         b'\xf0')
+
+    def test_bitfield(self):
+        value = bytearray()
+        set_bits(value, 4, 12, 0xabc)
+        self.assertEqual(value, b'\x0a\xbc')
+        self.assertEqual(get_bits(value, 4, 12), 0xabc)
+        self.assertEqual(get_bits(value, 8, 8, True), -68)
+        self.assertEqual(get_bits(value, 12, 16), 0xc000)
+        set_bits(value, 0, 4, -1)
+        self.assertEqual(value, b'\xfa\xbc')
+        self.assertEqual(overflow_bits(256, 8, False, b'wrap'), 0)
+        self.assertEqual(overflow_bits(256, 8, False, b'sat'), 255)
+        self.assertEqual(overflow_bits(-129, 8, True, b'sat'), -128)
+        self.assertEqual(overflow_bits(-129, 8, True, b'fail'), None)
+
+    def test_encodings(self):
+        e = Encodings(hash_entries=2, hash_value=3, set_entries=0)
+        h = e.hash()
+        self.assertEqual(e.encoding(h), 'ziplist')
+        h.update(((b'a', b'1'), (b'b', b'2')))
+        self.assertFalse(e.overflow(h, (b'a', b'1', b'b', b'2')))
+        h[b'c'] = b'3'
+        self.assertTrue(e.overflow(h, (b'c', b'3')))
+        # only the length of the elements written is checked
+        h = PackedHash(((b'a', b'long'),))
+        self.assertTrue(e.overflow(h, (b'a', b'long')))
+        self.assertFalse(e.overflow(h, (b'b', 1)))
+        self.assertEqual(e.encoding(e.set((b'1',))), 'hashtable')
+        self.assertEqual(e.encoding(Encodings().set((b'1',))), 'intset')
+        self.assertEqual(e.encoding(Encodings().set((b'a',))), 'hashtable')
+        compact = e.compact(Dict(((b'a', b'1'),)))
+        self.assertEqual(e.encoding(compact), 'ziplist')
+        self.assertEqual(compact, Dict(((b'a', b'1'),)))
+        full = IndexedHash(((b'a', b'long'),))
+        self.assertTrue(e.compact(full) is full)
+        self.assertEqual(type(e.compact(Dict(full))), IndexedHash)
+        self.assertEqual(e.encoding(e.compact(Dict(full))), 'hashtable')
+        self.assertEqual(e.encoding(e.compact(Zset([(1, b'a')]))), 'ziplist')
+        self.assertEqual(e.encoding(bytearray()), 'raw')
+
+    def test_lfu_counter(self):
+        usage = lfu_incr(None, 100)
+        self.assertEqual(usage & 255, LFU_INIT_VAL)
+        for _ in range(1000):
+            usage = lfu_incr(usage, 100)
+        counter = lfu_decr(usage, 100)
+        self.assertTrue(LFU_INIT_VAL < counter < 255)
+        self.assertEqual(lfu_decr(usage, 103), counter - 3)
+        self.assertEqual(lfu_decr(usage, 1000), 0)
+
+    def test_aof_read_commands(self):
+        pack = Parser(None, None).pack_command
+        data = pack(('select', '0')) + pack(('set', 'a', 'foo\r\nbar'))
+        file = BytesIO(data + pack(('del', 'a')))
+        self.assertEqual(list(read_commands(file)),
+                         [[b'select', b'0'], [b'set', b'a', b'foo\r\nbar'],
+                          [b'del', b'a']])
+        # incomplete command at the end of the file
+        file = BytesIO(data + pack(('del', 'a'))[:-3])
+        self.assertEqual(len(list(read_commands(file))), 2)
+
+    def test_aof_flush(self):
+        class Loop:
+            callbacks = []
+
+            def call_soon(self, callback, *args):
+                self.callbacks.append(callback)
+
+        class Store:
+            logger = logging.getLogger('pulsar.test')
+            _loop = Loop()
+            _parser = Parser(None, None)
+
+        dirname = tempfile.mkdtemp()
+        try:
+            aof = AppendOnlyFile(Store(), os.path.join(dirname, 'test.aof'),
+                                 'no')
+            self.assertEqual(aof._temp(),
+                             os.path.join(dirname, 'temp-rewrite-test.aof'))
+            aof.open()
+            # the first write also selects the database
+            aof.feed(0, ('set', 'a', '1'))
+            aof.feed(0, ('set', 'b', '2'))
+            self.assertEqual(len(Store._loop.callbacks), 1)
+            Store._loop.callbacks.pop()()
+            self.assertEqual(len(aof._buffer), 0)
+            size = aof.size()
+            self.assertTrue(size)
+            aof.feed(1, ('del', 'a'))
+            self.assertEqual(len(Store._loop.callbacks), 1)
+            aof._cron()
+            self.assertTrue(aof.size() > size)
+            aof.feed(1, ('del', 'b'))
+            aof.close()
+            with open(aof.filename, 'rb') as file:
+                self.assertEqual(len(list(read_commands(file))), 6)
+        finally:
+            shutil.rmtree(dirname)
+
+    def test_aof_rebuild_commands(self):
+        n = AOF_REWRITE_ITEMS_PER_CMD
+        self.assertEqual(list(rebuild_commands('a', bytearray(b'foo'))),
+                         [('set', 'a', b'foo')])
+        commands = list(rebuild_commands('l', deque(range(n + 1))))
+        self.assertEqual(len(commands), 2)
+        self.assertEqual(commands[0][:3], ['rpush', 'l', 0])
+        self.assertEqual(commands[1], ['rpush', 'l', n])
+        zset = Zset()
+        zset.add(1.5, 'm')
+        self.assertEqual(list(rebuild_commands('z', zset)),
+                         [['zadd', 'z', '1.5', 'm']])
+        self.assertEqual(list(rebuild_commands('h', {'f': 'v'})),
+                         [['hmset', 'h', 'f', 'v']])
+        self.assertRaises(TypeError, list, rebuild_commands('x', 3))
+
+    def _snapshot(self, dbs, **kw):
+        file = BytesIO()
+        write_snapshot(file, (2, dbs), **kw)
+        file.seek(0)
+        return file
+
+    def test_snapshot(self):
+        zset = Zset()
+        zset.add(1.5, b'm')
+        zset.add(-2, b'n')
+        data = {b'a': bytearray(b'foo'),
+                b'l': Deque((b'x', b'y')),
+                b's': set((b'x', b'y')),
+                b'h': Dict(((b'f', b'v'),)),
+                b'z': zset}
+        dbs = [(0, data, {b'a': 1000.5}), (3, {b'b': bytearray()}, {})]
+        for compress in (0, 1):
+            file = self._snapshot(dbs, compress=compress, chunk_size=10)
+            items = list(read_snapshot(file))
+            self.assertEqual(len(items), 6)
+            self.assertEqual(dict(((k, v) for n, k, v, _ in items[:5])),
+                             data)
+            self.assertEqual(items[-1], (3, b'b', bytearray(), None))
+            expiry = dict(((k, w) for n, k, _, w in items))
+            self.assertEqual(expiry[b'a'], 1000.5)
+            self.assertEqual(expiry[b'l'], None)
+
+    def test_snapshot_compact(self):
+        data = {b'l': PackedList((b'x', b'y')),
+                b's': IntSet((b'1', b'2')),
+                b'h': PackedHash(((b'f', b'v'),)),
+                b'z': PackedZset([(1.5, b'm')])}
+        file = self._snapshot([(0, data, {})])
+        items = dict(((k, v) for n, k, v, _ in read_snapshot(file)))
+        self.assertEqual(items, {b'l': Deque((b'x', b'y')),
+                                 b's': set((b'1', b'2')),
+                                 b'h': Dict(((b'f', b'v'),)),
+                                 b'z': Zset([(1.5, b'm')])})
+
+    def test_snapshot_corrupted(self):
+        data = self._snapshot([(0, {b'a': bytearray(b'foo')}, {})]).read()
+        self.assertRaises(ValueError, list, read_snapshot(BytesIO(data[:-4])))
+        data = data[:-2] + b'x' + data[-1:]
+        self.assertRaises(ValueError, list, read_snapshot(BytesIO(data)))
+        self.assertRaises(ValueError, list, read_snapshot(BytesIO(b'foo')))
+
+    def test_replication_backlog(self):
+        backlog = ReplicationBacklog(10, 100)
+        self.assertEqual(backlog.read(100), b'')
+        self.assertEqual(backlog.read(99), None)
+        backlog.append(b'abcdef')
+        backlog.append(b'ghijkl')
+        self.assertEqual(backlog.offset, 112)
+        self.assertEqual(backlog.read(104), b'efghijkl')
+        backlog.append(b'mnopqr')
+        self.assertEqual(backlog.start, 106)
+        self.assertEqual(backlog.histlen, 12)
+        self.assertEqual(backlog.read(104), None)
+        self.assertEqual(backlog.read(110), b'klmnopqr')
+        self.assertEqual(backlog.read(119), None)
+
+    def test_master_link_buffer(self):
+        class Server:
+            _parser_class = partial(Parser, None, None)
+
+        class Store:
+            logger = logging.getLogger('pulsar.test')
+            MASTER = 1
+            _loop = None
+            _password = b''
+            _server = Server()
+            _parser = Parser(None, None)
+            snapshots = []
+
+            def _load_snapshot(self, file):
+                self.snapshots.append(file.read())
+
+        store = Store()
+        link = MasterLink(store, 'localhost', 6379)
+        link.state = 'handshake'
+        link.data_received(b'+FULLRESYNC abc 9')
+        self.assertEqual(link.state, 'handshake')
+        link.data_received(b'9\r\n$10\r\n01234')
+        self.assertEqual((link.state, link.replid, link.offset),
+                         ('sync', 'abc', 99))
+        self.assertEqual(bytes(link._buffer[link._pos:]), b'01234')
+        link.data_received(b'56789')
+        self.assertEqual(store.snapshots, [b'0123456789'])
+        self.assertEqual(link.state, 'connected')
+        self.assertEqual(link._pos, 0)
+        self.assertEqual(len(link._buffer), 0)
+
+    def test_key_slot(self):
+        self.assertEqual(key_slot(b'123456789'), 0x31C3)
+        self.assertEqual(key_slot(b'{user1000}.following'),
+                         key_slot(b'{user1000}.followers'))
+        self.assertEqual(key_slot(b'foo{}{bar}'), key_slot(b'foo{}{bar}'))
+        self.assertNotEqual(key_slot(b'foo{}{bar}'), key_slot(b'bar'))
+        self.assertEqual(key_slot(b'foo{{bar}}zap'), key_slot(b'{bar'))
+
+    def test_command_keys(self):
+        self.assertEqual(command_keys(['get', b'a']), [b'a'])
+        self.assertEqual(command_keys(['mset', b'a', b'1', b'b', b'2']),
+                         [b'a', b'b'])
+        self.assertEqual(command_keys(['blpop', b'a', b'b', b'0']),
+                         [b'a', b'b'])
+        self.assertEqual(command_keys(['zunionstore', b'c', b'2', b'a',
+                                       b'b', b'weights', b'1', b'2']),
+                         [b'a', b'b', b'c'])
+        self.assertEqual(command_keys(['eval', b'return 1', b'0']), [])
+        self.assertEqual(command_keys(['ping']), ())
+
+    def test_cluster_route(self):
+        self.assertEqual(shard_slots(3), [(0, 5460), (5461, 10921),
+                                          (10922, 16383)])
+        addresses = [('127.0.0.1', 7001), ('127.0.0.1', 7002)]
+        cluster = Cluster(0, addresses)
+        self.assertEqual(cluster.route(['get', b'b']), None)
+        self.assertEqual(cluster.route(['ping']), None)
+        slot = key_slot(b'a')
+        self.assertEqual(cluster.owner(slot), 1)
+        self.assertEqual(cluster.route(['get', b'a']),
+                         ('MOVED', '%d 127.0.0.1:7002' % slot))
+        error = cluster.route(['mget', b'b', b'a'])
+        self.assertEqual(error[0], 'CROSSSLOT')
+        self.assertEqual(cluster.route(['mget', b'{b}1', b'{b}2']), None)
+
+    def test_command_stats(self):
+        stats = CommandStats()
+        self.assertEqual(stats.percentile(50), 0)
+        for usec in range(1, 101):
+            stats.add(usec)
+        self.assertEqual(stats.calls, 100)
+        self.assertEqual(stats.usec, 5050)
+        self.assertEqual(stats.info()['usec_per_call'], '50.50')
+        p50 = stats.percentile(50)
+        self.assertTrue(32 <= p50 <= 64)
+        self.assertTrue(p50 <= stats.percentile(99) <= 128)
+        self.assertEqual(set(stats.latency_info()),
+                         set(('p50', 'p99', 'p99.9')))
+        stats.add(0)
+        stats.add(1 << 40)
+        self.assertEqual(stats.buckets[0], 1)
+        self.assertEqual(stats.buckets[-1], 1)
+
+    def test_slowlog(self):
+        slowlog = SlowLog(2)
+        slowlog.add(['get', b'a'], 20)
+        slowlog.add(['set', b'a', b'x'*200], 30)
+        slowlog.add(['mget'] + [b'k']*40, 40)
+        self.assertEqual(len(slowlog), 2)
+        entries = slowlog.get()
+        self.assertEqual([e[0] for e in entries], [2, 1])
+        self.assertEqual(entries[1][2], 30)
+        self.assertEqual(entries[1][3][2],
+                         b'x'*128 + b'... (72 more bytes)')
+        args = entries[0][3]
+        self.assertEqual(len(args), 32)
+        self.assertEqual(args[-1], b'... (10 more arguments)')
+        self.assertEqual(len(slowlog.get(1)), 1)
+        slowlog.resize(1)
+        self.assertEqual(slowlog.get(-1)[0][0], 2)
+        slowlog.reset()
+        self.assertEqual(len(slowlog), 0)
+
+    def test_glob_regex(self):
+        def match(pattern, channel):
+            return glob_regex(pattern).match(channel) is not None
+        self.assertTrue(match(b'h?llo', b'hello'))
+        self.assertFalse(match(b'h?llo', b'hllo'))
+        self.assertTrue(match(b'h*llo', b'heeeello'))
+        self.assertTrue(match(b'h[ae]llo', b'hallo'))
+        self.assertFalse(match(b'h[ae]llo', b'hillo'))
+        self.assertTrue(match(b'h[^e]llo', b'hallo'))
+        self.assertFalse(match(b'h[^e]llo', b'hello'))
+        self.assertTrue(match(b'h[a-c]llo', b'hbllo'))
+        self.assertFalse(match(b'h[a-c]llo', b'h-llo'))
+        self.assertTrue(match(b'news.*', b'news.sport'))
+        self.assertFalse(match(b'news.*', b'newsXsport'))
+        self.assertTrue(match(b'h\\*llo', b'h*llo'))
+        self.assertFalse(match(b'h\\*llo', b'hello'))
+        self.assertTrue(match(b'a[b', b'a[b'))
+        self.assertFalse(match(b'foo', b'foo\n'))
+        self.assertEqual(literal_prefix(b'news.*'), b'news.')
+        self.assertEqual(literal_prefix(b'a\\*'), b'a')
+        self.assertEqual(literal_prefix(b'foo'), b'foo')
+
+    def test_pattern_index(self):
+        index = PatternIndex()
+        for pattern in (b'*', b'news.*', b'news.s*t', b'news.sport',
+                        b'new?.*', b'weather'):
+            index.add(pattern, 'a')
+        index.add(b'news.*', 'b')
+        self.assertEqual(len(index), 6)
+
+        def match(channel):
+            return set((sub.pattern for sub in index.match(channel)))
+        self.assertEqual(match(b'news.sport'),
+                         set((b'*', b'news.*', b'news.s*t', b'news.sport',
+                              b'new?.*')))
+        self.assertEqual(match(b'news'), set((b'*',)))
+        self.assertEqual(match(b'newt.x'), set((b'*', b'new?.*')))
+        self.assertEqual(match(b''), set((b'*',)))
+        self.assertEqual(index.get(b'news.*').clients, set(('a', 'b')))
+        index.discard(b'news.*', 'a')
+        self.assertTrue(b'news.*' in index)
+        index.discard(b'news.*', 'b')
+        self.assertFalse(b'news.*' in index)
+        index.discard(b'news.sport', 'a')
+        index.discard(b'news.s*t', 'a')
+        self.assertEqual(match(b'news.sport'), set((b'*', b'new?.*')))
+        # the branch of news. is pruned, new?.* is still in the trie
+        self.assertEqual(list(index._root.children[b'n'].children[b'e']
+                              .children[b'w'].children), [])
+        for pattern in list(index):
+            index.discard(pattern, 'a')
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index._root.children, {})
+
+    def test_output_buffer_limits(self):
+        self.assertEqual(validate_output_buffer_limits(
+            'normal 0 0 0 pubsub 1024 512 60'),
+            [('normal', 0, 0, 0), ('pubsub', 1024, 512, 60)])
+        self.assertEqual(validate_output_buffer_limits(
+            [('slave', '10', 5, 1)]), [('slave', 10, 5, 1)])
+        self.assertEqual(validate_output_buffer_limits(None), [])
+        self.assertRaises(ValueError, validate_output_buffer_limits,
+                          'foo 0 0 0')
+        self.assertRaises(TypeError, validate_output_buffer_limits,
+                          'pubsub 0 0')
+
+    def test_tracking_table(self):
+        self.assertEqual(prefix_pattern(b'user:'), b'user:*')
+        self.assertEqual(prefix_pattern(b'a*b?'), b'a\\*b\\?*')
+        table = TrackingTable()
+        table.add(1, [b'a', b'b'])
+        table.add(2, [b'a'])
+        self.assertEqual(len(table), 2)
+        table.add_prefixes(3, [b'a*', b'c'])
+        table.add_prefixes(4, [])
+        self.assertEqual(table.pop(b'a'), set((1, 2, 4)))
+        self.assertEqual(table.pop(b'a'), set((4,)))
+        self.assertEqual(table.pop(b'a*b'), set((3, 4)))
+        self.assertEqual(table.pop(b'cd'), set((3, 4)))
+        table.discard_prefixes(3, [b'a*', b'c'])
+        table.discard_prefixes(4, [])
+        self.assertEqual(len(table.prefixes), 0)
+        self.assertEqual(table.pop(b'cd'), ())
+        self.assertEqual(table.popitem(), (b'b', set((1,))))
+        self.assertEqual(len(table), 0)
+
+    def test_lazy_free(self):
+        lazy = LazyFree(3)
+        self.assertFalse(lazy.free(set((1, 2, 3))))
+        self.assertFalse(lazy.free(bytearray(100)))
+        values = [set(range(10)), list(range(10)), Deque(range(10)),
+                  Zset(((n, str(n)) for n in range(10)))]
+        for value in values:
+            self.assertTrue(lazy.free(value))
+        self.assertEqual(lazy.release(15), 3)
+        self.assertEqual([len(v) for v in values], [0, 5, 10, 10])
+        self.assertEqual(lazy.release(100), 0)
+        self.assertEqual([len(v) for v in values], [0, 0, 0, 0])
+        self.assertEqual(lazy.freed, 4)
+        # values of a dictionary are released lazily too
+        big = set(range(10))
+        data = {'a': big, 'b': bytearray(3)}
+        lazy.add(data)
+        self.assertEqual(lazy.release(2), 1)
+        self.assertEqual(data, {})
+        self.assertEqual(lazy.release(4), 1)
+        self.assertEqual(len(big), 6)
+        self.assertEqual(lazy.release(6), 0)
+        self.assertEqual(lazy.freed, 6)
+
+    def test_near_cache(self):
+        cache = NearCache(2)
+        entry = cache.entry(('get', 'foo'), {})
+        self.assertEqual(entry, (b'foo', 'get'))
+        self.assertEqual(cache.entry(('set', 'foo', 'bla'), {}), None)
+        self.assertEqual(cache.entry(('HMGET', 'foo', 'a'),
+                                     {'fields': ('a',)}),
+                         (b'foo', 'hmget', 'a', (('fields', ('a',)),)))
+        self.assertEqual(cache.entry(('hgetall', 'foo'), {'factory': {}}),
+                         None)
+        self.assertRaises(KeyError, cache.get, entry)
+        token = cache.pending(entry)
+        cache.set(entry, b'bla', token)
+        self.assertEqual(cache.get(entry), b'bla')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # a key invalidated while the command is in flight is not cached
+        token = cache.pending((b'bar', 'smembers'))
+        cache.broadcast([b'__redis__:invalidate', [b'bar']])
+        cache.set((b'bar', 'smembers'), set((b'a',)), token)
+        self.assertFalse((b'bar', 'smembers') in cache)
+        token = cache.pending((b'bar', 'smembers'))
+        cache.set((b'bar', 'smembers'), set((b'a',)), token)
+        value = cache.get((b'bar', 'smembers'))
+        value.add(b'b')
+        self.assertEqual(cache.get((b'bar', 'smembers')), set((b'a',)))
+        # the least recently used entry is evicted
+        token = cache.pending((b'x', 'get'))
+        cache.set((b'x', 'get'), None, token)
+        self.assertEqual(len(cache), 2)
+        self.assertFalse(entry in cache)
+        self.assertEqual(sorted(cache._keys), [b'bar', b'x'])
+        cache.broadcast([b'__redis__:invalidate', [b'x']])
+        self.assertEqual(len(cache), 1)
+        cache.broadcast([b'__redis__:invalidate', None])
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache._keys, {})
+
+    def test_hash_slots(self):
+        slots = HashSlots(3)
+        self.assertEqual(parse_node(' 127.0.0.1:6380'), ('127.0.0.1', 6380))
+        self.assertEqual(slots.node('foo'), 2)
+        self.assertEqual(slots.node('bar'), 0)
+        self.assertEqual(slots.node('c'), 1)
+        self.assertEqual(slots.node('{bar}foo'), 0)
+        self.assertEqual(slots.nodes(('GET', 'foo')), ('get', [2]))
+        self.assertEqual(slots.nodes(('ping',)), ('ping', []))
+        self.assertEqual(slots.nodes(('eval', 'return 1', 2, 'foo', 'bar',
+                                      'c')), ('eval', [2, 0]))
+        args = ('mset', 'foo', 1, 'bar', 2, 'c', 3, 'x', 4)
+        name, nodes = slots.nodes(args)
+        self.assertEqual(nodes, [2, 0, 1, 2])
+        self.assertEqual(slots.split(args, nodes),
+                         [(2, [0, 3], ('mset', 'foo', 1, 'x', 4)),
+                          (0, [1], ('mset', 'bar', 2)),
+                          (1, [2], ('mset', 'c', 3))])
+        args = ('del', 'foo', 'bar', 'x')
+        self.assertEqual(slots.split(args, slots.nodes(args)[1]),
+                         [(2, [0, 2], ('del', 'foo', 'x')),
+                          (0, [1], ('del', 'bar'))])
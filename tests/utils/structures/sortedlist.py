@@ -0,0 +1,67 @@
+from random import randint, shuffle
+import unittest
+
+from pulsar.utils.pep import range
+from pulsar.utils.structures import Sortedlist
+
+
+class TestSortedlist(unittest.TestCase):
+
+    def random(self, size=1000):
+        return [randint(0, size//2) for _ in range(size)]
+
+    def test_insert(self):
+        data = self.random()
+        sl = Sortedlist(load=8)
+        for key in data:
+            sl.insert(key)
+        self.assertEqual(len(sl), len(data))
+        self.assertEqual(list(sl), sorted(data))
+
+    def test_update(self):
+        data = self.random()
+        sl = Sortedlist(data[:100], load=8)
+        sl.update(data[100:])
+        self.assertEqual(list(sl), sorted(data))
+        sl.update(data[:5])
+        self.assertEqual(list(sl), sorted(data + data[:5]))
+
+    def test_getitem_index(self):
+        data = sorted(set(self.random()))
+        sl = Sortedlist(data, load=8)
+        for index, key in enumerate(data):
+            self.assertEqual(sl[index], key)
+            self.assertEqual(sl.index(key), index)
+        self.assertEqual(sl[-1], data[-1])
+        self.assertEqual(sl.index(-1), None)
+        self.assertRaises(IndexError, lambda: sl[len(data)])
+
+    def test_bisect(self):
+        sl = Sortedlist([1, 3, 3, 3, 5], load=2)
+        self.assertEqual(sl.bisect_left(3), 1)
+        self.assertEqual(sl.bisect_right(3), 4)
+        self.assertEqual(sl.bisect_left(0), 0)
+        self.assertEqual(sl.bisect_right(6), 5)
+
+    def test_remove(self):
+        data = self.random()
+        sl = Sortedlist(data, load=8)
+        shuffle(data)
+        for key in data[:700]:
+            self.assertTrue(sl.remove(key))
+        self.assertFalse(sl.remove(-1))
+        self.assertEqual(list(sl), sorted(data[700:]))
+        for key in data[700:]:
+            self.assertTrue(key in sl)
+            sl.remove(key)
+        self.assertFalse(sl)
+
+    def test_islice_remove_range(self):
+        data = sorted(self.random())
+        sl = Sortedlist(data, load=8)
+        self.assertEqual(list(sl.islice(10, 500)), data[10:500])
+        self.assertEqual(sl.remove_range(10, 500), data[10:500])
+        self.assertEqual(list(sl), data[:10] + data[500:])
+        self.assertEqual(sl[10], data[500])
+        self.assertEqual(sl.remove_range(0, len(sl)), data[:10] + data[500:])
+        self.assertFalse(sl)
@@ -93,3 +93,49 @@ class TestZset(unittest.TestCase):
                        (4, 'b'), (5, 'c')])
         self.assertEqual(s.remove_range(1, 4), 3)
         self.assertEqual(s, self.zset([(1.2, 'bla'), (5, 'c')]))
+
+    def test_same_score_order(self):
+        s = self.zset([(3, 'foo'), (3, 'bla'), (1, 'pippo'), (3, 'abc')])
+        self.assertEqual(list(s), ['pippo', 'abc', 'bla', 'foo'])
+        self.assertEqual(s.rank('abc'), 1)
+        self.assertEqual(s.rank('foo'), 3)
+        self.assertEqual(s.count(3, 3), 3)
+        self.assertEqual(list(s.range_by_score(3, 3, start=1, num=1)),
+                         ['bla'])
+
+    def test_range_by_lex(self):
+        s = self.zset([(0, m) for m in 'gfedcba'])
+        self.assertEqual(list(s.range_by_lex()), list('abcdefg'))
+        self.assertEqual(list(s.range_by_lex('b', 'd')), ['b', 'c', 'd'])
+        self.assertEqual(list(s.range_by_lex('b', 'd', False, False)),
+                         ['c'])
+        self.assertEqual(list(s.range_by_lex(maxval='c')), ['a', 'b', 'c'])
+        self.assertEqual(list(s.range_by_lex('e', start=1, num=1)), ['f'])
+        self.assertEqual(list(s.range_by_lex('d', 'b')), [])
+        self.assertEqual(s.count_by_lex('aa', 'e'), 4)
+        self.assertEqual(s.count_by_lex('d', 'b'), 0)
+
+    def test_remove_range_by_lex(self):
+        s = self.zset([(0, m) for m in 'abcdefg'])
+        self.assertEqual(s.remove_range_by_lex('b', 'e', True, False), 3)
+        self.assertEqual(list(s), ['a', 'e', 'f', 'g'])
+        self.assertFalse('c' in s)
+        self.assertEqual(s.remove_range_by_lex(), 4)
+        self.assertFalse(s)
+
+    def test_large(self):
+        s = self.zset()
+        for i in range(3000):
+            s.add(i % 7, 'm%04d' % i)
+        self.assertEqual(len(s), 3000)
+        items = list(s.items())
+        self.assertEqual(items, sorted(items))
+        for member in ('m0000', 'm1234', 'm2999'):
+            self.assertEqual(items.index((s.score(member), member)),
+                             s.rank(member))
+        self.assertEqual(s.remove_range_by_score(2, 4), 1286)
+        self.assertEqual(len(s), 1714)
+        self.assertEqual(s.remove_range(100, -100), 1514)
+        self.assertEqual(list(s.items()), items[:100] + items[-100:])
+        s.clear()
+        self.assertFalse(s)
@@ -0,0 +1,148 @@
+'''Tests the response cache middleware in pulsar.apps.wsgi'''
+import unittest
+
+from pulsar import Future, get_event_loop, multi_async
+from pulsar.apps import wsgi
+from pulsar.apps.wsgi import route
+
+
+class CacheRouter(wsgi.Router):
+    calls = 0
+
+    def get(self, request):
+        return self.respond(request, 'max-age=60')
+
+    @route('nocache')
+    def nocache(self, request):
+        return self.respond(request, 'no-cache')
+
+    @route('private')
+    def private(self, request):
+        return self.respond(request, 'max-age=60, private')
+
+    @route('plain')
+    def plain(self, request):
+        return self.respond(request)
+
+    @route('vary')
+    def vary(self, request):
+        response = self.respond(request, 'max-age=60')
+        response['Vary'] = 'Accept-Language'
+        return response
+
+    @route('slow')
+    def slow(self, request):
+        loop = get_event_loop()
+        future = Future(loop=loop)
+        loop.call_later(0.1, future.set_result,
+                        self.respond(request, 'max-age=60'))
+        return future
+
+    def respond(self, request, cache_control=None):
+        CacheRouter.calls += 1
+        response = request.response
+        if cache_control:
+            response['Cache-Control'] = cache_control
+        response.content = ('%s' % CacheRouter.calls).encode('utf-8')
+        return response
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def cache(self, **kwargs):
+        return wsgi.ResponseCache(CacheRouter('/'), **kwargs)
+
+    def request(self, cache, path='/', **kwargs):
+        environ = wsgi.test_wsgi_environ(path, **kwargs)
+        return cache(environ, None)
+
+    def test_hit(self):
+        cache = self.cache()
+        response = yield self.request(cache)
+        content = response.content
+        response = yield self.request(cache)
+        self.assertEqual(response.content, content)
+        self.assertEqual(response['age'], '0')
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.stats['misses'], 1)
+        self.assertEqual(cache.stats['stores'], 1)
+        info = cache.info()
+        self.assertEqual(info['hit_rate'], 0.5)
+        self.assertEqual(info['entries'], 1)
+        # different query, different key
+        response = yield self.request(cache, '/?page=2')
+        self.assertNotEqual(response.content, content)
+
+    def test_not_cached(self):
+        cache = self.cache()
+        for path in ('/nocache', '/private'):
+            response1 = yield self.request(cache, path)
+            response2 = yield self.request(cache, path)
+            self.assertNotEqual(response1.content, response2.content)
+        self.assertEqual(cache.stats['stores'], 0)
+        self.assertEqual(cache.stats['misses'], 4)
+
+    def test_bypass(self):
+        cache = self.cache()
+        yield self.request(cache)
+        response1 = yield self.request(
+            cache, headers=[('Authorization', 'Basic YmxhOmZvbw==')])
+        response2 = yield self.request(
+            cache, headers=[('Cache-Control', 'no-store')])
+        self.assertNotEqual(response1.content, response2.content)
+        self.assertEqual(cache.stats['bypasses'], 2)
+        self.assertEqual(cache.stats['hits'], 0)
+
+    def test_refresh(self):
+        cache = self.cache()
+        response1 = yield self.request(cache)
+        response2 = yield self.request(
+            cache, headers=[('Cache-Control', 'no-cache')])
+        self.assertNotEqual(response1.content, response2.content)
+        response3 = yield self.request(cache)
+        self.assertEqual(response3.content, response2.content)
+
+    def test_vary(self):
+        cache = self.cache()
+        en = [('Accept-Language', 'en')]
+        it = [('Accept-Language', 'it')]
+        response_en = yield self.request(cache, '/vary', headers=en)
+        response_it = yield self.request(cache, '/vary', headers=it)
+        self.assertNotEqual(response_en.content, response_it.content)
+        response = yield self.request(cache, '/vary', headers=en)
+        self.assertEqual(response.content, response_en.content)
+        response = yield self.request(cache, '/vary', headers=it)
+        self.assertEqual(response.content, response_it.content)
+        self.assertEqual(cache.stats['hits'], 2)
+
+    def test_dogpile(self):
+        cache = self.cache()
+        calls = CacheRouter.calls
+        responses = yield multi_async([self.request(cache, '/slow')
+                                       for _ in range(3)])
+        self.assertEqual(CacheRouter.calls, calls + 1)
+        self.assertEqual(cache.stats['misses'], 1)
+        self.assertEqual(cache.stats['waits'], 2)
+        self.assertEqual(cache.stats['hits'], 2)
+        self.assertEqual(len(set((r.content for r in responses))), 1)
+
+    def test_timeout(self):
+        cache = self.cache()
+        yield self.request(cache, '/plain')
+        self.assertEqual(cache.stats['stores'], 0)
+        cache = self.cache(timeout=10)
+        yield self.request(cache, '/plain')
+        yield self.request(cache, '/nocache')
+        self.assertEqual(cache.stats['stores'], 1)
+
+    def test_memory_cache(self):
+        backend = wsgi.MemoryCache(max_entries=2, max_size=10)
+        cache = self.cache(backend=backend)
+        yield self.request(cache, '/?a=1')
+        yield self.request(cache, '/?a=2')
+        yield self.request(cache, '/?a=3')
+        self.assertEqual(len(backend), 2)
+        backend.max_size = 0
+        yield self.request(cache, '/?a=4')
+        self.assertEqual(len(backend), 0)
+        self.assertEqual(backend.size, 0)
@@ -0,0 +1,166 @@
+'''Tests the static files utilities in pulsar.apps.wsgi'''
+import os
+import shutil
+import tempfile
+import unittest
+
+from pulsar.apps import wsgi
+from pulsar.apps.wsgi import FileWrapper, FileCache, parse_range, etag_match
+
+
+class TestStaticFiles(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp()
+        cls.data = os.urandom(200000)
+        cls.write('small.js', cls.data[:1000])
+        cls.write('large.bin', cls.data)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir)
+
+    @classmethod
+    def write(cls, name, data):
+        path = os.path.join(cls.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def request(self, name, headers=None, method=None):
+        environ = wsgi.test_wsgi_environ('/media/%s' % name, method=method,
+                                         headers=headers)
+        router = wsgi.MediaRouter('media', self.dir)
+        router.file_cache = FileCache(max_file_size=10000)
+        request = wsgi.WsgiRequest(environ, router, urlargs={'path': name})
+        return router.get(request)
+
+    def test_file_wrapper(self):
+        wrapper = FileWrapper(open(self.path('large.bin'), 'rb'))
+        self.assertEqual(wrapper.offset, 0)
+        self.assertEqual(wrapper.count, len(self.data))
+        self.assertEqual(b''.join(wrapper), self.data)
+        wrapper.close()
+        wrapper = FileWrapper(open(self.path('large.bin'), 'rb'),
+                              block_size=1000, offset=70000, count=5500)
+        chunks = list(wrapper)
+        self.assertEqual(len(chunks), 6)
+        self.assertEqual(b''.join(chunks), self.data[70000:75500])
+        wrapper.close()
+        self.assertTrue(wrapper.file.closed)
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 100))
+        self.assertEqual(parse_range('bytes=500-', 1000), (500, 1000))
+        self.assertEqual(parse_range('bytes=900-2000', 1000), (900, 1000))
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 1000))
+        self.assertEqual(parse_range('bytes=-2000', 1000), (0, 1000))
+        self.assertEqual(parse_range('bytes=1000-', 1000), ())
+        self.assertEqual(parse_range('bytes=-0', 1000), ())
+        self.assertEqual(parse_range('bytes=0-', 0), ())
+        self.assertEqual(parse_range('bytes=100-99', 1000), None)
+        self.assertEqual(parse_range('bytes=-', 1000), None)
+        self.assertEqual(parse_range('bytes=0-1,5-6', 1000), None)
+        self.assertEqual(parse_range('lines=0-1', 1000), None)
+
+    def test_etag_match(self):
+        self.assertTrue(etag_match('"a"', '"a"'))
+        self.assertTrue(etag_match('"b", W/"a"', '"a"'))
+        self.assertTrue(etag_match('*', '"a"'))
+        self.assertFalse(etag_match('"b"', '"a"'))
+
+    def test_file_cache(self):
+        cache = FileCache(max_entries=2, max_file_size=1000, max_size=1500)
+        small = cache.get(self.path('small.js'))
+        self.assertEqual(small.content, self.data[:1000])
+        self.assertTrue(small.content_type.endswith('javascript'))
+        self.assertEqual(cache.size, 1000)
+        self.assertTrue(cache.get(self.path('small.js')) is small)
+        large = cache.get(self.path('large.bin'))
+        self.assertEqual(large.content, None)
+        self.assertEqual(large.size, len(self.data))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.size, 1000)
+        # the least recently used file is dropped
+        path = self.write('other.txt', self.data[:800])
+        cache.get(path)
+        self.assertEqual(len(cache), 2)
+        self.assertFalse(self.path('small.js') in cache)
+        self.assertEqual(cache.size, 800)
+        # the content size bound
+        cache.get(self.path('small.js'))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.size, 1000)
+        self.assertRaises(OSError, cache.get, self.path('foo.txt'))
+
+    def test_file_cache_modified(self):
+        cache = FileCache(check_interval=0)
+        path = self.write('modified.txt', b'hello')
+        file = cache.get(path)
+        self.assertEqual(file.content, b'hello')
+        self.write('modified.txt', b'hello world')
+        file2 = cache.get(path)
+        self.assertEqual(file2.content, b'hello world')
+        self.assertNotEqual(file.etag, file2.etag)
+        os.remove(path)
+        self.assertRaises(OSError, cache.get, path)
+        self.assertFalse(path in cache)
+
+    def test_serve_small_file(self):
+        response = self.request('small.js')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, (self.data[:1000],))
+        etag = response.headers['etag']
+        response = self.request('small.js', [('If-None-Match', etag)])
+        self.assertEqual(response.status_code, 304)
+        response = self.request('small.js', [('Range', 'bytes=100-199')])
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, (self.data[100:200],))
+        self.assertEqual(response['content-range'], 'bytes 100-199/1000')
+
+    def test_serve_large_file(self):
+        response = self.request('large.bin')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['content-length'], str(len(self.data)))
+        wrapper = response.content
+        self.assertTrue(isinstance(wrapper, FileWrapper))
+        self.assertEqual(b''.join(wrapper), self.data)
+        response.close()
+        self.assertTrue(wrapper.file.closed)
+        response = self.request('large.bin', [('Range', 'bytes=-50000')])
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['content-length'], '50000')
+        self.assertEqual(b''.join(response.content), self.data[-50000:])
+        response.close()
+        response = self.request('large.bin', method='HEAD')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, ())
+
+    def test_file_cache_find(self):
+        cache = FileCache(check_interval=10)
+        self.assertEqual(cache.find(self.path('missing.txt')), None)
+        path = self.write('missing.txt', b'hello')
+        # still missing until checked again
+        self.assertEqual(cache.find(path), None)
+        cache.check_interval = 0
+        self.assertEqual(cache.find(path).content, b'hello')
+        os.remove(path)
+
+    def test_serve_precompressed(self):
+        self.write('app.css', self.data[:5000])
+        self.write('app.css.gz', self.data[5000:6000])
+        response = self.request('app.css')
+        self.assertEqual(response.content, (self.data[:5000],))
+        self.assertEqual(response['vary'], 'Accept-Encoding')
+        self.assertFalse('content-encoding' in response)
+        response = self.request('app.css', [('Accept-Encoding', 'gzip')])
+        self.assertEqual(response.content, (self.data[5000:6000],))
+        self.assertEqual(response['content-encoding'], 'gzip')
+        self.assertEqual(response.content_type, 'text/css')
+        response = self.request('small.js', [('Accept-Encoding', 'gzip')])
+        self.assertEqual(response.content, (self.data[:1000],))
+        self.assertFalse('vary' in response)
@@ -0,0 +1,117 @@
+'''Tests the response middleware in pulsar.apps.wsgi'''
+import zlib
+import unittest
+
+from pulsar.apps import wsgi
+
+
+def gunzip(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+class TestCompressionMiddleware(unittest.TestCase):
+    data = b'pulsar compression middleware ' * 100
+
+    def environ(self, accept='gzip, deflate'):
+        return wsgi.test_wsgi_environ(
+            headers=[('Accept-Encoding', accept)] if accept else None)
+
+    def response(self, content=None, **headers):
+        response = wsgi.WsgiResponse(200, self.data if content is None
+                                     else content)
+        for name, value in headers.items():
+            response[name.replace('_', '-')] = value
+        return response
+
+    def test_negotiation(self):
+        middleware = wsgi.CompressionMiddleware()
+        encoding = middleware.content_encoding
+        self.assertEqual(encoding(self.environ()), 'gzip')
+        self.assertEqual(encoding(self.environ('deflate')), 'deflate')
+        self.assertEqual(encoding(self.environ('deflate, gzip;q=0.5')),
+                         'deflate')
+        self.assertEqual(encoding(self.environ('gzip;q=0')), None)
+        self.assertEqual(encoding(self.environ('br')), None)
+        self.assertEqual(encoding(self.environ(None)), None)
+        self.assertEqual(encoding(self.environ('*')), 'gzip')
+
+    def test_gzip(self):
+        middleware = wsgi.CompressionMiddleware()
+        response = middleware(self.environ(), self.response())
+        self.assertEqual(response['content-encoding'], 'gzip')
+        self.assertEqual(response['vary'], 'Accept-Encoding')
+        self.assertEqual(gunzip(b''.join(response.content)), self.data)
+
+    def test_deflate(self):
+        middleware = wsgi.CompressionMiddleware()
+        response = middleware(self.environ('deflate'), self.response())
+        self.assertEqual(response['content-encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(b''.join(response.content)),
+                         self.data)
+
+    def test_not_available(self):
+        middleware = wsgi.GZipMiddleware()
+        response = middleware(self.environ('deflate'), self.response())
+        self.assertFalse('content-encoding' in response)
+        response = middleware(self.environ(), self.response(b'short'))
+        self.assertFalse('content-encoding' in response)
+        response = self.response()
+        response.status_code = 404
+        response = middleware(self.environ(), response)
+        self.assertFalse('content-encoding' in response)
+
+    def test_streamed(self):
+        middleware = wsgi.CompressionMiddleware()
+        chunks = [self.data[:1000], self.data[1000:2000].decode('utf-8'),
+                  b'', self.data[2000:]]
+        response = middleware(self.environ(),
+                              self.response(iter(chunks),
+                                            content_length='3000'))
+        self.assertTrue(response.is_streamed)
+        self.assertFalse('content-length' in response)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data = []
+        for chunk in response:
+            data.append(decompressor.decompress(chunk))
+        self.assertEqual(b''.join(data), self.data)
+        self.assertEqual(data[0], self.data[:1000])
+
+    def test_cache(self):
+        middleware = wsgi.CompressionMiddleware(cache_size=1)
+        response = middleware(self.environ(),
+                              self.response(etag='"abc"'))
+        self.assertEqual(response['etag'], 'W/"abc"')
+        compressed = response.content[0]
+        response = middleware(self.environ(),
+                              self.response(etag='"abc"'))
+        self.assertTrue(response.content[0] is compressed)
+        response = middleware(self.environ('deflate'),
+                              self.response(etag='"abc"'))
+        self.assertFalse(response.content[0] is compressed)
+        self.assertEqual(len(middleware._cache), 1)
+        # a new validator is a new representation
+        response = middleware(self.environ('deflate'),
+                              self.response(self.data[1:], etag='"abd"'))
+        self.assertEqual(zlib.decompress(response.content[0]),
+                         self.data[1:])
+        # no validator, no cache
+        middleware = wsgi.CompressionMiddleware()
+        middleware(self.environ(), self.response())
+        self.assertEqual(len(middleware._cache), 0)
+
+    def test_cache_key(self):
+        middleware = wsgi.CompressionMiddleware()
+        modified = 'Sat, 01 Jan 2028 04:05:06 GMT'
+        for lang in ('en', 'fr'):
+            environ = wsgi.test_wsgi_environ(
+                '/api?lang=%s' % lang, headers=[('Accept-Encoding', 'gzip')])
+            data = ('%s' % lang).encode('utf-8') * 180
+            response = middleware(environ, self.response(
+                data, last_modified=modified, etag='"v1"'))
+            self.assertEqual(gunzip(response.content[0]), data)
+        self.assertEqual(len(middleware._cache), 2)
+        # weak validators are not cached
+        middleware = wsgi.CompressionMiddleware()
+        middleware(self.environ(), self.response(last_modified=modified))
+        middleware(self.environ(), self.response(etag='W/"v1"'))
+        self.assertEqual(len(middleware._cache), 0)
@@ -199,3 +199,12 @@ class Routes(unittest.TestCase):
         self.assertEqual(r.rule, '')
         self.assertEqual(r.url(), '/')
         self.assertEqual(r.path, '/')
+
+    def test_static_bit(self):
+        r = Route('bla/<id>/foo/')
+        self.assertEqual(r.static_bit(), (0, 'bla'))
+        self.assertEqual(r.static_bit(1), (2, 'foo'))
+        self.assertEqual(r.static_bit(3), None)
+        self.assertEqual(Route('<int:id>/foo').static_bit(), (1, 'foo'))
+        self.assertEqual(Route('<path:path>/foo').static_bit(), None)
+        self.assertEqual(Route('').static_bit(), None)
@@ -132,3 +132,32 @@ class TestRouter(unittest.TestCase):
         self.assertFalse(args)
         self.assertEqual(child.parent, router)
         self.assertEqual(child.path(), '/root/a')
+
+    def test_dispatch_order(self):
+        router = Router('/',
+                        Router('<id>', name='id'),
+                        Router('new', name='new'),
+                        Router('foo/', Router('<path:path>', name='path')),
+                        Router('foo/bar', name='bar'))
+        # the first matching child wins, as without the index
+        self.assertEqual(router.resolve('new')[0].name, 'id')
+        child, args = router.resolve('foo/bar')
+        self.assertEqual(child.name, 'path')
+        self.assertEqual(args, {'path': 'bar'})
+        self.assertEqual(router.resolve('foo/')[0].rule, 'foo/')
+        self.assertEqual(router.resolve('bar/foo'), None)
+
+    def test_dispatch_add_remove(self):
+        router = Router('/', *[Router('r%d' % n, name=n) for n in range(20)])
+        self.assertEqual(router.resolve('r19')[0].name, 19)
+        self.assertEqual(router.resolve('r20'), None)
+        child = router.add_child(Router('r20', name=20))
+        self.assertEqual(router.resolve('r20')[0], child)
+        router.remove_child(child)
+        self.assertEqual(router.resolve('r20'), None)
+        # moving a child to a leaf router changes its route
+        leaf = router.add_child(Router('leaf'))
+        leaf.add_child(child)
+        self.assertEqual(router.resolve('r20'), None)
+        self.assertEqual(router.resolve('leaf/r20')[0], child)
+        self.assertEqual(child.path(), '/leaf/r20')
@@ -154,6 +154,27 @@ class WsgiRequestTests(unittest.TestCase):
         self.assertTrue(response.has_header('content-type'))
         self.assertEqual(response['content-type'], 'text/plain')
 
+    def test_chunk_lines(self):
+        from pulsar.apps.wsgi.server import chunk_lines, chunk_encoding
+        data = b'x'*(2*wsgi.MAX_CHUNK_SIZE + 10)
+        lines = chunk_lines(data, [b'headers'])
+        self.assertEqual(len(lines), 10)
+        self.assertEqual(b''.join(lines[1:]),
+                         chunk_encoding(data[:wsgi.MAX_CHUNK_SIZE]) +
+                         chunk_encoding(data[wsgi.MAX_CHUNK_SIZE:
+                                             2*wsgi.MAX_CHUNK_SIZE]) +
+                         chunk_encoding(data[2*wsgi.MAX_CHUNK_SIZE:]))
+        self.assertEqual(chunk_lines(b'', []), [])
+
+    def test_status_and_date_lines(self):
+        from pulsar.apps.wsgi.server import status_line, date_line
+        line = status_line((1, 1), '200 OK')
+        self.assertEqual(line, b'HTTP/1.1 200 OK\r\n')
+        self.assertTrue(status_line((1, 1), '200 OK') is line)
+        line = date_line()
+        self.assertTrue(line.startswith(b'Date: '))
+        self.assertTrue(line.endswith(b' GMT\r\n'))
+
     def testBuildWsgiApp(self):
         appserver = wsgi.WSGIServer()
         self.assertEqual(appserver.name, 'wsgi')